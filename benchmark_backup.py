@@ -0,0 +1,180 @@
+"""
+Latencia de la API Madre mientras se hace una copia de seguridad en caliente.
+
+Copia la base de datos a un directorio temporal, la engorda hasta el
+tamaño pedido con una tabla de relleno (para simular una base de varios
+GB), arranca madre_headless.py sobre ella y mide la latencia de un mix de
+lecturas y escrituras en tres fases:
+
+  - sin copia (referencia)
+  - copia incremental (BACKUP_PAGES páginas por paso, como la programada)
+  - copia en un solo paso (pages=-1)
+
+Cada copia se lanza con `madre_backup.py crear` en otro proceso, como haría
+un operador o el worker que hace la copia programada.
+
+Uso:
+    python benchmark_backup.py --tamano-mb 2048 --clients 4
+"""
+
+import argparse
+import os
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import requests
+
+from benchmark_workers import BASE_DIR, ENDPOINTS, SIN_ADMISION, esperar_servidor, print_header
+
+WRITE_USER = "juan_perez"
+
+
+def engordar(db_path: str, tamano_mb: int) -> float:
+    """Añade filas de relleno hasta que la base de datos ocupe tamano_mb; devuelve su tamaño en MB."""
+    conn = sqlite3.connect(db_path)
+    conn.execute("CREATE TABLE IF NOT EXISTS bench_relleno (id INTEGER PRIMARY KEY, datos BLOB)")
+    lote = 25000
+    while os.path.getsize(db_path) < tamano_mb * 1024 * 1024:
+        conn.execute('''
+            INSERT INTO bench_relleno (datos)
+            SELECT randomblob(4000) FROM (
+                WITH RECURSIVE n(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM n WHERE x < ?)
+                SELECT x FROM n)
+        ''', (lote,))
+        conn.commit()
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    conn.close()
+    return os.path.getsize(db_path) / 1024 / 1024
+
+
+def cliente(base_url: str, stop: threading.Event, latencias: list, errores: list, offset: int):
+    """Hace peticiones en bucle (1 de cada 4 es una escritura) hasta que se activa `stop`."""
+    session = requests.Session()
+    i = offset
+    while not stop.is_set():
+        i += 1
+        start = time.perf_counter()
+        try:
+            if i % 4 == 0:
+                response = session.post(f"{base_url}/actualizar_permiso", timeout=30,
+                                        json={"username": WRITE_USER, "permiso_acceso": bool(i % 8)})
+            else:
+                response = session.get(f"{base_url}{ENDPOINTS[i % len(ENDPOINTS)]}", timeout=30)
+            ok = response.status_code == 200
+        except requests.RequestException:
+            ok = False
+        elapsed = time.perf_counter() - start
+        (latencias if ok else errores).append(elapsed)
+
+
+def percentil(valores: list, p: float) -> float:
+    if not valores:
+        return 0.0
+    ordenados = sorted(valores)
+    return ordenados[min(len(ordenados) - 1, int(len(ordenados) * p))]
+
+
+def fase(nombre: str, base_url: str, clients: int, duracion: float, backup_cmd=None, env=None) -> dict:
+    """Mide la latencia durante `duracion` segundos o mientras dure la copia."""
+    stop = threading.Event()
+    latencias, errores = [], []
+    hilos = [threading.Thread(target=cliente, args=(base_url, stop, latencias, errores, n), daemon=True)
+             for n in range(clients)]
+    for hilo in hilos:
+        hilo.start()
+
+    time.sleep(1.0)
+    latencias.clear()
+    errores.clear()
+    start = time.perf_counter()
+    copia = ""
+    if backup_cmd:
+        copia = subprocess.run(backup_cmd, cwd=BASE_DIR, env=env, check=True, text=True,
+                               stdout=subprocess.PIPE, stderr=subprocess.DEVNULL).stdout.strip()
+    else:
+        time.sleep(duracion)
+    segundos = time.perf_counter() - start
+
+    stop.set()
+    for hilo in hilos:
+        hilo.join(timeout=35)
+
+    return {
+        "fase": nombre,
+        "segundos": segundos,
+        "peticiones": len(latencias),
+        "errores": len(errores),
+        "p50": percentil(latencias, 0.50) * 1000,
+        "p95": percentil(latencias, 0.95) * 1000,
+        "p99": percentil(latencias, 0.99) * 1000,
+        "max": max(latencias, default=0.0) * 1000,
+        "copia": copia,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Latencia de la API durante una copia de seguridad")
+    parser.add_argument("--tamano-mb", type=int, default=2048, help="Tamaño de la base de datos de prueba")
+    parser.add_argument("--clients", type=int, default=4, help="Hilos cliente concurrentes")
+    parser.add_argument("--duration", type=float, default=10.0, help="Duración de la fase de referencia (s)")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--pages", type=int, default=None, help="Páginas por paso (por defecto BACKUP_PAGES)")
+    parser.add_argument("--comprimir", action="store_true", help="Comprimir las copias (más lento)")
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument("--db", default=os.path.join(BASE_DIR, "data", "gym_database.db"),
+                        help="Base de datos a copiar para la prueba")
+    args = parser.parse_args()
+
+    tmp_dir = tempfile.mkdtemp(prefix="gym_bench_backup_")
+    db_path = os.path.join(tmp_dir, "gym_database.db")
+    shutil.copy(args.db, db_path)
+
+    print_header("LATENCIA API DURANTE COPIA DE SEGURIDAD")
+    print(f"Preparando base de datos de {args.tamano_mb} MB en {tmp_dir}...")
+    tamano = engordar(db_path, args.tamano_mb)
+
+    env = dict(os.environ, **SIN_ADMISION, DB_PATH=db_path, LOG_LEVEL="WARNING", BACKUP_INTERVAL="0",
+               REPLICATION_INTERVAL="0", BACKUP_DIR=os.path.join(tmp_dir, "backups"))
+    server = subprocess.Popen(
+        [sys.executable, os.path.join(BASE_DIR, "madre_headless.py"),
+         "--workers", str(args.workers), "--host", "127.0.0.1", "--port", str(args.port)],
+        cwd=BASE_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+
+    base_url = f"http://127.0.0.1:{args.port}"
+    crear = [sys.executable, os.path.join(BASE_DIR, "madre_backup.py"), "crear",
+             "--comprimir" if args.comprimir else "--sin-comprimir"]
+    incremental_env = dict(env, **({"BACKUP_PAGES": str(args.pages)} if args.pages else {}))
+    try:
+        if not esperar_servidor(base_url):
+            raise RuntimeError("El servidor no arrancó")
+
+        print(f"Base de datos: {tamano:.0f} MB | Clientes: {args.clients} | Workers: {args.workers}")
+        results = [
+            fase("Sin copia", base_url, args.clients, args.duration),
+            fase("Copia incremental", base_url, args.clients, args.duration, crear, incremental_env),
+            fase("Copia en un paso", base_url, args.clients, args.duration, crear,
+                 dict(env, BACKUP_PAGES="-1")),
+        ]
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    print(f"\n{'Fase':<20} {'Duración':>9} {'Petic.':>7} {'Err.':>5} "
+          f"{'p50':>8} {'p95':>8} {'p99':>8} {'máx':>8}")
+    for r in results:
+        print(f"{r['fase']:<20} {r['segundos']:>8.1f}s {r['peticiones']:>7} {r['errores']:>5} "
+              f"{r['p50']:>6.1f}ms {r['p95']:>6.1f}ms {r['p99']:>6.1f}ms {r['max']:>6.1f}ms")
+    for r in results:
+        if r["copia"]:
+            print(f"  {r['fase']}: {os.path.basename(r['copia'])}")
+
+
+if __name__ == "__main__":
+    main()
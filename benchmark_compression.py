@@ -0,0 +1,139 @@
+"""
+Bytes en el cable y coste de CPU de la compresión de respuestas por endpoint.
+
+Arranca madre_headless.py sobre una copia de la base de datos y, para los
+endpoints que más pesan en la sincronización de las Hijas, pide cada
+respuesta sin comprimir y con cada codificación disponible (gzip, y br/zstd
+si están instalados brotli/zstandard). Muestra:
+
+  - bytes en el cable (cuerpo tal como llega, sin descomprimir)
+  - latencia mediana de la petición completa
+  - CPU de comprimir (servidor) y descomprimir (cliente) esa respuesta,
+    medida en este proceso con los mismos niveles que usa el servidor
+
+Conviene usar una base de datos con volumen, p. ej. la de populate_db:
+
+    DB_PATH=/tmp/bench.db python populate_db.py --escala 0.05
+    python benchmark_compression.py --db /tmp/bench.db
+"""
+
+import argparse
+import gzip
+import os
+import shutil
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import requests
+
+from benchmark_workers import BASE_DIR, SIN_ADMISION, esperar_servidor, print_header
+from madre_compression import ENCODERS
+
+DECODERS = {"gzip": gzip.decompress}
+if "zstd" in ENCODERS:
+    import zstandard
+    DECODERS["zstd"] = lambda data: zstandard.ZstdDecompressor().decompress(data)
+if "br" in ENCODERS:
+    import brotli
+    DECODERS["br"] = brotli.decompress
+
+
+def endpoints(db_path: str) -> list:
+    """Endpoints de la prueba, con el socio y la conversación de chat con más mensajes."""
+    conn = sqlite3.connect(db_path)
+    usuario = (conn.execute('''
+        SELECT to_user FROM messages GROUP BY to_user ORDER BY COUNT(*) DESC LIMIT 1
+    ''').fetchone() or conn.execute('SELECT username FROM users LIMIT 1').fetchone())[0]
+    chat = conn.execute('''
+        SELECT from_user, to_user FROM chat_messages GROUP BY from_user, to_user ORDER BY COUNT(*) DESC LIMIT 1
+    ''').fetchone() or (usuario, usuario)
+    conn.close()
+    return [
+        f"/sincronizar_datos?usuario={usuario}",
+        "/usuarios",
+        f"/obtener_mensajes?usuario={usuario}",
+        f"/obtener_chat?user1={chat[0]}&user2={chat[1]}&limit=200",
+        "/clases",
+        "/ejercicios",
+    ]
+
+
+def pedir(session: requests.Session, url: str, encoding: str, repeticiones: int):
+    """Pide url con Accept-Encoding=encoding; devuelve (cuerpo en el cable, codificación recibida, latencia mediana)."""
+    latencias = []
+    wire, recibida = b"", None
+    for _ in range(repeticiones):
+        start = time.perf_counter()
+        with session.get(url, headers={"Accept-Encoding": encoding}, stream=True, timeout=60) as response:
+            response.raise_for_status()
+            wire = response.raw.read(decode_content=False)
+            recibida = response.headers.get("Content-Encoding")
+        latencias.append(time.perf_counter() - start)
+    return wire, recibida, statistics.median(latencias)
+
+
+def cpu_ms(func, data: bytes, repeticiones: int) -> float:
+    start = time.process_time()
+    for _ in range(repeticiones):
+        func(data)
+    return (time.process_time() - start) / repeticiones * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bytes en el cable y CPU de la compresión de respuestas")
+    parser.add_argument("--db", default=os.path.join(BASE_DIR, "data", "gym_database.db"),
+                        help="Base de datos a copiar para la prueba")
+    parser.add_argument("--repeticiones", type=int, default=10, help="Peticiones y compresiones por medida")
+    parser.add_argument("--port", type=int, default=8767)
+    args = parser.parse_args()
+
+    tmp_dir = tempfile.mkdtemp(prefix="gym_bench_compression_")
+    db_path = os.path.join(tmp_dir, "gym_database.db")
+    shutil.copy(args.db, db_path)
+
+    env = dict(os.environ, **SIN_ADMISION, DB_PATH=db_path, LOG_LEVEL="WARNING", BACKUP_INTERVAL="0",
+               REPLICATION_INTERVAL="0", ARCHIVE_INTERVAL="0", COMPRESSION_MIN_SIZE="0")
+    server = subprocess.Popen(
+        [sys.executable, os.path.join(BASE_DIR, "madre_headless.py"),
+         "--workers", "1", "--host", "127.0.0.1", "--port", str(args.port)],
+        cwd=BASE_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+
+    base_url = f"http://127.0.0.1:{args.port}"
+    codificaciones = ["identity", "gzip"] + [e for e in ("br", "zstd") if e in ENCODERS]
+    filas = []
+    try:
+        if not esperar_servidor(base_url):
+            raise RuntimeError("El servidor no arrancó")
+        session = requests.Session()
+        for endpoint in endpoints(db_path):
+            for encoding in codificaciones:
+                wire, recibida, latencia = pedir(session, base_url + endpoint, encoding, args.repeticiones)
+                if recibida is None:
+                    filas.append((endpoint, "identity", len(wire), len(wire), latencia, 0.0, 0.0))
+                    continue
+                plano = DECODERS[recibida](wire)
+                filas.append((endpoint, recibida, len(wire), len(plano), latencia,
+                              cpu_ms(ENCODERS[recibida], plano, args.repeticiones),
+                              cpu_ms(DECODERS[recibida], wire, args.repeticiones)))
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    print_header("COMPRESIÓN DE RESPUESTAS POR ENDPOINT")
+    print(f"{'Endpoint':<42} {'Codif.':<8} {'Cable':>10} {'Ratio':>6} {'Latencia':>9} "
+          f"{'Compr.':>8} {'Descompr.':>9}")
+    for endpoint, encoding, wire, plano, latencia, comprimir, descomprimir in filas:
+        nombre = endpoint.split("?")[0]
+        print(f"{nombre:<42} {encoding:<8} {wire:>10,} {plano / max(wire, 1):>5.1f}x {latencia * 1000:>7.1f}ms "
+              f"{comprimir:>6.2f}ms {descomprimir:>7.2f}ms")
+    print("\nCompr./Descompr.: CPU por respuesta en este proceso (niveles COMPRESSION_*_LEVEL).")
+
+
+if __name__ == "__main__":
+    main()
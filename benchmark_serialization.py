@@ -0,0 +1,135 @@
+"""
+Coste de serializar las respuestas de los endpoints de listas.
+
+Compara, en este proceso y sobre una copia de la base de datos, las formas
+de producir el cuerpo de /usuarios, /obtener_mensajes y /obtener_chat:
+
+  - actual: dicts de sqlite3.Row + jsonable_encoder + JSONResponse (json)
+  - orjson: los mismos dicts serializados con orjson (FastJSONResponse)
+  - sqlite: json_group_array en la propia consulta (madre_db.fetch_json_rows),
+    sin dicts intermedios (solo /usuarios y /obtener_mensajes)
+  - msgpack: los dicts en MessagePack, si está instalado msgpack
+
+Cada medida incluye la consulta a la base de datos. Conviene usar una base
+de datos con volumen, p. ej. la de populate_db:
+
+    DB_PATH=/tmp/bench.db python populate_db.py --escala 0.05
+    python benchmark_serialization.py --db /tmp/bench.db
+"""
+
+import argparse
+import os
+import shutil
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+
+from benchmark_workers import BASE_DIR, print_header
+
+
+def medir(func, repeticiones: int):
+    """Ejecuta func repeticiones veces; devuelve (ms mediana, bytes del último cuerpo)."""
+    tiempos = []
+    body = b""
+    for _ in range(repeticiones):
+        start = time.perf_counter()
+        body = func()
+        tiempos.append(time.perf_counter() - start)
+    return statistics.median(tiempos) * 1000, len(body)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Coste de serializar las respuestas de listas")
+    parser.add_argument("--db", default=os.path.join(BASE_DIR, "data", "gym_database.db"),
+                        help="Base de datos a copiar para la prueba")
+    parser.add_argument("--repeticiones", type=int, default=20, help="Repeticiones por medida")
+    args = parser.parse_args()
+
+    tmp_dir = tempfile.mkdtemp(prefix="gym_bench_serialization_")
+    db_path = os.path.join(tmp_dir, "gym_database.db")
+    shutil.copy(args.db, db_path)
+    os.environ["DB_PATH"] = db_path
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+    # madre_db abre la base de datos de DB_PATH al importarse
+    sys.path.insert(0, BASE_DIR)
+    from fastapi.encoders import jsonable_encoder
+    from fastapi.responses import JSONResponse
+
+    import madre_db
+    import madre_responses
+
+    conn = sqlite3.connect(db_path)
+    usuario = (conn.execute('''
+        SELECT to_user FROM messages GROUP BY to_user ORDER BY COUNT(*) DESC LIMIT 1
+    ''').fetchone() or conn.execute('SELECT username FROM users LIMIT 1').fetchone())[0]
+    chat = conn.execute('''
+        SELECT from_user, to_user FROM chat_messages GROUP BY from_user, to_user ORDER BY COUNT(*) DESC LIMIT 1
+    ''').fetchone() or (usuario, usuario)
+    conn.close()
+
+    def usuarios_dicts():
+        usuarios = madre_db.get_all_users()
+        for user in usuarios:
+            user.pop('password_hash', None)
+        return {"total": len(usuarios), "usuarios": usuarios}
+
+    def usuarios_sqlite():
+        total, usuarios = madre_db.get_users_json()
+        return madre_responses.json_array_response({"total": total}, "usuarios", usuarios).body
+
+    def mensajes_dicts():
+        messages = madre_db.get_user_messages(usuario)
+        return {"status": "ok", "total_mensajes": len(messages),
+                "mensajes_no_leidos": madre_db.count_unread_messages(usuario), "mensajes": messages}
+
+    def mensajes_sqlite():
+        total, messages = madre_db.get_user_messages_json(usuario)
+        return madre_responses.json_array_response({
+            "status": "ok", "total_mensajes": total,
+            "mensajes_no_leidos": madre_db.count_unread_messages(usuario)
+        }, "mensajes", messages).body
+
+    def chat_dicts():
+        messages = madre_db.get_chat_history(chat[0], chat[1], 200)
+        return {"status": "ok", "total_mensajes": len(messages), "mensajes": messages}
+
+    casos = [
+        ("/usuarios", usuarios_dicts, usuarios_sqlite),
+        ("/obtener_mensajes", mensajes_dicts, mensajes_sqlite),
+        ("/obtener_chat", chat_dicts, None),
+    ]
+
+    filas = []
+    try:
+        for endpoint, dicts, sqlite_path in casos:
+            variantes = [
+                ("actual", lambda d=dicts: JSONResponse(jsonable_encoder(d())).body),
+                ("orjson", lambda d=dicts: madre_responses.FastJSONResponse(d()).body),
+            ]
+            if sqlite_path is not None:
+                variantes.append(("sqlite", sqlite_path))
+            if madre_responses.MSGPACK_AVAILABLE:
+                variantes.append(("msgpack", lambda d=dicts: madre_responses.MessagePackResponse(d()).body))
+
+            base = None
+            for nombre, func in variantes:
+                ms, size = medir(func, args.repeticiones)
+                base = base or ms
+                filas.append((endpoint, nombre, ms, size, base / ms if ms else 0.0))
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    print_header("SERIALIZACIÓN DE RESPUESTAS DE LISTAS")
+    if not madre_responses.ORJSON_AVAILABLE:
+        print("orjson no está instalado: la variante orjson usa json")
+    print(f"{'Endpoint':<20} {'Variante':<9} {'Tiempo':>9} {'Bytes':>11} {'Mejora':>7}")
+    for endpoint, nombre, ms, size, mejora in filas:
+        print(f"{endpoint:<20} {nombre:<9} {ms:>7.2f}ms {size:>11,} {mejora:>6.1f}x")
+    print("\nTiempo: mediana por respuesta, consulta incluida. Mejora: frente a la variante actual.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+"""
+Compara el rendimiento de la API Madre con 1 worker frente a N workers.
+
+Arranca madre_headless.py sobre una copia de la base de datos, lanza
+varios procesos cliente que hacen peticiones durante un tiempo fijo y
+muestra peticiones por segundo y latencia media de cada configuración.
+
+Uso:
+    python benchmark_workers.py --workers 4 --clients 8 --duration 10
+"""
+
+import argparse
+import multiprocessing
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import requests
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+ENDPOINTS = [
+    "/clases",
+    "/clases/horarios",
+    "/ejercicios",
+    "/equipos",
+    "/obtener_hilos?usuario=admin",
+    "/contar_no_leidos?usuario=admin",
+]
+
+
+def print_header(text):
+    print("\n" + "=" * 60)
+    print(f"  {text}")
+    print("=" * 60)
+
+
+# Entorno del servidor sin control de admisión: las pruebas de carga miden el servidor, no las cuotas
+SIN_ADMISION = {
+    "ADMISSION_MAX_CONCURRENT": "0",
+    "ADMISSION_RATE_CRITICAL": "0",
+    "ADMISSION_RATE_INTERACTIVE": "0",
+    "ADMISSION_RATE_BULK": "0",
+}
+
+
+def esperar_servidor(base_url: str, timeout: float = 30.0) -> bool:
+    """Espera a que el servidor responda en /health."""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if requests.get(f"{base_url}/health", timeout=1).status_code == 200:
+                return True
+        except requests.RequestException:
+            pass
+        time.sleep(0.3)
+    return False
+
+
+def cliente(args):
+    """Proceso cliente: hace peticiones en bucle y devuelve (ok, errores, segundos_totales)."""
+    base_url, duration, offset = args
+    session = requests.Session()
+    ok = errors = 0
+    elapsed_total = 0.0
+    i = offset
+    deadline = time.time() + duration
+
+    while time.time() < deadline:
+        path = ENDPOINTS[i % len(ENDPOINTS)]
+        i += 1
+        start = time.perf_counter()
+        try:
+            response = session.get(f"{base_url}{path}", timeout=10)
+            if response.status_code == 200:
+                ok += 1
+            else:
+                errors += 1
+        except requests.RequestException:
+            errors += 1
+        elapsed_total += time.perf_counter() - start
+
+    return ok, errors, elapsed_total
+
+
+def medir(workers: int, port: int, db_path: str, clients: int, duration: float) -> dict:
+    """Arranca el servidor con `workers` procesos y mide su throughput."""
+    env = dict(os.environ, DB_PATH=db_path, LOG_LEVEL="WARNING", **SIN_ADMISION)
+    server = subprocess.Popen(
+        [sys.executable, os.path.join(BASE_DIR, "madre_headless.py"),
+         "--workers", str(workers), "--host", "127.0.0.1", "--port", str(port)],
+        cwd=BASE_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+
+    base_url = f"http://127.0.0.1:{port}"
+    try:
+        if not esperar_servidor(base_url):
+            raise RuntimeError(f"El servidor con {workers} workers no arrancó")
+
+        with multiprocessing.Pool(clients) as pool:
+            results = pool.map(cliente, [(base_url, duration, n) for n in range(clients)])
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+
+    ok = sum(r[0] for r in results)
+    errors = sum(r[1] for r in results)
+    latency = sum(r[2] for r in results) / max(ok + errors, 1)
+
+    return {
+        "workers": workers,
+        "requests": ok,
+        "errors": errors,
+        "rps": ok / duration,
+        "latency_ms": latency * 1000
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Throughput de la API con 1 vs N workers")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 2)
+    parser.add_argument("--clients", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--db", default=os.path.join(BASE_DIR, "data", "gym_database.db"),
+                        help="Base de datos a copiar para la prueba")
+    args = parser.parse_args()
+
+    tmp_dir = tempfile.mkdtemp(prefix="gym_bench_")
+    db_path = os.path.join(tmp_dir, "gym_database.db")
+    shutil.copy(args.db, db_path)
+
+    print_header("THROUGHPUT API MADRE: 1 vs N WORKERS")
+    print(f"Clientes: {args.clients} procesos | Duración: {args.duration}s por configuración")
+
+    try:
+        results = [medir(w, args.port, db_path, args.clients, args.duration)
+                   for w in sorted({1, args.workers})]
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    print(f"\n{'Workers':>8} {'Peticiones':>11} {'Errores':>8} {'req/s':>9} {'Lat. media':>11}")
+    for r in results:
+        print(f"{r['workers']:>8} {r['requests']:>11} {r['errors']:>8} "
+              f"{r['rps']:>9.1f} {r['latency_ms']:>9.1f}ms")
+
+    if len(results) > 1 and results[0]['rps']:
+        print(f"\nAceleración {results[-1]['workers']} workers vs 1: "
+              f"x{results[-1]['rps'] / results[0]['rps']:.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -4,6 +4,7 @@ Carga configuraciones desde variables de entorno con valores por defecto como re
 """
 
 import os
+import socket
 from typing import Any, Optional
 from shared.constants import (
     DEFAULT_HOST_IP,
@@ -16,8 +17,66 @@ from shared.constants import (
     SYNC_INTERVAL_INITIAL,
     SYNC_INTERVAL_NORMAL,
     SYNC_REQUIRED_HOURS,
+    SYNC_JITTER,
+    SYNC_BACKOFF_MAX,
+    SYNC_IDLE_AFTER,
+    SYNC_IDLE_MULTIPLIER,
+    DB_BUSY_RETRY_AFTER,
     LOCAL_DATA_DIR_NAME,
-    HIJA_LOCAL_DIR_NAME
+    HIJA_LOCAL_DIR_NAME,
+    ATTACHMENTS_DIR_NAME,
+    MAX_ATTACHMENT_MB,
+    DB_BUSY_TIMEOUT_MS,
+    DEFAULT_WORKERS,
+    SHUTDOWN_TIMEOUT,
+    THUMBNAILS_DIR_NAME,
+    THUMBNAIL_WORKERS,
+    IMAGE_CACHE_MB,
+    BATCH_WINDOW_MS,
+    QUERY_PROFILE_SAMPLE_RATE,
+    QUERY_PROFILE_TOP_N,
+    QUERY_PROFILE_FLUSH_INTERVAL,
+    QUERY_PROFILE_DIR_NAME,
+    CDC_RETENTION_DAYS,
+    CDC_PAGE_SIZE,
+    CDC_MAINTENANCE_INTERVAL,
+    REPLICATION_INTERVAL,
+    REPLICATION_BATCH_SIZE,
+    REPLICATION_TIMEOUT,
+    BACKUP_DIR_NAME,
+    BACKUP_INTERVAL,
+    BACKUP_KEEP,
+    BACKUP_PAGES,
+    BACKUP_STEP_SLEEP_MS,
+    BACKUP_MAX_RESTARTS,
+    ARCHIVE_DIR_NAME,
+    ARCHIVE_HORIZON_DAYS,
+    ARCHIVE_PERIOD,
+    ARCHIVE_BATCH_SIZE,
+    ARCHIVE_INTERVAL,
+    COMPRESSION_ENCODINGS,
+    COMPRESSION_MIN_SIZE,
+    COMPRESSION_GZIP_LEVEL,
+    COMPRESSION_ZSTD_LEVEL,
+    COMPRESSION_BROTLI_LEVEL,
+    COMPRESSION_CACHE_ENTRIES,
+    IDEMPOTENCY_RETENTION_DAYS,
+    ADMISSION_MAX_CONCURRENT,
+    ADMISSION_BULK_SHARE,
+    ADMISSION_CRITICAL_RESERVE,
+    ADMISSION_MAX_QUEUE,
+    ADMISSION_QUEUE_TIMEOUT,
+    ADMISSION_RETRY_AFTER,
+    ADMISSION_CRITICAL_PATHS,
+    ADMISSION_BULK_PATHS,
+    ADMISSION_EXEMPT_PATHS,
+    ADMISSION_RATE_CRITICAL,
+    ADMISSION_BURST_CRITICAL,
+    ADMISSION_RATE_INTERACTIVE,
+    ADMISSION_BURST_INTERACTIVE,
+    ADMISSION_RATE_BULK,
+    ADMISSION_BURST_BULK,
+    ADMISSION_MAX_BUCKETS
 )
 
 
@@ -58,6 +117,68 @@ class MadreSettings:
         self.HOST: str = get_env('MADRE_HOST', DEFAULT_HOST_IP)
         self.PORT: int = get_env('MADRE_PORT', DEFAULT_HOST_PORT, int)
         self.DB_PATH: str = get_env('DB_PATH', os.path.join(LOCAL_DATA_DIR_NAME, DEFAULT_DB_FILENAME))
+        self.DB_BUSY_TIMEOUT_MS: int = get_env('DB_BUSY_TIMEOUT_MS', DB_BUSY_TIMEOUT_MS, int)
+        self.WORKERS: int = get_env('MADRE_WORKERS', DEFAULT_WORKERS, int)
+        self.SHUTDOWN_TIMEOUT: int = get_env('SHUTDOWN_TIMEOUT', SHUTDOWN_TIMEOUT, int)
+        self.DB_BUSY_RETRY_AFTER: int = get_env('DB_BUSY_RETRY_AFTER', DB_BUSY_RETRY_AFTER, int)
+        self.ATTACHMENTS_DIR: str = get_env('ATTACHMENTS_DIR', os.path.join(LOCAL_DATA_DIR_NAME, ATTACHMENTS_DIR_NAME))
+        self.MAX_ATTACHMENT_MB: int = get_env('MAX_ATTACHMENT_MB', MAX_ATTACHMENT_MB, int)
+        self.THUMBNAILS_DIR: str = get_env('THUMBNAILS_DIR', os.path.join(LOCAL_DATA_DIR_NAME, THUMBNAILS_DIR_NAME))
+        self.THUMBNAIL_WORKERS: int = get_env('THUMBNAIL_WORKERS', THUMBNAIL_WORKERS, int)
+        self.QUERY_PROFILING: bool = get_env('QUERY_PROFILING', False, bool)
+        self.QUERY_PROFILE_SAMPLE_RATE: float = get_env('QUERY_PROFILE_SAMPLE_RATE', QUERY_PROFILE_SAMPLE_RATE, float)
+        self.QUERY_PROFILE_TOP_N: int = get_env('QUERY_PROFILE_TOP_N', QUERY_PROFILE_TOP_N, int)
+        self.QUERY_PROFILE_FLUSH_INTERVAL: int = get_env(
+            'QUERY_PROFILE_FLUSH_INTERVAL', QUERY_PROFILE_FLUSH_INTERVAL, int)
+        self.QUERY_PROFILE_DIR: str = get_env(
+            'QUERY_PROFILE_DIR', os.path.join(LOCAL_DATA_DIR_NAME, QUERY_PROFILE_DIR_NAME))
+        self.CDC_RETENTION_DAYS: int = get_env('CDC_RETENTION_DAYS', CDC_RETENTION_DAYS, int)
+        self.CDC_PAGE_SIZE: int = get_env('CDC_PAGE_SIZE', CDC_PAGE_SIZE, int)
+        self.CDC_MAINTENANCE_INTERVAL: int = get_env('CDC_MAINTENANCE_INTERVAL', CDC_MAINTENANCE_INTERVAL, int)
+        self.SERVER_NAME: str = get_env('MADRE_SERVER_NAME', socket.gethostname())
+        self.REPLICATION_INTERVAL: int = get_env('REPLICATION_INTERVAL', REPLICATION_INTERVAL, int)
+        self.REPLICATION_BATCH_SIZE: int = get_env('REPLICATION_BATCH_SIZE', REPLICATION_BATCH_SIZE, int)
+        self.REPLICATION_TIMEOUT: int = get_env('REPLICATION_TIMEOUT', REPLICATION_TIMEOUT, int)
+        self.BACKUP_DIR: str = get_env('BACKUP_DIR', os.path.join(LOCAL_DATA_DIR_NAME, BACKUP_DIR_NAME))
+        self.BACKUP_INTERVAL: int = get_env('BACKUP_INTERVAL', BACKUP_INTERVAL, int)
+        self.BACKUP_KEEP: int = get_env('BACKUP_KEEP', BACKUP_KEEP, int)
+        self.BACKUP_COMPRESS: bool = get_env('BACKUP_COMPRESS', True, bool)
+        self.BACKUP_PAGES: int = get_env('BACKUP_PAGES', BACKUP_PAGES, int)
+        self.BACKUP_STEP_SLEEP_MS: int = get_env('BACKUP_STEP_SLEEP_MS', BACKUP_STEP_SLEEP_MS, int)
+        self.BACKUP_MAX_RESTARTS: int = get_env('BACKUP_MAX_RESTARTS', BACKUP_MAX_RESTARTS, int)
+        self.ARCHIVE_DIR: str = get_env('ARCHIVE_DIR', os.path.join(LOCAL_DATA_DIR_NAME, ARCHIVE_DIR_NAME))
+        self.ARCHIVE_HORIZON_DAYS: int = get_env('ARCHIVE_HORIZON_DAYS', ARCHIVE_HORIZON_DAYS, int)
+        self.ARCHIVE_PERIOD: str = get_env('ARCHIVE_PERIOD', ARCHIVE_PERIOD).lower()
+        self.ARCHIVE_BATCH_SIZE: int = get_env('ARCHIVE_BATCH_SIZE', ARCHIVE_BATCH_SIZE, int)
+        self.ARCHIVE_INTERVAL: int = get_env('ARCHIVE_INTERVAL', ARCHIVE_INTERVAL, int)
+        self.COMPRESSION_ENCODINGS: list = [
+            e.strip().lower() for e in get_env('COMPRESSION_ENCODINGS', COMPRESSION_ENCODINGS).split(",")
+            if e.strip()]
+        self.COMPRESSION_MIN_SIZE: int = get_env('COMPRESSION_MIN_SIZE', COMPRESSION_MIN_SIZE, int)
+        self.COMPRESSION_GZIP_LEVEL: int = get_env('COMPRESSION_GZIP_LEVEL', COMPRESSION_GZIP_LEVEL, int)
+        self.COMPRESSION_ZSTD_LEVEL: int = get_env('COMPRESSION_ZSTD_LEVEL', COMPRESSION_ZSTD_LEVEL, int)
+        self.COMPRESSION_BROTLI_LEVEL: int = get_env('COMPRESSION_BROTLI_LEVEL', COMPRESSION_BROTLI_LEVEL, int)
+        self.COMPRESSION_CACHE_ENTRIES: int = get_env('COMPRESSION_CACHE_ENTRIES', COMPRESSION_CACHE_ENTRIES, int)
+        self.IDEMPOTENCY_RETENTION_DAYS: int = get_env('IDEMPOTENCY_RETENTION_DAYS', IDEMPOTENCY_RETENTION_DAYS, int)
+        self.ADMISSION_MAX_CONCURRENT: int = get_env('ADMISSION_MAX_CONCURRENT', ADMISSION_MAX_CONCURRENT, int)
+        self.ADMISSION_BULK_SHARE: float = get_env('ADMISSION_BULK_SHARE', ADMISSION_BULK_SHARE, float)
+        self.ADMISSION_CRITICAL_RESERVE: float = get_env('ADMISSION_CRITICAL_RESERVE', ADMISSION_CRITICAL_RESERVE, float)
+        self.ADMISSION_MAX_QUEUE: int = get_env('ADMISSION_MAX_QUEUE', ADMISSION_MAX_QUEUE, int)
+        self.ADMISSION_QUEUE_TIMEOUT: float = get_env('ADMISSION_QUEUE_TIMEOUT', ADMISSION_QUEUE_TIMEOUT, float)
+        self.ADMISSION_RETRY_AFTER: int = get_env('ADMISSION_RETRY_AFTER', ADMISSION_RETRY_AFTER, int)
+        self.ADMISSION_CRITICAL_PATHS: list = [
+            p.strip().rstrip('/') for p in get_env('ADMISSION_CRITICAL_PATHS', ADMISSION_CRITICAL_PATHS).split(",") if p.strip()]
+        self.ADMISSION_BULK_PATHS: list = [
+            p.strip().rstrip('/') for p in get_env('ADMISSION_BULK_PATHS', ADMISSION_BULK_PATHS).split(",") if p.strip()]
+        self.ADMISSION_EXEMPT_PATHS: list = [
+            p.strip().rstrip('/') for p in get_env('ADMISSION_EXEMPT_PATHS', ADMISSION_EXEMPT_PATHS).split(",") if p.strip()]
+        self.ADMISSION_RATE_CRITICAL: float = get_env('ADMISSION_RATE_CRITICAL', ADMISSION_RATE_CRITICAL, float)
+        self.ADMISSION_BURST_CRITICAL: int = get_env('ADMISSION_BURST_CRITICAL', ADMISSION_BURST_CRITICAL, int)
+        self.ADMISSION_RATE_INTERACTIVE: float = get_env('ADMISSION_RATE_INTERACTIVE', ADMISSION_RATE_INTERACTIVE, float)
+        self.ADMISSION_BURST_INTERACTIVE: int = get_env('ADMISSION_BURST_INTERACTIVE', ADMISSION_BURST_INTERACTIVE, int)
+        self.ADMISSION_RATE_BULK: float = get_env('ADMISSION_RATE_BULK', ADMISSION_RATE_BULK, float)
+        self.ADMISSION_BURST_BULK: int = get_env('ADMISSION_BURST_BULK', ADMISSION_BURST_BULK, int)
+        self.ADMISSION_MAX_BUCKETS: int = get_env('ADMISSION_MAX_BUCKETS', ADMISSION_MAX_BUCKETS, int)
         self.LOG_LEVEL: str = get_env('LOG_LEVEL', 'INFO').upper()
 
     def __repr__(self) -> str:
@@ -75,7 +196,13 @@ class HijaSettings:
         self.SYNC_INTERVAL_INITIAL: int = get_env('SYNC_INTERVAL_INITIAL', SYNC_INTERVAL_INITIAL, int)
         self.SYNC_INTERVAL_NORMAL: int = get_env('SYNC_INTERVAL_NORMAL', SYNC_INTERVAL_NORMAL, int)
         self.SYNC_REQUIRED_HOURS: int = get_env('SYNC_REQUIRED_HOURS', SYNC_REQUIRED_HOURS, int)
+        self.SYNC_JITTER: float = get_env('SYNC_JITTER', SYNC_JITTER, float)
+        self.SYNC_BACKOFF_MAX: int = get_env('SYNC_BACKOFF_MAX', SYNC_BACKOFF_MAX, int)
+        self.SYNC_IDLE_AFTER: int = get_env('SYNC_IDLE_AFTER', SYNC_IDLE_AFTER, int)
+        self.SYNC_IDLE_MULTIPLIER: int = get_env('SYNC_IDLE_MULTIPLIER', SYNC_IDLE_MULTIPLIER, int)
         self.LOCAL_DATA_DIR: str = get_env('LOCAL_DATA_DIR', os.path.join(LOCAL_DATA_DIR_NAME, HIJA_LOCAL_DIR_NAME))
+        self.IMAGE_CACHE_MB: int = get_env('IMAGE_CACHE_MB', IMAGE_CACHE_MB, int)
+        self.BATCH_WINDOW_MS: int = get_env('BATCH_WINDOW_MS', BATCH_WINDOW_MS, int)
         self.LOG_LEVEL: str = get_env('LOG_LEVEL', 'INFO').upper()
 
     def __repr__(self) -> str:
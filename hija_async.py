@@ -0,0 +1,438 @@
+import asyncio
+import queue
+import random
+import threading
+import time
+import uuid
+from typing import Any, Callable, Coroutine, Dict, List, Optional, Tuple
+
+import httpx
+
+from config.settings import get_hija_settings
+from hija_comms import parse_retry_after
+from shared.logger import setup_logger
+from shared.constants import (
+    ENDPOINT_ENVIAR_MENSAJE,
+    ENDPOINT_OBTENER_HILO,
+    ENDPOINT_ENVIAR_CHAT,
+    ENDPOINT_IMAGENES,
+    ENDPOINT_RESERVAR_CLASE,
+    ENDPOINT_MIS_RESERVAS,
+    ENDPOINT_WORKOUT_LOG,
+    ENDPOINT_WORKOUT_HISTORIAL,
+    ENDPOINT_BATCH,
+    BATCH_MAX_REQUESTS,
+    HTTP_MAX_RETRY_AFTER,
+    IDEMPOTENCY_HEADER,
+    STATUS_SYNC_SUCCESS,
+    ERROR_CONNECTION,
+    ERROR_TIMEOUT,
+    ERROR_SERVER_BUSY
+)
+
+logger = setup_logger(__name__, log_file="hija_async.log")
+
+settings = get_hija_settings()
+
+POLL_INTERVAL_MS = 16
+POLL_BUDGET_SECONDS = 0.008
+
+# Respuestas que significan "aún no, reintenta": saturación y petición
+# idempotente todavía en curso. Cualquier otra con Retry-After cuenta igual.
+BUSY_STATUS_CODES = (409, 429)
+
+OUTBOX_OPERATIONS = {
+    "enviar_mensaje": ENDPOINT_ENVIAR_MENSAJE,
+    "enviar_chat": ENDPOINT_ENVIAR_CHAT,
+    "reservar_clase": ENDPOINT_RESERVAR_CLASE,
+    "registrar_serie": ENDPOINT_WORKOUT_LOG,
+}
+
+
+class AsyncAPIClient:
+    """
+    Cliente HTTP asíncrono de la Hija.
+
+    Mantiene un event loop propio en un hilo de fondo con un único
+    httpx.AsyncClient, de modo que las conexiones keep-alive se reutilizan
+    entre peticiones y varias peticiones pueden ir en paralelo (fan-out).
+    La GUI nunca espera a la red: lanza corrutinas con submit() y recibe
+    el resultado en el hilo de Tk, porque attach() vacía la cola de
+    resultados con after() cada ~16 ms (un frame a 60 fps).
+
+    Las consultas de lectura de un usuario (validar_sync, sincronizar_datos,
+    hilos, chat) se agrupan: las que se lanzan dentro de BATCH_WINDOW_MS
+    viajan juntas en un único POST /batch.
+    """
+
+    def __init__(self, base_url: Optional[str] = None, image_cache=None):
+        self.base_url = base_url or settings.MADRE_BASE_URL
+        self.image_cache = image_cache
+
+        self._results: "queue.SimpleQueue[Tuple[Callable, Tuple[bool, Any]]]" = queue.SimpleQueue()
+        self._tk_root = None
+        self._poll_job = None
+
+        self._batch_pending: Dict[str, List[tuple]] = {}
+        self._batch_handles: Dict[str, asyncio.TimerHandle] = {}
+
+        self._loop = asyncio.new_event_loop()
+        self._client: Optional[httpx.AsyncClient] = None
+        self._ready = threading.Event()
+        self._thread = threading.Thread(target=self._run_loop, daemon=True, name="AsyncHTTPLoop")
+        self._thread.start()
+        self._ready.wait()
+
+        logger.info("AsyncAPIClient initialized with base_url: %s", self.base_url)
+
+    def _run_loop(self):
+        """Hilo de fondo: crea el cliente HTTP y ejecuta el event loop."""
+        asyncio.set_event_loop(self._loop)
+        self._client = httpx.AsyncClient(
+            base_url=self.base_url,
+            timeout=httpx.Timeout(settings.HTTP_TIMEOUT_MEDIUM, connect=settings.HTTP_TIMEOUT_SHORT),
+            limits=httpx.Limits(max_connections=20, max_keepalive_connections=10, keepalive_expiry=30)
+        )
+        self._ready.set()
+        self._loop.run_forever()
+
+    def attach(self, tk_root, interval_ms: int = POLL_INTERVAL_MS):
+        """Empieza a entregar resultados al hilo de Tk de tk_root."""
+        self._tk_root = tk_root
+        self._poll_interval = interval_ms
+        self._poll()
+
+    def _poll(self):
+        """
+        Ejecuta en el hilo de Tk los callbacks de las peticiones terminadas.
+        Se limita a ~8 ms por frame para no bloquear el redibujado.
+        """
+        deadline = time.perf_counter() + POLL_BUDGET_SECONDS
+        while time.perf_counter() < deadline:
+            try:
+                callback, result = self._results.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                callback(*result)
+            except Exception as e:
+                logger.error("Error en callback de petición asíncrona: %s", e, exc_info=True)
+
+        self._poll_job = self._tk_root.after(self._poll_interval, self._poll)
+
+    def submit(self, coro: Coroutine, callback: Optional[Callable[[bool, Any], None]] = None):
+        """
+        Lanza una corrutina en el event loop de fondo.
+        callback(success, data) se ejecutará en el hilo de Tk al terminar.
+        """
+        future = asyncio.run_coroutine_threadsafe(coro, self._loop)
+        if callback is not None:
+            future.add_done_callback(lambda f: self._results.put((callback, self._unwrap(f))))
+        return future
+
+    @staticmethod
+    def _unwrap(future) -> Tuple[bool, Any]:
+        """Convierte el resultado (o la excepción) de un future en (success, data)."""
+        try:
+            return future.result()
+        except Exception as e:
+            return False, {"error": f"Error: {e}"}
+
+    def close(self):
+        """Cierra las conexiones y detiene el event loop."""
+        if self._tk_root is not None and self._poll_job is not None:
+            try:
+                self._tk_root.after_cancel(self._poll_job)
+            except Exception:
+                pass
+            self._poll_job = None
+
+        try:
+            asyncio.run_coroutine_threadsafe(self._client.aclose(), self._loop).result(timeout=2)
+        except Exception as e:
+            logger.warning("Error cerrando cliente HTTP: %s", e)
+
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(timeout=2)
+        logger.info("AsyncAPIClient closed")
+
+    async def _request(self, method: str, path: str, max_retries: int = 3,
+                       **kwargs) -> Tuple[bool, Any]:
+        """
+        Petición con reintentos y backoff exponencial.
+        Las esperas son asyncio.sleep: no bloquean ni el loop ni la GUI.
+
+        Returns:
+            Tuple[bool, Any]: (True, httpx.Response) o (False, {"error": ...}).
+            Solo si no se pudo conectar el dict incluye "offline": True; tras
+            un timeout de lectura la Madre puede haber aplicado la petición.
+            Si la Madre sigue rechazándola por saturación (429, o cualquier
+            respuesta con Retry-After) o porque la misma petición sigue en
+            curso (409) incluye "busy": True: puede reintentarse más tarde con
+            la misma clave de idempotencia.
+        """
+        for attempt in range(max_retries):
+            is_last = attempt == max_retries - 1
+            try:
+                response = await self._client.request(method, path, **kwargs)
+
+                retry_after = parse_retry_after(response)
+                if response.status_code in BUSY_STATUS_CODES or (
+                        response.status_code >= 400 and retry_after is not None):
+                    # Madre saturada (429/503), misma petición aún en curso (409) o
+                    # cualquier rechazo con Retry-After: esperar lo que indique
+                    if is_last:
+                        logger.warning("Server busy (%d) after %d attempts", response.status_code, max_retries)
+                        return False, {"error": ERROR_SERVER_BUSY, "busy": True, "retry_after": retry_after}
+                    wait_time = min(retry_after if retry_after is not None else 2 ** attempt,
+                                    HTTP_MAX_RETRY_AFTER) + random.uniform(0, 1)
+                    logger.warning("Server busy (%d), retrying in %.2fs...", response.status_code, wait_time)
+                    await asyncio.sleep(wait_time)
+                    continue
+
+                if response.status_code >= 500 and not is_last:
+                    wait_time = (2 ** attempt) + random.uniform(0, 1)
+                    logger.warning("Server error %d, retrying in %.2fs...", response.status_code, wait_time)
+                    await asyncio.sleep(wait_time)
+                    continue
+
+                response.raise_for_status()
+                return True, response
+
+            except (httpx.ConnectError, httpx.TimeoutException) as e:
+                if not is_last:
+                    wait_time = (2 ** attempt) + random.uniform(0, 1)
+                    logger.warning(
+                        "Request failed (attempt %d/%d): %s. Retrying in %.2fs...",
+                        attempt + 1, max_retries, e, wait_time
+                    )
+                    await asyncio.sleep(wait_time)
+                    continue
+                logger.error("Request failed after %d attempts: %s", max_retries, e)
+                if isinstance(e, (httpx.ConnectError, httpx.ConnectTimeout)):
+                    return False, {"error": ERROR_CONNECTION, "offline": True}
+                return False, {"error": ERROR_TIMEOUT}
+
+            except httpx.HTTPStatusError as e:
+                try:
+                    detail = e.response.json().get("detail", "Error de servidor")
+                    return False, {"error": f"Error: {detail}"}
+                except ValueError:
+                    return False, {"error": f"Error HTTP {e.response.status_code}"}
+
+            except httpx.HTTPError as e:
+                return False, {"error": f"Error: {e}"}
+
+        return False, {"error": ERROR_CONNECTION, "offline": True}
+
+    async def _request_json(self, method: str, path: str, **kwargs) -> Tuple[bool, dict]:
+        """Como _request, pero devuelve el cuerpo JSON."""
+        success, result = await self._request(method, path, **kwargs)
+        if not success:
+            return False, result
+        return True, result.json()
+
+    async def _batched(self, username: str, op: str, params: Optional[dict] = None,
+                       max_retries: int = 3) -> Tuple[bool, dict]:
+        """
+        Encola una consulta para el próximo POST /batch del usuario y espera
+        su resultado. La primera consulta abre la ventana de BATCH_WINDOW_MS;
+        el lote se envía al cerrarse o al llegar a BATCH_MAX_REQUESTS.
+        """
+        future = self._loop.create_future()
+        pending = self._batch_pending.setdefault(username, [])
+        pending.append((op, params or {}, max_retries, future))
+
+        if len(pending) >= BATCH_MAX_REQUESTS:
+            self._flush_batch(username)
+        elif username not in self._batch_handles:
+            self._batch_handles[username] = self._loop.call_later(
+                settings.BATCH_WINDOW_MS / 1000, self._flush_batch, username
+            )
+        return await future
+
+    def _flush_batch(self, username: str):
+        """Envía las consultas pendientes del usuario (hilo del event loop)."""
+        handle = self._batch_handles.pop(username, None)
+        if handle is not None:
+            handle.cancel()
+        entries = self._batch_pending.pop(username, [])
+        if entries:
+            self._loop.create_task(self._send_batch(username, entries))
+
+    async def _send_batch(self, username: str, entries: List[tuple]):
+        """Hace el POST /batch y reparte cada respuesta a su future."""
+        payload = {
+            "usuario": username,
+            "peticiones": [{"op": op, "id": str(i), "params": params}
+                           for i, (op, params, _, _) in enumerate(entries)]
+        }
+        logger.debug("Enviando batch de %d consultas para %s", len(entries), username)
+
+        try:
+            success, data = await self._request_json(
+                "POST", ENDPOINT_BATCH, json=payload,
+                max_retries=min(entry[2] for entry in entries),
+                timeout=settings.HTTP_TIMEOUT_LONG
+            )
+            resultados = data.get("resultados", {}) if success else {}
+            if not isinstance(resultados, dict):
+                raise ValueError("respuesta de /batch sin 'resultados'")
+        except Exception as e:
+            # Nunca dejar sin resolver los futures: quien espera en _batched se colgaría
+            logger.error("Batch para %s fallido: %s", username, e, exc_info=True)
+            success, data = False, {"error": f"Error: {e}"}
+
+        for i, (_, _, _, future) in enumerate(entries):
+            if future.done():
+                continue
+            if not success:
+                future.set_result((False, data))
+                continue
+            result = resultados.get(str(i))
+            if isinstance(result, dict) and result.get("codigo") == 200:
+                future.set_result((True, result.get("datos")))
+            else:
+                detail = result.get("detail", "Error de servidor") if isinstance(result, dict) else "Error de servidor"
+                future.set_result((False, {"error": f"Error: {detail}"}))
+
+    async def gather(self, *coros: Coroutine) -> Tuple[bool, list]:
+        """Ejecuta varias peticiones en paralelo y devuelve todos sus resultados."""
+        results = await asyncio.gather(*coros)
+        return True, list(results)
+
+    async def validate_sync_status(self, username: str) -> Tuple[bool, dict]:
+        """Valida si el usuario necesita sincronizar (False si está bloqueado)."""
+        success, data = await self._batched(username, "validar_sync", max_retries=1)
+        if success and data.get("bloqueado", False):
+            return False, data
+        return success, data
+
+    async def fetch_sync_data(self, username: str) -> Tuple[bool, dict]:
+        """Obtiene los datos de sincronización completos."""
+        success, data = await self._batched(username, "sincronizar_datos")
+        if success and data.get("status") != STATUS_SYNC_SUCCESS:
+            return False, {"error": "Respuesta de sincronización inválida."}
+        return success, data
+
+    async def _post_or_enqueue(self, store, username: str, operation: str,
+                               payload: dict) -> Tuple[bool, dict]:
+        """
+        Envía una escritura; si no hay conexión (o la Madre responde "busy":
+        saturada o con la misma petición aún en curso) y se indica un almacén
+        local, la deja en la cola de salida y responde {"status": "encolado"}.
+        La clave de idempotencia viaja con el envío y con los reenvíos.
+        """
+        idempotency_key = uuid.uuid4().hex
+        success, data = await self._request_json(
+            "POST", OUTBOX_OPERATIONS[operation], json=payload, max_retries=1,
+            headers={IDEMPOTENCY_HEADER: idempotency_key}
+        )
+        if not success and (data.get("offline") or data.get("busy")) and store is not None:
+            await asyncio.to_thread(store.enqueue, username, operation, payload, idempotency_key)
+            return True, {"status": "encolado"}
+        return success, data
+
+    async def send_message(self, from_user: str, to_user: str, subject: str, body: str,
+                           parent_message_id: Optional[int] = None, store=None) -> Tuple[bool, dict]:
+        """Envía un mensaje (o lo encola en store si no hay conexión)."""
+        payload = {
+            "from_user": from_user,
+            "to_user": to_user,
+            "subject": subject,
+            "body": body,
+            "parent_message_id": parent_message_id
+        }
+        return await self._post_or_enqueue(store, from_user, "enviar_mensaje", payload)
+
+    async def get_threads(self, username: str, limit: int = 50, offset: int = 0) -> Tuple[bool, dict]:
+        """Obtiene las conversaciones del usuario."""
+        return await self._batched(username, "obtener_hilos", {"limit": limit, "offset": offset})
+
+    async def get_thread(self, thread_id: int) -> Tuple[bool, dict]:
+        """Obtiene una conversación completa."""
+        return await self._request_json("GET", f"{ENDPOINT_OBTENER_HILO}/{thread_id}")
+
+    async def send_chat_message(self, from_user: str, to_user: str, message: str,
+                                store=None) -> Tuple[bool, dict]:
+        """Envía un mensaje de chat en vivo (o lo encola en store si no hay conexión)."""
+        payload = {"from_user": from_user, "to_user": to_user, "message": message}
+        return await self._post_or_enqueue(store, from_user, "enviar_chat", payload)
+
+    async def book_class(self, username: str, schedule_id: int, fecha_clase: str,
+                         store=None) -> Tuple[bool, dict]:
+        """Reserva una clase (o la encola en store si no hay conexión)."""
+        payload = {"username": username, "schedule_id": schedule_id, "fecha_clase": fecha_clase}
+        return await self._post_or_enqueue(store, username, "reservar_clase", payload)
+
+    async def log_workout(self, payload: dict, store=None) -> Tuple[bool, dict]:
+        """Registra una serie de ejercicio (o la encola en store si no hay conexión)."""
+        return await self._post_or_enqueue(store, payload.get("username", ""), "registrar_serie", payload)
+
+    async def get_chat_history(self, username: str, other_user: str, limit: int = 50) -> Tuple[bool, dict]:
+        """Obtiene el historial de chat con otro usuario."""
+        return await self._batched(username, "obtener_chat", {"user2": other_user, "limit": limit})
+
+    async def get_bookings(self, username: str) -> Tuple[bool, dict]:
+        """Obtiene las reservas de clases del usuario."""
+        return await self._request_json("GET", ENDPOINT_MIS_RESERVAS, params={"username": username})
+
+    async def get_workout_history(self, username: str, exercise_id: int,
+                                  limit: int = 10) -> Tuple[bool, dict]:
+        """Obtiene el historial de un ejercicio del usuario."""
+        params = {"username": username, "exercise_id": exercise_id, "limit": limit}
+        return await self._request_json("GET", ENDPOINT_WORKOUT_HISTORIAL, params=params)
+
+    async def replay_outbox(self, store, username: str) -> Tuple[bool, dict]:
+        """
+        Reenvía en orden las escrituras hechas sin conexión.
+        Se detiene en el primer fallo de conectividad o respuesta "busy"
+        (saturación o petición aún en curso) para conservar el orden; el resto de rechazos del servidor
+        cuentan como intento fallido.
+
+        Returns:
+            Tuple[bool, dict]: (True, {"enviados": n, "pendientes": m})
+        """
+        entries = await asyncio.to_thread(store.pending, username)
+        sent = 0
+
+        for entry in entries:
+            path = OUTBOX_OPERATIONS.get(entry['operation'])
+            if path is None:
+                await asyncio.to_thread(store.mark_done, entry['id'])
+                continue
+
+            headers = {IDEMPOTENCY_HEADER: entry['idempotency_key']} if entry.get('idempotency_key') else None
+            success, result = await self._request("POST", path, json=entry['payload'], max_retries=1,
+                                                  headers=headers)
+            if success:
+                await asyncio.to_thread(store.mark_done, entry['id'])
+                sent += 1
+            elif result.get("offline") or result.get("busy"):
+                break
+            else:
+                await asyncio.to_thread(store.mark_failed, entry['id'], result.get("error", ""))
+
+        pending = await asyncio.to_thread(store.count_pending, username)
+        if sent:
+            logger.info("Outbox: %d operaciones reenviadas, %d pendientes", sent, pending)
+        return True, {"enviados": sent, "pendientes": pending}
+
+    async def get_thumbnail(self, tipo: str, photo_id: int, size: str = "small") -> Tuple[bool, dict]:
+        """Obtiene una miniatura, pasando por la caché de imágenes en disco."""
+        key = f"{tipo}_{photo_id}_{size}.jpg"
+        if self.image_cache is not None:
+            path = await asyncio.to_thread(self.image_cache.get, key)
+            if path:
+                return True, {"path": path}
+
+        success, result = await self._request("GET", f"{ENDPOINT_IMAGENES}/{tipo}/{photo_id}",
+                                              params={"tamano": size}, max_retries=2)
+        if not success:
+            return False, result
+
+        if self.image_cache is None:
+            return True, {"content": result.content}
+
+        path = await asyncio.to_thread(self.image_cache.put, key, result.content)
+        return True, {"path": path}
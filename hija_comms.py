@@ -3,15 +3,32 @@ import requests
 import json
 import os
 import hashlib
+import mimetypes
 import time
 import random
-from datetime import datetime
-from typing import Optional, Dict, Any, Tuple
+import threading
+from concurrent.futures import Future
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Optional, Dict, Any, List, Tuple
+from urllib3.util.request import ACCEPT_ENCODING
 from config.settings import get_hija_settings
+from hija_image_cache import ImageCache
 from shared.logger import setup_logger
 from shared.constants import (
     ENDPOINT_AUTORIZAR,
     ENDPOINT_SINCRONIZAR_DATOS,
+    ENDPOINT_VERSION_SYNC,
+    ENDPOINT_BUSCAR_MENSAJES,
+    ENDPOINT_OBTENER_HILOS,
+    ENDPOINT_OBTENER_HILO,
+    ENDPOINT_ADJUNTOS,
+    ENDPOINT_IMAGENES,
+    ENDPOINT_BATCH,
+    BATCH_MAX_REQUESTS,
+    HTTP_MAX_RETRY_AFTER,
+    IMAGE_CACHE_DIR_NAME,
+    STORAGE_CHUNK_SIZE,
     STATUS_APPROVED,
     STATUS_SYNC_SUCCESS,
     ERROR_CONNECTION,
@@ -28,10 +45,44 @@ if os.path.isabs(settings.LOCAL_DATA_DIR):
 else:
     LOCAL_DATA_DIR = os.path.join(os.path.dirname(__file__), settings.LOCAL_DATA_DIR)
 CREDENTIALS_FILE = os.path.join(LOCAL_DATA_DIR, CREDENTIALS_FILENAME)
+IMAGE_CACHE_DIR = os.path.join(LOCAL_DATA_DIR, IMAGE_CACHE_DIR_NAME)
 
 logger.info("Communication module initialized - Madre URL: %s", settings.MADRE_BASE_URL)
 
 
+def accept_encoding() -> str:
+    """
+    Accept-Encoding de las peticiones a Madre: las codificaciones que
+    requests (urllib3) sabe descomprimir, de la más compacta a la más común.
+    zstd y br solo aparecen si están instalados zstandard y brotli.
+    """
+    available = {encoding.strip() for encoding in ACCEPT_ENCODING.split(",")}
+    return ", ".join(encoding for encoding in ("zstd", "br", "gzip", "deflate") if encoding in available)
+
+
+def parse_retry_after(response) -> Optional[float]:
+    """
+    Lee la cabecera Retry-After de una respuesta (segundos o fecha HTTP).
+
+    Returns:
+        Optional[float]: segundos a esperar, o None si no hay indicación
+    """
+    value = response.headers.get("Retry-After") if response is not None else None
+    if not value:
+        return None
+
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+
+    try:
+        when = parsedate_to_datetime(value)
+        return max(0.0, (when - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+
 class APICommunicator:
     """
     Gestiona todas las peticiones HTTP a la API del Sistema de Gestión del Gimnasio.
@@ -48,13 +99,18 @@ class APICommunicator:
         """
         self.base_url = base_url or settings.MADRE_BASE_URL
         self.session = requests.Session()
-        self.session.headers.update({"Content-Type": "application/json"})
+        self.session.headers.update({"Content-Type": "application/json", "Accept-Encoding": accept_encoding()})
 
         self.is_connected = False
         self.last_successful_request = None
         self.consecutive_failures = 0
 
+        self._batch_lock = threading.Lock()
+        self._batch_pending: Dict[str, List[tuple]] = {}
+        self._batch_timer: Optional[threading.Timer] = None
+
         os.makedirs(LOCAL_DATA_DIR, exist_ok=True)
+        self.image_cache = ImageCache(IMAGE_CACHE_DIR, settings.IMAGE_CACHE_MB * 1024 * 1024)
         logger.info("APICommunicator initialized with base_url: %s", self.base_url)
 
         self._check_connectivity()
@@ -157,6 +213,15 @@ class APICommunicator:
             except requests.exceptions.HTTPError as e:
                 logger.error("HTTP error: %s", e)
 
+                if e.response.status_code == 429 and attempt < max_retries - 1:
+                    # Control de admisión del servidor: esperar lo que indique Retry-After
+                    retry_after = parse_retry_after(e.response)
+                    wait_time = min(retry_after if retry_after is not None else 2 ** attempt,
+                                    HTTP_MAX_RETRY_AFTER) + random.uniform(0, 1)
+                    logger.warning("Server busy (429), retrying in %.2fs...", wait_time)
+                    time.sleep(wait_time)
+                    continue
+
                 if e.response.status_code >= 500 and attempt < max_retries - 1:
                     wait_time = (2 ** attempt) + random.uniform(0, 1)
                     logger.warning(
@@ -373,13 +438,14 @@ class APICommunicator:
                 return False, {"error": "Respuesta de sincronización inválida."}
 
         except requests.exceptions.HTTPError as e:
+            retry_after = parse_retry_after(e.response)
             try:
                 error_detail = e.response.json().get("detail", "Error de servidor")
                 logger.error("Sync HTTP error for %s: %s", username, error_detail)
-                return False, {"error": f"Error: {error_detail}"}
+                return False, {"error": f"Error: {error_detail}", "retry_after": retry_after}
             except json.JSONDecodeError:
                 logger.error("Sync HTTP error for %s: %d", username, e.response.status_code)
-                return False, {"error": f"Error HTTP {e.response.status_code}"}
+                return False, {"error": f"Error HTTP {e.response.status_code}", "retry_after": retry_after}
 
         except requests.exceptions.ConnectionError as e:
             logger.error("Connection error during sync for %s: %s", username, e)
@@ -393,6 +459,157 @@ class APICommunicator:
             logger.error("Unexpected error during sync for %s: %s", username, e, exc_info=True)
             return False, {"error": f"Error inesperado: {e}"}
 
+    def probe_sync_version(self, username: str, version: Optional[str]) -> Tuple[bool, dict]:
+        """
+        Sondeo ligero de /sync/version: indica si hay cambios respecto a la
+        versión local sin descargar los datos. Sin reintentos: el planificador
+        de sincronización decide cuándo volver a intentarlo.
+
+        Args:
+            username: Nombre de usuario
+            version: Versión de los datos locales (None si no hay)
+
+        Returns:
+            Tuple[bool, dict]: (éxito, {"version", "cambios"} o error). Los
+            errores incluyen "retry_after" si el servidor lo indicó.
+        """
+        url = f"{self.base_url}{ENDPOINT_VERSION_SYNC}"
+        params = {"usuario": username}
+        if version:
+            params["version"] = version
+
+        try:
+            response = self.session.get(url, params=params, timeout=settings.HTTP_TIMEOUT_SHORT)
+            response.raise_for_status()
+
+            self.is_connected = True
+            self.last_successful_request = datetime.now()
+            self.consecutive_failures = 0
+            return True, response.json()
+
+        except requests.exceptions.HTTPError as e:
+            retry_after = parse_retry_after(e.response)
+            try:
+                error_detail = e.response.json().get("detail", "Error de servidor")
+                return False, {"error": f"Error: {error_detail}", "retry_after": retry_after}
+            except json.JSONDecodeError:
+                return False, {"error": f"Error HTTP {e.response.status_code}", "retry_after": retry_after}
+
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+            self.is_connected = False
+            self.consecutive_failures += 1
+            return False, {"error": ERROR_CONNECTION}
+
+        except Exception as e:
+            logger.error("Unexpected error probing sync version for %s: %s", username, e, exc_info=True)
+            return False, {"error": f"Error inesperado: {e}"}
+
+    def queue_call(self, username: str, op: str, params: Optional[Dict[str, Any]] = None) -> Future:
+        """
+        Encola una consulta para el próximo POST /batch del usuario.
+
+        Las consultas encoladas dentro de BATCH_WINDOW_MS (desde cualquier
+        hilo) viajan juntas en una sola petición, que la Madre resuelve con
+        una única búsqueda del usuario y una única conexión a la base de datos.
+
+        Args:
+            username: Usuario para el que se ejecuta la consulta
+            op: Operación del batch ('validar_sync', 'sincronizar_datos',
+                'obtener_mensajes', 'obtener_hilos', 'contar_no_leidos',
+                'obtener_chat', 'contar_chat_no_leidos')
+            params: Parámetros de la operación
+
+        Returns:
+            Future: se resuelve con (éxito, datos_o_error)
+
+        Example:
+            >>> hilos = communicator.queue_call("user1", "obtener_hilos", {"limit": 20})
+            >>> chat = communicator.queue_call("user1", "obtener_chat", {"user2": "admin"})
+            >>> success, data = hilos.result()
+        """
+        future = Future()
+        flush_now = False
+
+        with self._batch_lock:
+            pending = self._batch_pending.setdefault(username, [])
+            pending.append((op, params or {}, future))
+
+            if len(pending) >= BATCH_MAX_REQUESTS:
+                flush_now = True
+            elif self._batch_timer is None:
+                self._batch_timer = threading.Timer(settings.BATCH_WINDOW_MS / 1000, self._flush_batches)
+                self._batch_timer.daemon = True
+                self._batch_timer.start()
+
+        if flush_now:
+            self._flush_batches()
+        return future
+
+    def batch(self, username: str, calls: List[Tuple[str, Dict[str, Any]]]) -> List[Tuple[bool, dict]]:
+        """
+        Ejecuta varias consultas en una sola petición y espera sus resultados.
+
+        Args:
+            username: Usuario para el que se ejecutan las consultas
+            calls: Lista de (op, params)
+
+        Returns:
+            List[Tuple[bool, dict]]: resultados en el mismo orden que calls
+        """
+        futures = [self.queue_call(username, op, params) for op, params in calls]
+        return [future.result() for future in futures]
+
+    def _flush_batches(self):
+        """Envía todas las consultas pendientes, un POST /batch por usuario."""
+        with self._batch_lock:
+            if self._batch_timer is not None:
+                self._batch_timer.cancel()
+                self._batch_timer = None
+            pending, self._batch_pending = self._batch_pending, {}
+
+        for username, entries in pending.items():
+            self._send_batch(username, entries)
+
+    def _send_batch(self, username: str, entries: List[tuple]):
+        """Hace el POST /batch y resuelve el Future de cada consulta."""
+        url = f"{self.base_url}{ENDPOINT_BATCH}"
+        payload = {
+            "usuario": username,
+            "peticiones": [{"op": op, "id": str(i), "params": params}
+                           for i, (op, params, _) in enumerate(entries)]
+        }
+
+        logger.debug("Sending batch of %d calls for user: %s", len(entries), username)
+
+        try:
+            response = self._retry_request('POST', url, json=payload, timeout=settings.HTTP_TIMEOUT_LONG)
+            resultados = response.json().get("resultados", {})
+        except requests.exceptions.HTTPError as e:
+            try:
+                error = {"error": f"Error: {e.response.json().get('detail', 'Error de servidor')}"}
+            except json.JSONDecodeError:
+                error = {"error": f"Error HTTP {e.response.status_code}"}
+            resultados = None
+        except requests.exceptions.ConnectionError:
+            error = {"error": ERROR_CONNECTION}
+            resultados = None
+        except requests.exceptions.Timeout:
+            error = {"error": ERROR_TIMEOUT}
+            resultados = None
+        except Exception as e:
+            logger.error("Unexpected error in batch for %s: %s", username, e, exc_info=True)
+            error = {"error": f"Error inesperado: {e}"}
+            resultados = None
+
+        for i, (_, _, future) in enumerate(entries):
+            if resultados is None:
+                future.set_result((False, error))
+                continue
+            result = resultados.get(str(i), {})
+            if result.get("codigo") == 200:
+                future.set_result((True, result["datos"]))
+            else:
+                future.set_result((False, {"error": f"Error: {result.get('detail', 'Error de servidor')}"}))
 
     def send_message(self, to_user: str, subject: str, body: str,
                      parent_message_id: Optional[int] = None) -> Tuple[bool, dict]:
@@ -465,6 +682,127 @@ class APICommunicator:
         except Exception as e:
             return False, {"error": f"Error: {e}"}
 
+    def get_threads(self, limit: int = 50, offset: int = 0) -> Tuple[bool, dict]:
+        """Obtiene las conversaciones del usuario ordenadas por actividad."""
+        url = f"{self.base_url}{ENDPOINT_OBTENER_HILOS}"
+
+        creds = self.load_credentials()
+        username = creds.get('username', '') if creds else ''
+
+        if not username:
+            return False, {"error": "Usuario no identificado"}
+
+        params = {
+            "usuario": username,
+            "limit": limit,
+            "offset": offset
+        }
+
+        try:
+            response = self.session.get(url, params=params, timeout=10)
+            response.raise_for_status()
+
+            data = response.json()
+            return True, data
+
+        except Exception as e:
+            return False, {"error": f"Error: {e}"}
+
+    def get_thread(self, thread_id: int) -> Tuple[bool, dict]:
+        """Obtiene una conversación completa con sus adjuntos."""
+        url = f"{self.base_url}{ENDPOINT_OBTENER_HILO}/{thread_id}"
+
+        try:
+            response = self.session.get(url, timeout=10)
+            response.raise_for_status()
+
+            data = response.json()
+            return True, data
+
+        except Exception as e:
+            return False, {"error": f"Error: {e}"}
+
+    def upload_attachment(self, message_id: int, file_path: str) -> Tuple[bool, dict]:
+        """
+        Sube un archivo como adjunto de un mensaje.
+        El archivo se envía en streaming, sin leerlo entero en memoria.
+        """
+        url = f"{self.base_url}{ENDPOINT_ADJUNTOS}/subir/{message_id}"
+        filename = os.path.basename(file_path)
+        content_type = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+
+        try:
+            with open(file_path, 'rb') as f:
+                response = self.session.post(
+                    url,
+                    params={"filename": filename},
+                    data=f,
+                    headers={
+                        "Content-Type": content_type,
+                        "Content-Length": str(os.path.getsize(file_path))
+                    },
+                    timeout=60
+                )
+            response.raise_for_status()
+
+            data = response.json()
+            return True, data
+
+        except Exception as e:
+            return False, {"error": f"Error: {e}"}
+
+    def download_attachment(self, attachment_id: int, dest_path: str) -> Tuple[bool, dict]:
+        """
+        Descarga un adjunto a disco por bloques.
+        Si existe una descarga parcial previa se reanuda con una petición Range.
+        """
+        url = f"{self.base_url}{ENDPOINT_ADJUNTOS}/{attachment_id}"
+        partial_path = dest_path + ".part"
+        offset = os.path.getsize(partial_path) if os.path.exists(partial_path) else 0
+        headers = {"Range": f"bytes={offset}-"} if offset else {}
+
+        try:
+            with self.session.get(url, headers=headers, stream=True, timeout=60) as response:
+                if response.status_code == 416:
+                    os.remove(partial_path)
+                    return self.download_attachment(attachment_id, dest_path)
+                response.raise_for_status()
+
+                mode = 'ab' if response.status_code == 206 else 'wb'
+                with open(partial_path, mode) as f:
+                    for chunk in response.iter_content(chunk_size=STORAGE_CHUNK_SIZE):
+                        f.write(chunk)
+
+            os.replace(partial_path, dest_path)
+            return True, {"path": dest_path, "size": os.path.getsize(dest_path)}
+
+        except Exception as e:
+            return False, {"error": f"Error: {e}"}
+
+    def get_thumbnail(self, tipo: str, photo_id: int, size: str = "small") -> Tuple[bool, dict]:
+        """
+        Obtiene la miniatura de una foto, usando la caché local en disco.
+
+        Returns:
+            Tuple[bool, dict]: (éxito, {"path": ruta_local} o {"error": ...})
+        """
+        key = f"{tipo}_{photo_id}_{size}.jpg"
+        path = self.image_cache.get(key)
+        if path:
+            return True, {"path": path}
+
+        url = f"{self.base_url}{ENDPOINT_IMAGENES}/{tipo}/{photo_id}"
+
+        try:
+            response = self.session.get(url, params={"tamano": size}, timeout=10)
+            response.raise_for_status()
+
+            path = self.image_cache.put(key, response.content)
+            return True, {"path": path}
+
+        except Exception as e:
+            return False, {"error": f"Error: {e}"}
+
     def mark_message_read(self, message_id: int) -> Tuple[bool, dict]:
         """Marca un mensaje como leído."""
         url = f"{self.base_url}/marcar_leido/{message_id}"
@@ -550,3 +888,30 @@ class APICommunicator:
 
         except Exception as e:
             return False, {"error": f"Error: {e}"}
+
+    def search_messages(self, query: str, limit: int = 20, offset: int = 0) -> Tuple[bool, dict]:
+        """Busca en los mensajes y el chat del usuario."""
+        url = f"{self.base_url}{ENDPOINT_BUSCAR_MENSAJES}"
+
+        creds = self.load_credentials()
+        username = creds.get('username', '') if creds else ''
+
+        if not username:
+            return False, {"error": "Usuario no identificado"}
+
+        params = {
+            "usuario": username,
+            "q": query,
+            "limit": limit,
+            "offset": offset
+        }
+
+        try:
+            response = self.session.get(url, params=params, timeout=10)
+            response.raise_for_status()
+
+            data = response.json()
+            return True, data
+
+        except Exception as e:
+            return False, {"error": f"Error: {e}"}
@@ -0,0 +1,90 @@
+import os
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+from shared.logger import setup_logger
+
+logger = setup_logger(__name__, log_file="hija_image_cache.log")
+
+
+class ImageCache:
+    """
+    Caché LRU en disco para miniaturas descargadas de la Madre.
+
+    El orden de uso se guarda en la fecha de modificación de cada fichero,
+    de modo que sobrevive a reinicios de la aplicación. Cuando el tamaño
+    total supera max_bytes se eliminan las imágenes menos usadas.
+    """
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, int]" = OrderedDict()
+        self._total_bytes = 0
+
+        os.makedirs(self.directory, exist_ok=True)
+        self._cargar_indice()
+
+    def _cargar_indice(self):
+        """Reconstruye el índice LRU a partir de los ficheros en disco."""
+        files = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if name.endswith(".tmp"):
+                os.remove(path)
+                continue
+            stat = os.stat(path)
+            files.append((stat.st_mtime, name, stat.st_size))
+
+        for _mtime, name, size in sorted(files):
+            self._entries[name] = size
+            self._total_bytes += size
+
+        logger.info("Image cache: %d imágenes, %d bytes", len(self._entries), self._total_bytes)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key)
+
+    def get(self, key: str) -> Optional[str]:
+        """Devuelve la ruta de la imagen si está en caché y la marca como usada."""
+        with self._lock:
+            if key not in self._entries:
+                return None
+
+            path = self._path(key)
+            try:
+                os.utime(path)
+            except FileNotFoundError:
+                self._total_bytes -= self._entries.pop(key)
+                return None
+
+            self._entries.move_to_end(key)
+            return path
+
+    def put(self, key: str, data: bytes) -> str:
+        """Guarda una imagen en caché y expulsa las menos usadas si hace falta."""
+        path = self._path(key)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+
+        with self._lock:
+            os.replace(tmp_path, path)
+            self._total_bytes -= self._entries.pop(key, 0)
+            self._entries[key] = len(data)
+            self._total_bytes += len(data)
+            self._evict()
+
+        return path
+
+    def _evict(self):
+        """Elimina entradas LRU hasta volver bajo el límite (conserva la última)."""
+        while self._total_bytes > self.max_bytes and len(self._entries) > 1:
+            key, size = self._entries.popitem(last=False)
+            self._total_bytes -= size
+            try:
+                os.remove(self._path(key))
+            except FileNotFoundError:
+                pass
@@ -1,11 +1,16 @@
 
 import customtkinter
-import threading
+import os
 import time
-from hija_comms import APICommunicator
+from typing import Tuple
+from hija_async import AsyncAPIClient
+from hija_comms import APICommunicator, LOCAL_DATA_DIR
+from hija_store import LocalStore
+from hija_sync import SyncScheduler
 from hija_views import LoginFrame, MainAppFrame
 from config.settings import get_hija_settings
 from shared.logger import setup_logger
+from shared.constants import LOCAL_STORE_FILENAME, OUTBOX_RETRY_INTERVAL
 
 logger = setup_logger(__name__, log_file="hija_main.log")
 
@@ -36,16 +41,25 @@ class AppHija(customtkinter.CTk):
         self.grid_rowconfigure(0, weight=1)
 
         self.communicator = APICommunicator()
+        self.store = LocalStore(os.path.join(LOCAL_DATA_DIR, LOCAL_STORE_FILENAME))
         self.current_username = None
         self.current_user_data = None
 
-        self.sync_thread = None
-        self.sync_running = False
-        self.sync_interval = settings.SYNC_INTERVAL_INITIAL
-        self.first_sync_done = False
+        self.sync_scheduler = SyncScheduler(self._sync_en_background, is_idle=self._app_inactiva)
+        self.sync_version = None
+        self._minimizada = False
+        self._ultima_actividad = time.monotonic()
+        self.bind("<Unmap>", self._on_unmap, add="+")
+        self.bind("<Map>", self._on_map, add="+")
+        for secuencia in ("<KeyPress>", "<ButtonPress>", "<Motion>"):
+            self.bind_all(secuencia, self._registrar_actividad, add="+")
 
         self._current_frame = None
 
+        self.async_client = AsyncAPIClient(image_cache=self.communicator.image_cache)
+        self.async_client.attach(self)
+        self._outbox_job = None
+
         logger.info("Hija application initialized, attempting auto-login...")
 
         self._intentar_auto_login()
@@ -71,13 +85,6 @@ class AppHija(customtkinter.CTk):
 
         username = creds.get('username')
 
-        valid, validation_data = self.communicator.validate_sync_status(username)
-
-        if not valid and validation_data.get('bloqueado'):
-            self.communicator.clear_credentials()
-            self._mostrar_login()
-            return
-
         self.current_username = username
         self.current_user_data = {
             'username': username,
@@ -85,6 +92,22 @@ class AppHija(customtkinter.CTk):
         }
         self._mostrar_app_principal()
 
+        self.async_client.submit(
+            self.async_client.validate_sync_status(username),
+            self._on_validacion_sync
+        )
+
+    def _on_validacion_sync(self, valid: bool, validation_data: dict):
+        """
+        Resultado de la validación de 72h del auto-login. La app ya se muestra
+        con los datos locales; solo se vuelve al login si la Madre lo bloquea.
+        """
+        if not valid and validation_data.get('bloqueado'):
+            logger.warning("Acceso bloqueado por la Madre: %s", validation_data.get('mensaje'))
+            self.sync_scheduler.stop()
+            self.communicator.clear_credentials()
+            self._mostrar_login()
+
     def _mostrar_login(self):
         """
         Crea y muestra el LoginFrame.
@@ -129,160 +152,319 @@ class AppHija(customtkinter.CTk):
             user_data=self.current_user_data,
             on_sync_attempt=self._intentar_sync,
             on_send_message=self._enviar_mensaje,
-            on_send_chat=self._enviar_chat
+            on_send_chat=self._enviar_chat,
+            on_open_thread=self._abrir_hilo,
+            on_request_thumbnail=self._cargar_miniatura
         )
         self._current_frame.pack(fill="both", expand=True)
 
-        self._cargar_mensajes()
-        self._cargar_chat()
+        self._mostrar_datos_locales()
+
+        self._cargar_bandeja()
 
         self._iniciar_sync_automatica()
+        self._programar_reenvio()
+
+    def _mostrar_datos_locales(self):
+        """Pinta al instante la última copia local, antes de contactar con la Madre."""
+        self.sync_version = None
+        sync_data = self.store.load_snapshot(self.current_username, "sync")
+        if sync_data:
+            self.sync_version = self.store.load_snapshot(self.current_username, "sync_version")
+            self._current_frame.update_content(sync_data)
+            self._current_frame.update_sync_status("Mostrando datos guardados, actualizando...", True)
+
+        threads = self.store.load_snapshot(self.current_username, "hilos")
+        if threads is not None:
+            self._current_frame.update_message_list(threads)
+
+        chat = self.store.load_snapshot(self.current_username, "chat")
+        if chat is not None:
+            self._current_frame.update_chat_history(chat)
+
+    def _programar_reenvio(self):
+        """Programa el siguiente intento de vaciar la cola de salida."""
+        if self._outbox_job is None:
+            self._outbox_job = self.after(OUTBOX_RETRY_INTERVAL * 1000, self._reenviar_pendientes)
+
+    def _reenviar_pendientes(self):
+        """Reenvía a la Madre las escrituras hechas sin conexión."""
+        if self._outbox_job is not None:
+            self.after_cancel(self._outbox_job)
+            self._outbox_job = None
+        if not self.current_username:
+            return
+
+        if self.store.count_pending(self.current_username):
+            self.async_client.submit(
+                self.async_client.replay_outbox(self.store, self.current_username),
+                self._on_reenvio
+            )
+        self._programar_reenvio()
+
+    def _on_reenvio(self, _success: bool, data: dict):
+        """Refresca las vistas si se aplicó alguna escritura pendiente."""
+        if data.get('enviados') and isinstance(self._current_frame, MainAppFrame):
+            self._current_frame.update_sync_status(
+                f"{data['enviados']} operaciones pendientes enviadas"
+            )
+            self._cargar_bandeja()
 
     def _intentar_sync(self):
         """
         Callback de lógica de negocio. Es llamado por MainAppFrame.
-        Usa el 'communicator' para obtener datos de sincronización.
+        Lanza la sincronización en el cliente asíncrono; la GUI sigue
+        respondiendo mientras tanto y el resultado llega en _on_sync.
         """
         if not self.current_username:
             if isinstance(self._current_frame, MainAppFrame):
                 self._current_frame.show_sync_error("Error: No hay usuario autenticado.")
             return
 
-        success, data = self.communicator.fetch_sync_data(self.current_username)
+        self.async_client.submit(
+            self.async_client.fetch_sync_data(self.current_username),
+            self._on_sync
+        )
 
-        if isinstance(self._current_frame, MainAppFrame):
-            if success:
-                self._current_frame.update_content(data)
-
-                if not self.first_sync_done:
-                    self.first_sync_done = True
-                    self.sync_interval = settings.SYNC_INTERVAL_NORMAL
-                    logger.info(
-                        "Primera sincronización exitosa. Intervalo cambiado a %d minutos.",
-                        self.sync_interval // 60)
-            else:
-                error_msg = data.get("error", "Error de sincronización desconocido.")
-                self._current_frame.show_sync_error(error_msg)
+    def _on_sync(self, success: bool, data: dict):
+        """Aplica el resultado de una sincronización manual (hilo de Tk)."""
+        if not isinstance(self._current_frame, MainAppFrame):
+            return
+
+        if success:
+            self.store.save_snapshot(self.current_username, "sync", data)
+            self._current_frame.update_content(data)
+            self._reenviar_pendientes()
+        else:
+            error_msg = data.get("error", "Error de sincronización desconocido.")
+            self._current_frame.show_sync_error(error_msg)
 
     def _iniciar_sync_automatica(self):
         """
-        Inicia un hilo de sincronización automática en segundo plano.
-        Sincroniza cada 5 minutos inicialmente, luego cada 30 minutos tras la primera sync exitosa.
+        Inicia la sincronización automática en segundo plano. El planificador
+        decide los intervalos (jitter, backoff, inactividad, Retry-After).
         """
-        if self.sync_running:
-            return
-
-        self.sync_running = True
-        self.sync_thread = threading.Thread(target=self._sync_loop, daemon=True, name="SyncThread")
-
-        self.sync_thread.start()
-        logger.info("Sincronización automática iniciada (intervalo: %ds)", self.sync_interval)
-
-    def _sync_loop(self):
+        self.sync_scheduler.start()
+
+    def _app_inactiva(self) -> bool:
+        """True si la ventana está minimizada o lleva SYNC_IDLE_AFTER segundos sin uso."""
+        return self._minimizada or time.monotonic() - self._ultima_actividad > settings.SYNC_IDLE_AFTER
+
+    def _registrar_actividad(self, _event=None):
+        """Registra actividad del usuario; al volver de la inactividad adelanta la sincronización."""
+        estaba_inactiva = self._app_inactiva()
+        self._ultima_actividad = time.monotonic()
+        if estaba_inactiva:
+            self.sync_scheduler.wake()
+
+    def _on_unmap(self, event):
+        """La ventana principal se ha minimizado."""
+        if event.widget is self:
+            self._minimizada = True
+
+    def _on_map(self, event):
+        """La ventana principal vuelve a mostrarse: sincroniza pronto."""
+        if event.widget is self and self._minimizada:
+            self._minimizada = False
+            self.sync_scheduler.wake()
+
+    def _sync_en_background(self) -> Tuple[bool, dict]:
         """
-        Loop de sincronización que se ejecuta en segundo plano.
-        Respeta el intervalo configurado (5 min inicial, 30 min después).
+        Una pasada de la sincronización automática (hilo del planificador).
+        Sondea /sync/version y solo descarga los datos completos si la Madre
+        informa de cambios respecto a la versión local.
         """
-        time.sleep(2)
-        self._sync_en_background()
+        username = self.current_username
+        if not username:
+            return True, {}
 
-        while self.sync_running:
-            time.sleep(self.sync_interval)
+        success, probe = self.communicator.probe_sync_version(username, self.sync_version)
+        if not success:
+            logger.warning("Error en sondeo de sincronización: %s", probe.get('error', 'Desconocido'))
+            return False, probe
 
-            if not self.sync_running:
-                break
+        if not probe.get('cambios'):
+            logger.debug("Sin cambios en la Madre (versión %s)", self.sync_version)
+            self._mostrar_estado_sync()
+            return True, probe
 
-            self._sync_en_background()
+        if isinstance(self._current_frame, MainAppFrame):
+            self.after(0, lambda: self._current_frame.update_sync_status(
+                "Sincronizando en segundo plano...", True
+            ))
 
-    def _sync_en_background(self):
-        """
-        Realiza una sincronización en segundo plano sin bloquear la GUI.
-        """
-        if not self.current_username:
-            return
+        success, data = self.communicator.fetch_sync_data(username)
 
-        try:
+        if success:
+            self.sync_version = probe.get('version')
+            self.store.save_snapshot(username, "sync", data)
+            self.store.save_snapshot(username, "sync_version", self.sync_version)
+            self.after(0, self._reenviar_pendientes)
             if isinstance(self._current_frame, MainAppFrame):
-                self.after(0, lambda: self._current_frame.update_sync_status(
-                    "Sincronizando en segundo plano...", True
-                ))
+                self.after(0, lambda: self._current_frame.update_content(data))
+            self._mostrar_estado_sync()
+        else:
+            logger.warning("Error en sincronización automática: %s", data.get('error', 'Desconocido'))
 
-            success, data = self.communicator.fetch_sync_data(self.current_username)
+        return success, data
 
-            if success:
-                if isinstance(self._current_frame, MainAppFrame):
-                    self.after(0, lambda: self._current_frame.update_content(data))
-                    self.after(0, lambda: self._current_frame.update_sync_status(
-                        f"Sincronización automática activa (cada {self.sync_interval // 60} min)"
-                    ))
-
-                if not self.first_sync_done:
-                    self.first_sync_done = True
-                    self.sync_interval = settings.SYNC_INTERVAL_NORMAL
-                    logger.info(
-                        "Primera sincronización automática exitosa. Intervalo -> %d min",
-                        self.sync_interval // 60)
-            else:
-                logger.warning("Error en sincronización automática: %s", data.get('error', 'Desconocido'))
-
-        except Exception as e:
-            logger.error("Excepción en sincronización automática: %s", e, exc_info=True)
+    def _mostrar_estado_sync(self):
+        """Muestra en la vista el estado de la sincronización automática."""
+        if isinstance(self._current_frame, MainAppFrame):
+            minutos = self.sync_scheduler.interval // 60
+            self.after(0, lambda: self._current_frame.update_sync_status(
+                f"Sincronización automática activa (cada {minutos} min)"
+            ))
 
     def _enviar_mensaje(self, to_user: str, subject: str, body: str):
         """Envía un mensaje a otro usuario."""
         if not isinstance(self._current_frame, MainAppFrame):
             return
 
-        success, data = self.communicator.send_message(to_user, subject, body)
-
-        if success:
-            self._current_frame.lbl_status.configure(
-                text=f"✓ Mensaje enviado a {to_user}"
-            )
-            self._cargar_mensajes()
-        else:
-            error_msg = data.get("error", "Error desconocido")
-            self._current_frame.lbl_status.configure(
-                text=f"✗ Error enviando mensaje: {error_msg}"
-            )
+        def _on_enviado(success: bool, data: dict):
+            if not isinstance(self._current_frame, MainAppFrame):
+                return
+            if success and data.get('status') == "encolado":
+                self._current_frame.lbl_status.configure(
+                    text=f"⏳ Sin conexión: el mensaje a {to_user} se enviará al reconectar"
+                )
+            elif success:
+                self._current_frame.lbl_status.configure(
+                    text=f"✓ Mensaje enviado a {to_user}"
+                )
+                self._cargar_mensajes()
+            else:
+                error_msg = data.get("error", "Error desconocido")
+                self._current_frame.lbl_status.configure(
+                    text=f"✗ Error enviando mensaje: {error_msg}"
+                )
+
+        self.async_client.submit(
+            self.async_client.send_message(self.current_username, to_user, subject, body,
+                                           store=self.store),
+            _on_enviado
+        )
 
     def _enviar_chat(self, to_user: str, message: str):
         """Envía un mensaje de chat en vivo."""
         if not isinstance(self._current_frame, MainAppFrame):
             return
 
-        success, data = self.communicator.send_chat_message(to_user, message)
+        def _on_enviado(success: bool, data: dict):
+            if not isinstance(self._current_frame, MainAppFrame):
+                return
+            if success and data.get('status') == "encolado":
+                self._current_frame.lbl_status.configure(
+                    text="⏳ Sin conexión: el chat se enviará al reconectar"
+                )
+            elif success:
+                self._cargar_chat()
+            else:
+                error_msg = data.get("error", "Error desconocido")
+                self._current_frame.lbl_status.configure(
+                    text=f"✗ Error enviando chat: {error_msg}"
+                )
+
+        self.async_client.submit(
+            self.async_client.send_chat_message(self.current_username, to_user, message,
+                                                store=self.store),
+            _on_enviado
+        )
 
-        if success:
-            self._cargar_chat()
-        else:
-            error_msg = data.get("error", "Error desconocido")
-            self._current_frame.lbl_status.configure(
-                text=f"✗ Error enviando chat: {error_msg}"
-            )
+    def _cargar_bandeja(self):
+        """Carga mensajes, chat y reservas en paralelo (una sola ida y vuelta de espera)."""
+        if not isinstance(self._current_frame, MainAppFrame):
+            return
+
+        def _on_cargada(success: bool, results):
+            if not success:
+                logger.error("Error cargando bandeja: %s", results.get('error', 'Desconocido'))
+                return
+            (ok_hilos, hilos), (ok_chat, chat), (ok_reservas, reservas) = results
+            self._on_mensajes(ok_hilos, hilos)
+            self._on_chat(ok_chat, chat)
+            if ok_reservas:
+                self.store.save_snapshot(self.current_username, "reservas", reservas.get('reservas', []))
+
+        self.async_client.submit(
+            self.async_client.gather(
+                self.async_client.get_threads(self.current_username),
+                self.async_client.get_chat_history(self.current_username, "admin"),
+                self.async_client.get_bookings(self.current_username)
+            ),
+            _on_cargada
+        )
 
     def _cargar_mensajes(self):
         """Carga los mensajes del usuario."""
         if not isinstance(self._current_frame, MainAppFrame):
             return
 
-        success, data = self.communicator.get_messages()
+        self.async_client.submit(
+            self.async_client.get_threads(self.current_username),
+            self._on_mensajes
+        )
+
+    def _on_mensajes(self, success: bool, data: dict):
+        """Muestra la lista de conversaciones recibida (hilo de Tk)."""
+        if not isinstance(self._current_frame, MainAppFrame):
+            return
 
         if success:
-            messages = data.get('mensajes', [])
-            self._current_frame.update_message_list(messages)
+            threads = data.get('hilos', [])
+            self.store.save_snapshot(self.current_username, "hilos", threads)
+            self._current_frame.update_message_list(threads)
         else:
             logger.error("Error cargando mensajes: %s", data.get('error', 'Desconocido'))
 
+    def _abrir_hilo(self, thread_id: int):
+        """Carga una conversación completa y la muestra."""
+        if not isinstance(self._current_frame, MainAppFrame):
+            return
+
+        def _on_hilo(success: bool, data: dict):
+            if not isinstance(self._current_frame, MainAppFrame):
+                return
+            if success:
+                self._current_frame.show_thread(data.get('hilo', {}))
+            else:
+                error_msg = data.get("error", "Error desconocido")
+                self._current_frame.lbl_status.configure(
+                    text=f"✗ Error cargando conversación: {error_msg}"
+                )
+
+        self.async_client.submit(self.async_client.get_thread(thread_id), _on_hilo)
+
+    def _cargar_miniatura(self, photo_id: int):
+        """Descarga (o lee de la caché) una miniatura de la galería sin bloquear la GUI."""
+        frame = self._current_frame
+
+        def _on_miniatura(success: bool, data: dict):
+            if not success:
+                logger.warning("Error cargando miniatura %s: %s", photo_id, data.get('error'))
+            elif frame is self._current_frame:
+                frame.set_gallery_thumbnail(photo_id, data['path'])
+
+        self.async_client.submit(self.async_client.get_thumbnail("galeria", photo_id), _on_miniatura)
+
     def _cargar_chat(self):
         """Carga el historial de chat."""
         if not isinstance(self._current_frame, MainAppFrame):
             return
 
-        success, data = self.communicator.get_chat_history("admin")
+        self.async_client.submit(
+            self.async_client.get_chat_history(self.current_username, "admin"),
+            self._on_chat
+        )
+
+    def _on_chat(self, success: bool, data: dict):
+        """Muestra el historial de chat recibido (hilo de Tk)."""
+        if not isinstance(self._current_frame, MainAppFrame):
+            return
 
         if success:
             messages = data.get('mensajes', [])
+            self.store.save_snapshot(self.current_username, "chat", messages)
             self._current_frame.update_chat_history(messages)
         else:
             logger.error("Error cargando chat: %s", data.get('error', 'Desconocido'))
@@ -292,10 +474,12 @@ class AppHija(customtkinter.CTk):
         Override del método destroy para detener la sincronización al cerrar.
         """
         logger.info("Shutting down Hija application...")
-        self.sync_running = False
-        if self.sync_thread and self.sync_thread.is_alive():
-            logger.debug("Waiting for sync thread to finish...")
-            self.sync_thread.join(timeout=1)
+        logger.debug("Waiting for sync thread to finish...")
+        self.sync_scheduler.stop()
+        if self._outbox_job is not None:
+            self.after_cancel(self._outbox_job)
+        self.async_client.close()
+        self.store.close()
         super().destroy()
         logger.info("Hija application closed")
 
@@ -0,0 +1,174 @@
+import json
+import os
+import sqlite3
+import threading
+import uuid
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from shared.logger import setup_logger
+from shared.constants import OUTBOX_MAX_ATTEMPTS
+
+logger = setup_logger(__name__, log_file="hija_store.log")
+
+
+class LocalStore:
+    """
+    Almacén local (SQLite) de la Hija para funcionar sin conexión.
+
+    Guarda la última copia conocida de cada colección del socio (sync,
+    hilos, chat, reservas, historial de ejercicios) para que las vistas
+    se pinten al instante, y una cola de salida (outbox) con las escrituras
+    hechas sin conexión, que se reenvían en orden cuando vuelve la red.
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._init_schema()
+
+        logger.info("Local store initialized - Path: %s", db_path)
+
+    def _init_schema(self):
+        """Crea las tablas del almacén local si no existen."""
+        with self._lock:
+            cursor = self._conn.cursor()
+            cursor.execute("PRAGMA journal_mode=WAL")
+            cursor.execute("PRAGMA synchronous=NORMAL")
+
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS snapshots (
+                    username TEXT NOT NULL,
+                    collection TEXT NOT NULL,
+                    data TEXT NOT NULL,
+                    updated_date TEXT NOT NULL,
+                    PRIMARY KEY (username, collection)
+                )
+            ''')
+
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS outbox (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    username TEXT NOT NULL,
+                    operation TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    created_date TEXT NOT NULL,
+                    attempts INTEGER DEFAULT 0,
+                    last_error TEXT,
+                    idempotency_key TEXT
+                )
+            ''')
+
+            columns = {row['name'] for row in cursor.execute("PRAGMA table_info(outbox)")}
+            if 'idempotency_key' not in columns:
+                cursor.execute("ALTER TABLE outbox ADD COLUMN idempotency_key TEXT")
+
+            self._conn.commit()
+
+    def save_snapshot(self, username: str, collection: str, data: Any) -> None:
+        """Guarda la copia más reciente de una colección."""
+        payload = json.dumps(data, ensure_ascii=False)
+        with self._lock:
+            self._conn.execute('''
+                INSERT INTO snapshots (username, collection, data, updated_date)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT(username, collection) DO UPDATE SET
+                    data = excluded.data,
+                    updated_date = excluded.updated_date
+            ''', (username, collection, payload, datetime.now().isoformat()))
+            self._conn.commit()
+
+    def load_snapshot(self, username: str, collection: str) -> Optional[Any]:
+        """Obtiene la última copia guardada de una colección, si existe."""
+        with self._lock:
+            row = self._conn.execute('''
+                SELECT data FROM snapshots WHERE username = ? AND collection = ?
+            ''', (username, collection)).fetchone()
+
+        if row:
+            return json.loads(row['data'])
+        return None
+
+    def enqueue(self, username: str, operation: str, payload: Dict[str, Any],
+                idempotency_key: Optional[str] = None) -> int:
+        """
+        Añade una escritura pendiente a la cola de salida. idempotency_key
+        (uno nuevo si no se indica) acompaña a cada reenvío para que la
+        Madre no aplique dos veces la misma escritura.
+        """
+        with self._lock:
+            cursor = self._conn.execute('''
+                INSERT INTO outbox (username, operation, payload, created_date, idempotency_key)
+                VALUES (?, ?, ?, ?, ?)
+            ''', (username, operation, json.dumps(payload, ensure_ascii=False),
+                  datetime.now().isoformat(), idempotency_key or uuid.uuid4().hex))
+            self._conn.commit()
+            logger.info("Operación '%s' encolada sin conexión (ID: %d)", operation, cursor.lastrowid)
+            return cursor.lastrowid
+
+    def pending(self, username: str) -> List[Dict[str, Any]]:
+        """Obtiene las escrituras pendientes del usuario en orden de creación."""
+        with self._lock:
+            rows = self._conn.execute('''
+                SELECT * FROM outbox WHERE username = ? ORDER BY id
+            ''', (username,)).fetchall()
+
+        entries = []
+        for row in rows:
+            entry = dict(row)
+            entry['payload'] = json.loads(entry['payload'])
+            entries.append(entry)
+        return entries
+
+    def count_pending(self, username: str) -> int:
+        """Cuenta las escrituras pendientes del usuario."""
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT COUNT(*) AS count FROM outbox WHERE username = ?', (username,)
+            ).fetchone()
+        return row['count']
+
+    def mark_done(self, entry_id: int) -> None:
+        """Elimina de la cola una escritura ya aplicada en la Madre."""
+        with self._lock:
+            self._conn.execute('DELETE FROM outbox WHERE id = ?', (entry_id,))
+            self._conn.commit()
+
+    def mark_failed(self, entry_id: int, error: str) -> bool:
+        """
+        Registra un intento fallido. Tras OUTBOX_MAX_ATTEMPTS rechazos la
+        escritura se descarta.
+
+        Returns:
+            bool: True si la escritura se descartó
+        """
+        with self._lock:
+            self._conn.execute('''
+                UPDATE outbox SET attempts = attempts + 1, last_error = ? WHERE id = ?
+            ''', (error, entry_id))
+            cursor = self._conn.execute('''
+                DELETE FROM outbox WHERE id = ? AND attempts >= ?
+            ''', (entry_id, OUTBOX_MAX_ATTEMPTS))
+            self._conn.commit()
+            discarded = cursor.rowcount > 0
+
+        if discarded:
+            logger.warning("Operación pendiente %d descartada tras %d intentos: %s",
+                           entry_id, OUTBOX_MAX_ATTEMPTS, error)
+        return discarded
+
+    def clear_user(self, username: str) -> None:
+        """Borra los datos locales de un usuario (cierre de sesión)."""
+        with self._lock:
+            self._conn.execute('DELETE FROM snapshots WHERE username = ?', (username,))
+            self._conn.execute('DELETE FROM outbox WHERE username = ?', (username,))
+            self._conn.commit()
+
+    def close(self) -> None:
+        """Cierra la conexión con el almacén."""
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,140 @@
+import random
+import threading
+import time
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from config.settings import get_hija_settings
+from shared.logger import setup_logger
+from shared.constants import (
+    SYNC_STARTUP_DELAY,
+    SYNC_BACKOFF_BASE,
+    SYNC_WAKE_MIN_GAP
+)
+
+logger = setup_logger(__name__, log_file="hija_sync.log")
+
+settings = get_hija_settings()
+
+
+class SyncScheduler:
+    """
+    Planificador de la sincronización automática de la Hija.
+
+    Ejecuta `task` en un hilo de fondo y decide cuándo repetirla:
+      - Intervalo base SYNC_INTERVAL_INITIAL hasta el primer éxito y
+        SYNC_INTERVAL_NORMAL después.
+      - Jitter aleatorio (±SYNC_JITTER) en cada espera, para que una flota
+        de clientes no sincronice a la vez contra la Madre.
+      - Backoff exponencial tras fallos (SYNC_BACKOFF_BASE, 2x, 4x...,
+        hasta SYNC_BACKOFF_MAX).
+      - Espera multiplicada por SYNC_IDLE_MULTIPLIER mientras `is_idle()`
+        indique que la app está minimizada o sin uso.
+      - Nunca antes de lo que pida el servidor (Retry-After).
+
+    `task()` devuelve (éxito, datos); si datos trae "retry_after" se respeta.
+    wake() adelanta la siguiente ejecución (p. ej. al volver a la app).
+    """
+
+    def __init__(self, task: Callable[[], Tuple[bool, Dict[str, Any]]],
+                 is_idle: Optional[Callable[[], bool]] = None):
+        self.task = task
+        self.is_idle = is_idle or (lambda: False)
+
+        self.interval = settings.SYNC_INTERVAL_INITIAL
+        self.failures = 0
+        self.first_success = False
+
+        self._running = False
+        self._wake = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._last_run = 0.0
+        self._not_before = 0.0
+
+    @property
+    def running(self) -> bool:
+        return self._running
+
+    def start(self):
+        """Arranca el hilo de sincronización (no hace nada si ya corre)."""
+        if self._running:
+            return
+
+        self._running = True
+        self._wake.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True, name="SyncThread")
+        self._thread.start()
+        logger.info("Sincronización automática iniciada (intervalo: %ds)", self.interval)
+
+    def stop(self, timeout: float = 1.0):
+        """Detiene el hilo de sincronización."""
+        self._running = False
+        self._wake.set()
+        if self._thread and self._thread.is_alive() and self._thread is not threading.current_thread():
+            self._thread.join(timeout=timeout)
+
+    def wake(self):
+        """Adelanta la siguiente sincronización (respetando SYNC_WAKE_MIN_GAP)."""
+        self._wake.set()
+
+    @staticmethod
+    def _jitter(delay: float) -> float:
+        """Aplica un desvío aleatorio de ±SYNC_JITTER al retardo."""
+        return delay * random.uniform(1 - settings.SYNC_JITTER, 1 + settings.SYNC_JITTER)
+
+    def next_delay(self, success: bool, retry_after: Optional[float] = None) -> float:
+        """
+        Calcula la espera hasta la próxima ejecución tras un resultado.
+
+        Args:
+            success: Si la última ejecución tuvo éxito
+            retry_after: Segundos mínimos indicados por el servidor
+
+        Returns:
+            float: segundos hasta la próxima ejecución
+        """
+        if success:
+            self.failures = 0
+            if not self.first_success:
+                self.first_success = True
+                self.interval = settings.SYNC_INTERVAL_NORMAL
+                logger.info("Primera sincronización exitosa. Intervalo -> %d min", self.interval // 60)
+            delay = self.interval
+        else:
+            self.failures += 1
+            delay = min(SYNC_BACKOFF_BASE * (2 ** (self.failures - 1)), settings.SYNC_BACKOFF_MAX)
+
+        if self.is_idle():
+            delay *= settings.SYNC_IDLE_MULTIPLIER
+
+        delay = self._jitter(delay)
+        if retry_after:
+            delay = max(delay, retry_after)
+            self._not_before = time.monotonic() + retry_after
+        return delay
+
+    def _run(self):
+        """Bucle del hilo: espera, ejecuta la tarea y recalcula la espera."""
+        delay = self._jitter(SYNC_STARTUP_DELAY)
+
+        while self._running:
+            woken = self._wake.wait(delay)
+            if not self._running:
+                break
+
+            if woken:
+                self._wake.clear()
+                now = time.monotonic()
+                remaining = max(SYNC_WAKE_MIN_GAP - (now - self._last_run), self._not_before - now)
+                if remaining > 0:
+                    delay = remaining
+                    continue
+
+            self._last_run = time.monotonic()
+            try:
+                success, data = self.task()
+            except Exception as e:
+                logger.error("Excepción en sincronización automática: %s", e, exc_info=True)
+                success, data = False, {}
+
+            delay = self.next_delay(success, (data or {}).get("retry_after"))
+            logger.debug("Próxima sincronización en %.0fs (fallos: %d)", delay, self.failures)
@@ -1,6 +1,24 @@
 
+import math
+from datetime import datetime
+
 import customtkinter
 
+from hija_widgets import VirtualList
+from shared.constants import THUMBNAIL_SIZES
+
+try:
+    from PIL import Image
+    PIL_AVAILABLE = True
+except ImportError:
+    PIL_AVAILABLE = False
+
+MENSAJE_ROW_HEIGHT = 110
+GALERIA_ROW_HEIGHT = THUMBNAIL_SIZES["small"] + 20
+CHAT_CHARS_PER_LINE = 50
+CHAT_LINE_HEIGHT = 18
+CHAT_ROW_PADDING = 44
+
 
 class LoginFrame(customtkinter.CTkFrame):
     """
@@ -90,7 +108,8 @@ class MainAppFrame(customtkinter.CTkFrame):
     """
 
     def __init__(self, master, username: str, user_data: dict, on_sync_attempt,
-                 on_send_message=None, on_send_chat=None, **kwargs):
+                 on_send_message=None, on_send_chat=None, on_open_thread=None,
+                 on_request_thumbnail=None, **kwargs):
         super().__init__(master, **kwargs)
 
         self.username = username
@@ -98,6 +117,16 @@ class MainAppFrame(customtkinter.CTkFrame):
         self.on_sync_attempt = on_sync_attempt
         self.on_send_message = on_send_message
         self.on_send_chat = on_send_chat
+        self.on_open_thread = on_open_thread
+        self.on_request_thumbnail = on_request_thumbnail
+
+        self.photo_gallery = []
+        self.message_list = []
+        self.chat_messages = []
+        self._thumbnails_requested = set()
+        self._thumbnail_images = {}
+        self._thumbnail_placeholder = None
+        self._local_chat_seq = 0
 
         self.grid_columnconfigure(1, weight=1)
         self.grid_rowconfigure(1, weight=1)
@@ -312,17 +341,94 @@ class MainAppFrame(customtkinter.CTkFrame):
         self._activar_boton_nav("gallery")
         self.current_view = "galeria"
 
-        self.scrollable_galeria = customtkinter.CTkScrollableFrame(
+        lbl_title = customtkinter.CTkLabel(
             self.content_frame,
-            label_text="🖼️ GALERÍA DE FOTOS"
+            text="🖼️ GALERÍA DE FOTOS",
+            font=customtkinter.CTkFont(size=16, weight="bold")
         )
-        self.scrollable_galeria.pack(fill="both", expand=True, padx=10, pady=10)
+        lbl_title.pack(padx=10, pady=(10, 0))
 
-        lbl_inicial = customtkinter.CTkLabel(
-            self.scrollable_galeria,
-            text="Sin fotos cargadas. Sincronice para obtener su galería."
+        self.lista_galeria = VirtualList(
+            self.content_frame,
+            create_row=self._crear_fila_foto,
+            bind_row=self._pintar_fila_foto,
+            key=lambda photo: photo.get('id'),
+            row_height=GALERIA_ROW_HEIGHT,
+            empty_text="Sin fotos cargadas. Sincronice para obtener su galería."
+        )
+        self.lista_galeria.pack(fill="both", expand=True, padx=10, pady=10)
+        self.lista_galeria.set_items(self.photo_gallery)
+
+    def _crear_fila_foto(self, parent):
+        """Crea una fila reutilizable de la galería."""
+        row = customtkinter.CTkFrame(parent, height=GALERIA_ROW_HEIGHT)
+
+        row.lbl_thumb = customtkinter.CTkLabel(
+            row,
+            text="🖼️",
+            width=THUMBNAIL_SIZES["small"],
+            height=THUMBNAIL_SIZES["small"]
         )
-        lbl_inicial.pack(pady=20)
+        row.lbl_thumb.pack(side="left", padx=10, pady=5)
+
+        row.lbl_photo = customtkinter.CTkLabel(
+            row,
+            text="",
+            font=customtkinter.CTkFont(weight="bold"),
+            anchor="w"
+        )
+        row.lbl_photo.pack(side="left", padx=10, pady=5)
+
+        row.lbl_desc = customtkinter.CTkLabel(row, text="", text_color="gray", anchor="w")
+        row.lbl_desc.pack(side="left", padx=10, pady=5)
+
+        row.lbl_fecha = customtkinter.CTkLabel(row, text="", text_color="gray", anchor="e")
+        row.lbl_fecha.pack(side="right", padx=10, pady=5)
+        return row
+
+    def _pintar_fila_foto(self, row, photo: dict):
+        """
+        Rellena una fila de la galería. La miniatura se pide la primera vez
+        que la foto se hace visible; mientras tanto se muestra un hueco.
+        """
+        photo_id = photo.get('id')
+
+        row.lbl_photo.configure(text=f"📷 {photo.get('photo_path', '').split('/')[-1]}")
+        row.lbl_desc.configure(text=photo.get('descripcion') or '')
+        row.lbl_fecha.configure(text=(photo.get('upload_date') or '')[:10])
+
+        image = self._thumbnail_images.get(photo_id)
+        if image is not None:
+            row.lbl_thumb.configure(image=image, text="")
+            return
+
+        if self._thumbnail_placeholder is not None:
+            row.lbl_thumb.configure(image=self._thumbnail_placeholder, text="🖼️")
+        if photo_id is not None and photo_id not in self._thumbnails_requested and self.on_request_thumbnail:
+            self._thumbnails_requested.add(photo_id)
+            self.on_request_thumbnail(photo_id)
+
+    def set_gallery_thumbnail(self, photo_id: int, path: str):
+        """Guarda una miniatura ya descargada y la muestra si su fila está visible."""
+        if not PIL_AVAILABLE:
+            return
+
+        try:
+            with Image.open(path) as img:
+                img.load()
+                image = customtkinter.CTkImage(light_image=img.copy(), dark_image=img.copy(), size=img.size)
+        except OSError:
+            self._thumbnails_requested.discard(photo_id)
+            return
+
+        if self._thumbnail_placeholder is None:
+            size = (THUMBNAIL_SIZES["small"], THUMBNAIL_SIZES["small"])
+            blank = Image.new("RGBA", size, (0, 0, 0, 0))
+            self._thumbnail_placeholder = customtkinter.CTkImage(light_image=blank, dark_image=blank, size=size)
+
+        self._thumbnail_images[photo_id] = image
+        if self.current_view == "galeria":
+            self.lista_galeria.refresh(photo_id)
 
     def _mostrar_mensajes(self):
         """Muestra la vista de mensajes."""
@@ -353,14 +459,17 @@ class MainAppFrame(customtkinter.CTkFrame):
         )
         btn_nuevo.pack(side="right", padx=10)
 
-        self.scrollable_mensajes = customtkinter.CTkScrollableFrame(msg_frame)
-        self.scrollable_mensajes.grid(row=1, column=0, padx=10, pady=10, sticky="nsew")
-
-        lbl_inicial = customtkinter.CTkLabel(
-            self.scrollable_mensajes,
-            text="Sin mensajes. Sincronice para cargar."
+        self.lista_mensajes = VirtualList(
+            msg_frame,
+            create_row=self._crear_fila_mensaje,
+            bind_row=self._pintar_fila_mensaje,
+            key=self._clave_mensaje,
+            row_height=MENSAJE_ROW_HEIGHT,
+            empty_text="Sin mensajes. Sincronice para cargar."
         )
-        lbl_inicial.pack(pady=20)
+        self.lista_mensajes.grid(row=1, column=0, padx=10, pady=10, sticky="nsew")
+        if self.message_list:
+            self.lista_mensajes.set_items(self.message_list)
 
     def _mostrar_chat(self):
         """Muestra la vista de chat en vivo."""
@@ -383,8 +492,17 @@ class MainAppFrame(customtkinter.CTkFrame):
         )
         lbl_title.pack(side="left", padx=10)
 
-        self.scrollable_chat = customtkinter.CTkScrollableFrame(chat_frame)
-        self.scrollable_chat.grid(row=1, column=0, padx=10, pady=10, sticky="nsew")
+        self.lista_chat = VirtualList(
+            chat_frame,
+            create_row=self._crear_fila_chat,
+            bind_row=self._pintar_fila_chat,
+            key=lambda chat: chat.get('id'),
+            row_height=self._alto_fila_chat,
+            empty_text="Inicia una conversación con la administración.\n"
+                       "Escribe un mensaje abajo para comenzar.",
+            stick_to_end=True
+        )
+        self.lista_chat.grid(row=1, column=0, padx=10, pady=10, sticky="nsew")
 
         input_frame = customtkinter.CTkFrame(chat_frame)
         input_frame.grid(row=2, column=0, padx=10, pady=10, sticky="ew")
@@ -405,13 +523,9 @@ class MainAppFrame(customtkinter.CTkFrame):
         )
         btn_enviar.grid(row=0, column=1, padx=5, pady=5)
 
-        lbl_inicial = customtkinter.CTkLabel(
-            self.scrollable_chat,
-            text="Inicia una conversación con la administración.\nEscribe un mensaje abajo para comenzar.",
-            justify="center",
-            text_color="gray"
-        )
-        lbl_inicial.pack(pady=30)
+        if self.chat_messages:
+            self.lista_chat.set_items(self.chat_messages)
+            self.lista_chat.scroll_to_end()
 
     def _abrir_nuevo_mensaje(self):
         """Abre un diálogo para enviar un nuevo mensaje."""
@@ -433,16 +547,16 @@ class MainAppFrame(customtkinter.CTkFrame):
             self.on_send_chat("admin", mensaje)
             self.entry_chat.delete(0, "end")
 
-            msg_frame = customtkinter.CTkFrame(self.scrollable_chat)
-            msg_frame.pack(fill="x", padx=5, pady=3, anchor="e")
-
-            lbl_msg = customtkinter.CTkLabel(
-                msg_frame,
-                text=f"Tú: {mensaje}",
-                anchor="w",
-                wraplength=400
-            )
-            lbl_msg.pack(padx=10, pady=5)
+            self._local_chat_seq += 1
+            self.chat_messages = self.chat_messages + [{
+                "id": f"local-{self._local_chat_seq}",
+                "from_user": self.username,
+                "to_user": "admin",
+                "message": mensaje,
+                "timestamp": datetime.now().isoformat()
+            }]
+            self.lista_chat.set_items(self.chat_messages)
+            self.lista_chat.scroll_to_end()
 
     def _handle_sync_event(self):
         """Manejador interno para el botón de sincronización."""
@@ -476,46 +590,9 @@ class MainAppFrame(customtkinter.CTkFrame):
             self.textbox_cronograma.insert("1.0", content)
             self.textbox_cronograma.configure(state="disabled")
 
-        photo_gallery = sync_data.get('photo_gallery', [])
+        self.photo_gallery = sync_data.get('photo_gallery', [])
         if self.current_view == "galeria":
-            for widget in self.scrollable_galeria.winfo_children():
-                widget.destroy()
-
-            if photo_gallery:
-                for i, photo in enumerate(photo_gallery):
-                    photo_frame = customtkinter.CTkFrame(self.scrollable_galeria)
-                    photo_frame.pack(fill="x", padx=5, pady=5)
-
-                    lbl_photo = customtkinter.CTkLabel(
-                        photo_frame,
-                        text=f"📷 {photo.get('photo_path', '').split('/')[-1]}",
-                        font=customtkinter.CTkFont(weight="bold"),
-                        anchor="w"
-                    )
-                    lbl_photo.pack(side="left", padx=10, pady=5)
-
-                    if photo.get('descripcion'):
-                        lbl_desc = customtkinter.CTkLabel(
-                            photo_frame,
-                            text=photo['descripcion'],
-                            text_color="gray",
-                            anchor="w"
-                        )
-                        lbl_desc.pack(side="left", padx=10, pady=5)
-
-                    lbl_fecha = customtkinter.CTkLabel(
-                        photo_frame,
-                        text=photo.get('upload_date', '')[:10],
-                        text_color="gray",
-                        anchor="e"
-                    )
-                    lbl_fecha.pack(side="right", padx=10, pady=5)
-            else:
-                lbl_no_photos = customtkinter.CTkLabel(
-                    self.scrollable_galeria,
-                    text="No hay fotos en la galería"
-                )
-                lbl_no_photos.pack(pady=20)
+            self.lista_galeria.set_items(self.photo_gallery)
 
         timestamp = sync_data.get('timestamp', '')[:19] if sync_data.get('timestamp') else ''
         self.lbl_status.configure(
@@ -536,63 +613,120 @@ class MainAppFrame(customtkinter.CTkFrame):
             self.lbl_status.configure(text=f"● {message}")
 
     def update_message_list(self, messages: list):
-        """Actualiza la lista de mensajes."""
+        """
+        Actualiza la lista de mensajes.
+        Acepta mensajes sueltos o hilos (con 'thread_id', 'message_count' y
+        'unread_count'), mostrando en ese caso el último mensaje de cada hilo.
+        Solo se repintan las filas visibles cuyo mensaje cambió.
+        """
+        self.message_list = messages
         if self.current_view != "mensajes":
             return
 
-        for widget in self.scrollable_mensajes.winfo_children():
-            widget.destroy()
+        self.lista_mensajes.set_empty_text("No hay mensajes")
+        self.lista_mensajes.set_items(messages)
 
-        if not messages:
-            lbl_no_msg = customtkinter.CTkLabel(
-                self.scrollable_mensajes,
-                text="No hay mensajes"
-            )
-            lbl_no_msg.pack(pady=20)
-            return
+    @staticmethod
+    def _clave_mensaje(msg: dict):
+        """Clave estable de una fila del buzón: el hilo, o el mensaje si no tiene hilo."""
+        if msg.get('thread_id'):
+            return ("hilo", msg['thread_id'])
+        return ("mensaje", msg.get('id'))
 
-        for msg in messages:
-            msg_frame = customtkinter.CTkFrame(self.scrollable_mensajes)
-            msg_frame.pack(fill="x", padx=5, pady=5)
+    def _crear_fila_mensaje(self, parent):
+        """Crea una fila reutilizable del buzón."""
+        row = customtkinter.CTkFrame(parent, height=MENSAJE_ROW_HEIGHT)
 
-            indicator = "●" if not msg.get('is_read') else "○"
-            color = "#2563eb" if not msg.get('is_read') else "gray"
+        header_frame = customtkinter.CTkFrame(row, fg_color="transparent")
+        header_frame.pack(fill="x", padx=10, pady=5)
 
-            header_frame = customtkinter.CTkFrame(msg_frame, fg_color="transparent")
-            header_frame.pack(fill="x", padx=10, pady=5)
+        row.lbl_from = customtkinter.CTkLabel(
+            header_frame,
+            text="",
+            font=customtkinter.CTkFont(weight="bold"),
+            anchor="w"
+        )
+        row.lbl_from.pack(side="left")
 
-            lbl_from = customtkinter.CTkLabel(
-                header_frame,
-                text=f"{indicator} De: {msg.get('from_user', 'Desconocido')}",
-                font=customtkinter.CTkFont(weight="bold"),
-                text_color=color,
-                anchor="w"
-            )
-            lbl_from.pack(side="left")
+        row.lbl_date = customtkinter.CTkLabel(header_frame, text="", text_color="gray", anchor="e")
+        row.lbl_date.pack(side="right")
 
-            lbl_date = customtkinter.CTkLabel(
-                header_frame,
-                text=msg.get('sent_date', '')[:16],
-                text_color="gray",
-                anchor="e"
+        row.lbl_subject = customtkinter.CTkLabel(row, text="", anchor="w")
+        row.lbl_subject.pack(fill="x", padx=10, pady=2)
+
+        row.btn_view = customtkinter.CTkButton(row, text="Ver Mensaje", width=100, height=25)
+        row.btn_view.pack(padx=10, pady=5, anchor="e")
+        return row
+
+    def _pintar_fila_mensaje(self, row, msg: dict):
+        """Rellena una fila del buzón con un mensaje o hilo."""
+        unread = msg.get('unread_count', 0 if msg.get('is_read') else 1)
+        indicator = "●" if unread else "○"
+
+        row.lbl_from.configure(
+            text=f"{indicator} De: {msg.get('from_user', 'Desconocido')}",
+            text_color="#2563eb" if unread else "gray"
+        )
+        row.lbl_date.configure(text=msg.get('sent_date', '')[:16])
+
+        subject = msg.get('thread_subject') or msg.get('subject') or 'Sin asunto'
+        if msg.get('message_count', 1) > 1:
+            subject = f"{subject} ({msg['message_count']})"
+        row.lbl_subject.configure(text=subject)
+
+        row.btn_view.configure(command=lambda m=msg: self._abrir_mensaje(m))
+
+    def _abrir_mensaje(self, msg: dict):
+        """Abre la conversación completa si el mensaje pertenece a un hilo."""
+        if msg.get('thread_id') and self.on_open_thread:
+            self.on_open_thread(msg['thread_id'])
+        else:
+            self._ver_mensaje_detalle(msg)
+
+    def show_thread(self, thread: dict):
+        """Muestra todos los mensajes de una conversación en orden cronológico."""
+        dialog = customtkinter.CTkToplevel(self)
+        dialog.title(thread.get('subject') or "Conversación")
+        dialog.geometry("600x500")
+
+        content_frame = customtkinter.CTkScrollableFrame(dialog)
+        content_frame.pack(fill="both", expand=True, padx=10, pady=10)
+
+        for msg in thread.get('mensajes', []):
+            is_me = msg.get('from_user') == self.username
+
+            msg_frame = customtkinter.CTkFrame(
+                content_frame,
+                fg_color=("#e3f2fd" if is_me else "#f5f5f5")
             )
-            lbl_date.pack(side="right")
+            msg_frame.pack(fill="x", padx=(50 if is_me else 5, 5 if is_me else 50), pady=5)
 
-            lbl_subject = customtkinter.CTkLabel(
+            lbl_header = customtkinter.CTkLabel(
                 msg_frame,
-                text=msg.get('subject', 'Sin asunto'),
+                text=f"{'Tú' if is_me else msg.get('from_user', 'Desconocido')} - "
+                     f"{msg.get('sent_date', '')[:16]}",
+                font=customtkinter.CTkFont(weight="bold"),
                 anchor="w"
             )
-            lbl_subject.pack(fill="x", padx=10, pady=2)
+            lbl_header.pack(fill="x", padx=10, pady=(5, 0))
 
-            btn_view = customtkinter.CTkButton(
+            lbl_body = customtkinter.CTkLabel(
                 msg_frame,
-                text="Ver Mensaje",
-                width=100,
-                height=25,
-                command=lambda m=msg: self._ver_mensaje_detalle(m)
+                text=msg.get('body', ''),
+                anchor="w",
+                justify="left",
+                wraplength=450
             )
-            btn_view.pack(padx=10, pady=5, anchor="e")
+            lbl_body.pack(fill="x", padx=10, pady=5)
+
+            for att in msg.get('attachments', []):
+                lbl_att = customtkinter.CTkLabel(
+                    msg_frame,
+                    text=f"📎 {att.get('filename')} ({att.get('file_size', 0)} bytes)",
+                    text_color="gray",
+                    anchor="w"
+                )
+                lbl_att.pack(fill="x", padx=10, pady=(0, 5))
 
     def _ver_mensaje_detalle(self, msg: dict):
         """Muestra los detalles de un mensaje."""
@@ -632,53 +766,54 @@ class MainAppFrame(customtkinter.CTkFrame):
         textbox.configure(state="disabled")
 
     def update_chat_history(self, messages: list):
-        """Actualiza el historial de chat."""
+        """Actualiza el historial de chat; solo se repintan los mensajes nuevos o cambiados."""
+        self.chat_messages = messages
         if self.current_view != "chat":
             return
 
-        for widget in self.scrollable_chat.winfo_children():
-            widget.destroy()
+        self.lista_chat.set_empty_text("No hay mensajes de chat. Escribe uno para comenzar.")
+        self.lista_chat.set_items(messages)
 
-        if not messages:
-            lbl_no_chat = customtkinter.CTkLabel(
-                self.scrollable_chat,
-                text="No hay mensajes de chat. Escribe uno para comenzar.",
-                text_color="gray"
-            )
-            lbl_no_chat.pack(pady=20)
-            return
+    @staticmethod
+    def _alto_fila_chat(chat: dict) -> int:
+        """Alto estimado de un mensaje de chat según las líneas que ocupa."""
+        lines = sum(
+            max(1, math.ceil(len(line) / CHAT_CHARS_PER_LINE))
+            for line in (chat.get('message') or '').split("\n")
+        )
+        return CHAT_ROW_PADDING + lines * CHAT_LINE_HEIGHT
 
-        for chat in messages:
-            is_me = chat.get('from_user') == self.username
+    def _crear_fila_chat(self, parent):
+        """Crea una fila reutilizable del chat (una burbuja dentro de un contenedor)."""
+        row = customtkinter.CTkFrame(parent, fg_color="transparent")
 
-            msg_frame = customtkinter.CTkFrame(
-                self.scrollable_chat,
-                fg_color=("#e3f2fd" if is_me else "#f5f5f5")
-            )
-            msg_frame.pack(
-                fill="x",
-                padx=(50 if is_me else 5, 5 if is_me else 50),
-                pady=3,
-                anchor="e" if is_me else "w"
-            )
+        row.bubble = customtkinter.CTkFrame(row)
+        row.bubble.pack(fill="both", expand=True, pady=3)
 
-            sender = "Tú" if is_me else chat.get('from_user', 'Admin')
-            lbl_msg = customtkinter.CTkLabel(
-                msg_frame,
-                text=f"{sender}: {chat.get('message', '')}",
-                anchor="w",
-                wraplength=400
-            )
-            lbl_msg.pack(padx=10, pady=5)
+        row.lbl_msg = customtkinter.CTkLabel(row.bubble, text="", anchor="w", justify="left", wraplength=400)
+        row.lbl_msg.pack(padx=10, pady=5, anchor="w")
 
-            lbl_time = customtkinter.CTkLabel(
-                msg_frame,
-                text=chat.get('timestamp', '')[:16],
-                font=customtkinter.CTkFont(size=10),
-                text_color="gray",
-                anchor="e"
-            )
-            lbl_time.pack(padx=10, pady=(0, 5), anchor="e")
+        row.lbl_time = customtkinter.CTkLabel(
+            row.bubble,
+            text="",
+            font=customtkinter.CTkFont(size=10),
+            text_color="gray",
+            anchor="e"
+        )
+        row.lbl_time.pack(padx=10, pady=(0, 5), anchor="e")
+        return row
+
+    def _pintar_fila_chat(self, row, chat: dict):
+        """Rellena una fila del chat; las burbujas propias van a la derecha."""
+        is_me = chat.get('from_user') == self.username
+
+        row.bubble.configure(fg_color=("#e3f2fd" if is_me else "#f5f5f5"))
+        row.bubble.pack(fill="both", expand=True, pady=3,
+                        padx=(50 if is_me else 5, 5 if is_me else 50))
+
+        sender = "Tú" if is_me else chat.get('from_user', 'Admin')
+        row.lbl_msg.configure(text=f"{sender}: {chat.get('message', '')}")
+        row.lbl_time.configure(text=chat.get('timestamp', '')[:16])
 
     def _mostrar_ejercicios(self):
         """Muestra la vista de seguimiento de ejercicios."""
@@ -0,0 +1,202 @@
+import bisect
+import tkinter
+from typing import Any, Callable, Dict, Hashable, List, Tuple, Union
+
+import customtkinter
+
+OVERSCAN_ROWS = 3
+SCROLL_INCREMENT = 20
+SCROLL_UNITS_PER_STEP = 3
+
+
+class VirtualList(customtkinter.CTkFrame):
+    """
+    Lista con scroll virtualizado y reconciliación por clave.
+
+    Solo existen widgets para las filas visibles (más OVERSCAN_ROWS por
+    arriba y por abajo), de modo que pintar 50 o 50.000 elementos cuesta lo
+    mismo. Las filas se reutilizan: al hacer scroll, la que sale de la
+    ventana pasa a mostrar un elemento que entra.
+
+    Al llamar a set_items() con datos nuevos se compara por clave: una fila
+    cuyo elemento no cambió no se toca, una que cambió se vuelve a rellenar
+    (bind_row) sin recrearse, y solo se crean widgets si hacen falta más
+    filas visibles que las que hay en el pool.
+
+    Args:
+        create_row: create_row(parent) -> widget, crea una fila vacía
+        bind_row: bind_row(row, item), rellena una fila con un elemento
+        key: key(item) -> clave única y estable del elemento (p. ej. su id)
+        row_height: alto fijo de fila en px, o función item -> alto
+        empty_text: texto a mostrar cuando no hay elementos
+        stick_to_end: si la vista está al final, se mantiene al final al
+            añadir elementos (chat)
+    """
+
+    def __init__(self, master, create_row: Callable[[Any], Any], bind_row: Callable[[Any, Any], None],
+                 key: Callable[[Any], Hashable], row_height: Union[int, Callable[[Any], int]] = 60,
+                 empty_text: str = "", stick_to_end: bool = False, **kwargs):
+        super().__init__(master, **kwargs)
+
+        self.create_row = create_row
+        self.bind_row = bind_row
+        self.key = key
+        self.row_height = row_height
+        self.stick_to_end = stick_to_end
+
+        self._items: List[Any] = []
+        self._keys: List[Hashable] = []
+        self._offsets: List[int] = [0]
+        self._active: Dict[Hashable, Tuple[Any, int, Any]] = {}
+        self._free: List[Tuple[Any, int]] = []
+        self._layout_job = None
+
+        self.grid_columnconfigure(0, weight=1)
+        self.grid_rowconfigure(0, weight=1)
+
+        self._canvas = tkinter.Canvas(
+            self, highlightthickness=0, bd=0,
+            bg=self._canvas_bg(), yscrollincrement=SCROLL_INCREMENT
+        )
+        self._canvas.grid(row=0, column=0, sticky="nsew")
+
+        self._scrollbar = customtkinter.CTkScrollbar(self, command=self._canvas.yview)
+        self._scrollbar.grid(row=0, column=1, sticky="ns")
+        self._canvas.configure(yscrollcommand=self._on_yscroll)
+
+        self._lbl_empty = customtkinter.CTkLabel(self, text=empty_text, text_color="gray")
+
+        self._canvas.bind("<Configure>", lambda _e: self._programar_layout())
+        self._bind_wheel(self._canvas)
+
+    def _canvas_bg(self) -> str:
+        """Color de fondo del canvas según el tema actual."""
+        color = self._bg_color if self._fg_color == "transparent" else self._fg_color
+        return self._apply_appearance_mode(color)
+
+    def _set_appearance_mode(self, mode_string):
+        super()._set_appearance_mode(mode_string)
+        self._canvas.configure(bg=self._canvas_bg())
+
+    def _height_of(self, item) -> int:
+        """Alto real (escalado) de la fila de un elemento."""
+        height = self.row_height(item) if callable(self.row_height) else self.row_height
+        return int(height * self._get_widget_scaling())
+
+    def set_items(self, items: List[Any]):
+        """Sustituye los elementos de la lista; solo repinta las filas afectadas."""
+        at_end = self._canvas.yview()[1] >= 0.999
+
+        self._items = list(items)
+        self._keys = [self.key(item) for item in self._items]
+
+        offsets = [0]
+        for item in self._items:
+            offsets.append(offsets[-1] + self._height_of(item))
+        self._offsets = offsets
+        self._canvas.configure(scrollregion=(0, 0, 0, offsets[-1]))
+
+        if self._items:
+            self._lbl_empty.place_forget()
+        else:
+            self._lbl_empty.place(relx=0.5, y=20, anchor="n")
+
+        if self.stick_to_end and at_end:
+            self._canvas.yview_moveto(1.0)
+        self._programar_layout()
+
+    def set_empty_text(self, text: str):
+        """Cambia el texto que se muestra sin elementos."""
+        self._lbl_empty.configure(text=text)
+
+    def refresh(self, key: Hashable):
+        """Vuelve a rellenar la fila de un elemento si está visible."""
+        entry = self._active.get(key)
+        if entry is not None:
+            row, _window_id, item = entry
+            self.bind_row(row, item)
+
+    def scroll_to_end(self):
+        """Lleva la vista al último elemento."""
+        self._canvas.yview_moveto(1.0)
+        self._programar_layout()
+
+    def _on_yscroll(self, first, last):
+        """El canvas se ha desplazado: actualiza la barra y las filas visibles."""
+        self._scrollbar.set(first, last)
+        self._programar_layout()
+
+    def _programar_layout(self):
+        """Agrupa los cambios de scroll/tamaño en un único layout por ciclo."""
+        if self._layout_job is None:
+            self._layout_job = self.after_idle(self._layout)
+
+    def _new_row(self) -> Tuple[Any, int]:
+        """Crea una fila nueva para el pool."""
+        row = self.create_row(self._canvas)
+        row.pack_propagate(False)
+        row.grid_propagate(False)
+        window_id = self._canvas.create_window(0, 0, window=row, anchor="nw")
+        self._bind_wheel(row)
+        return row, window_id
+
+    def _layout(self):
+        """
+        Reconcilia las filas con la ventana visible: libera las que salen,
+        asigna filas del pool a las que entran y recoloca las demás.
+        """
+        self._layout_job = None
+        if not self.winfo_exists():
+            return
+
+        width = self._canvas.winfo_width()
+        top = self._canvas.canvasy(0)
+        bottom = top + self._canvas.winfo_height()
+
+        first = max(bisect.bisect_right(self._offsets, top) - 1 - OVERSCAN_ROWS, 0)
+        last = min(bisect.bisect_left(self._offsets, bottom) + OVERSCAN_ROWS, len(self._items))
+        visible = {self._keys[i]: i for i in range(first, last)}
+
+        for key in [k for k in self._active if k not in visible]:
+            row, window_id, _item = self._active.pop(key)
+            self._canvas.itemconfigure(window_id, state="hidden")
+            self._free.append((row, window_id))
+
+        for key, i in visible.items():
+            item = self._items[i]
+            entry = self._active.get(key)
+
+            if entry is None:
+                row, window_id = self._free.pop() if self._free else self._new_row()
+                self.bind_row(row, item)
+            else:
+                row, window_id, bound = entry
+                if bound != item:
+                    self.bind_row(row, item)
+
+            self._canvas.coords(window_id, 0, self._offsets[i])
+            self._canvas.itemconfigure(
+                window_id, width=width, height=self._offsets[i + 1] - self._offsets[i], state="normal"
+            )
+            self._active[key] = (row, window_id, item)
+
+    def _bind_wheel(self, widget):
+        """Propaga la rueda del ratón de una fila (y sus hijos) al canvas."""
+        for sequence in ("<MouseWheel>", "<Button-4>", "<Button-5>"):
+            tkinter.Misc.bind(widget, sequence, self._on_mousewheel, "+")
+        for child in widget.winfo_children():
+            self._bind_wheel(child)
+
+    def _on_mousewheel(self, event):
+        if event.num == 4 or getattr(event, "delta", 0) > 0:
+            step = -SCROLL_UNITS_PER_STEP
+        else:
+            step = SCROLL_UNITS_PER_STEP
+        self._canvas.yview_scroll(step, "units")
+        return "break"
+
+    def destroy(self):
+        if self._layout_job is not None:
+            self.after_cancel(self._layout_job)
+            self._layout_job = None
+        super().destroy()
@@ -0,0 +1,409 @@
+"""
+Pruebas de carga de la API Madre con escenarios realistas.
+
+Genera carga con asyncio + httpx (N usuarios virtuales concurrentes) y
+mide, por endpoint, throughput y latencias p50/p95/p99. Los resultados se
+pueden guardar en JSON y comparar con una ejecución anterior para detectar
+regresiones.
+
+Escenarios:
+    checkin   Avalancha de check-ins de la mañana (token + check-in + avisos)
+    reservas  Estampida de reservas sobre el mismo horario de clase
+    sync      Tormenta de sincronización de N Hijas (sondeo, validación, datos, batch)
+    chat      Ráfaga de mensajes de chat entre socios
+    mixto     Todos los anteriores repartidos entre los usuarios virtuales
+
+Modos:
+    asgi      En proceso contra madre_server.app (sin red), sobre una copia de la BD
+    lanzar    Arranca madre_headless.py en local sobre una copia de la BD
+    url       Contra un servidor ya en marcha (--url)
+
+Uso:
+    python load_test.py --escenario sync --usuarios 50 --duracion 20 --salida sync.json
+    python load_test.py --escenario mixto --modo lanzar --workers 4
+    python load_test.py --escenario sync --salida nuevo.json --comparar sync.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+import httpx
+
+from benchmark_workers import SIN_ADMISION
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+DIAS_SEMANA = ["Lunes", "Martes", "Miércoles", "Jueves", "Viernes", "Sábado", "Domingo"]
+
+
+def print_header(text):
+    print("\n" + "=" * 60)
+    print(f"  {text}")
+    print("=" * 60)
+
+
+def percentil(valores: List[float], p: float) -> float:
+    """Percentil p (0-100) por rango más cercano sobre una lista ordenada."""
+    if not valores:
+        return 0.0
+    rango = max(int(round(p / 100 * len(valores) + 0.5)) - 1, 0)
+    return valores[min(rango, len(valores) - 1)]
+
+
+class Resultados:
+    """Latencias y errores por endpoint (nombre lógico, no la URL con parámetros)."""
+
+    def __init__(self):
+        self.latencias: Dict[str, List[float]] = {}
+        self.errores: Dict[str, int] = {}
+        self.codigos: Dict[str, Dict[int, int]] = {}
+
+    def registrar(self, nombre: str, segundos: float, codigo: int):
+        self.latencias.setdefault(nombre, []).append(segundos)
+        codigos = self.codigos.setdefault(nombre, {})
+        codigos[codigo] = codigos.get(codigo, 0) + 1
+        if codigo == 0 or codigo >= 400:
+            self.errores[nombre] = self.errores.get(nombre, 0) + 1
+
+    def resumen(self, duracion: float) -> Dict[str, Dict[str, Any]]:
+        """Estadísticas por endpoint más un total ("*")."""
+        resumen = {}
+        todas: List[float] = []
+        for nombre, valores in sorted(self.latencias.items()):
+            todas.extend(valores)
+            resumen[nombre] = self._stats(sorted(valores), self.errores.get(nombre, 0), duracion)
+            resumen[nombre]["codigos"] = {str(k): v for k, v in sorted(self.codigos[nombre].items())}
+        resumen["*"] = self._stats(sorted(todas), sum(self.errores.values()), duracion)
+        return resumen
+
+    @staticmethod
+    def _stats(valores: List[float], errores: int, duracion: float) -> Dict[str, Any]:
+        return {
+            "peticiones": len(valores),
+            "errores": errores,
+            "rps": round(len(valores) / duracion, 2) if duracion else 0.0,
+            "p50_ms": round(percentil(valores, 50) * 1000, 2),
+            "p95_ms": round(percentil(valores, 95) * 1000, 2),
+            "p99_ms": round(percentil(valores, 99) * 1000, 2),
+            "max_ms": round((valores[-1] if valores else 0.0) * 1000, 2),
+        }
+
+
+class UsuarioVirtual:
+    """Cliente de un escenario: hace peticiones y las registra en Resultados."""
+
+    def __init__(self, client: httpx.AsyncClient, resultados: Resultados, indice: int,
+                 usernames: List[str], contexto: Dict[str, Any]):
+        self.client = client
+        self.resultados = resultados
+        self.indice = indice
+        self.usernames = usernames
+        self.contexto = contexto
+        self.username = usernames[indice % len(usernames)]
+        self.estado: Dict[str, Any] = {}
+
+    def otro_usuario(self) -> str:
+        """Un usuario distinto del propio (o el mismo si solo hay uno)."""
+        if len(self.usernames) == 1:
+            return self.username
+        return self.usernames[(self.indice + 1 + random.randrange(len(self.usernames) - 1)) % len(self.usernames)]
+
+    async def peticion(self, nombre: str, metodo: str, path: str, **kwargs) -> Optional[httpx.Response]:
+        start = time.perf_counter()
+        try:
+            response = await self.client.request(metodo, path, **kwargs)
+            codigo = response.status_code
+        except httpx.HTTPError:
+            response, codigo = None, 0
+        self.resultados.registrar(nombre, time.perf_counter() - start, codigo)
+        return response
+
+
+async def escenario_checkin(vu: UsuarioVirtual):
+    """Avalancha de la mañana: token QR, check-in en la entrada y consulta de avisos."""
+    await vu.peticion("POST /checkin/generate-token", "POST", "/checkin/generate-token",
+                      params={"username": vu.username, "token_type": "qr"})
+    await vu.peticion("POST /checkin", "POST", "/checkin",
+                      params={"username": vu.username, "location": "entrada"})
+    await vu.peticion("GET /notificaciones", "GET", "/notificaciones",
+                      params={"username": vu.username, "unread_only": True})
+
+
+async def escenario_reservas(vu: UsuarioVirtual):
+    """Estampida: todos intentan reservar el mismo horario el mismo día."""
+    await vu.peticion("GET /clases/horarios", "GET", "/clases/horarios")
+    await vu.peticion("POST /clases/reservar", "POST", "/clases/reservar", json={
+        "username": vu.username,
+        "schedule_id": vu.contexto["schedule_id"],
+        "fecha_clase": vu.contexto["fecha_clase"],
+    })
+    await vu.peticion("GET /clases/mis-reservas", "GET", "/clases/mis-reservas",
+                      params={"username": vu.username})
+
+
+async def escenario_sync(vu: UsuarioVirtual):
+    """Tormenta de sincronización: sondeo de versión y descarga completa si cambió."""
+    response = await vu.peticion("GET /sync/version", "GET", "/sync/version",
+                                 params={"usuario": vu.username, "version": vu.estado.get("version")})
+    if response is not None and response.status_code == 200:
+        data = response.json()
+        if data.get("cambios"):
+            await vu.peticion("GET /sincronizar_datos", "GET", "/sincronizar_datos",
+                              params={"usuario": vu.username})
+            vu.estado["version"] = data.get("version")
+
+    await vu.peticion("GET /validar_sync", "GET", "/validar_sync", params={"usuario": vu.username})
+    await vu.peticion("POST /batch", "POST", "/batch", json={
+        "usuario": vu.username,
+        "peticiones": [
+            {"op": "obtener_hilos", "id": "hilos"},
+            {"op": "contar_no_leidos", "id": "no_leidos"},
+            {"op": "contar_chat_no_leidos", "id": "chat_no_leidos"},
+        ]
+    })
+
+
+async def escenario_chat(vu: UsuarioVirtual):
+    """Ráfaga de chat: enviar, leer la conversación y contar no leídos."""
+    destino = vu.otro_usuario()
+    await vu.peticion("POST /enviar_chat", "POST", "/enviar_chat", json={
+        "from_user": vu.username,
+        "to_user": destino,
+        "message": f"Carga {vu.indice} {time.time():.3f}",
+    })
+    await vu.peticion("GET /obtener_chat", "GET", "/obtener_chat",
+                      params={"user1": vu.username, "user2": destino, "limit": 50})
+    await vu.peticion("GET /contar_chat_no_leidos", "GET", "/contar_chat_no_leidos",
+                      params={"usuario": vu.username})
+
+
+ESCENARIOS: Dict[str, Callable[[UsuarioVirtual], Awaitable[None]]] = {
+    "checkin": escenario_checkin,
+    "reservas": escenario_reservas,
+    "sync": escenario_sync,
+    "chat": escenario_chat,
+}
+
+
+async def escenario_mixto(vu: UsuarioVirtual):
+    """Cada usuario virtual ejecuta uno de los escenarios, según su índice."""
+    nombres = sorted(nombre for nombre in ESCENARIOS if nombre != "mixto")
+    await ESCENARIOS[nombres[vu.indice % len(nombres)]](vu)
+
+
+ESCENARIOS["mixto"] = escenario_mixto
+
+
+async def preparar_contexto(client: httpx.AsyncClient) -> Dict[str, Any]:
+    """Usuarios existentes y un horario de clase con su próxima fecha."""
+    response = await client.get("/usuarios")
+    response.raise_for_status()
+    usernames = [u["username"] for u in response.json().get("usuarios", [])]
+    if not usernames:
+        raise RuntimeError("La base de datos no tiene usuarios (ejecute populate_db.py)")
+
+    contexto: Dict[str, Any] = {"usernames": usernames, "schedule_id": 1,
+                                "fecha_clase": (date.today() + timedelta(days=1)).isoformat()}
+
+    response = await client.get("/clases/horarios")
+    horarios = response.json().get("horarios", []) if response.status_code == 200 else []
+    if horarios:
+        horario = horarios[0]
+        contexto["schedule_id"] = horario["id"]
+        if horario.get("dia_semana") in DIAS_SEMANA:
+            dias = (DIAS_SEMANA.index(horario["dia_semana"]) - date.today().weekday()) % 7 or 7
+            contexto["fecha_clase"] = (date.today() + timedelta(days=dias)).isoformat()
+    return contexto
+
+
+async def ejecutar(client: httpx.AsyncClient, escenario: str, usuarios: int,
+                   duracion: float, rampa: float, pausa: float) -> Dict[str, Any]:
+    """Lanza `usuarios` usuarios virtuales que repiten el escenario durante `duracion` s."""
+    contexto = await preparar_contexto(client)
+    resultados = Resultados()
+    funcion = ESCENARIOS[escenario]
+    deadline = time.perf_counter() + duracion
+
+    async def bucle(indice: int):
+        if rampa:
+            await asyncio.sleep(rampa * indice / usuarios)
+        vu = UsuarioVirtual(client, resultados, indice, contexto["usernames"], contexto)
+        while time.perf_counter() < deadline:
+            await funcion(vu)
+            if pausa:
+                await asyncio.sleep(random.uniform(0, 2 * pausa))
+
+    start = time.perf_counter()
+    await asyncio.gather(*(bucle(i) for i in range(usuarios)))
+    transcurrido = time.perf_counter() - start
+
+    return {
+        "escenario": escenario,
+        "usuarios": usuarios,
+        "duracion_s": round(transcurrido, 2),
+        "usuarios_bd": len(contexto["usernames"]),
+        "endpoints": resultados.resumen(transcurrido),
+    }
+
+
+def _copiar_bd(origen: str) -> str:
+    tmp_dir = tempfile.mkdtemp(prefix="gym_load_")
+    db_path = os.path.join(tmp_dir, "gym_database.db")
+    shutil.copy(origen, db_path)
+    return db_path
+
+
+async def _esperar_servidor(client: httpx.AsyncClient, timeout: float = 30.0) -> bool:
+    """Espera a que el servidor responda en /health."""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if (await client.get("/health", timeout=1)).status_code == 200:
+                return True
+        except httpx.HTTPError:
+            pass
+        await asyncio.sleep(0.3)
+    return False
+
+
+async def correr(args) -> Dict[str, Any]:
+    """Prepara el destino según el modo y ejecuta el escenario."""
+    limits = httpx.Limits(max_connections=args.usuarios, max_keepalive_connections=args.usuarios)
+    server = None
+    db_path = None
+
+    if args.modo == "asgi":
+        db_path = _copiar_bd(args.db)
+        os.environ["DB_PATH"] = db_path
+        os.environ.update(SIN_ADMISION)
+        os.environ.setdefault("LOG_LEVEL", "WARNING")
+        import madre_server
+        client = httpx.AsyncClient(transport=httpx.ASGITransport(app=madre_server.app),
+                                   base_url="http://madre", timeout=30)
+    elif args.modo == "lanzar":
+        db_path = _copiar_bd(args.db)
+        env = dict(os.environ, **SIN_ADMISION, DB_PATH=db_path, LOG_LEVEL="WARNING")
+        server = subprocess.Popen(
+            [sys.executable, os.path.join(BASE_DIR, "madre_headless.py"),
+             "--workers", str(args.workers), "--host", "127.0.0.1", "--port", str(args.port)],
+            cwd=BASE_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+        client = httpx.AsyncClient(base_url=f"http://127.0.0.1:{args.port}", timeout=30, limits=limits)
+    else:
+        client = httpx.AsyncClient(base_url=args.url, timeout=30, limits=limits)
+
+    try:
+        async with client:
+            if args.modo != "asgi" and not await _esperar_servidor(client):
+                raise RuntimeError(f"El servidor no responde en {client.base_url}")
+            resultado = await ejecutar(client, args.escenario, args.usuarios,
+                                       args.duracion, args.rampa, args.pausa)
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait(timeout=30)
+        if db_path is not None:
+            shutil.rmtree(os.path.dirname(db_path), ignore_errors=True)
+
+    resultado.update({
+        "modo": args.modo,
+        "workers": args.workers if args.modo == "lanzar" else None,
+        "fecha": datetime.now().isoformat(timespec="seconds"),
+        "commit": _git_commit(),
+    })
+    return resultado
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BASE_DIR,
+                              capture_output=True, text=True, timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def imprimir(resultado: Dict[str, Any]):
+    print_header(f"ESCENARIO {resultado['escenario'].upper()} ({resultado['modo']})")
+    print(f"Usuarios virtuales: {resultado['usuarios']} | Duración: {resultado['duracion_s']}s | "
+          f"Usuarios en BD: {resultado['usuarios_bd']}")
+    print(f"\n{'Endpoint':<32} {'Pet.':>7} {'Err.':>5} {'req/s':>8} {'p50':>8} {'p95':>8} {'p99':>8}")
+    for nombre, stats in resultado["endpoints"].items():
+        etiqueta = "TOTAL" if nombre == "*" else nombre
+        print(f"{etiqueta:<32} {stats['peticiones']:>7} {stats['errores']:>5} {stats['rps']:>8.1f} "
+              f"{stats['p50_ms']:>6.1f}ms {stats['p95_ms']:>6.1f}ms {stats['p99_ms']:>6.1f}ms")
+
+
+def comparar(actual: Dict[str, Any], base: Dict[str, Any], tolerancia: float) -> bool:
+    """
+    Compara p95 y throughput por endpoint con una ejecución anterior.
+
+    Returns:
+        bool: True si ningún endpoint empeora más de `tolerancia` (fracción)
+    """
+    print_header(f"COMPARACIÓN CON {base.get('fecha', '?')} ({base.get('commit') or 'sin commit'})")
+    for campo in ("escenario", "modo", "usuarios", "workers"):
+        if base.get(campo) != actual.get(campo):
+            print(f"Aviso: {campo} distinto ({base.get(campo)} -> {actual.get(campo)}), la comparación no es homogénea")
+    print(f"{'Endpoint':<32} {'p95 antes':>10} {'p95 ahora':>10} {'Δp95':>8} {'Δreq/s':>8}")
+
+    ok = True
+    for nombre, stats in actual["endpoints"].items():
+        anterior = base.get("endpoints", {}).get(nombre)
+        if not anterior:
+            continue
+        delta_p95 = (stats["p95_ms"] - anterior["p95_ms"]) / anterior["p95_ms"] if anterior["p95_ms"] else 0.0
+        delta_rps = (stats["rps"] - anterior["rps"]) / anterior["rps"] if anterior["rps"] else 0.0
+        regresion = delta_p95 > tolerancia or delta_rps < -tolerancia
+        ok = ok and not regresion
+        etiqueta = "TOTAL" if nombre == "*" else nombre
+        print(f"{etiqueta:<32} {anterior['p95_ms']:>8.1f}ms {stats['p95_ms']:>8.1f}ms "
+              f"{delta_p95:>+7.0%} {delta_rps:>+7.0%}{'  <-- REGRESIÓN' if regresion else ''}")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pruebas de carga de la API Madre")
+    parser.add_argument("--escenario", choices=sorted(ESCENARIOS), default="mixto")
+    parser.add_argument("--modo", choices=["asgi", "lanzar", "url"], default="asgi")
+    parser.add_argument("--url", default="http://127.0.0.1:8000", help="Servidor para --modo url")
+    parser.add_argument("--workers", type=int, default=1, help="Workers para --modo lanzar")
+    parser.add_argument("--port", type=int, default=8766, help="Puerto para --modo lanzar")
+    parser.add_argument("--db", default=os.path.join(BASE_DIR, "data", "gym_database.db"),
+                        help="Base de datos a copiar (modos asgi y lanzar)")
+    parser.add_argument("--usuarios", type=int, default=20, help="Usuarios virtuales concurrentes")
+    parser.add_argument("--duracion", type=float, default=10.0, help="Segundos de carga")
+    parser.add_argument("--rampa", type=float, default=0.0, help="Segundos para incorporar a todos los usuarios")
+    parser.add_argument("--pausa", type=float, default=0.0, help="Pausa media (s) entre iteraciones de cada usuario")
+    parser.add_argument("--salida", help="Guarda los resultados en este JSON")
+    parser.add_argument("--comparar", help="JSON de una ejecución anterior con el que comparar")
+    parser.add_argument("--tolerancia", type=float, default=0.2,
+                        help="Empeoramiento máximo admitido de p95/req/s al comparar (0.2 = 20%%)")
+    args = parser.parse_args()
+
+    resultado = asyncio.run(correr(args))
+    imprimir(resultado)
+
+    if args.salida:
+        with open(args.salida, "w", encoding="utf-8") as f:
+            json.dump(resultado, f, indent=2, ensure_ascii=False)
+        print(f"\nResultados guardados en {args.salida}")
+
+    if args.comparar:
+        with open(args.comparar, "r", encoding="utf-8") as f:
+            base = json.load(f)
+        if not comparar(resultado, base, args.tolerancia):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
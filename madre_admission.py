@@ -0,0 +1,347 @@
+"""
+Control de admisión por prioridades del servidor Madre.
+
+Cada petición recibe una clase de prioridad según el prefijo de su ruta:
+
+  - critical: torniquete y acceso (/checkin, /autorizar)
+  - interactive: lo que usa un socio en la app (reservas, mensajes...); por defecto
+  - bulk: listados, historiales, exportaciones y administración
+
+AdmissionMiddleware (ASGI) aplica dos límites antes de que la petición
+llegue a FastAPI:
+
+  - Cubeta de tokens por cliente (IP + usuario de la query o, en los POST,
+    del cuerpo JSON, si lo hay) y clase: ADMISSION_RATE_* peticiones/s con
+    ráfagas de ADMISSION_BURST_*.
+  - Concurrencia: como mucho ADMISSION_MAX_CONCURRENT peticiones en curso.
+    bulk solo puede ocupar ADMISSION_BULK_SHARE de los huecos y
+    ADMISSION_CRITICAL_RESERVE quedan reservados para critical, así que con
+    sobrecarga se rechaza primero bulk, después interactive. Las que no
+    caben esperan en una cola por clase (se atiende antes la de más
+    prioridad) hasta ADMISSION_QUEUE_TIMEOUT segundos.
+
+Lo que no se admite se responde con 429 y Retry-After. El estado es de cada
+worker (proceso): con N workers el límite efectivo es N veces el configurado.
+"""
+import asyncio
+import json
+import math
+import time
+from collections import OrderedDict, deque
+from typing import Deque, Dict, Optional, Sequence, Tuple
+
+from starlette.datastructures import Headers, QueryParams
+
+from config.settings import get_madre_settings
+from madre_metrics import registry
+from madre_responses import FastJSONResponse
+from shared.logger import setup_logger
+
+logger = setup_logger(__name__, log_file="madre_admission.log")
+
+settings = get_madre_settings()
+
+CRITICAL = "critical"
+INTERACTIVE = "interactive"
+BULK = "bulk"
+
+# De mayor a menor prioridad
+PRIORITIES = (CRITICAL, INTERACTIVE, BULK)
+
+# Parámetros de la query (o campos del cuerpo JSON) que identifican al usuario de la petición
+_USER_PARAMS = ("usuario", "username", "user1", "from_user")
+
+# Solo se lee el cuerpo para buscar el usuario si es JSON y no pasa de este tamaño
+_MAX_KEY_BODY = 64 * 1024
+
+QUEUE_DEPTH = registry.gauge(
+    "madre_admission_queue_depth", "Peticiones esperando turno por clase de prioridad", ("priority",))
+ADMITTED_IN_FLIGHT = registry.gauge(
+    "madre_admission_in_flight", "Peticiones admitidas en curso por clase de prioridad", ("priority",))
+ADMISSION_WAIT_SECONDS = registry.histogram(
+    "madre_admission_wait_seconds", "Espera en cola hasta ser admitida por clase de prioridad", ("priority",),
+    buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0))
+ADMISSION_REJECTED = registry.counter(
+    "madre_admission_rejected_total", "Peticiones rechazadas con 429 por clase y motivo", ("priority", "reason"))
+
+
+def _matches(path: str, prefixes: Sequence[str]) -> bool:
+    return any(path == prefix or path.startswith(prefix + "/") for prefix in prefixes)
+
+
+def classify(path: str) -> Optional[str]:
+    """Clase de prioridad de una ruta, o None si está exenta (ADMISSION_EXEMPT_PATHS)."""
+    path = path.rstrip("/") or "/"
+    if _matches(path, settings.ADMISSION_EXEMPT_PATHS):
+        return None
+    if _matches(path, settings.ADMISSION_CRITICAL_PATHS):
+        return CRITICAL
+    if _matches(path, settings.ADMISSION_BULK_PATHS):
+        return BULK
+    return INTERACTIVE
+
+
+def _body_user(body: Optional[bytes]) -> Optional[str]:
+    """Usuario de un cuerpo JSON (campos de _USER_PARAMS), o None."""
+    if not body:
+        return None
+    try:
+        data = json.loads(body)
+    except ValueError:
+        return None
+    if not isinstance(data, dict):
+        return None
+    for name in _USER_PARAMS:
+        user = data.get(name)
+        if isinstance(user, str) and user:
+            return user
+    return None
+
+
+def client_key(scope, body: Optional[bytes] = None) -> str:
+    """
+    Clave de la cubeta de tokens: IP del cliente y, si la query (o el cuerpo
+    JSON de un POST) trae usuario, también el usuario: los socios que
+    comparten la IP del gimnasio no agotan la cuota unos de otros.
+    """
+    client = scope.get("client")
+    host = client[0] if client else "desconocido"
+    params = QueryParams(scope.get("query_string", b"").decode("latin-1"))
+    for name in _USER_PARAMS:
+        user = params.get(name)
+        if user:
+            return f"{host}:{user}"
+    user = _body_user(body)
+    return f"{host}:{user}" if user else host
+
+
+async def _read_json_body(scope, receive):
+    """
+    Lee el cuerpo de una petición JSON pequeña para buscar el usuario.
+
+    Returns:
+        (cuerpo o None, receive que vuelve a entregar el cuerpo a la aplicación)
+    """
+    if scope["method"] not in ("POST", "PUT", "PATCH"):
+        return None, receive
+    headers = Headers(scope=scope)
+    length = headers.get("content-length")
+    if (not headers.get("content-type", "").startswith("application/json")
+            or headers.get("content-encoding") or not length or not length.isdigit()
+            or int(length) > _MAX_KEY_BODY):
+        return None, receive
+
+    chunks = []
+    while True:
+        message = await receive()
+        if message["type"] != "http.request":
+            # El cliente se desconectó: la aplicación recibirá lo mismo
+            async def disconnected():
+                return message
+            return None, disconnected
+        chunks.append(message.get("body", b""))
+        if not message.get("more_body", False):
+            break
+    body = b"".join(chunks)
+
+    replayed = False
+
+    async def replay():
+        nonlocal replayed
+        if not replayed:
+            replayed = True
+            return {"type": "http.request", "body": body, "more_body": False}
+        return await receive()
+
+    return body, replay
+
+
+class TokenBuckets:
+    """
+    Cubetas de tokens por (cliente, clase). Se usan solo desde el bucle de
+    eventos, sin lock. Se conservan como máximo max_entries (LRU); una
+    cubeta olvidada vuelve llena, que es lo que tendría tras esperar.
+    """
+
+    def __init__(self, rates: Dict[str, Tuple[float, int]] = None, max_entries: int = None):
+        self.rates = rates if rates is not None else {
+            CRITICAL: (settings.ADMISSION_RATE_CRITICAL, settings.ADMISSION_BURST_CRITICAL),
+            INTERACTIVE: (settings.ADMISSION_RATE_INTERACTIVE, settings.ADMISSION_BURST_INTERACTIVE),
+            BULK: (settings.ADMISSION_RATE_BULK, settings.ADMISSION_BURST_BULK),
+        }
+        self.max_entries = settings.ADMISSION_MAX_BUCKETS if max_entries is None else max_entries
+        self._buckets: "OrderedDict[Tuple[str, str], list]" = OrderedDict()
+
+    def take(self, key: str, priority: str) -> float:
+        """
+        Consume un token de la cubeta de key en la clase priority.
+
+        Returns:
+            0 si había token; si no, segundos hasta que haya uno
+        """
+        rate, burst = self.rates[priority]
+        if rate <= 0:
+            return 0.0
+        burst = max(burst, 1)
+
+        now = time.monotonic()
+        bucket = self._buckets.get((key, priority))
+        if bucket is None:
+            bucket = [float(burst), now]
+            self._buckets[(key, priority)] = bucket
+            while len(self._buckets) > self.max_entries:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end((key, priority))
+            bucket[0] = min(burst, bucket[0] + (now - bucket[1]) * rate)
+            bucket[1] = now
+
+        if bucket[0] >= 1:
+            bucket[0] -= 1
+            return 0.0
+        return (1 - bucket[0]) / rate
+
+
+class AdmissionController:
+    """
+    Límite de peticiones concurrentes con huecos reservados por prioridad y
+    colas de espera por clase. Se usa solo desde el bucle de eventos.
+    """
+
+    def __init__(self, capacity: int = None, bulk_share: float = None, critical_reserve: float = None,
+                 max_queue: int = None, queue_timeout: float = None):
+        self.capacity = settings.ADMISSION_MAX_CONCURRENT if capacity is None else capacity
+        bulk_share = settings.ADMISSION_BULK_SHARE if bulk_share is None else bulk_share
+        critical_reserve = settings.ADMISSION_CRITICAL_RESERVE if critical_reserve is None else critical_reserve
+        self.max_queue = settings.ADMISSION_MAX_QUEUE if max_queue is None else max_queue
+        self.queue_timeout = settings.ADMISSION_QUEUE_TIMEOUT if queue_timeout is None else queue_timeout
+        self.limits = {
+            CRITICAL: self.capacity,
+            INTERACTIVE: max(1, int(self.capacity * (1 - critical_reserve))),
+            BULK: max(1, int(self.capacity * bulk_share)),
+        }
+        self.in_flight = 0
+        self._running = {priority: 0 for priority in PRIORITIES}
+        self._queues: Dict[str, Deque[asyncio.Future]] = {priority: deque() for priority in PRIORITIES}
+
+    def _can_start(self, priority: str) -> bool:
+        if self.in_flight >= self.limits[priority]:
+            return False
+        # No adelantar a quien ya espera con igual o mayor prioridad
+        return not any(self._queues[p] for p in PRIORITIES[:PRIORITIES.index(priority) + 1])
+
+    def _start(self, priority: str):
+        self.in_flight += 1
+        self._running[priority] += 1
+        ADMITTED_IN_FLIGHT.set(self._running[priority], priority)
+
+    async def acquire(self, priority: str) -> bool:
+        """
+        Ocupa un hueco para una petición de la clase priority, esperando en
+        cola si hace falta.
+
+        Returns:
+            True si se admite (hay que llamar después a release), False si no
+        """
+        if self.capacity <= 0:
+            return True
+        if self._can_start(priority):
+            self._start(priority)
+            return True
+
+        queue = self._queues[priority]
+        if len(queue) >= self.max_queue or self.queue_timeout <= 0:
+            return False
+
+        future = asyncio.get_running_loop().create_future()
+        queue.append(future)
+        QUEUE_DEPTH.set(len(queue), priority)
+        start = time.perf_counter()
+        try:
+            await asyncio.wait((future,), timeout=self.queue_timeout)
+        except asyncio.CancelledError:
+            # El cliente se fue: si ya se le había dado el hueco, se devuelve
+            if future.done() and not future.cancelled():
+                self.release(priority)
+            raise
+        finally:
+            if not future.done():
+                future.cancel()
+                queue.remove(future)
+            QUEUE_DEPTH.set(len(queue), priority)
+
+        if future.cancelled():
+            return False
+        ADMISSION_WAIT_SECONDS.observe(time.perf_counter() - start, priority)
+        return True
+
+    def release(self, priority: str):
+        """Libera el hueco de una petición terminada y da paso a las que esperan, por prioridad."""
+        if self.capacity <= 0:
+            return
+        self.in_flight -= 1
+        self._running[priority] -= 1
+        ADMITTED_IN_FLIGHT.set(self._running[priority], priority)
+        for waiting in PRIORITIES:
+            queue = self._queues[waiting]
+            while queue and self.in_flight < self.limits[waiting]:
+                self._start(waiting)
+                queue.popleft().set_result(None)
+                QUEUE_DEPTH.set(len(queue), waiting)
+            if queue:
+                # Si esta clase no cabe, las de menor prioridad tampoco
+                break
+
+    def status(self) -> dict:
+        return {
+            "capacity": self.capacity,
+            "in_flight": self.in_flight,
+            "limits": dict(self.limits),
+            "running": dict(self._running),
+            "queued": {priority: len(queue) for priority, queue in self._queues.items()},
+        }
+
+
+async def _reject(scope, receive, send, retry_after: float, detail: str):
+    response = FastJSONResponse(
+        {"detail": detail}, status_code=429,
+        headers={"Retry-After": str(max(1, math.ceil(retry_after)))})
+    await response(scope, receive, send)
+
+
+class AdmissionMiddleware:
+    """Middleware ASGI de control de admisión (cubetas de tokens y concurrencia por prioridad)."""
+
+    def __init__(self, app, controller: AdmissionController = None, buckets: TokenBuckets = None):
+        self.app = app
+        self.controller = controller or AdmissionController()
+        self.buckets = buckets or TokenBuckets()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        priority = classify(scope["path"])
+        if priority is None:
+            await self.app(scope, receive, send)
+            return
+
+        body, receive = await _read_json_body(scope, receive)
+        wait = self.buckets.take(client_key(scope, body), priority)
+        if wait > 0:
+            ADMISSION_REJECTED.inc(priority, "cuota")
+            await _reject(scope, receive, send, wait, "Demasiadas peticiones, reintente más tarde")
+            return
+
+        if not await self.controller.acquire(priority):
+            ADMISSION_REJECTED.inc(priority, "sobrecarga")
+            logger.info(f"Load shedding {priority} request {scope['path']}: {self.controller.status()}")
+            await _reject(scope, receive, send, settings.ADMISSION_RETRY_AFTER,
+                          "Servidor saturado, reintente más tarde")
+            return
+
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.controller.release(priority)
@@ -0,0 +1,114 @@
+"""
+Archivado de las tablas de crecimiento continuo de la base de datos Madre.
+
+chat_messages, checkin_history, workout_logs, notifications y class_bookings
+crecen sin límite. Las filas más antiguas que ARCHIVE_HORIZON_DAYS se mueven,
+por lotes de ARCHIVE_BATCH_SIZE y en una transacción por lote, a un archivo
+SQLite por periodo (ARCHIVE_PERIOD: "year" o "month") en ARCHIVE_DIR, que se
+adjunta con ATTACH solo mientras se copia. Así la base de datos principal se
+mantiene pequeña y en caché.
+
+Las consultas de historial (get_chat_history, get_exercise_history) siguen
+viendo los datos archivados: si la base principal no llega al límite pedido,
+completan con los archivos del periodo más reciente al más antiguo
+(madre_db.fetch_archived). El servidor archiva cada ARCHIVE_INTERVAL segundos.
+
+    python madre_archive.py archivar [--dias 365] [--tablas chat_messages,workout_logs] [--vacuum]
+    python madre_archive.py listar
+"""
+import argparse
+import sys
+import time
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, Optional
+
+import madre_db
+from config.settings import get_madre_settings
+from madre_metrics import registry
+from shared.logger import setup_logger
+
+logger = setup_logger(__name__, log_file="madre_archive.log")
+
+settings = get_madre_settings()
+
+ARCHIVED_ROWS = registry.counter(
+    "madre_archive_rows_total", "Filas movidas a los archivos históricos por tabla", ("table",))
+
+
+def archive_cutoff(horizon_days: Optional[int] = None) -> str:
+    """Fecha ISO (YYYY-MM-DD) antes de la cual las filas se archivan."""
+    horizon_days = settings.ARCHIVE_HORIZON_DAYS if horizon_days is None else horizon_days
+    return (datetime.now() - timedelta(days=horizon_days)).date().isoformat()
+
+
+def archive_old_rows(horizon_days: Optional[int] = None,
+                     tables: Optional[Iterable[str]] = None) -> Dict[str, int]:
+    """
+    Mueve a los archivos históricos las filas anteriores al horizonte.
+
+    Args:
+        horizon_days: Días que se conservan en la base principal (por defecto ARCHIVE_HORIZON_DAYS)
+        tables: Tablas a archivar (por defecto todas las de madre_db.ARCHIVE_TABLES)
+
+    Returns:
+        Dict tabla -> filas movidas
+    """
+    cutoff = archive_cutoff(horizon_days)
+    start = time.perf_counter()
+    movidas = {}
+    for table in tables or madre_db.ARCHIVE_TABLES:
+        with madre_db.db_session() as (_conn, cursor):
+            periods = madre_db.fetch_archivable_periods(cursor, table, cutoff)
+
+        total = 0
+        for period in periods:
+            while True:
+                moved = madre_db.archive_batch(table, period, cutoff)
+                if not moved:
+                    break
+                total += moved
+                ARCHIVED_ROWS.inc(table, amount=moved)
+        movidas[table] = total
+
+    if any(movidas.values()):
+        logger.info(f"Archivado anterior a {cutoff} en {time.perf_counter() - start:.1f} s: {movidas}")
+    return movidas
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Archivado de tablas históricas de la base de datos Madre")
+    sub = parser.add_subparsers(dest="comando", required=True)
+
+    archivar = sub.add_parser("archivar", help="Mueve las filas antiguas a los archivos por periodo")
+    archivar.add_argument("--dias", type=int, default=None,
+                          help="Días que se conservan en la base principal (por defecto ARCHIVE_HORIZON_DAYS)")
+    archivar.add_argument("--tablas", default=None, help="Tablas separadas por comas")
+    archivar.add_argument("--vacuum", action="store_true",
+                          help="Compactar después la base principal (bloquea las escrituras)")
+
+    sub.add_parser("listar", help="Lista los archivos históricos")
+
+    args = parser.parse_args()
+
+    if args.comando == "archivar":
+        tablas = [t.strip() for t in args.tablas.split(",") if t.strip()] if args.tablas else None
+        desconocidas = set(tablas or []) - set(madre_db.ARCHIVE_TABLES)
+        if desconocidas:
+            print(f"Tablas no archivables: {', '.join(sorted(desconocidas))}")
+            sys.exit(1)
+        movidas = archive_old_rows(args.dias, tablas)
+        for table, total in movidas.items():
+            print(f"{table}: {total} filas archivadas")
+        if args.vacuum:
+            madre_db.vacuum_database()
+            print("Base de datos compactada")
+    else:
+        catalogo = madre_db.get_archive_catalog()
+        if not catalogo:
+            print("No hay datos archivados")
+        for entry in catalogo:
+            print(f"{entry['period']:<8} {entry['table_name']:<16} {entry['rows']:>9} filas  {entry['path']}")
+
+
+if __name__ == "__main__":
+    main()
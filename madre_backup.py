@@ -0,0 +1,423 @@
+"""
+Copias de seguridad en caliente de la base de datos Madre.
+
+Usa la API de backup de SQLite (sqlite3.Connection.backup) por pasos de
+BACKUP_PAGES páginas con una pausa de BACKUP_STEP_SLEEP_MS entre pasos: no
+toma db_lock y, en modo WAL, copia desde una transacción de lectura que fija
+la instantánea: las peticiones siguen escribiendo mientras se copia y las
+pausas reparten la E/S. Sin WAL cada paso toma un bloqueo de lectura breve;
+si otra conexión escribe entre pasos SQLite reinicia la copia, y tras
+BACKUP_MAX_RESTARTS reinicios se termina en un único paso.
+
+Cada copia se verifica con PRAGMA quick_check, se comprime opcionalmente con
+gzip y se conservan las BACKUP_KEEP más recientes. El servidor hace una copia
+cada BACKUP_INTERVAL segundos (solo un worker por intervalo).
+
+Los archivos históricos de ARCHIVE_DIR (madre_archive) forman parte de los
+datos: cada copia los guarda, verificados, en una carpeta hermana
+"<copia>.archivo". Se copian después de la base principal, así que una fila
+archivada durante la copia puede quedar en los dos sitios (el siguiente
+archivado la vuelve a mover) pero nunca en ninguno.
+
+    python madre_backup.py crear [--comprimir | --sin-comprimir] [--dir DIR]
+    python madre_backup.py listar
+    python madre_backup.py restaurar data/backups/gym_database-20260101-030000.db.gz
+
+Restaurar sobrescribe la base de datos y sus archivos históricos (con el
+servidor detenido); antes se guarda una copia "pre_restauracion" de los actuales.
+"""
+import argparse
+import gzip
+import os
+import shutil
+import sqlite3
+import sys
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+import madre_db
+from madre_tasks import acquire_lock
+from config.settings import get_madre_settings
+from madre_metrics import registry
+from shared.logger import setup_logger
+
+logger = setup_logger(__name__, log_file="madre_backup.log")
+
+settings = get_madre_settings()
+
+BACKUP_DIR = settings.BACKUP_DIR if os.path.isabs(
+    settings.BACKUP_DIR) else os.path.join(os.path.dirname(__file__), settings.BACKUP_DIR)
+
+BACKUP_PREFIX = os.path.splitext(os.path.basename(madre_db.DB_PATH))[0]
+PRE_RESTORE_PREFIX = "pre_restauracion"
+ARCHIVE_SUFFIX = ".archivo"
+
+_LOCK_NAME = ".backup.lock"
+
+BACKUP_SECONDS = registry.histogram(
+    "madre_backup_duration_seconds", "Duración de las copias de seguridad",
+    buckets=(1, 5, 15, 30, 60, 120, 300, 600, 1800, 3600))
+LAST_BACKUP = registry.gauge(
+    "madre_backup_last_success_timestamp", "Hora (epoch) de la última copia de seguridad correcta")
+
+
+class _Restarted(Exception):
+    """La copia se reinició demasiadas veces por escrituras concurrentes."""
+
+
+def _copy_database(source: str, target: str, pages: int, sleep_ms: int) -> int:
+    """
+    Copia `source` en `target` con la API de backup por pasos.
+
+    Returns:
+        Número de veces que SQLite reinició la copia
+    """
+    state = {"restarts": 0, "remaining": None}
+
+    def progress(_status, remaining, _total):
+        if state["remaining"] is not None and remaining > state["remaining"]:
+            state["restarts"] += 1
+            if state["restarts"] > settings.BACKUP_MAX_RESTARTS:
+                raise _Restarted()
+        state["remaining"] = remaining
+
+    src = sqlite3.connect(source, timeout=settings.DB_BUSY_TIMEOUT_MS / 1000)
+    dst = sqlite3.connect(target)
+    try:
+        if src.execute("PRAGMA journal_mode").fetchone()[0] == "wal":
+            # En WAL una transacción de lectura abierta fija la instantánea para
+            # todos los pasos (sin reinicios) y no bloquea a los escritores
+            src.execute("BEGIN")
+            src.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()
+        try:
+            src.backup(dst, pages=pages, progress=progress, sleep=sleep_ms / 1000)
+        except _Restarted:
+            logger.warning(f"Copia reiniciada {state['restarts']} veces por escrituras: "
+                           f"se termina en un solo paso")
+            src.backup(dst)
+        # La copia queda autocontenida (sin -wal) para poder comprimirla o moverla
+        dst.execute("PRAGMA journal_mode=DELETE")
+    finally:
+        dst.close()
+        src.close()
+    return state["restarts"]
+
+
+def verify_database(path: str) -> None:
+    """Comprueba la integridad de una copia (PRAGMA quick_check); lanza ValueError si falla."""
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        result = conn.execute("PRAGMA quick_check").fetchone()[0]
+    finally:
+        conn.close()
+    if result != "ok":
+        raise ValueError(f"Copia dañada ({path}): {result}")
+
+
+def archive_copy_dir(backup_path: str) -> str:
+    """Carpeta con los archivos históricos de una copia (hermana del archivo .db/.db.gz)."""
+    base = backup_path[:-len(".gz")] if backup_path.endswith(".gz") else backup_path
+    return f"{os.path.splitext(base)[0]}{ARCHIVE_SUFFIX}"
+
+
+def _archive_files(directory: str) -> List[str]:
+    """Archivos históricos (madre_db.ARCHIVE_PREFIX_<periodo>.db[.gz]) de una carpeta."""
+    if not os.path.isdir(directory):
+        return []
+    return sorted(name for name in os.listdir(directory)
+                  if name.startswith(f"{madre_db.ARCHIVE_PREFIX}_") and name.endswith((".db", ".db.gz")))
+
+
+def _decompress(path: str, target: str) -> str:
+    """Descomprime path en target si es .gz; devuelve la ruta legible (path o target)."""
+    if not path.endswith(".gz"):
+        return path
+    with gzip.open(path, "rb") as src, open(target, "wb") as dst:
+        shutil.copyfileobj(src, dst, 1024 * 1024)
+    return target
+
+
+def _compress(path: str) -> str:
+    compressed = f"{path}.gz"
+    tmp_path = f"{compressed}.tmp"
+    with open(path, "rb") as src, gzip.open(tmp_path, "wb", compresslevel=6) as dst:
+        shutil.copyfileobj(src, dst, 1024 * 1024)
+    os.replace(tmp_path, compressed)
+    os.remove(path)
+    return compressed
+
+
+def _copy_archives(archive_dir: str, target_dir: str, compress: bool) -> int:
+    """
+    Copia verificada de los archivos históricos en target_dir (se crea
+    entera o no se crea).
+
+    Returns:
+        Número de archivos copiados
+    """
+    tmp_dir = f"{target_dir}.tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    try:
+        names = [name for name in _archive_files(archive_dir) if name.endswith(".db")]
+        for name in names:
+            path = os.path.join(tmp_dir, name)
+            _copy_database(os.path.join(archive_dir, name), path,
+                           settings.BACKUP_PAGES, settings.BACKUP_STEP_SLEEP_MS)
+            verify_database(path)
+            if compress:
+                _compress(path)
+        os.replace(tmp_dir, target_dir)
+    except Exception:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+    return len(names)
+
+
+def create_backup(directory: Optional[str] = None, compress: Optional[bool] = None,
+                  prefix: str = BACKUP_PREFIX, source: Optional[str] = None,
+                  archive_dir: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Crea una copia verificada de la base de datos y de sus archivos
+    históricos sin detener el servidor.
+
+    Args:
+        directory: Carpeta de destino (por defecto BACKUP_DIR)
+        compress: Comprimir con gzip (por defecto BACKUP_COMPRESS)
+        prefix: Prefijo del archivo; la rotación solo afecta a las copias con BACKUP_PREFIX
+        source: Base de datos a copiar (por defecto la de madre_db)
+        archive_dir: Carpeta de los archivos históricos (por defecto madre_db.ARCHIVE_DIR)
+
+    Returns:
+        Dict con archivo, bytes, segundos, reinicios y archivos_historicos
+    """
+    directory = directory or BACKUP_DIR
+    compress = settings.BACKUP_COMPRESS if compress is None else compress
+    os.makedirs(directory, exist_ok=True)
+
+    stamp = datetime.now().strftime('%Y%m%d-%H%M%S')
+    path = os.path.join(directory, f"{prefix}-{stamp}.db")
+    n = 1
+    while os.path.exists(path) or os.path.exists(f"{path}.gz") or os.path.exists(archive_copy_dir(path)):
+        n += 1
+        path = os.path.join(directory, f"{prefix}-{stamp}-{n}.db")
+    tmp_path = f"{path}.tmp"
+    start = time.perf_counter()
+    try:
+        restarts = _copy_database(source or madre_db.DB_PATH, tmp_path,
+                                  settings.BACKUP_PAGES, settings.BACKUP_STEP_SLEEP_MS)
+        verify_database(tmp_path)
+        # Después de la base principal: lo archivado entretanto queda duplicado, no perdido
+        archives = _copy_archives(archive_dir or madre_db.ARCHIVE_DIR, archive_copy_dir(path), compress)
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    if compress:
+        path = _compress(path)
+
+    seconds = time.perf_counter() - start
+    BACKUP_SECONDS.observe(seconds)
+    LAST_BACKUP.set(time.time())
+    size = os.path.getsize(path)
+    logger.info(f"Copia de seguridad creada: {path} ({size / 1024 / 1024:.1f} MB, "
+                f"{seconds:.1f} s, {restarts} reinicios, {archives} archivos históricos)")
+
+    if prefix == BACKUP_PREFIX:
+        rotate_backups(directory)
+    return {"archivo": path, "bytes": size, "segundos": round(seconds, 2), "reinicios": restarts,
+            "archivos_historicos": archives}
+
+
+def list_backups(directory: Optional[str] = None, prefix: Optional[str] = None) -> List[Dict[str, Any]]:
+    """Copias existentes, de la más reciente a la más antigua."""
+    directory = directory or BACKUP_DIR
+    if not os.path.isdir(directory):
+        return []
+
+    backups = []
+    for name in os.listdir(directory):
+        if not name.endswith((".db", ".db.gz")) or (prefix and not name.startswith(f"{prefix}-")):
+            continue
+        path = os.path.join(directory, name)
+        stat = os.stat(path)
+        backups.append({
+            "archivo": path,
+            "mtime": stat.st_mtime,
+            "bytes": stat.st_size,
+            "fecha": datetime.fromtimestamp(stat.st_mtime).isoformat(timespec="seconds"),
+            "comprimida": name.endswith(".gz")
+        })
+    backups.sort(key=lambda backup: backup.pop("mtime"), reverse=True)
+    return backups
+
+
+def rotate_backups(directory: Optional[str] = None, keep: Optional[int] = None) -> int:
+    """Elimina las copias programadas más antiguas y conserva las `keep` (BACKUP_KEEP) más recientes."""
+    keep = settings.BACKUP_KEEP if keep is None else keep
+    removed = 0
+    for backup in list_backups(directory, BACKUP_PREFIX)[max(keep, 1):]:
+        os.remove(backup["archivo"])
+        shutil.rmtree(archive_copy_dir(backup["archivo"]), ignore_errors=True)
+        removed += 1
+    if removed:
+        logger.info(f"Rotación de copias: {removed} eliminadas")
+    return removed
+
+
+def backup_if_due(interval: Optional[int] = None) -> Optional[Dict[str, Any]]:
+    """
+    Crea una copia si la última programada tiene más de `interval` segundos
+    (BACKUP_INTERVAL). Con varios workers solo uno la hace.
+    """
+    interval = settings.BACKUP_INTERVAL if interval is None else interval
+    latest = list_backups(prefix=BACKUP_PREFIX)
+    if latest and time.time() - os.path.getmtime(latest[0]["archivo"]) < interval:
+        return None
+
+    lock_path = acquire_lock(BACKUP_DIR, _LOCK_NAME)
+    if lock_path is None:
+        return None
+    try:
+        return create_backup()
+    finally:
+        os.remove(lock_path)
+
+
+def _restore_file(source: str, target: str) -> None:
+    """Vuelca una base de datos verificada sobre target en un solo paso (API de backup)."""
+    src = sqlite3.connect(f"file:{source}?mode=ro", uri=True)
+    dst = sqlite3.connect(target, timeout=settings.DB_BUSY_TIMEOUT_MS / 1000)
+    try:
+        src.backup(dst)
+    finally:
+        dst.close()
+        src.close()
+
+
+def restore_backup(path: str, target: Optional[str] = None, safety_copy: bool = True,
+                   archive_dir: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Restaura una copia (comprimida o no) sobre la base de datos y sus
+    archivos históricos.
+
+    La copia y sus archivos históricos se verifican antes de tocar nada y
+    se vuelcan con la API de backup en un solo paso, así que ningún destino
+    queda a medias. Los archivos históricos que no estaban en la copia se
+    eliminan (sus filas siguen en la base restaurada, o en la copia previa).
+    Las copias anteriores sin carpeta de archivos históricos no los tocan.
+    Debe hacerse con el servidor detenido: los procesos que sigan abiertos
+    no ven el cambio en sus cachés.
+
+    Args:
+        path: Archivo .db o .db.gz
+        target: Base de datos a sobrescribir (por defecto la de madre_db)
+        safety_copy: Guardar antes una copia "pre_restauracion" del destino
+        archive_dir: Carpeta de los archivos históricos (por defecto madre_db.ARCHIVE_DIR)
+
+    Returns:
+        Dict con archivo, destino, copia_previa y archivos_historicos (None si la copia no los tenía)
+    """
+    target = target or madre_db.DB_PATH
+    archive_dir = archive_dir or madre_db.ARCHIVE_DIR
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"No existe la copia: {path}")
+
+    copy_dir = archive_copy_dir(path)
+    archive_names = _archive_files(copy_dir) if os.path.isdir(copy_dir) else None
+    tmp_paths = []
+    try:
+        source = _decompress(path, f"{target}.restore.tmp")
+        if source != path:
+            tmp_paths.append(source)
+        verify_database(source)
+
+        archives = {}
+        if archive_names is not None:
+            os.makedirs(archive_dir, exist_ok=True)
+            for name in archive_names:
+                db_name = name[:-len(".gz")] if name.endswith(".gz") else name
+                archive_source = _decompress(os.path.join(copy_dir, name),
+                                             os.path.join(archive_dir, f"{db_name}.restore.tmp"))
+                if archive_source.endswith(".restore.tmp"):
+                    tmp_paths.append(archive_source)
+                verify_database(archive_source)
+                archives[db_name] = archive_source
+
+        previous = None
+        if safety_copy and os.path.exists(target):
+            previous = create_backup(prefix=PRE_RESTORE_PREFIX, source=target,
+                                     archive_dir=archive_dir)["archivo"]
+
+        _restore_file(source, target)
+        dst = sqlite3.connect(target)
+        try:
+            dst.execute("PRAGMA journal_mode=WAL")
+        finally:
+            dst.close()
+
+        if archive_names is not None:
+            for db_name, archive_source in archives.items():
+                _restore_file(archive_source, os.path.join(archive_dir, db_name))
+            for name in _archive_files(archive_dir):
+                if name not in archives:
+                    os.remove(os.path.join(archive_dir, name))
+    finally:
+        for tmp_path in tmp_paths:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    logger.warning(f"Base de datos restaurada desde {path} (copia previa: {previous}, "
+                   f"{len(archives) if archive_names is not None else 'sin'} archivos históricos)")
+    return {"archivo": path, "destino": target, "copia_previa": previous,
+            "archivos_historicos": len(archives) if archive_names is not None else None}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Copias de seguridad de la base de datos Madre")
+    sub = parser.add_subparsers(dest="comando", required=True)
+
+    crear = sub.add_parser("crear", help="Crea una copia en caliente")
+    compresion = crear.add_mutually_exclusive_group()
+    compresion.add_argument("--comprimir", dest="comprimir", action="store_true", default=None)
+    compresion.add_argument("--sin-comprimir", dest="comprimir", action="store_false")
+    crear.add_argument("--dir", default=None, help="Carpeta de destino (por defecto BACKUP_DIR)")
+
+    listar = sub.add_parser("listar", help="Lista las copias existentes")
+    listar.add_argument("--dir", default=None)
+
+    restaurar = sub.add_parser("restaurar", help="Restaura una copia (con el servidor detenido)")
+    restaurar.add_argument("archivo")
+    restaurar.add_argument("--destino", default=None, help="Base de datos a sobrescribir")
+    restaurar.add_argument("--sin-copia-previa", action="store_true",
+                           help="No guardar una copia de la base de datos actual")
+
+    args = parser.parse_args()
+
+    if args.comando == "crear":
+        result = create_backup(args.dir, args.comprimir)
+        print(f"{result['archivo']} ({result['bytes'] / 1024 / 1024:.1f} MB, {result['segundos']} s, "
+              f"{result['reinicios']} reinicios, {result['archivos_historicos']} archivos históricos)")
+    elif args.comando == "listar":
+        backups = list_backups(args.dir)
+        if not backups:
+            print("No hay copias de seguridad")
+        for backup in backups:
+            print(f"{backup['fecha']}  {backup['bytes'] / 1024 / 1024:>9.1f} MB  {backup['archivo']}")
+    else:
+        try:
+            result = restore_backup(args.archivo, args.destino, not args.sin_copia_previa)
+        except (OSError, ValueError, sqlite3.Error) as e:
+            print(f"Error: {e}")
+            sys.exit(1)
+        print(f"Restaurada {result['archivo']} en {result['destino']}")
+        if result["archivos_historicos"] is not None:
+            print(f"Archivos históricos restaurados: {result['archivos_historicos']}")
+        if result["copia_previa"]:
+            print(f"Copia previa: {result['copia_previa']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,275 @@
+"""
+Compresión de las respuestas HTTP del servidor Madre.
+
+CompressionMiddleware (ASGI) comprime las respuestas JSON y de texto de al
+menos COMPRESSION_MIN_SIZE bytes con la codificación que prefiera el cliente
+según su Accept-Encoding (a igual q, el orden de COMPRESSION_ENCODINGS:
+zstd, br, gzip). zstd requiere el paquete zstandard y br el paquete brotli;
+sin ellos se usa gzip. No se tocan las respuestas por partes (streaming:
+adjuntos, imágenes), las de peticiones con Range ni las que ya traen
+Content-Encoding.
+
+PrecompressedCache guarda las respuestas de catálogo ya serializadas y
+comprimidas por codificación, vinculadas a la versión de su ámbito en
+db_version (como madre_db.VersionedCache): mientras el catálogo no cambie,
+ni se consulta la base de datos ni se vuelve a comprimir.
+"""
+import asyncio
+import gzip
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional, Sequence, Tuple
+
+from fastapi import Request
+from fastapi.responses import Response
+from starlette.datastructures import Headers, MutableHeaders
+
+from config.settings import get_madre_settings
+from madre_metrics import registry
+from madre_responses import dumps
+from shared.logger import setup_logger
+
+logger = setup_logger(__name__, log_file="madre_compression.log")
+
+settings = get_madre_settings()
+
+try:
+    import zstandard
+    ZSTD_AVAILABLE = True
+except ImportError:
+    ZSTD_AVAILABLE = False
+
+try:
+    import brotli
+    BROTLI_AVAILABLE = True
+except ImportError:
+    BROTLI_AVAILABLE = False
+
+# Por encima de este tamaño se comprime en un hilo para no bloquear el bucle de eventos
+_THREAD_MIN_SIZE = 256 * 1024
+
+_SKIP_STATUS = (204, 206, 304)
+
+COMPRESSION_BYTES = registry.counter(
+    "madre_compression_bytes_total", "Bytes de respuesta antes y después de comprimir por ruta y codificación",
+    ("route", "encoding", "kind"))
+COMPRESSION_SECONDS = registry.histogram(
+    "madre_compression_seconds", "Tiempo de compresión por codificación", ("encoding",),
+    buckets=(0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0))
+PRECOMPRESSED_LOOKUPS = registry.counter(
+    "madre_precompressed_cache_total", "Consultas a la caché de respuestas precomprimidas", ("result",))
+
+
+def _gzip(data: bytes) -> bytes:
+    return gzip.compress(data, compresslevel=settings.COMPRESSION_GZIP_LEVEL, mtime=0)
+
+
+def _zstd(data: bytes) -> bytes:
+    # ZstdCompressor no es seguro entre hilos: uno por llamada (crearlo es barato)
+    return zstandard.ZstdCompressor(level=settings.COMPRESSION_ZSTD_LEVEL).compress(data)
+
+
+def _brotli(data: bytes) -> bytes:
+    return brotli.compress(data, quality=settings.COMPRESSION_BROTLI_LEVEL)
+
+
+ENCODERS: Dict[str, Callable[[bytes], bytes]] = {"gzip": _gzip}
+if ZSTD_AVAILABLE:
+    ENCODERS["zstd"] = _zstd
+if BROTLI_AVAILABLE:
+    ENCODERS["br"] = _brotli
+
+# Codificaciones configuradas y disponibles, en orden de preferencia del servidor
+ENCODINGS = tuple(encoding for encoding in settings.COMPRESSION_ENCODINGS if encoding in ENCODERS)
+
+_missing = [encoding for encoding in settings.COMPRESSION_ENCODINGS if encoding not in ENCODERS]
+if _missing:
+    logger.info(f"Codificaciones no disponibles (faltan zstandard/brotli): {', '.join(_missing)}")
+
+
+def negotiate(accept_encoding: str, encodings: Sequence[str] = None) -> Optional[str]:
+    """
+    Elige la codificación de la respuesta según Accept-Encoding: la de mayor
+    q entre las disponibles y, a igual q, la primera de `encodings`. "*"
+    solo habilita gzip (el cliente no ha dicho qué sabe descomprimir).
+
+    Returns:
+        "zstd", "br", "gzip" o None si no hay ninguna aceptable
+    """
+    encodings = ENCODINGS if encodings is None else encodings
+    accepted: Dict[str, float] = {}
+    for part in accept_encoding.lower().split(","):
+        coding, _, params = part.partition(";")
+        coding = coding.strip()
+        if not coding:
+            continue
+        q = 1.0
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        accepted[coding] = q
+
+    if "gzip" not in accepted and "*" in accepted:
+        accepted["gzip"] = accepted["*"]
+
+    candidates = [(accepted[encoding], -index, encoding)
+                  for index, encoding in enumerate(encodings) if accepted.get(encoding, 0.0) > 0]
+    return max(candidates)[2] if candidates else None
+
+
+def compress(encoding: str, data: bytes, route: str = "") -> bytes:
+    """Comprime `data` y registra los bytes y el tiempo en las métricas."""
+    start = time.perf_counter()
+    compressed = ENCODERS[encoding](data)
+    COMPRESSION_SECONDS.observe(time.perf_counter() - start, encoding)
+    COMPRESSION_BYTES.inc(route, encoding, "original", amount=len(data))
+    COMPRESSION_BYTES.inc(route, encoding, "comprimido", amount=len(compressed))
+    return compressed
+
+
+def _is_compressible(content_type: str) -> bool:
+    media_type = content_type.split(";")[0].strip().lower()
+    return media_type.startswith("text/") or media_type.endswith(("json", "xml", "javascript"))
+
+
+class CompressionMiddleware:
+    """Middleware ASGI que comprime las respuestas completas (un solo mensaje de cuerpo)."""
+
+    def __init__(self, app, encodings: Sequence[str] = None, minimum_size: int = None):
+        self.app = app
+        self.encodings = ENCODINGS if encodings is None else tuple(encodings)
+        self.minimum_size = settings.COMPRESSION_MIN_SIZE if minimum_size is None else minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.encodings:
+            await self.app(scope, receive, send)
+            return
+
+        request_headers = Headers(scope=scope)
+        encoding = negotiate(request_headers.get("accept-encoding", ""), self.encodings)
+        if encoding is None or "range" in request_headers:
+            await self.app(scope, receive, send)
+            return
+
+        start_message = None
+        done = False
+
+        async def send_compressed(message):
+            nonlocal start_message, done
+            if message["type"] == "http.response.start":
+                start_message = message
+                return
+            if done or start_message is None or message["type"] != "http.response.body":
+                await send(message)
+                return
+
+            done = True
+            body = message.get("body", b"")
+            headers = MutableHeaders(scope=start_message)
+            eligible = (start_message["status"] not in _SKIP_STATUS
+                        and "content-encoding" not in headers and "content-range" not in headers
+                        and _is_compressible(headers.get("content-type", "")))
+            if eligible:
+                headers.add_vary_header("Accept-Encoding")
+            if not eligible or message.get("more_body", False) or len(body) < self.minimum_size:
+                await send(start_message)
+                await send(message)
+                return
+
+            route = scope.get("route")
+            route_path = route.path if route is not None else "sin_ruta"
+            if len(body) >= _THREAD_MIN_SIZE:
+                compressed = await asyncio.to_thread(compress, encoding, body, route_path)
+            else:
+                compressed = compress(encoding, body, route_path)
+
+            headers["Content-Encoding"] = encoding
+            headers["Content-Length"] = str(len(compressed))
+            etag = headers.get("etag")
+            if etag and not etag.startswith("W/"):
+                headers["ETag"] = f"W/{etag}"
+            await send(start_message)
+            await send({"type": "http.response.body", "body": compressed})
+
+        await self.app(scope, receive, send_compressed)
+
+
+class PrecompressedCache:
+    """
+    Respuestas JSON serializadas y comprimidas por codificación.
+
+    version() se consulta en cada acceso (una lectura de db_version): si el
+    ámbito cambió, la caché se vacía. Se conservan como máximo max_entries
+    cuerpos (LRU), contando cada codificación por separado.
+    """
+
+    def __init__(self, version: Callable[[], int], max_entries: int = None):
+        self._version_fn = version
+        self.max_entries = settings.COMPRESSION_CACHE_ENTRIES if max_entries is None else max_entries
+        self._version = None
+        self._entries: "OrderedDict[Tuple[Hashable, Optional[str]], bytes]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, encoding: Optional[str], loader: Callable[[], Any],
+            route: str = "") -> Tuple[bytes, Optional[str]]:
+        """
+        Cuerpo de la respuesta para key en la codificación pedida; loader()
+        devuelve el contenido JSON si no está en caché. Las respuestas más
+        pequeñas que COMPRESSION_MIN_SIZE se sirven sin comprimir.
+
+        Returns:
+            (cuerpo, codificación usada o None)
+        """
+        version = self._version_fn()
+        with self._lock:
+            if version != self._version:
+                self._entries.clear()
+                self._version = version
+            identity = self._entries.get((key, None))
+            if identity is not None and (encoding is None or len(identity) < settings.COMPRESSION_MIN_SIZE):
+                PRECOMPRESSED_LOOKUPS.inc("hit")
+                self._entries.move_to_end((key, None))
+                return identity, None
+            body = self._entries.get((key, encoding))
+            if body is not None:
+                PRECOMPRESSED_LOOKUPS.inc("hit")
+                self._entries.move_to_end((key, encoding))
+                return body, encoding
+
+        PRECOMPRESSED_LOOKUPS.inc("miss")
+        if identity is None:
+            identity = dumps(loader())
+        if encoding is None or len(identity) < settings.COMPRESSION_MIN_SIZE:
+            encoding, body = None, identity
+        else:
+            body = compress(encoding, identity, route)
+
+        with self._lock:
+            if self._version == version:
+                self._entries[(key, None)] = identity
+                self._entries[(key, encoding)] = body
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return body, encoding
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._version = None
+
+
+def cached_json_response(cache: PrecompressedCache, request: Request, key: Hashable,
+                         loader: Callable[[], Any]) -> Response:
+    """Respuesta JSON servida desde `cache`, ya comprimida según el Accept-Encoding de la petición."""
+    route = request.scope.get("route")
+    encoding = negotiate(request.headers.get("accept-encoding", ""))
+    body, encoding = cache.get(key, encoding, loader, route.path if route is not None else "")
+    headers = {"Vary": "Accept-Encoding"}
+    if encoding:
+        headers["Content-Encoding"] = encoding
+    return Response(content=body, media_type="application/json", headers=headers)
@@ -1,13 +1,23 @@
 
+import calendar
 import sqlite3
 import threading
 import os
+import copy
+import functools
 import hashlib
-from datetime import datetime
-from typing import Optional, Dict, Any, List
+from datetime import date, datetime, timezone
+from typing import Optional, Dict, Any, List, Tuple
 import json
+import sys
+import time
+import contextlib
+import re
+from contextlib import contextmanager
 from config.settings import get_madre_settings
 from shared.logger import setup_logger
+from madre_metrics import registry
+import madre_profiler
 
 logger = setup_logger(__name__, log_file="madre_db.log")
 
@@ -18,7 +28,156 @@ DB_PATH = settings.DB_PATH if os.path.isabs(
         os.path.dirname(__file__),
     settings.DB_PATH)
 
-db_lock = threading.Lock()
+ARCHIVE_DIR = settings.ARCHIVE_DIR if os.path.isabs(
+    settings.ARCHIVE_DIR) else os.path.join(os.path.dirname(__file__), settings.ARCHIVE_DIR)
+ARCHIVE_PREFIX = os.path.splitext(os.path.basename(DB_PATH))[0] + "_archivo"
+
+DB_LOCK_WAIT = registry.histogram(
+    "madre_db_lock_wait_seconds", "Espera para adquirir db_lock por función de madre_db", ("function",))
+DB_QUERY_SECONDS = registry.histogram(
+    "madre_db_query_seconds", "Tiempo con db_lock retenido (consultas) por función de madre_db", ("function",))
+
+
+def _lock_caller() -> str:
+    """Nombre de la función que pide db_lock (saltando db_session y contextlib)."""
+    frame = sys._getframe(2)
+    while frame is not None and (frame.f_code.co_name == "db_session"
+                                 or frame.f_code.co_filename == contextlib.__file__):
+        frame = frame.f_back
+    return frame.f_code.co_name if frame is not None else "desconocida"
+
+
+class TimedLock:
+    """
+    Lock de la base de datos que mide, por función llamante, cuánto se
+    espera para adquirirlo y cuánto se retiene. Se usa igual que un Lock
+    (`with db_lock:`); no es reentrante.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._holder = None
+
+    def __enter__(self):
+        caller = _lock_caller()
+        start = time.perf_counter()
+        self._lock.acquire()
+        acquired = time.perf_counter()
+        self._holder = (caller, acquired)
+        DB_LOCK_WAIT.observe(acquired - start, caller)
+        return self
+
+    def __exit__(self, *exc):
+        caller, acquired = self._holder
+        self._holder = None
+        self._lock.release()
+        DB_QUERY_SECONDS.observe(time.perf_counter() - acquired, caller)
+        return False
+
+    def locked(self) -> bool:
+        return self._lock.locked()
+
+    def holder(self) -> Optional[Dict[str, Any]]:
+        """Función que retiene el lock y desde hace cuántos segundos (None si está libre)."""
+        holder = self._holder
+        if holder is None:
+            return None
+        return {"function": holder[0], "held_seconds": round(time.perf_counter() - holder[1], 3)}
+
+
+db_lock = TimedLock()
+
+FTS_TOKENIZER = "unicode61 remove_diacritics 2 tokenchars '_'"
+FTS_AVAILABLE = True
+
+CACHE_SCOPES = {
+    "catalogo": ("classes", "class_schedules", "equipment_zones", "exercises"),
+    "sync": ("sync_data",),
+}
+
+USER_SYNC_TABLES = ("profile_photos", "training_schedules", "photo_gallery")
+
+# Tablas registradas en el log de cambios (CDC) -> columnas cuyas
+# actualizaciones no cuentan como cambio (contadores y marcas internas).
+CDC_TABLES = {
+    "users": ("last_sync", "sync_version"),
+    "profile_photos": (),
+    "training_schedules": (),
+    "photo_gallery": (),
+    "sync_data": (),
+    "message_threads": (),
+    "messages": (),
+    "message_attachments": (),
+    "chat_messages": (),
+    "classes": (),
+    "class_schedules": (),
+    "class_bookings": (),
+    "class_waitlist": (),
+    "class_ratings": (),
+    "equipment_zones": (),
+    "equipment_reservations": (),
+    "exercises": (),
+    "workout_logs": (),
+    "checkin_history": (),
+    "notifications": (),
+    "user_preferences": (),
+}
+
+CDC_LOCAL_ORIGIN = "local"
+
+# Tablas que se replican entre servidores Madre. Los adjuntos quedan fuera:
+# sus blobs viven en disco (madre_storage) y no viajan con la fila.
+REPLICATED_TABLES = tuple(table for table in CDC_TABLES if table != "message_attachments")
+
+# Columnas de las tablas replicadas con el id de otra fila replicada -> tabla a la
+# que apuntan. Viajan como identidad global y cada servidor las traduce a su id local.
+REPLICATED_REFERENCES = {
+    "profile_photos": {"user_id": "users"},
+    "training_schedules": {"user_id": "users"},
+    "photo_gallery": {"user_id": "users"},
+    "message_threads": {"root_message_id": "messages", "last_message_id": "messages"},
+    "messages": {"parent_message_id": "messages", "thread_id": "message_threads"},
+    "class_schedules": {"class_id": "classes"},
+    "class_bookings": {"user_id": "users", "schedule_id": "class_schedules"},
+    "class_waitlist": {"user_id": "users", "schedule_id": "class_schedules"},
+    "class_ratings": {"user_id": "users", "class_id": "classes", "schedule_id": "class_schedules"},
+    "equipment_reservations": {"user_id": "users", "equipment_id": "equipment_zones"},
+    "workout_logs": {"user_id": "users", "exercise_id": "exercises"},
+    "checkin_history": {"user_id": "users"},
+    "notifications": {"user_id": "users"},
+    "user_preferences": {"user_id": "users"},
+}
+
+# Tablas de crecimiento continuo que se archivan -> columna (fecha ISO) que decide su antigüedad
+ARCHIVE_TABLES = {
+    "chat_messages": "timestamp",
+    "checkin_history": "checkin_date",
+    "workout_logs": "fecha",
+    "notifications": "created_date",
+    "class_bookings": "fecha_clase",
+}
+
+ARCHIVE_ORIGIN = "archivo"
+
+# Columnas de fecha ISO con una columna entera generada al lado, para filtrar
+# y ordenar con índices pequeños: "ts" -> <columna>_ts (segundos epoch),
+# "dia" -> <columna>_dia (días desde 1970-01-01)
+EPOCH_COLUMNS = {
+    "users": {"last_sync": "ts"},
+    "messages": {"sent_date": "ts"},
+    "thread_participants": {"last_activity": "ts"},
+    "chat_messages": {"timestamp": "ts"},
+    "checkin_history": {"checkin_date": "ts"},
+    "notifications": {"created_date": "ts"},
+    "workout_logs": {"fecha": "dia"},
+    "class_bookings": {"fecha_clase": "dia"},
+}
+
+_EPOCH_DATE = date(1970, 1, 1)
+
+USER_LIST_COLUMNS = ("username", "nombre_completo", "email", "equipo",
+                     "permiso_acceso", "fecha_registro", "last_sync")
+USER_SEARCH_COLUMNS = ("username", "nombre_completo", "email", "equipo")
 
 logger.info(f"Database module initialized - DB Path: {DB_PATH}")
 
@@ -35,19 +194,59 @@ def get_db_connection() -> sqlite3.Connection:
     """
     try:
         os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
-        conn = sqlite3.connect(DB_PATH, check_same_thread=False)
+        conn = sqlite3.connect(
+            DB_PATH,
+            timeout=settings.DB_BUSY_TIMEOUT_MS / 1000,
+            check_same_thread=False,
+            factory=madre_profiler.connection_factory()
+        )
         conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA synchronous=NORMAL")
         return conn
     except Exception as e:
         logger.error(f"Error creating database connection: {e}", exc_info=True)
         raise
 
 
+@contextmanager
+def db_session():
+    """
+    Abre una única conexión bajo db_lock para ejecutar varias operaciones
+    seguidas con los helpers fetch_* (que reciben el cursor). Confirma los
+    cambios al salir del bloque sin errores.
+
+    Ejemplo:
+        >>> with db_session() as (conn, cursor):
+        ...     user = fetch_user(cursor, "juan_perez")
+        ...     threads = fetch_user_threads(cursor, user['username'])
+    """
+    with db_lock:
+        conn = get_db_connection()
+        try:
+            yield conn, conn.cursor()
+            conn.commit()
+        finally:
+            conn.close()
+
+
+def ping() -> bool:
+    """Comprueba la base de datos con un SELECT 1 (sin tomar db_lock)."""
+    conn = get_db_connection()
+    try:
+        return conn.execute("SELECT 1").fetchone()[0] == 1
+    finally:
+        conn.close()
+
+
 def init_database() -> None:
     """
     Inicializa la base de datos con las tablas necesarias.
     Crea todas las tablas si no existen.
 
+    Activa el modo WAL (lectores concurrentes con un escritor entre procesos)
+    y aplica el esquema dentro de una transacción inmediata, de modo que si
+    varios workers arrancan a la vez solo uno ejecuta las migraciones.
+
     Raises:
         sqlite3.Error: Si hay un error al crear las tablas
     """
@@ -57,6 +256,9 @@ def init_database() -> None:
             conn = get_db_connection()
             cursor = conn.cursor()
 
+            cursor.execute("PRAGMA journal_mode=WAL")
+            cursor.execute("BEGIN IMMEDIATE")
+
             cursor.execute('''
                 CREATE TABLE IF NOT EXISTS users (
                     id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -164,6 +366,44 @@ def init_database() -> None:
                 )
             ''')
 
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS replication_state (
+                    server_name TEXT NOT NULL,
+                    table_name TEXT NOT NULL,
+                    last_seq INTEGER NOT NULL DEFAULT 0,
+                    updated_at TEXT,
+                    PRIMARY KEY (server_name, table_name)
+                )
+            ''')
+
+            # Identidad global de las filas recibidas por replicación (ver apply_replicated_changes)
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS row_origins (
+                    table_name TEXT NOT NULL,
+                    row_id INTEGER NOT NULL,
+                    origin_server TEXT NOT NULL,
+                    origin_id INTEGER NOT NULL,
+                    PRIMARY KEY (table_name, row_id),
+                    UNIQUE (table_name, origin_server, origin_id)
+                )
+            ''')
+
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS pending_references (
+                    table_name TEXT NOT NULL,
+                    row_id INTEGER NOT NULL,
+                    column_name TEXT NOT NULL,
+                    ref_table TEXT NOT NULL,
+                    ref_server TEXT NOT NULL,
+                    ref_id INTEGER NOT NULL,
+                    PRIMARY KEY (table_name, row_id, column_name)
+                )
+            ''')
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_pending_references_ref
+                ON pending_references (ref_table, ref_server, ref_id)
+            ''')
+
             cursor.execute('''
                 CREATE TABLE IF NOT EXISTS classes (
                     id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -368,6 +608,101 @@ def init_database() -> None:
                 )
             ''')
 
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS message_threads (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    root_message_id INTEGER,
+                    subject TEXT,
+                    created_date TEXT NOT NULL,
+                    last_activity TEXT NOT NULL,
+                    last_message_id INTEGER,
+                    message_count INTEGER DEFAULT 0
+                )
+            ''')
+
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS thread_participants (
+                    thread_id INTEGER NOT NULL,
+                    username TEXT NOT NULL,
+                    last_activity TEXT NOT NULL,
+                    PRIMARY KEY (thread_id, username),
+                    FOREIGN KEY (thread_id) REFERENCES message_threads(id)
+                )
+            ''')
+
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS attachment_blobs (
+                    sha256 TEXT PRIMARY KEY,
+                    size INTEGER NOT NULL,
+                    created_date TEXT NOT NULL
+                )
+            ''')
+
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS attachment_gc_queue (
+                    sha256 TEXT PRIMARY KEY,
+                    queued_date TEXT NOT NULL
+                )
+            ''')
+
+            _ensure_column(cursor, 'messages', 'thread_id', 'INTEGER REFERENCES message_threads(id)')
+            _ensure_column(cursor, 'message_attachments', 'sha256', 'TEXT')
+            _ensure_column(cursor, 'message_attachments', 'content_type', 'TEXT')
+            _ensure_column(cursor, 'users', 'sync_version', 'INTEGER DEFAULT 0')
+            _init_epoch_columns(cursor)
+
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_users_nombre_completo
+                ON users (nombre_completo COLLATE NOCASE)
+            ''')
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_users_equipo
+                ON users (equipo COLLATE NOCASE)
+            ''')
+            cursor.execute('DROP INDEX IF EXISTS idx_thread_participants_user')
+            cursor.execute('DROP INDEX IF EXISTS idx_thread_participants_user_ts')
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_thread_participants_user_ts_thread
+                ON thread_participants (username, last_activity_ts DESC, thread_id DESC)
+            ''')
+            cursor.execute('DROP INDEX IF EXISTS idx_messages_thread')
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_messages_thread_ts
+                ON messages (thread_id, sent_date_ts)
+            ''')
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_messages_to_user_ts
+                ON messages (to_user, sent_date_ts)
+            ''')
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_notifications_user_ts
+                ON notifications (user_id, created_date_ts)
+            ''')
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_class_bookings_user_dia
+                ON class_bookings (user_id, fecha_clase_dia)
+            ''')
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_message_attachments_message
+                ON message_attachments (message_id)
+            ''')
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_message_attachments_sha256
+                ON message_attachments (sha256)
+            ''')
+
+            _backfill_message_threads(cursor)
+
+            _init_search_index(cursor)
+
+            _init_version_tracking(cursor)
+
+            _init_change_capture(cursor)
+
+            _init_archive(cursor)
+
+            _init_idempotency(cursor)
+
             conn.commit()
             conn.close()
             logger.info("Database schema initialized successfully")
@@ -376,187 +711,1319 @@ def init_database() -> None:
             raise
 
 
-def hash_password(password: str) -> str:
-    """Hash de contraseña usando SHA256."""
-    return hashlib.sha256(password.encode()).hexdigest()
+def _ensure_column(cursor, table: str, column: str, definition: str, schema: str = "main") -> None:
+    """Añade una columna a una tabla existente si todavía no existe (migración)."""
+    cursor.execute(f"PRAGMA {schema}.table_xinfo({table})")
+    if column not in {row['name'] for row in cursor.fetchall()}:
+        cursor.execute(f"ALTER TABLE {schema}.{table} ADD COLUMN {column} {definition}")
+        logger.info(f"Migración: columna {table}.{column} añadida")
 
 
-def verify_password(password: str, password_hash: str) -> bool:
-    """Verifica una contraseña contra su hash."""
-    return hash_password(password) == password_hash
+def _epoch_definition(column: str, kind: str) -> str:
+    """Definición de la columna entera generada a partir de una fecha ISO."""
+    if kind == "dia":
+        expression = f"CAST(julianday({column}) - 2440587.5 AS INTEGER)"
+    else:
+        expression = f"CAST(strftime('%s', {column}) AS INTEGER)"
+    return f"INTEGER GENERATED ALWAYS AS ({expression}) VIRTUAL"
 
 
-def create_user(username: str, password: str, nombre_completo: str,
-                email: str = "", telefono: str = "", equipo: str = "",
-                permiso_acceso: bool = True) -> bool:
-    """Crea un nuevo usuario en la base de datos."""
-    with db_lock:
-        try:
-            conn = get_db_connection()
-            cursor = conn.cursor()
+def epoch_column(table: str, column: str) -> str:
+    """Nombre de la columna entera que acompaña a una columna de fecha ISO."""
+    return f"{column}_{EPOCH_COLUMNS[table][column]}"
 
-            password_hash = hash_password(password)
-            fecha_registro = datetime.now().isoformat()
 
-            cursor.execute('''
-                INSERT INTO users (username, password_hash, permiso_acceso,
-                                 nombre_completo, email, telefono, equipo, fecha_registro)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (username, password_hash, 1 if permiso_acceso else 0,
-                  nombre_completo, email, telefono, equipo, fecha_registro))
+def epoch_value(table: str, column: str, value) -> int:
+    """Valor de la columna entera de table.column para una fecha ISO (o date/datetime)."""
+    return to_day(value) if EPOCH_COLUMNS[table][column] == "dia" else to_epoch(value)
 
-            conn.commit()
-            conn.close()
-            return True
-        except sqlite3.IntegrityError:
-            return False
 
+def to_epoch(value) -> int:
+    """
+    Convierte una fecha ISO (o datetime) al valor de las columnas *_ts: la
+    hora local sin zona se cuenta como si fuera UTC, igual que strftime('%s')
+    en SQLite; con zona horaria, el epoch real.
+    """
+    moment = datetime.fromisoformat(value) if isinstance(value, str) else value
+    if moment.tzinfo is not None:
+        return int(moment.timestamp())
+    return calendar.timegm(moment.timetuple())
 
-def get_user(username: str) -> Optional[Dict[str, Any]]:
-    """Obtiene los datos de un usuario."""
-    with db_lock:
-        conn = get_db_connection()
-        cursor = conn.cursor()
 
-        cursor.execute('SELECT * FROM users WHERE username = ?', (username,))
-        row = cursor.fetchone()
-        conn.close()
+def to_day(value) -> int:
+    """Convierte una fecha ISO (o date/datetime) al valor de las columnas *_dia."""
+    moment = datetime.fromisoformat(value) if isinstance(value, str) else value
+    if isinstance(moment, datetime):
+        if moment.tzinfo is not None:
+            moment = moment.astimezone(timezone.utc)
+        moment = moment.date()
+    return (moment - _EPOCH_DATE).days
 
-        if row:
-            return dict(row)
-        return None
 
+def _init_epoch_columns(cursor, schema: str = "main", tables=None) -> None:
+    """
+    Añade las columnas enteras de EPOCH_COLUMNS. Son columnas generadas
+    VIRTUAL: el ALTER no reescribe la tabla, no ocupan espacio en las filas
+    y se calculan a partir del texto ISO en cada escritura, así que no hace
+    falta tocar ningún INSERT; lo que se materializa son sus índices.
+    """
+    for table in tables or EPOCH_COLUMNS:
+        for column, kind in EPOCH_COLUMNS[table].items():
+            _ensure_column(cursor, table, f"{column}_{kind}", _epoch_definition(column, kind), schema)
 
-def get_all_users() -> List[Dict[str, Any]]:
-    """Obtiene todos los usuarios."""
-    with db_lock:
-        conn = get_db_connection()
-        cursor = conn.cursor()
 
-        cursor.execute('SELECT * FROM users ORDER BY username')
-        rows = cursor.fetchall()
-        conn.close()
+def _backfill_message_threads(cursor) -> None:
+    """
+    Asigna hilo a los mensajes anteriores al modelo de hilos.
+    Recorre los mensajes en orden de creación, de modo que el padre
+    siempre tiene hilo antes que sus respuestas.
+    """
+    cursor.execute('''
+        SELECT id, from_user, to_user, subject, sent_date, parent_message_id
+        FROM messages WHERE thread_id IS NULL ORDER BY id
+    ''')
+    pending = cursor.fetchall()
+    if not pending:
+        return
 
-        return [dict(row) for row in rows]
+    for msg in pending:
+        thread_id = _resolve_thread(cursor, msg['parent_message_id'], msg['subject'], msg['sent_date'])
+        cursor.execute('UPDATE messages SET thread_id = ? WHERE id = ?', (thread_id, msg['id']))
+        _touch_thread(cursor, thread_id, msg['id'], msg['from_user'], msg['to_user'], msg['sent_date'])
 
+    logger.info(f"Migración: {len(pending)} mensajes asignados a hilos")
 
-def update_user_permission(username: str, permiso_acceso: bool) -> bool:
-    """Actualiza el permiso de acceso de un usuario."""
-    with db_lock:
-        conn = get_db_connection()
-        cursor = conn.cursor()
 
-        cursor.execute('''
-            UPDATE users SET permiso_acceso = ? WHERE username = ?
-        ''', (1 if permiso_acceso else 0, username))
+def _init_search_index(cursor) -> None:
+    """
+    Crea los índices FTS5 de mensajes y chat y los triggers que los mantienen.
 
-        conn.commit()
-        success = cursor.rowcount > 0
-        conn.close()
-        return success
+    Los índices usan tablas de contenido externo (vistas sobre messages y
+    chat_messages), por lo que el texto no se duplica. La columna
+    'participantes' permite filtrar por usuario dentro del propio MATCH.
+    Si SQLite no incluye FTS5, la búsqueda recurre a LIKE.
+    """
+    global FTS_AVAILABLE
 
+    cursor.execute('''
+        SELECT name FROM sqlite_master
+        WHERE type = 'table' AND name IN ('messages_fts', 'chat_messages_fts')
+    ''')
+    existing = {row['name'] for row in cursor.fetchall()}
 
-def update_user_sync(username: str) -> bool:
-    """Actualiza la última fecha de sincronización del usuario."""
-    with db_lock:
-        conn = get_db_connection()
-        cursor = conn.cursor()
+    try:
+        cursor.execute('''
+            CREATE VIEW IF NOT EXISTS messages_fts_source AS
+            SELECT id, subject, body, from_user || ' ' || to_user AS participantes
+            FROM messages
+        ''')
+        cursor.execute(f'''
+            CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+                subject, body, participantes,
+                content='messages_fts_source', content_rowid='id',
+                tokenize="{FTS_TOKENIZER}", prefix='2 3'
+            )
+        ''')
 
-        last_sync = datetime.now().isoformat()
         cursor.execute('''
-            UPDATE users SET last_sync = ? WHERE username = ?
-        ''', (last_sync, username))
+            CREATE VIEW IF NOT EXISTS chat_messages_fts_source AS
+            SELECT id, message, from_user || ' ' || to_user AS participantes
+            FROM chat_messages
+        ''')
+        cursor.execute(f'''
+            CREATE VIRTUAL TABLE IF NOT EXISTS chat_messages_fts USING fts5(
+                message, participantes,
+                content='chat_messages_fts_source', content_rowid='id',
+                tokenize="{FTS_TOKENIZER}", prefix='2 3'
+            )
+        ''')
+    except sqlite3.OperationalError as e:
+        FTS_AVAILABLE = False
+        logger.warning(f"FTS5 no disponible, la búsqueda usará LIKE: {e}")
+        return
+
+    # Sentencia a sentencia: executescript haría COMMIT y sacaría el resto del
+    # esquema de la transacción inmediata de init_database
+    triggers = (
+        '''
+        CREATE TRIGGER IF NOT EXISTS messages_fts_ai AFTER INSERT ON messages BEGIN
+            INSERT INTO messages_fts (rowid, subject, body, participantes)
+            VALUES (new.id, new.subject, new.body, new.from_user || ' ' || new.to_user);
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS messages_fts_ad AFTER DELETE ON messages BEGIN
+            INSERT INTO messages_fts (messages_fts, rowid, subject, body, participantes)
+            VALUES ('delete', old.id, old.subject, old.body, old.from_user || ' ' || old.to_user);
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS messages_fts_au
+        AFTER UPDATE OF subject, body, from_user, to_user ON messages BEGIN
+            INSERT INTO messages_fts (messages_fts, rowid, subject, body, participantes)
+            VALUES ('delete', old.id, old.subject, old.body, old.from_user || ' ' || old.to_user);
+            INSERT INTO messages_fts (rowid, subject, body, participantes)
+            VALUES (new.id, new.subject, new.body, new.from_user || ' ' || new.to_user);
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS chat_messages_fts_ai AFTER INSERT ON chat_messages BEGIN
+            INSERT INTO chat_messages_fts (rowid, message, participantes)
+            VALUES (new.id, new.message, new.from_user || ' ' || new.to_user);
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS chat_messages_fts_ad AFTER DELETE ON chat_messages BEGIN
+            INSERT INTO chat_messages_fts (chat_messages_fts, rowid, message, participantes)
+            VALUES ('delete', old.id, old.message, old.from_user || ' ' || old.to_user);
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS chat_messages_fts_au
+        AFTER UPDATE OF message, from_user, to_user ON chat_messages BEGIN
+            INSERT INTO chat_messages_fts (chat_messages_fts, rowid, message, participantes)
+            VALUES ('delete', old.id, old.message, old.from_user || ' ' || old.to_user);
+            INSERT INTO chat_messages_fts (rowid, message, participantes)
+            VALUES (new.id, new.message, new.from_user || ' ' || new.to_user);
+        END
+        ''',
+    )
+    for trigger in triggers:
+        cursor.execute(trigger)
+
+    for table in ('messages_fts', 'chat_messages_fts'):
+        if table not in existing:
+            cursor.execute(f"INSERT INTO {table} ({table}) VALUES ('rebuild')")
+            logger.info(f"Índice de búsqueda {table} construido")
+
+
+def _init_version_tracking(cursor) -> None:
+    """
+    Crea la tabla db_version y los triggers que incrementan la versión de
+    cada ámbito cuando cambia alguna de sus tablas. Las cachés de cada
+    proceso comparan esta versión para invalidarse (ver VersionedCache).
 
-        conn.commit()
-        success = cursor.rowcount > 0
-        conn.close()
-        return success
+    También mantiene users.sync_version, que cambia cuando se modifica algo
+    de lo que recibe el usuario en /sincronizar_datos (ver fetch_sync_version).
+    """
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS db_version (
+            scope TEXT PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+
+    for scope, tables in CACHE_SCOPES.items():
+        cursor.execute('INSERT OR IGNORE INTO db_version (scope, version) VALUES (?, 0)', (scope,))
+        for table in tables:
+            for suffix, event in (('ai', 'INSERT'), ('au', 'UPDATE'), ('ad', 'DELETE')):
+                cursor.execute(f'''
+                    CREATE TRIGGER IF NOT EXISTS {table}_version_{suffix}
+                    AFTER {event} ON {table} BEGIN
+                        UPDATE db_version SET version = version + 1 WHERE scope = '{scope}';
+                    END
+                ''')
+
+    for table in USER_SYNC_TABLES:
+        for suffix, event, ref in (('ai', 'INSERT', 'NEW'), ('au', 'UPDATE', 'NEW'), ('ad', 'DELETE', 'OLD')):
+            cursor.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS {table}_user_sync_{suffix}
+                AFTER {event} ON {table} BEGIN
+                    UPDATE users SET sync_version = sync_version + 1 WHERE id = {ref}.user_id;
+                END
+            ''')
 
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS users_user_sync_au
+        AFTER UPDATE OF nombre_completo, email, telefono, equipo, fecha_registro ON users BEGIN
+            UPDATE users SET sync_version = sync_version + 1 WHERE id = NEW.id;
+        END
+    ''')
 
-def authenticate_user(username: str, password: str) -> tuple[bool, Optional[Dict[str, Any]]]:
-    """Autentica un usuario con contraseña."""
-    user = get_user(username)
-    if not user:
-        return False, None
 
-    if verify_password(password, user['password_hash']):
-        return True, user
-    return False, None
+def _init_change_capture(cursor) -> None:
+    """
+    Crea el log de cambios (CDC) y sus triggers.
+
+    Cada INSERT/UPDATE/DELETE sobre las tablas de CDC_TABLES añade una fila
+    a `changes` con la tabla, el id de la fila, la operación ('I', 'U', 'D'),
+    el origen del cambio ('local' salvo que se marque con tag_changes) y una
+    secuencia monótona que nunca se reutiliza (AUTOINCREMENT). Los
+    consumidores leen a partir de la última secuencia que procesaron
+    (get_changes / iter_changes).
+
+    Los triggers solo usan SQL estándar (herramientas externas como el CLI
+    de sqlite3 pueden seguir escribiendo) y se recrean en cada arranque para
+    que el de UPDATE cubra las columnas añadidas por migraciones. Las cargas
+    masivas de populate_db los mantienen, así que también quedan registradas.
+    """
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS changes (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            table_name TEXT NOT NULL,
+            row_id INTEGER NOT NULL,
+            op TEXT NOT NULL CHECK (op IN ('I', 'U', 'D')),
+            origin TEXT NOT NULL DEFAULT 'local',
+            changed_at REAL NOT NULL
+        )
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_changes_row
+        ON changes (table_name, row_id, seq)
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_changes_changed_at
+        ON changes (changed_at)
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS cdc_state (
+            key TEXT PRIMARY KEY,
+            value INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    cursor.execute("INSERT OR IGNORE INTO cdc_state (key, value) VALUES ('purged_up_to', 0)")
+
+    now = "(julianday('now') - 2440587.5) * 86400.0"
+    for table, ignored in CDC_TABLES.items():
+        cursor.execute(f"PRAGMA table_info({table})")
+        columns = [row['name'] for row in cursor.fetchall() if row['name'] not in ignored]
+
+        triggers = (('ai', 'INSERT', 'NEW', 'I'), ('ad', 'DELETE', 'OLD', 'D'),
+                    ('au', f'UPDATE OF {", ".join(columns)}', 'NEW', 'U'))
+        for suffix, event, ref, op in triggers:
+            cursor.execute(f"DROP TRIGGER IF EXISTS {table}_cdc_{suffix}")
+            cursor.execute(f'''
+                CREATE TRIGGER {table}_cdc_{suffix}
+                AFTER {event} ON {table} BEGIN
+                    INSERT INTO changes (table_name, row_id, op, changed_at)
+                    VALUES ('{table}', {ref}.id, '{op}', {now});
+                END
+            ''')
 
 
-def get_user_profile_photo(user_id: int) -> Optional[str]:
-    """Obtiene la ruta de la foto de perfil del usuario."""
-    with db_lock:
-        conn = get_db_connection()
-        cursor = conn.cursor()
+def tag_changes(cursor, after_seq: int, origin: str) -> None:
+    """
+    Marca con `origin` los cambios registrados después de after_seq en la
+    transacción en curso (por ejemplo, los aplicados por la replicación), para
+    que los consumidores puedan filtrarlos con exclude_origin. after_seq debe
+    leerse con fetch_latest_change_seq dentro de una transacción de escritura
+    (BEGIN IMMEDIATE), para que no incluya cambios de otros procesos.
+    """
+    cursor.execute('UPDATE changes SET origin = ? WHERE seq > ?', (origin, after_seq))
 
-        cursor.execute('''
-            SELECT photo_path FROM profile_photos
-            WHERE user_id = ?
-            ORDER BY upload_date DESC LIMIT 1
-        ''', (user_id,))
 
-        row = cursor.fetchone()
-        conn.close()
+def fetch_changes(cursor, after_seq: int = 0, limit: int = None,
+                  tables: Optional[List[str]] = None,
+                  exclude_origin=None) -> List[Dict[str, Any]]:
+    """
+    Cambios con secuencia mayor que after_seq, en orden, con un cursor ya
+    abierto. exclude_origin puede ser un origen o una lista de orígenes.
+    """
+    query = '''
+        SELECT seq, table_name, row_id, op, origin, changed_at
+        FROM changes WHERE seq > ?
+    '''
+    params: List[Any] = [after_seq]
+    if tables:
+        query += f" AND table_name IN ({','.join('?' * len(tables))})"
+        params.extend(tables)
+    if exclude_origin:
+        origins = [exclude_origin] if isinstance(exclude_origin, str) else list(exclude_origin)
+        query += f" AND origin NOT IN ({','.join('?' * len(origins))})"
+        params.extend(origins)
+    query += " ORDER BY seq LIMIT ?"
+    params.append(limit or settings.CDC_PAGE_SIZE)
+
+    cursor.execute(query, params)
+    return [{
+        "seq": row['seq'],
+        "table": row['table_name'],
+        "row_id": row['row_id'],
+        "op": row['op'],
+        "origin": row['origin'],
+        "changed_at": row['changed_at']
+    } for row in cursor.fetchall()]
+
+
+def fetch_latest_change_seq(cursor) -> int:
+    """Última secuencia asignada en el log de cambios (0 si está vacío)."""
+    cursor.execute("SELECT seq FROM sqlite_sequence WHERE name = 'changes'")
+    row = cursor.fetchone()
+    return row['seq'] if row else 0
+
+
+def get_changes(after_seq: int = 0, limit: int = None,
+                tables: Optional[List[str]] = None,
+                exclude_origin: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Lee una página del log de cambios.
 
-        if row:
-            return row['photo_path']
-        return None
+    Args:
+        after_seq: Última secuencia ya procesada por el consumidor
+        limit: Máximo de cambios (por defecto CDC_PAGE_SIZE)
+        tables: Limitar a estas tablas
+        exclude_origin: Omitir los cambios con este origen
 
+    Returns:
+        Dict con changes, last_seq (secuencia desde la que pedir la siguiente
+        página), has_more y reset. reset es True si la retención ya eliminó
+        cambios posteriores a after_seq: el consumidor debe resincronizar
+        por completo antes de seguir leyendo.
+    """
+    limit = limit or settings.CDC_PAGE_SIZE
+    try:
+        with db_lock:
+            conn = get_db_connection()
+            cursor = conn.cursor()
+            # Una sola transacción de lectura: last_seq debe corresponder a la misma instantánea
+            cursor.execute("BEGIN")
+            changes = fetch_changes(cursor, after_seq, limit + 1, tables, exclude_origin)
+            cursor.execute("SELECT value FROM cdc_state WHERE key = 'purged_up_to'")
+            purged_up_to = cursor.fetchone()['value']
+            latest = fetch_latest_change_seq(cursor)
+            conn.commit()
+            conn.close()
 
-def set_user_profile_photo(user_id: int, photo_path: str) -> bool:
-    """Establece la foto de perfil del usuario."""
-    with db_lock:
-        conn = get_db_connection()
-        cursor = conn.cursor()
+        has_more = len(changes) > limit
+        changes = changes[:limit]
+        # Con filtros, avanzar hasta la última secuencia examinada aunque no
+        # haya cambios que devolver, para no releer el mismo tramo.
+        last_seq = changes[-1]['seq'] if has_more else max(after_seq, latest)
+        return {
+            "changes": changes,
+            "last_seq": last_seq,
+            "has_more": has_more,
+            "reset": after_seq < purged_up_to
+        }
+    except Exception as e:
+        logger.error(f"Error reading change log after {after_seq}: {e}", exc_info=True)
+        raise
 
-        upload_date = datetime.now().isoformat()
-        cursor.execute('''
-            INSERT INTO profile_photos (user_id, photo_path, upload_date)
-            VALUES (?, ?, ?)
-        ''', (user_id, photo_path, upload_date))
 
-        conn.commit()
-        conn.close()
-        return True
+def iter_changes(after_seq: int = 0, page_size: int = None,
+                 tables: Optional[List[str]] = None,
+                 exclude_origin: Optional[str] = None):
+    """
+    Recorre el log de cambios desde after_seq página a página (cada página
+    con su propia conexión, sin retener db_lock entre páginas).
+    """
+    while True:
+        page = get_changes(after_seq, page_size, tables, exclude_origin)
+        yield from page["changes"]
+        after_seq = page["last_seq"]
+        if not page["has_more"]:
+            return
 
 
-def get_training_schedule(user_id: int, mes: str = None, ano: int = None) -> Optional[Dict[str, Any]]:
-    """Obtiene el cronograma de entrenamiento del usuario."""
+def get_latest_change_seq() -> int:
+    """Última secuencia del log de cambios."""
     with db_lock:
         conn = get_db_connection()
-        cursor = conn.cursor()
+        try:
+            return fetch_latest_change_seq(conn.cursor())
+        finally:
+            conn.close()
 
-        if mes and ano:
-            cursor.execute('''
-                SELECT * FROM training_schedules
-                WHERE user_id = ? AND mes = ? AND ano = ?
-                ORDER BY modified_date DESC LIMIT 1
-            ''', (user_id, mes, ano))
-        else:
-            cursor.execute('''
-                SELECT * FROM training_schedules
-                WHERE user_id = ?
-                ORDER BY modified_date DESC LIMIT 1
-            ''', (user_id,))
 
-        row = cursor.fetchone()
-        conn.close()
+def compact_changes() -> int:
+    """
+    Deja en el log solo el último cambio de cada fila.
 
-        if row:
-            schedule = dict(row)
-            schedule['schedule_data'] = json.loads(schedule['schedule_data'])
-            return schedule
-        return None
+    Los consumidores aplican los cambios leyendo el estado actual de la fila,
+    así que los anteriores al último no aportan nada: tras compactar, un 'I'
+    seguido de 'U' queda como 'U' (el consumidor lo trata como upsert).
 
+    Returns:
+        Número de entradas eliminadas
+    """
+    try:
+        with db_lock:
+            conn = get_db_connection()
+            cursor = conn.cursor()
+            cursor.execute('''
+                DELETE FROM changes
+                WHERE seq < (SELECT MAX(c.seq) FROM changes c
+                             WHERE c.table_name = changes.table_name AND c.row_id = changes.row_id)
+            ''')
+            removed = cursor.rowcount
+            conn.commit()
+            conn.close()
 
-def save_training_schedule(user_id: int, mes: str, ano: int, schedule_data: Dict) -> bool:
-    """Guarda o actualiza el cronograma de entrenamiento."""
-    with db_lock:
-        conn = get_db_connection()
-        cursor = conn.cursor()
+        if removed:
+            logger.info(f"Change log compacted: {removed} entries removed")
+        return removed
+    except Exception as e:
+        logger.error(f"Error compacting change log: {e}", exc_info=True)
+        return 0
 
-        now = datetime.now().isoformat()
+
+def purge_changes(retention_days: int = None) -> int:
+    """
+    Elimina los cambios más antiguos que retention_days (por defecto
+    CDC_RETENTION_DAYS) y recuerda hasta qué secuencia se purgó, para
+    avisar (reset) a los consumidores que se hayan quedado atrás.
+
+    Returns:
+        Número de entradas eliminadas
+    """
+    retention_days = settings.CDC_RETENTION_DAYS if retention_days is None else retention_days
+    cutoff = time.time() - retention_days * 86400
+    try:
+        with db_lock:
+            conn = get_db_connection()
+            cursor = conn.cursor()
+            cursor.execute('SELECT MAX(seq) AS seq FROM changes WHERE changed_at < ?', (cutoff,))
+            purged_up_to = cursor.fetchone()['seq']
+            removed = 0
+            if purged_up_to is not None:
+                cursor.execute('DELETE FROM changes WHERE seq <= ?', (purged_up_to,))
+                removed = cursor.rowcount
+                cursor.execute('''
+                    UPDATE cdc_state SET value = MAX(value, ?) WHERE key = 'purged_up_to'
+                ''', (purged_up_to,))
+            conn.commit()
+            conn.close()
+
+        if removed:
+            logger.info(f"Change log purged: {removed} entries older than {retention_days} days")
+        return removed
+    except Exception as e:
+        logger.error(f"Error purging change log: {e}", exc_info=True)
+        return 0
+
+
+def maintain_changes() -> Dict[str, int]:
+    """Compacta y aplica la retención al log de cambios (y a las claves de idempotencia)."""
+    return {"compactados": compact_changes(), "purgados": purge_changes(),
+            "claves_idempotencia": purge_idempotency_keys()}
+
+
+# Segundos tras los que una reserva de Idempotency-Key sin respuesta se da por abandonada
+IDEMPOTENCY_STALE_SECONDS = 120
+
+
+def _init_idempotency(cursor) -> None:
+    """
+    Crea la tabla de claves de idempotencia: la respuesta de cada escritura
+    enviada con Idempotency-Key, para devolverla sin repetir la escritura si
+    el cliente la reenvía (p. ej. la cola de salida de la Hija tras un timeout).
+    """
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS idempotency_keys (
+            key TEXT PRIMARY KEY,
+            path TEXT NOT NULL,
+            status INTEGER,
+            content_type TEXT,
+            body BLOB,
+            created_at REAL NOT NULL
+        )
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_idempotency_keys_created
+        ON idempotency_keys (created_at)
+    ''')
+
+
+def claim_idempotency_key(key: str, path: str) -> Optional[Dict[str, Any]]:
+    """
+    Reserva key para una escritura sobre path.
+
+    Returns:
+        None si la clave es nueva (hay que ejecutar la escritura y después
+        save_idempotent_response o release_idempotency_key); si no, la fila
+        existente (status None mientras la primera petición sigue en curso)
+    """
+    with db_lock:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+
+        cursor.execute('''
+            INSERT OR IGNORE INTO idempotency_keys (key, path, created_at) VALUES (?, ?, ?)
+        ''', (key, path, time.time()))
+        existing = None
+        if cursor.rowcount == 0:
+            # Una reserva sin respuesta tan antigua es de un proceso que murió a medias
+            cursor.execute('''
+                UPDATE idempotency_keys SET created_at = ?
+                WHERE key = ? AND path = ? AND status IS NULL AND created_at < ?
+            ''', (time.time(), key, path, time.time() - IDEMPOTENCY_STALE_SECONDS))
+            if cursor.rowcount == 0:
+                cursor.execute('SELECT * FROM idempotency_keys WHERE key = ?', (key,))
+                existing = dict(cursor.fetchone())
+        conn.commit()
+        conn.close()
+        return existing
+
+
+def save_idempotent_response(key: str, status: int, content_type: str, body: bytes) -> None:
+    """Guarda la respuesta de la escritura que reservó key."""
+    with db_lock:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+
+        cursor.execute('''
+            UPDATE idempotency_keys SET status = ?, content_type = ?, body = ? WHERE key = ?
+        ''', (status, content_type, body, key))
+        conn.commit()
+        conn.close()
+
+
+def release_idempotency_key(key: str) -> None:
+    """Libera key si la escritura falló, para que el cliente pueda reintentarla."""
+    with db_lock:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+
+        cursor.execute('DELETE FROM idempotency_keys WHERE key = ? AND status IS NULL', (key,))
+        conn.commit()
+        conn.close()
+
+
+def purge_idempotency_keys(retention_days: int = None) -> int:
+    """Elimina las claves de idempotencia de más de retention_days (IDEMPOTENCY_RETENTION_DAYS)."""
+    retention_days = settings.IDEMPOTENCY_RETENTION_DAYS if retention_days is None else retention_days
+    try:
+        with db_lock:
+            conn = get_db_connection()
+            cursor = conn.cursor()
+            cursor.execute('DELETE FROM idempotency_keys WHERE created_at < ?',
+                           (time.time() - retention_days * 86400,))
+            removed = cursor.rowcount
+            conn.commit()
+            conn.close()
+        return removed
+    except Exception as e:
+        logger.error(f"Error purging idempotency keys: {e}", exc_info=True)
+        return 0
+
+
+def _init_archive(cursor) -> None:
+    """
+    Crea el catálogo de archivos históricos y los índices por fecha (sobre
+    las columnas enteras de EPOCH_COLUMNS) que usa el archivado, y los de
+    las consultas de historial, que se copian a cada archivo con la tabla.
+    """
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS archive_catalog (
+            period TEXT NOT NULL,
+            table_name TEXT NOT NULL,
+            rows INTEGER NOT NULL DEFAULT 0,
+            updated_at TEXT,
+            PRIMARY KEY (period, table_name)
+        )
+    ''')
+    for table, date_column in ARCHIVE_TABLES.items():
+        column = epoch_column(table, date_column)
+        cursor.execute(f'DROP INDEX IF EXISTS idx_{table}_{date_column}')
+        cursor.execute(f'''
+            CREATE INDEX IF NOT EXISTS idx_{table}_{column}
+            ON {table} ({column})
+        ''')
+    cursor.execute('DROP INDEX IF EXISTS idx_chat_messages_pair')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_chat_messages_pair_ts
+        ON chat_messages (from_user, to_user, timestamp_ts)
+    ''')
+    cursor.execute('DROP INDEX IF EXISTS idx_workout_logs_user_exercise')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_workout_logs_user_exercise_dia
+        ON workout_logs (user_id, exercise_id, fecha_dia, serie)
+    ''')
+
+
+def archive_path(period: str) -> str:
+    """Ruta del archivo histórico de un periodo ("2024" o "2024-05")."""
+    return os.path.join(ARCHIVE_DIR, f"{ARCHIVE_PREFIX}_{period}.db")
+
+
+def _period_length() -> int:
+    """Caracteres de la fecha ISO que forman el periodo: 4 (año) o 7 (mes)."""
+    return 7 if settings.ARCHIVE_PERIOD == "month" else 4
+
+
+def _ensure_archive_table(cursor, alias: str, table: str) -> None:
+    """
+    Crea (o pone al día) la tabla y sus índices en un archivo adjuntado como
+    `alias`, a partir del esquema de la base de datos principal.
+    """
+    cursor.execute(f"SELECT name FROM {alias}.sqlite_master WHERE type = 'table' AND name = ?", (table,))
+    if cursor.fetchone() is None:
+        cursor.execute("SELECT sql FROM main.sqlite_master WHERE type = 'table' AND name = ?", (table,))
+        create_sql = re.sub(r'^CREATE TABLE\s+(IF NOT EXISTS\s+)?"?\w+"?',
+                            f"CREATE TABLE {alias}.{table}", cursor.fetchone()['sql'], count=1)
+        cursor.execute(create_sql)
+    else:
+        cursor.execute(f"PRAGMA {alias}.table_info({table})")
+        existing = {row['name'] for row in cursor.fetchall()}
+        cursor.execute(f"PRAGMA main.table_info({table})")
+        for col in cursor.fetchall():
+            if col['name'] not in existing:
+                cursor.execute(f"ALTER TABLE {alias}.{table} ADD COLUMN {col['name']} {col['type']}")
+        _init_epoch_columns(cursor, alias, [table])
+
+    cursor.execute('''
+        SELECT sql FROM main.sqlite_master
+        WHERE type = 'index' AND tbl_name = ? AND sql IS NOT NULL
+    ''', (table,))
+    for row in cursor.fetchall():
+        cursor.execute(re.sub(r'^CREATE (UNIQUE )?INDEX\s+(IF NOT EXISTS\s+)?(\w+)',
+                              rf'CREATE \1INDEX IF NOT EXISTS {alias}.\3', row['sql'], count=1))
+
+
+def fetch_archivable_periods(cursor, table: str, cutoff: str) -> List[str]:
+    """Periodos con filas de `table` anteriores a cutoff (fecha ISO)."""
+    date_column = ARCHIVE_TABLES[table]
+    cursor.execute(f'''
+        SELECT DISTINCT substr({date_column}, 1, ?) AS period
+        FROM {table} WHERE {epoch_column(table, date_column)} < ? ORDER BY period
+    ''', (_period_length(), epoch_value(table, date_column, cutoff)))
+    return [row['period'] for row in cursor.fetchall()]
+
+
+def archive_batch(table: str, period: str, cutoff: str, batch_size: int = None) -> int:
+    """
+    Mueve al archivo de `period` un lote de filas de `table` anteriores a
+    cutoff, en una sola transacción: se insertan en el archivo (adjuntado con
+    ATTACH) y se borran de la base de datos principal. Los borrados quedan en
+    el log de cambios con origen ARCHIVE_ORIGIN, que la replicación no
+    propaga (cada servidor archiva lo suyo).
+
+    Returns:
+        Número de filas movidas (0 cuando no quedan)
+    """
+    if table not in ARCHIVE_TABLES:
+        raise ValueError(f"Tabla no archivable: {table}")
+
+    date_column = ARCHIVE_TABLES[table]
+    os.makedirs(ARCHIVE_DIR, exist_ok=True)
+    with db_lock:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        cursor.execute("ATTACH DATABASE ? AS archivo", (archive_path(period),))
+        try:
+            cursor.execute("BEGIN IMMEDIATE")
+            _ensure_archive_table(cursor, "archivo", table)
+
+            cursor.execute(f'''
+                SELECT id FROM main.{table}
+                WHERE {epoch_column(table, date_column)} < ? AND substr({date_column}, 1, ?) = ?
+                ORDER BY id LIMIT ?
+            ''', (epoch_value(table, date_column, cutoff), _period_length(), period,
+                  batch_size or settings.ARCHIVE_BATCH_SIZE))
+            ids = [row['id'] for row in cursor.fetchall()]
+            if not ids:
+                conn.rollback()
+                return 0
+
+            cursor.execute(f"PRAGMA main.table_info({table})")
+            columns = ", ".join(col['name'] for col in cursor.fetchall())
+            placeholders = ",".join("?" * len(ids))
+            before = fetch_latest_change_seq(cursor)
+            cursor.execute(f'''
+                INSERT OR REPLACE INTO archivo.{table} ({columns})
+                SELECT {columns} FROM main.{table} WHERE id IN ({placeholders})
+            ''', ids)
+            cursor.execute(f'DELETE FROM main.{table} WHERE id IN ({placeholders})', ids)
+            tag_changes(cursor, before, ARCHIVE_ORIGIN)
+            cursor.execute('''
+                INSERT INTO archive_catalog (period, table_name, rows, updated_at)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT (period, table_name)
+                DO UPDATE SET rows = rows + excluded.rows, updated_at = excluded.updated_at
+            ''', (period, table, len(ids), datetime.now().isoformat()))
+            conn.commit()
+            return len(ids)
+        except Exception as e:
+            conn.rollback()
+            logger.error(f"Error archiving {table} ({period}): {e}", exc_info=True)
+            raise
+        finally:
+            cursor.execute("DETACH DATABASE archivo")
+            conn.close()
+
+
+def get_archive_catalog() -> List[Dict[str, Any]]:
+    """Filas archivadas por periodo y tabla."""
+    with db_lock:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+
+        cursor.execute('SELECT * FROM archive_catalog ORDER BY period DESC, table_name')
+        rows = cursor.fetchall()
+        conn.close()
+        return [dict(row) | {"path": archive_path(row['period'])} for row in rows]
+
+
+def fetch_archived(cursor, table: str, query: str, params: tuple, limit: int) -> List[Dict[str, Any]]:
+    """
+    Ejecuta `query` (que termina en LIMIT ?) sobre los archivos históricos de
+    `table`, del periodo más reciente al más antiguo, hasta reunir `limit`
+    filas. Cada archivo se abre en solo lectura con su propia conexión: no
+    hace falta ATTACH, que no se permite dentro de la transacción que puede
+    tener abierta el cursor.
+    """
+    cursor.execute('''
+        SELECT period FROM archive_catalog
+        WHERE table_name = ? AND rows > 0 ORDER BY period DESC
+    ''', (table,))
+    periods = [row['period'] for row in cursor.fetchall()]
+
+    rows: List[Dict[str, Any]] = []
+    for period in periods:
+        if len(rows) >= limit:
+            break
+        path = archive_path(period)
+        try:
+            archive = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+        except sqlite3.OperationalError as e:
+            logger.warning(f"Archive {path} unavailable: {e}")
+            continue
+        try:
+            archive.row_factory = sqlite3.Row
+            found = archive.execute(query, (*params, limit - len(rows))).fetchall()
+            rows.extend(dict(row) for row in found)
+        except sqlite3.OperationalError as e:
+            logger.warning(f"Error reading archive {path}: {e}")
+        finally:
+            archive.close()
+    return rows
+
+
+def vacuum_database() -> None:
+    """Compacta la base de datos principal (VACUUM) tras archivar. Bloquea las escrituras mientras dura."""
+    with db_lock:
+        conn = get_db_connection()
+        try:
+            conn.execute("VACUUM")
+        finally:
+            conn.close()
+
+
+def get_db_version(scope: str) -> int:
+    """Obtiene la versión actual de un ámbito de caché."""
+    conn = get_db_connection()
+    try:
+        row = conn.execute('SELECT version FROM db_version WHERE scope = ?', (scope,)).fetchone()
+        return row['version'] if row else 0
+    finally:
+        conn.close()
+
+
+def fetch_sync_version(cursor, username: str) -> Optional[str]:
+    """
+    Obtiene la versión de los datos de sincronización del usuario con un
+    cursor ya abierto: "<versión global>.<versión del usuario>". Cambia
+    siempre que cambie la respuesta de /sincronizar_datos.
+    """
+    cursor.execute('''
+        SELECT u.sync_version,
+               (SELECT version FROM db_version WHERE scope = 'sync') AS global_version
+        FROM users u WHERE u.username = ?
+    ''', (username,))
+
+    row = cursor.fetchone()
+    if row:
+        return f"{row['global_version'] or 0}.{row['sync_version'] or 0}"
+    return None
+
+
+class VersionedCache:
+    """
+    Caché en memoria para lecturas frecuentes que rara vez cambian.
+
+    Cada proceso (worker de uvicorn, GUI) tiene su propia copia, así que en
+    lugar de invalidar localmente se consulta la versión del ámbito en
+    db_version: si otro proceso modificó las tablas, la versión habrá
+    cambiado y la caché se vacía. Se devuelven copias para que los llamadores
+    puedan modificar el resultado.
+    """
+
+    def __init__(self, scope: str):
+        self.scope = scope
+        self.hits = 0
+        self.misses = 0
+        self._version = None
+        self._entries: Dict[Any, Any] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, loader):
+        """Devuelve el valor cacheado para key o lo carga con loader()."""
+        version = get_db_version(self.scope)
+
+        with self._lock:
+            if version != self._version:
+                self._entries.clear()
+                self._version = version
+            if key in self._entries:
+                self.hits += 1
+                return copy.deepcopy(self._entries[key])
+
+        value = loader()
+
+        with self._lock:
+            self.misses += 1
+            if self._version == version:
+                self._entries[key] = value
+
+        return copy.deepcopy(value)
+
+    def clear(self):
+        """Vacía la caché local."""
+        with self._lock:
+            self._entries.clear()
+            self._version = None
+
+
+catalog_cache = VersionedCache("catalogo")
+sync_cache = VersionedCache("sync")
+
+
+def _cache_stats(attr: str):
+    def collect():
+        return {(cache.scope,): getattr(cache, attr) for cache in (catalog_cache, sync_cache)}
+    return collect
+
+
+def _cache_hit_ratio():
+    return {
+        (cache.scope,): cache.hits / (cache.hits + cache.misses) if cache.hits + cache.misses else 0.0
+        for cache in (catalog_cache, sync_cache)
+    }
+
+
+registry.gauge("madre_cache_hits", "Aciertos de las cachés de madre_db", ("cache",), _cache_stats("hits"))
+registry.gauge("madre_cache_misses", "Fallos de las cachés de madre_db", ("cache",), _cache_stats("misses"))
+registry.gauge("madre_cache_hit_ratio", "Proporción de aciertos de las cachés de madre_db", ("cache",),
+               _cache_hit_ratio)
+
+
+def _cached(cache: VersionedCache):
+    """Decorador que cachea el resultado de una lectura según sus argumentos."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            key = (func.__name__, args, tuple(sorted(kwargs.items())))
+            return cache.get(key, lambda: func(*args, **kwargs))
+        return wrapper
+    return decorator
+
+
+def rebuild_search_index() -> bool:
+    """
+    Reconstruye los índices de búsqueda a partir de messages y chat_messages.
+    Útil tras cargas masivas que desactivan los triggers.
+    """
+    if not FTS_AVAILABLE:
+        return False
+
+    with db_lock:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+
+        cursor.execute("INSERT INTO messages_fts (messages_fts) VALUES ('rebuild')")
+        cursor.execute("INSERT INTO chat_messages_fts (chat_messages_fts) VALUES ('rebuild')")
+        cursor.execute("INSERT INTO messages_fts (messages_fts) VALUES ('optimize')")
+        cursor.execute("INSERT INTO chat_messages_fts (chat_messages_fts) VALUES ('optimize')")
+
+        conn.commit()
+        conn.close()
+        logger.info("Índices de búsqueda reconstruidos")
+        return True
+
+
+def hash_password(password: str) -> str:
+    """Hash de contraseña usando SHA256."""
+    return hashlib.sha256(password.encode()).hexdigest()
+
+
+def verify_password(password: str, password_hash: str) -> bool:
+    """Verifica una contraseña contra su hash."""
+    return hash_password(password) == password_hash
+
+
+def create_user(username: str, password: str, nombre_completo: str,
+                email: str = "", telefono: str = "", equipo: str = "",
+                permiso_acceso: bool = True) -> bool:
+    """Crea un nuevo usuario en la base de datos."""
+    with db_lock:
+        try:
+            conn = get_db_connection()
+            cursor = conn.cursor()
+
+            password_hash = hash_password(password)
+            fecha_registro = datetime.now().isoformat()
+
+            cursor.execute('''
+                INSERT INTO users (username, password_hash, permiso_acceso,
+                                 nombre_completo, email, telefono, equipo, fecha_registro)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (username, password_hash, 1 if permiso_acceso else 0,
+                  nombre_completo, email, telefono, equipo, fecha_registro))
+
+            conn.commit()
+            conn.close()
+            return True
+        except sqlite3.IntegrityError:
+            return False
+
+
+def fetch_user(cursor, username: str) -> Optional[Dict[str, Any]]:
+    """Obtiene los datos de un usuario con un cursor ya abierto."""
+    cursor.execute('SELECT * FROM users WHERE username = ?', (username,))
+    row = cursor.fetchone()
+
+    if row:
+        return dict(row)
+    return None
+
+
+def get_user(username: str) -> Optional[Dict[str, Any]]:
+    """Obtiene los datos de un usuario."""
+    with db_lock:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+
+        user = fetch_user(cursor, username)
+        conn.close()
+        return user
+
+
+_json_columns_cache: Dict[str, List[str]] = {}
+
+
+def fetch_json_rows(cursor, query: str, params: tuple = (), exclude: tuple = ()) -> Tuple[int, bytes]:
+    """
+    Ejecuta query y devuelve sus filas como array JSON generado por SQLite
+    (json_group_array/json_object, en el orden de la consulta): las filas no
+    pasan por sqlite3.Row ni por dicts. La consulta no puede devolver BLOB.
+
+    Returns:
+        (número de filas, array JSON en UTF-8)
+    """
+    columns = _json_columns_cache.get(query)
+    if columns is None:
+        cursor.execute(f'SELECT * FROM ({query}) LIMIT 0', params)
+        columns = _json_columns_cache[query] = [description[0] for description in cursor.description]
+
+    pairs = ", ".join(f"'{column}', \"{column}\"" for column in columns if column not in exclude)
+    cursor.execute(f'SELECT COUNT(*), json_group_array(json_object({pairs})) FROM ({query})', params)
+    count, array = cursor.fetchone()
+    return count, array.encode("utf-8")
+
+
+def get_all_users() -> List[Dict[str, Any]]:
+    """Obtiene todos los usuarios."""
+    with db_lock:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+
+        cursor.execute('SELECT * FROM users ORDER BY username')
+        rows = cursor.fetchall()
+        conn.close()
+
+        return [dict(row) for row in rows]
+
+
+def get_users_json() -> Tuple[int, bytes]:
+    """Como get_all_users, sin password_hash y como array JSON (ver fetch_json_rows)."""
+    with db_lock:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+
+        result = fetch_json_rows(cursor, 'SELECT * FROM users ORDER BY username', exclude=('password_hash',))
+        conn.close()
+        return result
+
+
+def _user_filter(search: str) -> tuple:
+    """Cláusula WHERE y parámetros para buscar usuarios por texto."""
+    if not search:
+        return "", ()
+    pattern = f"%{search.strip()}%"
+    clause = " OR ".join(f"{column} LIKE ?" for column in USER_SEARCH_COLUMNS)
+    return f"WHERE {clause}", (pattern,) * len(USER_SEARCH_COLUMNS)
+
+
+def get_users_page(search: str = "", sort_by: str = "username", descending: bool = False,
+                   limit: int = 100, offset: int = 0) -> List[Dict[str, Any]]:
+    """
+    Obtiene una página de usuarios (sin el hash de contraseña) para las
+    tablas de la GUI, filtrada por texto y ordenada por una columna.
+
+    Args:
+        search: Texto a buscar en usuario, nombre, email o equipo
+        sort_by: Columna de USER_LIST_COLUMNS por la que ordenar
+        descending: Orden descendente
+        limit: Tamaño de la página
+        offset: Desplazamiento
+
+    Returns:
+        List[Dict[str, Any]]: Usuarios de la página
+    """
+    if sort_by not in USER_LIST_COLUMNS:
+        sort_by = "username"
+    direction = "DESC" if descending else "ASC"
+    where, params = _user_filter(search)
+
+    with db_lock:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+
+        cursor.execute(f'''
+            SELECT id, {", ".join(USER_LIST_COLUMNS)} FROM users
+            {where}
+            ORDER BY {sort_by} COLLATE NOCASE {direction}, username {direction}
+            LIMIT ? OFFSET ?
+        ''', params + (limit, offset))
+
+        rows = cursor.fetchall()
+        conn.close()
+        return [dict(row) for row in rows]
+
+
+def count_users(search: str = "") -> int:
+    """Cuenta los usuarios que coinciden con la búsqueda."""
+    where, params = _user_filter(search)
+
+    with db_lock:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+
+        cursor.execute(f'SELECT COUNT(*) as count FROM users {where}', params)
+        row = cursor.fetchone()
+        conn.close()
+        return row['count'] if row else 0
+
+
+def get_usernames(search: str = "") -> List[str]:
+    """Obtiene los nombres de usuario que coinciden con la búsqueda."""
+    where, params = _user_filter(search)
+
+    with db_lock:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+
+        cursor.execute(f'SELECT username FROM users {where} ORDER BY username', params)
+        rows = cursor.fetchall()
+        conn.close()
+        return [row['username'] for row in rows]
+
+
+def update_user_permission(username: str, permiso_acceso: bool) -> bool:
+    """Actualiza el permiso de acceso de un usuario."""
+    with db_lock:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+
+        cursor.execute('''
+            UPDATE users SET permiso_acceso = ? WHERE username = ?
+        ''', (1 if permiso_acceso else 0, username))
+
+        conn.commit()
+        success = cursor.rowcount > 0
+        conn.close()
+        return success
+
+
+def touch_user_sync(cursor, username: str) -> bool:
+    """Marca la sincronización del usuario con un cursor ya abierto (sin commit)."""
+    last_sync = datetime.now().isoformat()
+    cursor.execute('''
+        UPDATE users SET last_sync = ? WHERE username = ?
+    ''', (last_sync, username))
+    return cursor.rowcount > 0
+
+
+def update_user_sync(username: str) -> bool:
+    """Actualiza la última fecha de sincronización del usuario."""
+    with db_lock:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+
+        success = touch_user_sync(cursor, username)
+
+        conn.commit()
+        conn.close()
+        return success
+
+
+def _existing_usernames(cursor, usernames: List[str]) -> set:
+    """Devuelve cuáles de los usernames existen, en una sola consulta."""
+    cursor.execute('''
+        SELECT username FROM users WHERE username IN (SELECT value FROM json_each(?))
+    ''', (json.dumps(usernames),))
+    return {row['username'] for row in cursor.fetchall()}
+
+
+def update_users_sync_bulk(usernames: List[str]) -> Dict[str, bool]:
+    """
+    Marca la sincronización de varios usuarios en una sola transacción.
+
+    Returns:
+        Dict[str, bool]: username -> si existía y se actualizó
+    """
+    usernames = list(dict.fromkeys(usernames))
+    if not usernames:
+        return {}
+
+    last_sync = datetime.now().isoformat()
+    with db_lock:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+
+        cursor.executemany('''
+            UPDATE users SET last_sync = ? WHERE username = ?
+        ''', [(last_sync, username) for username in usernames])
+        existing = _existing_usernames(cursor, usernames)
+
+        conn.commit()
+        conn.close()
+
+    logger.info(f"Sincronización masiva: {len(existing)}/{len(usernames)} usuarios actualizados")
+    return {username: username in existing for username in usernames}
+
+
+def update_permissions_bulk(permisos: Dict[str, bool]) -> Dict[str, bool]:
+    """
+    Actualiza el permiso de acceso de varios usuarios en una sola transacción.
+
+    Args:
+        permisos: username -> nuevo permiso_acceso
+
+    Returns:
+        Dict[str, bool]: username -> si existía y se actualizó
+    """
+    if not permisos:
+        return {}
+
+    with db_lock:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+
+        cursor.executemany('''
+            UPDATE users SET permiso_acceso = ? WHERE username = ?
+        ''', [(1 if permiso else 0, username) for username, permiso in permisos.items()])
+        existing = _existing_usernames(cursor, list(permisos))
+
+        conn.commit()
+        conn.close()
+
+    logger.info(f"Permisos actualizados en bloque: {len(existing)}/{len(permisos)} usuarios")
+    return {username: username in existing for username in permisos}
+
+
+def authenticate_user(username: str, password: str) -> tuple[bool, Optional[Dict[str, Any]]]:
+    """Autentica un usuario con contraseña."""
+    user = get_user(username)
+    if not user:
+        return False, None
+
+    if verify_password(password, user['password_hash']):
+        return True, user
+    return False, None
+
+
+def fetch_user_profile_photo(cursor, user_id: int) -> Optional[str]:
+    """Obtiene la ruta de la foto de perfil con un cursor ya abierto."""
+    cursor.execute('''
+        SELECT photo_path FROM profile_photos
+        WHERE user_id = ?
+        ORDER BY upload_date DESC LIMIT 1
+    ''', (user_id,))
+
+    row = cursor.fetchone()
+    if row:
+        return row['photo_path']
+    return None
+
+
+def get_user_profile_photo(user_id: int) -> Optional[str]:
+    """Obtiene la ruta de la foto de perfil del usuario."""
+    with db_lock:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+
+        photo_path = fetch_user_profile_photo(cursor, user_id)
+        conn.close()
+        return photo_path
+
+
+def set_user_profile_photo(user_id: int, photo_path: str) -> Optional[int]:
+    """Establece la foto de perfil del usuario. Devuelve el ID del registro."""
+    with db_lock:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+
+        upload_date = datetime.now().isoformat()
+        cursor.execute('''
+            INSERT INTO profile_photos (user_id, photo_path, upload_date)
+            VALUES (?, ?, ?)
+        ''', (user_id, photo_path, upload_date))
+
+        photo_id = cursor.lastrowid
+        conn.commit()
+        conn.close()
+        return photo_id
+
+
+def get_profile_photo(photo_id: int) -> Optional[Dict[str, Any]]:
+    """Obtiene un registro de foto de perfil por ID."""
+    with db_lock:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+
+        cursor.execute('SELECT * FROM profile_photos WHERE id = ?', (photo_id,))
+
+        row = cursor.fetchone()
+        conn.close()
+
+        if row:
+            return dict(row)
+        return None
+
+
+def fetch_training_schedule(cursor, user_id: int, mes: str = None,
+                            ano: int = None) -> Optional[Dict[str, Any]]:
+    """Obtiene el cronograma de entrenamiento con un cursor ya abierto."""
+    if mes and ano:
+        cursor.execute('''
+            SELECT * FROM training_schedules
+            WHERE user_id = ? AND mes = ? AND ano = ?
+            ORDER BY modified_date DESC LIMIT 1
+        ''', (user_id, mes, ano))
+    else:
+        cursor.execute('''
+            SELECT * FROM training_schedules
+            WHERE user_id = ?
+            ORDER BY modified_date DESC LIMIT 1
+        ''', (user_id,))
+
+    row = cursor.fetchone()
+    if row:
+        schedule = dict(row)
+        schedule['schedule_data'] = json.loads(schedule['schedule_data'])
+        return schedule
+    return None
+
+
+def get_training_schedule(user_id: int, mes: str = None, ano: int = None) -> Optional[Dict[str, Any]]:
+    """Obtiene el cronograma de entrenamiento del usuario."""
+    with db_lock:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+
+        schedule = fetch_training_schedule(cursor, user_id, mes, ano)
+        conn.close()
+        return schedule
+
+
+def save_training_schedule(user_id: int, mes: str, ano: int, schedule_data: Dict) -> bool:
+    """Guarda o actualiza el cronograma de entrenamiento."""
+    with db_lock:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+
+        now = datetime.now().isoformat()
         schedule_json = json.dumps(schedule_data, ensure_ascii=False)
 
         cursor.execute('''
@@ -584,26 +2051,30 @@ def save_training_schedule(user_id: int, mes: str, ano: int, schedule_data: Dict
         return True
 
 
+def fetch_photo_gallery(cursor, user_id: int) -> List[Dict[str, Any]]:
+    """Obtiene la galería del usuario con un cursor ya abierto."""
+    cursor.execute('''
+        SELECT * FROM photo_gallery
+        WHERE user_id = ?
+        ORDER BY upload_date DESC
+    ''', (user_id,))
+
+    return [dict(row) for row in cursor.fetchall()]
+
+
 def get_photo_gallery(user_id: int) -> List[Dict[str, Any]]:
     """Obtiene todas las fotos de la galería del usuario."""
     with db_lock:
         conn = get_db_connection()
         cursor = conn.cursor()
 
-        cursor.execute('''
-            SELECT * FROM photo_gallery
-            WHERE user_id = ?
-            ORDER BY upload_date DESC
-        ''', (user_id,))
-
-        rows = cursor.fetchall()
+        gallery = fetch_photo_gallery(cursor, user_id)
         conn.close()
-
-        return [dict(row) for row in rows]
+        return gallery
 
 
-def add_photo_to_gallery(user_id: int, photo_path: str, descripcion: str = "") -> bool:
-    """Añade una foto a la galería del usuario."""
+def add_photo_to_gallery(user_id: int, photo_path: str, descripcion: str = "") -> Optional[int]:
+    """Añade una foto a la galería del usuario. Devuelve el ID de la foto."""
     with db_lock:
         conn = get_db_connection()
         cursor = conn.cursor()
@@ -614,100 +2085,277 @@ def add_photo_to_gallery(user_id: int, photo_path: str, descripcion: str = "") -
             VALUES (?, ?, ?, ?)
         ''', (user_id, photo_path, descripcion, upload_date))
 
+        photo_id = cursor.lastrowid
         conn.commit()
         conn.close()
-        return True
+        return photo_id
 
 
+def get_gallery_photo(photo_id: int) -> Optional[Dict[str, Any]]:
+    """Obtiene una foto de la galería por ID."""
+    with db_lock:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+
+        cursor.execute('SELECT * FROM photo_gallery WHERE id = ?', (photo_id,))
+
+        row = cursor.fetchone()
+        conn.close()
+
+        if row:
+            return dict(row)
+        return None
+
+
+def fetch_sync_data(cursor) -> Dict[str, Any]:
+    """Obtiene los datos de sincronización global con un cursor ya abierto."""
+    cursor.execute('''
+        SELECT contenido, metadatos_version FROM sync_data
+        ORDER BY id DESC LIMIT 1
+    ''')
+
+    row = cursor.fetchone()
+    if row:
+        return {
+            "contenido": row['contenido'],
+            "metadatos_version": row['metadatos_version']
+        }
+    return {
+        "contenido": "Contenido inicial del sistema.",
+        "metadatos_version": "1.0.0"
+    }
+
+
+@_cached(sync_cache)
 def get_sync_data() -> Dict[str, Any]:
     """Obtiene los datos de sincronización global."""
     with db_lock:
         conn = get_db_connection()
         cursor = conn.cursor()
 
+        sync_data = fetch_sync_data(cursor)
+        conn.close()
+        return sync_data
+
+
+def update_sync_data(contenido: str, version: str = None) -> bool:
+    """Actualiza los datos de sincronización global."""
+    with db_lock:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+
+        if version is None:
+            cursor.execute('SELECT metadatos_version FROM sync_data ORDER BY id DESC LIMIT 1')
+            row = cursor.fetchone()
+            if row:
+                try:
+                    parts = row['metadatos_version'].split('.')
+                    version = f"{parts[0]}.{int(parts[1]) + 1}.0"
+                except BaseException:
+                    version = "1.1.0"
+            else:
+                version = "1.0.0"
+
+        update_date = datetime.now().isoformat()
         cursor.execute('''
-            SELECT contenido, metadatos_version FROM sync_data
-            ORDER BY id DESC LIMIT 1
-        ''')
+            INSERT INTO sync_data (contenido, metadatos_version, update_date)
+            VALUES (?, ?, ?)
+        ''', (contenido, version, update_date))
+
+        conn.commit()
+        conn.close()
+        return True
 
+
+
+def send_message(from_user: str, to_user: str, subject: str, body: str,
+                 parent_message_id: Optional[int] = None) -> Optional[int]:
+    """Envía un mensaje. Retorna el ID del mensaje creado."""
+    with db_lock:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+
+        sent_date = datetime.now().isoformat()
+        thread_id = _resolve_thread(cursor, parent_message_id, subject, sent_date)
+
+        cursor.execute('''
+            INSERT INTO messages (from_user, to_user, subject, body, sent_date,
+                                  parent_message_id, thread_id)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', (from_user, to_user, subject, body, sent_date, parent_message_id, thread_id))
+
+        message_id = cursor.lastrowid
+        _touch_thread(cursor, thread_id, message_id, from_user, to_user, sent_date)
+
+        conn.commit()
+        conn.close()
+        return message_id
+
+
+def _resolve_thread(cursor, parent_message_id: Optional[int], subject: str, sent_date: str) -> int:
+    """
+    Devuelve el hilo al que pertenece un mensaje nuevo.
+    Las respuestas heredan el hilo del padre; el resto abre un hilo nuevo.
+    """
+    if parent_message_id:
+        cursor.execute('SELECT thread_id FROM messages WHERE id = ?', (parent_message_id,))
+        row = cursor.fetchone()
+        if row and row['thread_id']:
+            return row['thread_id']
+
+    cursor.execute('''
+        INSERT INTO message_threads (subject, created_date, last_activity, message_count)
+        VALUES (?, ?, ?, 0)
+    ''', (subject, sent_date, sent_date))
+    return cursor.lastrowid
+
+
+def _touch_thread(cursor, thread_id: int, message_id: int, from_user: str,
+                  to_user: str, sent_date: str) -> None:
+    """Actualiza actividad, contador y participantes de un hilo tras un mensaje nuevo."""
+    cursor.execute('''
+        UPDATE message_threads
+        SET last_activity = ?, last_message_id = ?, message_count = message_count + 1,
+            root_message_id = COALESCE(root_message_id, ?)
+        WHERE id = ?
+    ''', (sent_date, message_id, message_id, thread_id))
+
+    cursor.execute('''
+        UPDATE thread_participants SET last_activity = ? WHERE thread_id = ?
+    ''', (sent_date, thread_id))
+
+    cursor.executemany('''
+        INSERT INTO thread_participants (thread_id, username, last_activity)
+        VALUES (?, ?, ?)
+        ON CONFLICT (thread_id, username) DO UPDATE SET last_activity = excluded.last_activity
+    ''', [(thread_id, from_user, sent_date), (thread_id, to_user, sent_date)])
+
+
+def _refresh_thread(cursor, thread_id: int) -> None:
+    """Recalcula los datos de un hilo tras eliminar mensajes; lo borra si queda vacío."""
+    cursor.execute('''
+        SELECT id, sent_date FROM messages
+        WHERE thread_id = ?
+        ORDER BY sent_date_ts DESC, id DESC LIMIT 1
+    ''', (thread_id,))
+    last = cursor.fetchone()
+
+    if not last:
+        cursor.execute('DELETE FROM thread_participants WHERE thread_id = ?', (thread_id,))
+        cursor.execute('DELETE FROM message_threads WHERE id = ?', (thread_id,))
+        return
+
+    cursor.execute('''
+        UPDATE message_threads
+        SET last_activity = ?, last_message_id = ?,
+            message_count = (SELECT COUNT(*) FROM messages WHERE thread_id = ?)
+        WHERE id = ?
+    ''', (last['sent_date'], last['id'], thread_id, thread_id))
+    cursor.execute('''
+        UPDATE thread_participants SET last_activity = ? WHERE thread_id = ?
+    ''', (last['sent_date'], thread_id))
+
+
+def add_message_attachment(message_id: int, filename: str, file_path: str, file_size: int,
+                           sha256: Optional[str] = None,
+                           content_type: Optional[str] = None) -> Optional[int]:
+    """
+    Añade un adjunto a un mensaje. Retorna el ID del adjunto.
+
+    Si se indica sha256, el adjunto referencia un blob del almacén por
+    contenido y el blob queda registrado (una sola vez por hash).
+    """
+    with db_lock:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+
+        upload_date = datetime.now().isoformat()
+        if sha256:
+            cursor.execute('''
+                INSERT OR IGNORE INTO attachment_blobs (sha256, size, created_date)
+                VALUES (?, ?, ?)
+            ''', (sha256, file_size, upload_date))
+            cursor.execute('DELETE FROM attachment_gc_queue WHERE sha256 = ?', (sha256,))
+
+        cursor.execute('''
+            INSERT INTO message_attachments (message_id, filename, file_path, file_size,
+                                             upload_date, sha256, content_type)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', (message_id, filename, file_path, file_size, upload_date, sha256, content_type))
+
+        attachment_id = cursor.lastrowid
+        conn.commit()
+        conn.close()
+        return attachment_id
+
+
+def get_attachment(attachment_id: int) -> Optional[Dict[str, Any]]:
+    """Obtiene un adjunto por ID."""
+    with db_lock:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+
+        cursor.execute('SELECT * FROM message_attachments WHERE id = ?', (attachment_id,))
         row = cursor.fetchone()
         conn.close()
 
         if row:
-            return {
-                "contenido": row['contenido'],
-                "metadatos_version": row['metadatos_version']
-            }
-        return {
-            "contenido": "Contenido inicial del sistema.",
-            "metadatos_version": "1.0.0"
-        }
+            return dict(row)
+        return None
 
 
-def update_sync_data(contenido: str, version: str = None) -> bool:
-    """Actualiza los datos de sincronización global."""
+def get_attachment_gc_queue() -> List[str]:
+    """Obtiene los hashes de blobs pendientes de borrar que siguen sin referencias."""
     with db_lock:
         conn = get_db_connection()
         cursor = conn.cursor()
 
-        if version is None:
-            cursor.execute('SELECT metadatos_version FROM sync_data ORDER BY id DESC LIMIT 1')
-            row = cursor.fetchone()
-            if row:
-                try:
-                    parts = row['metadatos_version'].split('.')
-                    version = f"{parts[0]}.{int(parts[1]) + 1}.0"
-                except BaseException:
-                    version = "1.1.0"
-            else:
-                version = "1.0.0"
-
-        update_date = datetime.now().isoformat()
         cursor.execute('''
-            INSERT INTO sync_data (contenido, metadatos_version, update_date)
-            VALUES (?, ?, ?)
-        ''', (contenido, version, update_date))
-
-        conn.commit()
+            SELECT q.sha256 FROM attachment_gc_queue q
+            WHERE NOT EXISTS (SELECT 1 FROM attachment_blobs b WHERE b.sha256 = q.sha256)
+        ''')
+        rows = cursor.fetchall()
         conn.close()
-        return True
+        return [row['sha256'] for row in rows]
 
 
-
-def send_message(from_user: str, to_user: str, subject: str, body: str,
-                 parent_message_id: Optional[int] = None) -> Optional[int]:
-    """Envía un mensaje. Retorna el ID del mensaje creado."""
+def clear_attachment_gc_queue(hashes: List[str]) -> None:
+    """Retira de la cola de borrado los blobs ya eliminados del disco."""
     with db_lock:
         conn = get_db_connection()
         cursor = conn.cursor()
 
-        sent_date = datetime.now().isoformat()
-        cursor.execute('''
-            INSERT INTO messages (from_user, to_user, subject, body, sent_date, parent_message_id)
-            VALUES (?, ?, ?, ?, ?, ?)
-        ''', (from_user, to_user, subject, body, sent_date, parent_message_id))
+        cursor.executemany('DELETE FROM attachment_gc_queue WHERE sha256 = ?',
+                           [(h,) for h in hashes])
 
-        message_id = cursor.lastrowid
         conn.commit()
         conn.close()
-        return message_id
 
 
-def add_message_attachment(message_id: int, filename: str, file_path: str, file_size: int) -> bool:
-    """Añade un adjunto a un mensaje."""
+def get_attachment_blob_hashes() -> set:
+    """Obtiene el conjunto de hashes registrados en el almacén de adjuntos."""
     with db_lock:
         conn = get_db_connection()
         cursor = conn.cursor()
 
-        upload_date = datetime.now().isoformat()
-        cursor.execute('''
-            INSERT INTO message_attachments (message_id, filename, file_path, file_size, upload_date)
-            VALUES (?, ?, ?, ?, ?)
-        ''', (message_id, filename, file_path, file_size, upload_date))
-
-        conn.commit()
+        cursor.execute('SELECT sha256 FROM attachment_blobs')
+        rows = cursor.fetchall()
         conn.close()
-        return True
+        return {row['sha256'] for row in rows}
+
+
+def _user_messages_query(include_read: bool) -> str:
+    return f'''
+        SELECT * FROM messages
+        WHERE to_user = ?{"" if include_read else " AND is_read = 0"}
+        ORDER BY sent_date_ts DESC, id DESC
+    '''
+
+
+def fetch_user_messages(cursor, username: str, include_read: bool = True) -> List[Dict[str, Any]]:
+    """Obtiene los mensajes recibidos por el usuario con un cursor ya abierto."""
+    cursor.execute(_user_messages_query(include_read), (username,))
+    return [dict(row) for row in cursor.fetchall()]
 
 
 def get_user_messages(username: str, include_read: bool = True) -> List[Dict[str, Any]]:
@@ -716,22 +2364,20 @@ def get_user_messages(username: str, include_read: bool = True) -> List[Dict[str
         conn = get_db_connection()
         cursor = conn.cursor()
 
-        if include_read:
-            cursor.execute('''
-                SELECT * FROM messages
-                WHERE to_user = ?
-                ORDER BY sent_date DESC
-            ''', (username,))
-        else:
-            cursor.execute('''
-                SELECT * FROM messages
-                WHERE to_user = ? AND is_read = 0
-                ORDER BY sent_date DESC
-            ''', (username,))
+        messages = fetch_user_messages(cursor, username, include_read)
+        conn.close()
+        return messages
 
-        rows = cursor.fetchall()
+
+def get_user_messages_json(username: str, include_read: bool = True) -> Tuple[int, bytes]:
+    """Como get_user_messages, como array JSON (ver fetch_json_rows)."""
+    with db_lock:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+
+        result = fetch_json_rows(cursor, _user_messages_query(include_read), (username,))
         conn.close()
-        return [dict(row) for row in rows]
+        return result
 
 
 def get_message_by_id(message_id: int) -> Optional[Dict[str, Any]]:
@@ -766,21 +2412,72 @@ def mark_message_read(message_id: int) -> bool:
         return success
 
 
+def mark_thread_read(thread_id: int, username: str) -> int:
+    """Marca como leídos todos los mensajes de un hilo recibidos por el usuario."""
+    with db_lock:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+
+        read_date = datetime.now().isoformat()
+        cursor.execute('''
+            UPDATE messages SET is_read = 1, read_date = ?
+            WHERE thread_id = ? AND to_user = ? AND is_read = 0
+        ''', (read_date, thread_id, username))
+
+        conn.commit()
+        updated = cursor.rowcount
+        conn.close()
+        return updated
+
+
 def delete_message(message_id: int) -> bool:
     """Elimina un mensaje."""
     with db_lock:
         conn = get_db_connection()
         cursor = conn.cursor()
 
+        cursor.execute('SELECT thread_id FROM messages WHERE id = ?', (message_id,))
+        row = cursor.fetchone()
+
+        cursor.execute('''
+            SELECT DISTINCT sha256 FROM message_attachments
+            WHERE message_id = ? AND sha256 IS NOT NULL
+        ''', (message_id,))
+        hashes = [r['sha256'] for r in cursor.fetchall()]
+
         cursor.execute('DELETE FROM message_attachments WHERE message_id = ?', (message_id,))
         cursor.execute('DELETE FROM messages WHERE id = ?', (message_id,))
+        success = cursor.rowcount > 0
+
+        if hashes:
+            _release_attachment_blobs(cursor, hashes)
+
+        if success and row and row['thread_id']:
+            _refresh_thread(cursor, row['thread_id'])
 
         conn.commit()
-        success = cursor.rowcount > 0
         conn.close()
         return success
 
 
+def _release_attachment_blobs(cursor, hashes: List[str]) -> None:
+    """
+    Da de baja los blobs que ya no referencia ningún adjunto y los encola
+    para que el recolector de madre_storage borre sus ficheros.
+    """
+    queued_date = datetime.now().isoformat()
+    for sha256 in hashes:
+        cursor.execute('''
+            DELETE FROM attachment_blobs
+            WHERE sha256 = ?
+            AND NOT EXISTS (SELECT 1 FROM message_attachments WHERE sha256 = ?)
+        ''', (sha256, sha256))
+        if cursor.rowcount > 0:
+            cursor.execute('''
+                INSERT OR REPLACE INTO attachment_gc_queue (sha256, queued_date) VALUES (?, ?)
+            ''', (sha256, queued_date))
+
+
 def get_message_attachments(message_id: int) -> List[Dict[str, Any]]:
     """Obtiene los adjuntos de un mensaje."""
     with db_lock:
@@ -798,20 +2495,151 @@ def get_message_attachments(message_id: int) -> List[Dict[str, Any]]:
         return [dict(row) for row in rows]
 
 
-def count_unread_messages(username: str) -> int:
-    """Cuenta los mensajes no leídos de un usuario."""
+def fetch_user_threads(cursor, username: str, limit: int = 50, offset: int = 0) -> List[Dict[str, Any]]:
+    """Obtiene los hilos del usuario con un cursor ya abierto (ver get_user_threads)."""
+    cursor.execute('''
+        SELECT m.*, t.id AS thread_id, t.subject AS thread_subject,
+               t.message_count, t.last_activity, t.root_message_id,
+               (SELECT COUNT(*) FROM messages u
+                WHERE u.thread_id = t.id AND u.to_user = p.username AND u.is_read = 0) AS unread_count
+        FROM thread_participants p
+        JOIN message_threads t ON t.id = p.thread_id
+        JOIN messages m ON m.id = t.last_message_id
+        WHERE p.username = ?
+        ORDER BY p.last_activity_ts DESC, p.thread_id DESC
+        LIMIT ? OFFSET ?
+    ''', (username, limit, offset))
+
+    return [dict(row) for row in cursor.fetchall()]
+
+
+def get_user_threads(username: str, limit: int = 50, offset: int = 0) -> List[Dict[str, Any]]:
+    """
+    Obtiene los hilos en los que participa el usuario, ordenados por actividad.
+    Cada hilo incluye los campos de su último mensaje, el número de mensajes
+    y los no leídos por el usuario.
+    """
+    with db_lock:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+
+        threads = fetch_user_threads(cursor, username, limit, offset)
+        conn.close()
+        return threads
+
+
+def fetch_thread_count(cursor, username: str) -> int:
+    """Cuenta los hilos del usuario con un cursor ya abierto (los mismos que lista fetch_user_threads)."""
+    cursor.execute('''
+        SELECT COUNT(*) as count
+        FROM thread_participants p
+        JOIN message_threads t ON t.id = p.thread_id
+        JOIN messages m ON m.id = t.last_message_id
+        WHERE p.username = ?
+    ''', (username,))
+
+    row = cursor.fetchone()
+    return row['count'] if row else 0
+
+
+def count_user_threads(username: str) -> int:
+    """Cuenta los hilos en los que participa el usuario (para paginar get_user_threads)."""
+    with db_lock:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+
+        count = fetch_thread_count(cursor, username)
+        conn.close()
+        return count
+
+
+def get_thread(thread_id: int) -> Optional[Dict[str, Any]]:
+    """
+    Obtiene un hilo completo con todos sus mensajes y adjuntos en una sola consulta.
+
+    Returns:
+        Dict con los datos del hilo y la lista 'mensajes' (cada uno con
+        'attachments'), o None si el hilo no existe.
+    """
     with db_lock:
         conn = get_db_connection()
         cursor = conn.cursor()
 
         cursor.execute('''
-            SELECT COUNT(*) as count FROM messages
-            WHERE to_user = ? AND is_read = 0
-        ''', (username,))
+            SELECT t.subject AS thread_subject, t.created_date AS thread_created_date,
+                   t.last_activity, t.message_count, t.root_message_id,
+                   m.*,
+                   a.id AS att_id, a.filename AS att_filename, a.file_path AS att_file_path,
+                   a.file_size AS att_file_size, a.upload_date AS att_upload_date
+            FROM message_threads t
+            JOIN messages m ON m.thread_id = t.id
+            LEFT JOIN message_attachments a ON a.message_id = m.id
+            WHERE t.id = ?
+            ORDER BY m.sent_date_ts, m.id, a.upload_date
+        ''', (thread_id,))
 
-        row = cursor.fetchone()
+        rows = cursor.fetchall()
         conn.close()
-        return row['count'] if row else 0
+
+    if not rows:
+        return None
+
+    first = rows[0]
+    thread = {
+        "thread_id": thread_id,
+        "subject": first['thread_subject'],
+        "created_date": first['thread_created_date'],
+        "last_activity": first['last_activity'],
+        "message_count": first['message_count'],
+        "root_message_id": first['root_message_id'],
+        "mensajes": []
+    }
+
+    thread_columns = ('thread_subject', 'thread_created_date', 'last_activity',
+                      'message_count', 'root_message_id')
+    messages_by_id = {}
+    for row in rows:
+        message = messages_by_id.get(row['id'])
+        if message is None:
+            message = {key: row[key] for key in row.keys()
+                       if not key.startswith('att_') and key not in thread_columns}
+            message['attachments'] = []
+            messages_by_id[row['id']] = message
+            thread['mensajes'].append(message)
+
+        if row['att_id'] is not None:
+            message['attachments'].append({
+                "id": row['att_id'],
+                "message_id": row['id'],
+                "filename": row['att_filename'],
+                "file_path": row['att_file_path'],
+                "file_size": row['att_file_size'],
+                "upload_date": row['att_upload_date']
+            })
+
+    return thread
+
+
+def fetch_unread_count(cursor, username: str) -> int:
+    """Cuenta los mensajes no leídos con un cursor ya abierto."""
+    cursor.execute('''
+        SELECT COUNT(*) as count FROM messages
+        WHERE to_user = ? AND is_read = 0
+    ''', (username,))
+
+    row = cursor.fetchone()
+    return row['count'] if row else 0
+
+
+def count_unread_messages(username: str) -> int:
+    """Cuenta los mensajes no leídos de un usuario."""
+    with db_lock:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+
+        count = fetch_unread_count(cursor, username)
+        conn.close()
+        return count
 
 
 def export_message_to_txt(message_id: int, output_path: str) -> bool:
@@ -861,22 +2689,38 @@ def send_chat_message(from_user: str, to_user: str, message: str) -> Optional[in
         return chat_id
 
 
+def fetch_chat_history(cursor, user1: str, user2: str, limit: int = 50) -> List[Dict[str, Any]]:
+    """
+    Obtiene el historial de chat entre dos usuarios con un cursor ya abierto.
+    Si la base de datos principal no llega a `limit` mensajes, completa con
+    los archivados.
+    """
+    query = '''
+        SELECT * FROM chat_messages
+        WHERE (from_user = ? AND to_user = ?) OR (from_user = ? AND to_user = ?)
+        ORDER BY timestamp_ts DESC, id DESC
+        LIMIT ?
+    '''
+    params = (user1, user2, user2, user1)
+    cursor.execute(query, (*params, limit))
+    rows = [dict(row) for row in cursor.fetchall()]
+
+    if len(rows) < limit:
+        rows.extend(fetch_archived(cursor, "chat_messages", query, params, limit - len(rows)))
+        rows.sort(key=lambda row: (row['timestamp_ts'] or 0, row['id']), reverse=True)
+
+    return rows[:limit][::-1]
+
+
 def get_chat_history(user1: str, user2: str, limit: int = 50) -> List[Dict[str, Any]]:
     """Obtiene el historial de chat entre dos usuarios."""
     with db_lock:
         conn = get_db_connection()
         cursor = conn.cursor()
 
-        cursor.execute('''
-            SELECT * FROM chat_messages
-            WHERE (from_user = ? AND to_user = ?) OR (from_user = ? AND to_user = ?)
-            ORDER BY timestamp DESC
-            LIMIT ?
-        ''', (user1, user2, user2, user1, limit))
-
-        rows = cursor.fetchall()
+        history = fetch_chat_history(cursor, user1, user2, limit)
         conn.close()
-        return [dict(row) for row in reversed(rows)]
+        return history
 
 
 def mark_chat_messages_read(from_user: str, to_user: str) -> bool:
@@ -895,25 +2739,118 @@ def mark_chat_messages_read(from_user: str, to_user: str) -> bool:
         return True
 
 
+def fetch_unread_chat_count(cursor, username: str) -> int:
+    """Cuenta los mensajes de chat no leídos con un cursor ya abierto."""
+    cursor.execute('''
+        SELECT COUNT(*) as count FROM chat_messages
+        WHERE to_user = ? AND is_read = 0
+    ''', (username,))
+
+    row = cursor.fetchone()
+    return row['count'] if row else 0
+
+
 def count_unread_chat_messages(username: str) -> int:
     """Cuenta los mensajes de chat no leídos para un usuario."""
     with db_lock:
         conn = get_db_connection()
         cursor = conn.cursor()
 
-        cursor.execute('''
-            SELECT COUNT(*) as count FROM chat_messages
-            WHERE to_user = ? AND is_read = 0
-        ''', (username,))
+        count = fetch_unread_chat_count(cursor, username)
+        conn.close()
+        return count
 
-        row = cursor.fetchone()
+
+def _build_fts_query(text: str) -> str:
+    """
+    Convierte el texto libre del usuario en una expresión FTS5 segura.
+    Cada palabra se trata como término literal y la última admite prefijo.
+    """
+    terms = [t.replace('"', '') for t in text.split()]
+    terms = [t for t in terms if t]
+    if not terms:
+        return ""
+
+    quoted = [f'"{t}"' for t in terms]
+    quoted[-1] += '*'
+    return ' '.join(quoted)
+
+
+def search_messages(username: str, query: str, limit: int = 20,
+                    offset: int = 0) -> List[Dict[str, Any]]:
+    """
+    Busca en los mensajes y el chat del usuario (enviados o recibidos).
+
+    Los resultados se ordenan por relevancia (bm25) y se paginan con
+    limit/offset. Cada resultado incluye 'tipo' ('mensaje' o 'chat') y un
+    'fragmento' con los términos encontrados resaltados entre corchetes.
+    """
+    terms = _build_fts_query(query)
+    if not terms:
+        return []
+
+    with db_lock:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+
+        if FTS_AVAILABLE:
+            user_filter = f'participantes : "{username.replace(chr(34), "")}"'
+            cursor.execute('''
+                SELECT * FROM (
+                    SELECT 'mensaje' AS tipo, m.id, m.from_user, m.to_user, m.subject,
+                           snippet(messages_fts, 1, '[', ']', '...', 12) AS fragmento,
+                           m.sent_date AS fecha, bm25(messages_fts, 2.0, 1.0, 0.0) AS rank
+                    FROM messages_fts
+                    JOIN messages m ON m.id = messages_fts.rowid
+                    WHERE messages_fts MATCH ? AND (m.to_user = ? OR m.from_user = ?)
+                    UNION ALL
+                    SELECT 'chat' AS tipo, c.id, c.from_user, c.to_user, NULL AS subject,
+                           snippet(chat_messages_fts, 0, '[', ']', '...', 12) AS fragmento,
+                           c.timestamp AS fecha, bm25(chat_messages_fts, 1.0, 0.0) AS rank
+                    FROM chat_messages_fts
+                    JOIN chat_messages c ON c.id = chat_messages_fts.rowid
+                    WHERE chat_messages_fts MATCH ? AND (c.to_user = ? OR c.from_user = ?)
+                )
+                ORDER BY rank
+                LIMIT ? OFFSET ?
+            ''', (f'{user_filter} AND {{subject body}} : ({terms})', username, username,
+                  f'{user_filter} AND message : ({terms})', username, username,
+                  limit, offset))
+        else:
+            pattern = f"%{query.strip()}%"
+            cursor.execute('''
+                SELECT * FROM (
+                    SELECT 'mensaje' AS tipo, id, from_user, to_user, subject,
+                           body AS fragmento, sent_date AS fecha, 0 AS rank
+                    FROM messages
+                    WHERE (to_user = ? OR from_user = ?) AND (subject LIKE ? OR body LIKE ?)
+                    UNION ALL
+                    SELECT 'chat' AS tipo, id, from_user, to_user, NULL AS subject,
+                           message AS fragmento, timestamp AS fecha, 0 AS rank
+                    FROM chat_messages
+                    WHERE (to_user = ? OR from_user = ?) AND message LIKE ?
+                )
+                ORDER BY fecha DESC
+                LIMIT ? OFFSET ?
+            ''', (username, username, pattern, pattern, username, username, pattern,
+                  limit, offset))
+
+        rows = cursor.fetchall()
         conn.close()
-        return row['count'] if row else 0
+        return [dict(row) for row in rows]
+
 
 
+def add_madre_server(server_name: str, server_url: str, sync_token: str) -> bool:
+    """
+    Añade un servidor Madre para sincronización.
+
+    Raises:
+        ValueError: Si sync_token está vacío (sin token no puede replicar)
+    """
+    if not sync_token:
+        raise ValueError("sync_token obligatorio para registrar un servidor Madre")
 
-def add_madre_server(server_name: str, server_url: str, sync_token: str = "") -> bool:
-    """Añade un servidor Madre para sincronización."""
     with db_lock:
         try:
             conn = get_db_connection()
@@ -943,6 +2880,14 @@ def get_all_madre_servers() -> List[Dict[str, Any]]:
         return [dict(row) for row in rows]
 
 
+def list_madre_servers() -> List[Dict[str, Any]]:
+    """Servidores Madre registrados y activos, sin su sync_token (para mostrarlos)."""
+    servers = get_all_madre_servers()
+    for server in servers:
+        server.pop('sync_token', None)
+    return servers
+
+
 def update_madre_server_sync(server_name: str) -> bool:
     """Actualiza la última sincronización de un servidor Madre."""
     with db_lock:
@@ -960,6 +2905,429 @@ def update_madre_server_sync(server_name: str) -> bool:
         return success
 
 
+def get_madre_server(server_name: str) -> Optional[Dict[str, Any]]:
+    """Obtiene un servidor Madre registrado por nombre (activo o no)."""
+    with db_lock:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+
+        cursor.execute('SELECT * FROM madre_servers WHERE server_name = ?', (server_name,))
+        row = cursor.fetchone()
+        conn.close()
+        return dict(row) if row else None
+
+
+def get_replication_marks(server_name: str) -> Dict[str, int]:
+    """Última secuencia del servidor remoto aplicada en cada tabla (high-water marks)."""
+    with db_lock:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+
+        cursor.execute('''
+            SELECT table_name, last_seq FROM replication_state WHERE server_name = ?
+        ''', (server_name,))
+        marks = {row['table_name']: row['last_seq'] for row in cursor.fetchall()}
+        conn.close()
+        return marks
+
+
+def _origin_name(origin: str) -> str:
+    """Nombre de servidor de un origen del log ('local' es este servidor)."""
+    return settings.SERVER_NAME if origin == CDC_LOCAL_ORIGIN else origin
+
+
+def fetch_row_versions(cursor, table: str, row_ids: List[int]) -> Dict[int, tuple]:
+    """
+    Versión de cada fila para la resolución de conflictos: (changed_at,
+    servidor de origen) de su último cambio en el log. Las filas sin
+    cambios registrados tienen versión (0, este servidor).
+    """
+    versions = {row_id: (0.0, settings.SERVER_NAME) for row_id in row_ids}
+    if not row_ids:
+        return versions
+
+    cursor.execute(f'''
+        SELECT c.row_id, c.changed_at, c.origin FROM changes c
+        JOIN (SELECT row_id, MAX(seq) AS seq FROM changes
+              WHERE table_name = ? AND row_id IN ({','.join('?' * len(row_ids))})
+              GROUP BY row_id) last ON last.seq = c.seq
+    ''', [table, *row_ids])
+    for row in cursor.fetchall():
+        versions[row['row_id']] = (row['changed_at'], _origin_name(row['origin']))
+    return versions
+
+
+def fetch_global_ids(cursor, table: str, row_ids: List[int]) -> Dict[int, tuple]:
+    """
+    Identidad global de filas locales: (servidor de origen, id en ese
+    servidor). Las filas que no llegaron por replicación son de este servidor.
+    """
+    global_ids = {row_id: (settings.SERVER_NAME, row_id) for row_id in row_ids}
+    if not row_ids:
+        return global_ids
+
+    cursor.execute(f'''
+        SELECT row_id, origin_server, origin_id FROM row_origins
+        WHERE table_name = ? AND row_id IN ({','.join('?' * len(row_ids))})
+    ''', [table, *row_ids])
+    for row in cursor.fetchall():
+        global_ids[row['row_id']] = (row['origin_server'], row['origin_id'])
+    return global_ids
+
+
+def fetch_local_id(cursor, table: str, global_id: tuple) -> Optional[int]:
+    """Id local de una fila por su identidad global, o None si aún no se ha recibido."""
+    origin_server, origin_id = global_id
+    if origin_server == settings.SERVER_NAME:
+        return origin_id
+    cursor.execute('''
+        SELECT row_id FROM row_origins WHERE table_name = ? AND origin_server = ? AND origin_id = ?
+    ''', (table, origin_server, origin_id))
+    row = cursor.fetchone()
+    return row['row_id'] if row else None
+
+
+def _export_rows(cursor, table: str, row_ids: List[int]) -> List[Dict[str, Any]]:
+    """
+    Estado actual y versión de las filas indicadas ('D' si ya no existen),
+    con su identidad global (key) y la de las filas a las que apuntan (refs).
+    """
+    cursor.execute(f"SELECT * FROM {table} WHERE id IN ({','.join('?' * len(row_ids))})", row_ids)
+    rows = {row['id']: dict(row) for row in cursor.fetchall()}
+    versions = fetch_row_versions(cursor, table, row_ids)
+    keys = fetch_global_ids(cursor, table, row_ids)
+    references = {
+        column: fetch_global_ids(cursor, ref_table, list({row[column] for row in rows.values()
+                                                           if row[column] is not None}))
+        for column, ref_table in REPLICATED_REFERENCES.get(table, {}).items()
+    }
+
+    exported = []
+    for row_id in row_ids:
+        changed_at, origin = versions[row_id]
+        row = rows.get(row_id)
+        exported.append({
+            "row_id": row_id,
+            "key": keys[row_id],
+            "op": "U" if row is not None else "D",
+            "changed_at": changed_at,
+            "origin": origin,
+            "row": row,
+            "refs": {column: ids[row[column]] if row[column] is not None else None
+                     for column, ids in references.items()} if row is not None else {}
+        })
+    return exported
+
+
+def export_changes(table: str, after_seq: int = 0, limit: int = None,
+                   exclude_origin: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Prepara un lote de replicación de una tabla: las filas que cambiaron
+    después de after_seq, con su estado y versión actuales (una entrada por
+    fila aunque cambiara varias veces en el tramo).
+
+    Args:
+        table: Tabla de REPLICATED_TABLES
+        after_seq: High-water mark del servidor que pide el lote
+        limit: Máximo de entradas del log a recorrer (por defecto CDC_PAGE_SIZE)
+        exclude_origin: Servidor que pide el lote (no se le devuelven sus propios cambios)
+
+    Returns:
+        Dict con table, changes, last_seq, has_more y reset (ver get_changes)
+    """
+    if table not in REPLICATED_TABLES:
+        raise ValueError(f"Tabla no replicable: {table}")
+
+    limit = limit or settings.CDC_PAGE_SIZE
+    with db_lock:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        cursor.execute("BEGIN")
+        # Los borrados del archivado no se replican: cada servidor archiva lo suyo
+        excluded = [origin for origin in (exclude_origin, ARCHIVE_ORIGIN) if origin]
+        changes = fetch_changes(cursor, after_seq, limit + 1, [table], excluded)
+        cursor.execute("SELECT value FROM cdc_state WHERE key = 'purged_up_to'")
+        purged_up_to = cursor.fetchone()['value']
+        latest = fetch_latest_change_seq(cursor)
+
+        has_more = len(changes) > limit
+        changes = changes[:limit]
+        row_ids = list(dict.fromkeys(change['row_id'] for change in changes))
+        exported = _export_rows(cursor, table, row_ids) if row_ids else []
+        conn.commit()
+        conn.close()
+
+    return {
+        "table": table,
+        "changes": exported,
+        "last_seq": changes[-1]['seq'] if has_more else max(after_seq, latest),
+        "has_more": has_more,
+        "reset": after_seq < purged_up_to
+    }
+
+
+def export_snapshot(table: str, after_id: int = 0, limit: int = None) -> Dict[str, Any]:
+    """
+    Copia completa de una tabla por páginas de id (primera replicación o
+    tras un reset). last_seq es la secuencia del log al leer la página: el
+    servidor que la recibe continúa de forma incremental desde la de la
+    primera página.
+
+    Returns:
+        Dict con table, changes, last_id, last_seq y has_more
+    """
+    if table not in REPLICATED_TABLES:
+        raise ValueError(f"Tabla no replicable: {table}")
+
+    limit = limit or settings.CDC_PAGE_SIZE
+    with db_lock:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        cursor.execute("BEGIN")
+        cursor.execute(f'SELECT id FROM {table} WHERE id > ? ORDER BY id LIMIT ?', (after_id, limit + 1))
+        row_ids = [row['id'] for row in cursor.fetchall()]
+        has_more = len(row_ids) > limit
+        row_ids = row_ids[:limit]
+        latest = fetch_latest_change_seq(cursor)
+        exported = _export_rows(cursor, table, row_ids) if row_ids else []
+        conn.commit()
+        conn.close()
+
+    return {
+        "table": table,
+        "changes": exported,
+        "last_id": row_ids[-1] if row_ids else after_id,
+        "last_seq": latest,
+        "has_more": has_more
+    }
+
+
+def apply_replicated_changes(server_name: str, table: str, changes: List[Dict[str, Any]],
+                             expected_seq: Optional[int] = None,
+                             new_seq: Optional[int] = None) -> Optional[Dict[str, int]]:
+    """
+    Aplica un lote recibido de otro servidor Madre en una sola transacción.
+
+    Las filas se identifican por su identidad global (key: servidor de
+    origen e id en ese servidor), no por el id local, que cada servidor
+    asigna por su cuenta: una fila nueva de otro servidor se inserta con un
+    id local propio y su identidad queda en row_origins. Las columnas de
+    REPLICATED_REFERENCES se traducen igual; si la fila a la que apuntan aún
+    no ha llegado (el último mensaje de un hilo se replica después que el
+    hilo) quedan a NULL en pending_references y se completan al recibirla.
+
+    Conflictos: gana la versión más reciente (changed_at) y, a igualdad,
+    la del nombre de servidor mayor, de modo que todos los servidores
+    llegan al mismo resultado sea cual sea el orden en que reciben los
+    lotes. Las filas que chocan con una restricción UNIQUE local (otra fila
+    con el mismo username, por ejemplo) se omiten y se cuentan como conflicto.
+
+    Si se indica new_seq, el high-water mark de la tabla avanza en la misma
+    transacción, así que un lote interrumpido se vuelve a pedir entero. Si
+    expected_seq no coincide con el mark guardado (otro worker ya aplicó el
+    lote), no se aplica nada.
+
+    Returns:
+        Dict con aplicados, descartados y conflictos, o None si el lote ya no corresponde
+    """
+    if table not in REPLICATED_TABLES:
+        raise ValueError(f"Tabla no replicable: {table}")
+
+    with db_lock:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        try:
+            cursor.execute("BEGIN IMMEDIATE")
+            cursor.execute('''
+                SELECT last_seq FROM replication_state WHERE server_name = ? AND table_name = ?
+            ''', (server_name, table))
+            row = cursor.fetchone()
+            if expected_seq is not None and (row['last_seq'] if row else 0) != expected_seq:
+                conn.rollback()
+                return None
+
+            cursor.execute(f"PRAGMA table_info({table})")
+            columns = [col['name'] for col in cursor.fetchall() if col['name'] != 'id']
+            local_ids = {tuple(change['key']): None for change in changes}
+            for key in local_ids:
+                local_ids[key] = fetch_local_id(cursor, table, key)
+            row_ids = [row_id for row_id in local_ids.values() if row_id is not None]
+            versions = fetch_row_versions(cursor, table, row_ids)
+            current = {}
+            if row_ids:
+                cursor.execute(f"SELECT * FROM {table} WHERE id IN ({','.join('?' * len(row_ids))})", row_ids)
+                current = {row['id']: dict(row) for row in cursor.fetchall()}
+            result = {"aplicados": 0, "descartados": 0, "conflictos": 0}
+
+            for change in changes:
+                key = tuple(change['key'])
+                row_id = local_ids[key]
+                incoming = (change['changed_at'], change['origin'])
+                if (row_id is None and change['op'] == 'D') or (
+                        row_id is not None and incoming <= versions[row_id]):
+                    result["descartados"] += 1
+                    continue
+
+                values, pending = None, []
+                if change['op'] != 'D':
+                    values = {col: change['row'][col] for col in columns if col in change['row']}
+                    pending = _translate_references(cursor, table, values, change.get('refs') or {})
+                    # Sin diferencias (p. ej. servidores que partieron de la misma copia): no se reescribe
+                    if row_id is None and _adopt_identical_row(cursor, table, key, values):
+                        local_ids[key] = key[1]
+                        _resolve_pending_references(cursor, table, key, key[1])
+                        result["descartados"] += 1
+                        continue
+                    if row_id is not None and current.get(row_id) is not None and all(
+                            current[row_id].get(col) == value for col, value in values.items()):
+                        result["descartados"] += 1
+                        continue
+
+                before = fetch_latest_change_seq(cursor)
+                is_new = row_id is None
+                try:
+                    if change['op'] == 'D':
+                        cursor.execute(f'DELETE FROM {table} WHERE id = ?', (row_id,))
+                    elif is_new:
+                        cursor.execute(f'''
+                            INSERT INTO {table} ({", ".join(values)}) VALUES ({", ".join("?" * len(values))})
+                        ''', list(values.values()))
+                        row_id = cursor.lastrowid
+                        cursor.execute('''
+                            INSERT INTO row_origins (table_name, row_id, origin_server, origin_id)
+                            VALUES (?, ?, ?, ?)
+                        ''', (table, row_id, *key))
+                    else:
+                        updates = ", ".join(f"{col} = excluded.{col}" for col in values)
+                        cursor.execute(f'''
+                            INSERT INTO {table} (id, {", ".join(values)}) VALUES (?, {", ".join("?" * len(values))})
+                            ON CONFLICT (id) DO UPDATE SET {updates}
+                        ''', [row_id, *values.values()])
+                    if values is not None:
+                        _save_pending_references(cursor, table, row_id, pending)
+                        if table == 'messages':
+                            _upsert_thread_participants(cursor, values)
+                except sqlite3.IntegrityError as e:
+                    logger.warning(f"Replication conflict {table}#{key} from {server_name}: {e}")
+                    result["conflictos"] += 1
+                    continue
+
+                # El log local conserva la versión original, no la hora de aplicación
+                _keep_row_version(cursor, table, row_id, before, incoming)
+                versions[row_id] = incoming
+                local_ids[key] = row_id
+                if is_new:
+                    _resolve_pending_references(cursor, table, key, row_id)
+                result["aplicados"] += 1
+
+            if new_seq is not None:
+                cursor.execute('''
+                    INSERT INTO replication_state (server_name, table_name, last_seq, updated_at)
+                    VALUES (?, ?, ?, ?)
+                    ON CONFLICT (server_name, table_name)
+                    DO UPDATE SET last_seq = excluded.last_seq, updated_at = excluded.updated_at
+                ''', (server_name, table, new_seq, datetime.now().isoformat()))
+
+            conn.commit()
+            return result
+        except Exception as e:
+            conn.rollback()
+            logger.error(f"Error applying replication batch {table} from {server_name}: {e}", exc_info=True)
+            raise
+        finally:
+            conn.close()
+
+
+def _keep_row_version(cursor, table: str, row_id: int, after_seq: int, version: tuple) -> None:
+    """Da a los cambios de una fila registrados tras after_seq la versión (changed_at, servidor) indicada."""
+    changed_at, origin = version
+    cursor.execute('''
+        UPDATE changes SET changed_at = ?, origin = ?
+        WHERE seq > ? AND table_name = ? AND row_id = ?
+    ''', (changed_at, CDC_LOCAL_ORIGIN if origin == settings.SERVER_NAME else origin,
+          after_seq, table, row_id))
+
+
+def _translate_references(cursor, table: str, values: Dict[str, Any],
+                          refs: Dict[str, Any]) -> List[tuple]:
+    """
+    Sustituye en values las referencias de una fila replicada por los ids
+    locales. Devuelve las que aún no se pueden resolver (quedan a NULL) como
+    (columna, tabla, identidad global).
+    """
+    pending = []
+    for column, ref_table in REPLICATED_REFERENCES.get(table, {}).items():
+        if column not in values:
+            continue
+        if refs.get(column) is None:
+            values[column] = None
+            continue
+        global_id = tuple(refs[column])
+        values[column] = fetch_local_id(cursor, ref_table, global_id)
+        if values[column] is None:
+            pending.append((column, ref_table, global_id))
+    return pending
+
+
+def _save_pending_references(cursor, table: str, row_id: int, pending: List[tuple]) -> None:
+    cursor.execute('DELETE FROM pending_references WHERE table_name = ? AND row_id = ?', (table, row_id))
+    cursor.executemany('''
+        INSERT INTO pending_references (table_name, row_id, column_name, ref_table, ref_server, ref_id)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', [(table, row_id, column, ref_table, *global_id) for column, ref_table, global_id in pending])
+
+
+def _resolve_pending_references(cursor, table: str, global_id: tuple, row_id: int) -> None:
+    """Completa las referencias que esperaban a la fila global_id, recién recibida como row_id."""
+    cursor.execute('''
+        SELECT table_name, row_id, column_name FROM pending_references
+        WHERE ref_table = ? AND ref_server = ? AND ref_id = ?
+    ''', (table, *global_id))
+    waiting = cursor.fetchall()
+    for ref in waiting:
+        version = fetch_row_versions(cursor, ref['table_name'], [ref['row_id']])[ref['row_id']]
+        before = fetch_latest_change_seq(cursor)
+        cursor.execute(f"UPDATE {ref['table_name']} SET {ref['column_name']} = ? WHERE id = ?",
+                       (row_id, ref['row_id']))
+        # Completar la referencia no es una edición nueva: la fila conserva su versión
+        _keep_row_version(cursor, ref['table_name'], ref['row_id'], before, version)
+    if waiting:
+        cursor.execute('''
+            DELETE FROM pending_references WHERE ref_table = ? AND ref_server = ? AND ref_id = ?
+        ''', (table, *global_id))
+
+
+def _adopt_identical_row(cursor, table: str, global_id: tuple, values: Dict[str, Any]) -> bool:
+    """
+    Si una fila local propia tiene el mismo id que global_id en su origen y
+    los mismos datos (servidores que partieron de la misma copia), la
+    identifica con ella en vez de duplicarla.
+    """
+    cursor.execute(f'''
+        SELECT * FROM {table} WHERE id = ?
+        AND NOT EXISTS (SELECT 1 FROM row_origins WHERE table_name = ? AND row_id = ?)
+    ''', (global_id[1], table, global_id[1]))
+    row = cursor.fetchone()
+    if row is None or any(row[col] != value for col, value in values.items()):
+        return False
+    cursor.execute('''
+        INSERT INTO row_origins (table_name, row_id, origin_server, origin_id) VALUES (?, ?, ?, ?)
+    ''', (table, global_id[1], *global_id))
+    return True
+
+
+def _upsert_thread_participants(cursor, message: Dict[str, Any]) -> None:
+    """Mantiene thread_participants (derivada, no se replica) para un mensaje replicado."""
+    if not message.get('thread_id'):
+        return
+    cursor.executemany('''
+        INSERT INTO thread_participants (thread_id, username, last_activity)
+        VALUES (?, ?, ?)
+        ON CONFLICT (thread_id, username) DO UPDATE
+        SET last_activity = MAX(last_activity, excluded.last_activity)
+    ''', [(message['thread_id'], user, message.get('sent_date'))
+          for user in (message.get('from_user'), message.get('to_user')) if user])
+
 
 def create_class(nombre: str, descripcion: str, instructor: str, duracion: int,
                  capacidad_maxima: int, intensidad: str = "media", tipo: str = "grupal") -> Optional[int]:
@@ -987,6 +3355,7 @@ def create_class(nombre: str, descripcion: str, instructor: str, duracion: int,
             return None
 
 
+@_cached(catalog_cache)
 def get_all_classes(active_only: bool = True) -> List[Dict[str, Any]]:
     """Obtiene todas las clases."""
     with db_lock:
@@ -1003,6 +3372,7 @@ def get_all_classes(active_only: bool = True) -> List[Dict[str, Any]]:
         return [dict(row) for row in rows]
 
 
+@_cached(catalog_cache)
 def get_class(class_id: int) -> Optional[Dict[str, Any]]:
     """Obtiene una clase por ID."""
     with db_lock:
@@ -1045,6 +3415,7 @@ def create_class_schedule(class_id: int, instructor: str, dia_semana: str,
             return None
 
 
+@_cached(catalog_cache)
 def get_class_schedules(class_id: int = None) -> List[Dict[str, Any]]:
     """Obtiene horarios de clases."""
     with db_lock:
@@ -1079,6 +3450,7 @@ def book_class(user_id: int, schedule_id: int, fecha_clase: str) -> tuple[bool,
         try:
             conn = get_db_connection()
             cursor = conn.cursor()
+            cursor.execute('BEGIN IMMEDIATE')
 
             cursor.execute('''
                 SELECT cs.class_id, c.capacidad_maxima,
@@ -1242,9 +3614,9 @@ def get_user_bookings(user_id: int, fecha_desde: str = None) -> List[Dict[str, A
                 FROM class_bookings cb
                 JOIN class_schedules cs ON cb.schedule_id = cs.id
                 JOIN classes c ON cs.class_id = c.id
-                WHERE cb.user_id = ? AND cb.fecha_clase >= ? AND cb.status = 'confirmed'
-                ORDER BY cb.fecha_clase, cs.hora_inicio
-            ''', (user_id, fecha_desde))
+                WHERE cb.user_id = ? AND cb.fecha_clase_dia >= ? AND cb.status = 'confirmed'
+                ORDER BY cb.fecha_clase_dia, cs.hora_inicio
+            ''', (user_id, to_day(fecha_desde)))
         else:
             cursor.execute('''
                 SELECT cb.*, cs.dia_semana, cs.hora_inicio, cs.sala,
@@ -1253,7 +3625,7 @@ def get_user_bookings(user_id: int, fecha_desde: str = None) -> List[Dict[str, A
                 JOIN class_schedules cs ON cb.schedule_id = cs.id
                 JOIN classes c ON cs.class_id = c.id
                 WHERE cb.user_id = ? AND cb.status = 'confirmed'
-                ORDER BY cb.fecha_clase, cs.hora_inicio
+                ORDER BY cb.fecha_clase_dia, cs.hora_inicio
             ''', (user_id,))
 
         rows = cursor.fetchall()
@@ -1312,6 +3684,7 @@ def create_equipment_zone(nombre: str, tipo: str, descripcion: str = "",
             return None
 
 
+@_cached(catalog_cache)
 def get_all_equipment_zones(active_only: bool = True) -> List[Dict[str, Any]]:
     """Obtiene todos los equipos y zonas."""
     with db_lock:
@@ -1335,6 +3708,7 @@ def reserve_equipment(user_id: int, equipment_id: int, fecha_reserva: str,
         try:
             conn = get_db_connection()
             cursor = conn.cursor()
+            cursor.execute('BEGIN IMMEDIATE')
 
             cursor.execute('''
                 SELECT COUNT(*) as count FROM equipment_reservations
@@ -1417,23 +3791,29 @@ def log_workout(user_id: int, exercise_id: int, fecha: str, serie: int,
 
 
 def get_exercise_history(user_id: int, exercise_id: int, limit: int = 10) -> List[Dict[str, Any]]:
-    """Obtiene el historial de un ejercicio."""
+    """Obtiene el historial de un ejercicio (incluido el archivado si hace falta)."""
     with db_lock:
         conn = get_db_connection()
         cursor = conn.cursor()
 
-        cursor.execute('''
+        query = '''
             SELECT * FROM workout_logs
             WHERE user_id = ? AND exercise_id = ?
-            ORDER BY fecha DESC, serie DESC
+            ORDER BY fecha_dia DESC, serie DESC, id DESC
             LIMIT ?
-        ''', (user_id, exercise_id, limit))
+        '''
+        cursor.execute(query, (user_id, exercise_id, limit))
+        rows = [dict(row) for row in cursor.fetchall()]
+
+        if len(rows) < limit:
+            rows.extend(fetch_archived(cursor, "workout_logs", query, (user_id, exercise_id), limit - len(rows)))
+            rows.sort(key=lambda row: (row['fecha_dia'] or 0, row['serie'] or 0, row['id']), reverse=True)
 
-        rows = cursor.fetchall()
         conn.close()
-        return [dict(row) for row in rows]
+        return rows[:limit]
 
 
+@_cached(catalog_cache)
 def get_all_exercises() -> List[Dict[str, Any]]:
     """Obtiene todos los ejercicios."""
     with db_lock:
@@ -1530,13 +3910,13 @@ def get_user_notifications(user_id: int, unread_only: bool = False) -> List[Dict
             cursor.execute('''
                 SELECT * FROM notifications
                 WHERE user_id = ? AND is_read = 0
-                ORDER BY created_date DESC
+                ORDER BY created_date_ts DESC, id DESC
             ''', (user_id,))
         else:
             cursor.execute('''
                 SELECT * FROM notifications
                 WHERE user_id = ?
-                ORDER BY created_date DESC
+                ORDER BY created_date_ts DESC, id DESC
             ''', (user_id,))
 
         rows = cursor.fetchall()
@@ -1,12 +1,26 @@
+from concurrent.futures import ThreadPoolExecutor
 
 import customtkinter
 import requests
 
 import madre_db
+import madre_storage
+from madre_widgets import RESULT_POLL_MS, PagedTable
 
 customtkinter.set_appearance_mode("dark")
 customtkinter.set_default_color_theme("blue")
 
+USER_TABLE_COLUMNS = [
+    ("username", "Usuario", 140),
+    ("nombre_completo", "Nombre", 200),
+    ("equipo", "Equipo", 120),
+]
+SYNC_TABLE_COLUMNS = [
+    ("username", "Usuario", 140),
+    ("nombre_completo", "Nombre", 200),
+    ("last_sync", "Última sincronización", 180),
+]
+
 
 class UserDetailWindow(customtkinter.CTkToplevel):
     """
@@ -231,6 +245,10 @@ class Dashboard(customtkinter.CTkTabview):
         self._crear_pestaña_sync_masiva()
         self._crear_pestaña_mensajes()
 
+    def destroy(self):
+        self._executor_masivo.shutdown(wait=False)
+        super().destroy()
+
     def _crear_pestaña_usuarios(self):
         """Puebla la pestaña 'Gestión de Usuarios'."""
         tab_usuarios = self.tab("Gestión de Usuarios")
@@ -248,9 +266,19 @@ class Dashboard(customtkinter.CTkTabview):
                                           text="Habilite o deshabilite el acceso para las Aplicaciones Hijas.")
         lbl_desc.grid(row=1, column=0, padx=20, pady=(0, 10), sticky="w")
 
-        self.scrollable_frame_usuarios = customtkinter.CTkScrollableFrame(tab_usuarios, height=300)
-        self.scrollable_frame_usuarios.grid(row=2, column=0, padx=20, pady=10, sticky="nsew")
-        self.scrollable_frame_usuarios.grid_columnconfigure(0, weight=1)
+        tab_usuarios.grid_rowconfigure(2, weight=1)
+
+        self.tabla_usuarios = PagedTable(
+            tab_usuarios,
+            columns=USER_TABLE_COLUMNS,
+            fetch_page=madre_db.get_users_page,
+            count_rows=madre_db.count_users,
+            create_actions=self._crear_acciones_usuario,
+            bind_actions=self._pintar_acciones_usuario,
+            search_placeholder="Buscar por usuario, nombre, email o equipo...",
+            height=300
+        )
+        self.tabla_usuarios.grid(row=2, column=0, padx=20, pady=10, sticky="nsew")
 
         btn_actualizar = customtkinter.CTkButton(
             tab_usuarios,
@@ -258,58 +286,39 @@ class Dashboard(customtkinter.CTkTabview):
             command=self._actualizar_vista_usuarios)
         btn_actualizar.grid(row=3, column=0, padx=20, pady=10)
 
-        self._actualizar_vista_usuarios()
-
     def _actualizar_vista_usuarios(self):
         """
-        Limpia y vuelve a poblar el frame desplazable con los usuarios de madre_db.
+        Vuelve a cargar en segundo plano las filas visibles de la tabla de usuarios.
         """
-        for widget in self.scrollable_frame_usuarios.winfo_children():
-            widget.destroy()
-
-        usuarios = madre_db.get_all_users()
-
-        for i, user in enumerate(usuarios):
-            username = user['username']
-            permiso_actual = bool(user['permiso_acceso'])
-
-            user_frame = customtkinter.CTkFrame(self.scrollable_frame_usuarios)
-            user_frame.grid(row=i, column=0, padx=10, pady=5, sticky="ew")
-            user_frame.grid_columnconfigure(1, weight=1)
-
-            lbl_user = customtkinter.CTkLabel(
-                user_frame,
-                text=username,
-                font=customtkinter.CTkFont(weight="bold")
-            )
-            lbl_user.grid(row=0, column=0, padx=10, pady=5, sticky="w")
-
-            nombre_completo = user.get('nombre_completo', 'N/A')
-            equipo = user.get('equipo', 'N/A')
-            lbl_datos = customtkinter.CTkLabel(
-                user_frame,
-                text=f"{nombre_completo} - {equipo}",
-                text_color="gray"
-            )
-            lbl_datos.grid(row=0, column=1, padx=10, pady=5, sticky="w")
-
-            btn_detalles = customtkinter.CTkButton(
-                user_frame,
-                text="Ver Detalles",
-                width=100,
-                command=lambda u=username: self._ver_detalles_usuario(u)
-            )
-            btn_detalles.grid(row=0, column=2, padx=5, pady=5)
-
-            switch_permiso = customtkinter.CTkSwitch(
-                user_frame,
-                text="Acceso Habilitado",
-                command=lambda u=username: self._conmutar_permiso(u)
-            )
-            if permiso_actual:
-                switch_permiso.select()
+        self.tabla_usuarios.reload()
+
+    def _crear_acciones_usuario(self, row):
+        """Añade a una fila de la tabla el botón de detalles y el switch de permiso."""
+        row.btn_detalles = customtkinter.CTkButton(
+            row,
+            text="Ver Detalles",
+            width=100,
+            command=lambda: self._ver_detalles_usuario(row.username)
+        )
+        row.btn_detalles.grid(row=0, column=row.actions_column, padx=5, pady=5)
 
-            switch_permiso.grid(row=0, column=3, padx=10, pady=5)
+        row.switch_permiso = customtkinter.CTkSwitch(
+            row,
+            text="Acceso Habilitado",
+            command=lambda: self._conmutar_permiso(row.username)
+        )
+        row.switch_permiso.grid(row=0, column=row.actions_column + 1, padx=10, pady=5)
+
+    def _pintar_acciones_usuario(self, row, user):
+        """Sincroniza el botón y el switch de una fila con su usuario."""
+        row.username = user['username'] if user else None
+        state = "normal" if user else "disabled"
+        row.btn_detalles.configure(state=state)
+        row.switch_permiso.configure(state=state)
+        if user and user['permiso_acceso']:
+            row.switch_permiso.select()
+        else:
+            row.switch_permiso.deselect()
 
     def _ver_detalles_usuario(self, username: str):
         """
@@ -325,6 +334,10 @@ class Dashboard(customtkinter.CTkTabview):
         if user:
             nuevo_estado = not bool(user.get("permiso_acceso", False))
             madre_db.update_user_permission(username, nuevo_estado)
+            self.tabla_usuarios.patch_rows(
+                lambda row: row['username'] == username,
+                {"permiso_acceso": int(nuevo_estado)}
+            )
             print(f"Permiso para '{username}' actualizado a: {nuevo_estado}")
 
             try:
@@ -387,8 +400,24 @@ class Dashboard(customtkinter.CTkTabview):
         )
         lbl_desc.grid(row=1, column=0, padx=20, pady=5, sticky="w")
 
-        self.scrollable_frame_masiva = customtkinter.CTkScrollableFrame(tab_masiva, height=300)
-        self.scrollable_frame_masiva.grid(row=2, column=0, padx=20, pady=10, sticky="nsew")
+        tab_masiva.grid_rowconfigure(2, weight=1)
+
+        self.usuarios_seleccionados = set()
+        self.tabla_masiva = PagedTable(
+            tab_masiva,
+            columns=SYNC_TABLE_COLUMNS,
+            fetch_page=madre_db.get_users_page,
+            count_rows=madre_db.count_users,
+            create_actions=self._crear_check_usuario,
+            bind_actions=self._pintar_check_usuario,
+            search_placeholder="Buscar usuarios...",
+            height=300
+        )
+        self.tabla_masiva.grid(row=2, column=0, padx=20, pady=10, sticky="nsew")
+
+        # Las escrituras masivas van por su propio hilo: la cola de la tabla es
+        # para cargar páginas y descarta resultados si cambia la búsqueda.
+        self._executor_masivo = ThreadPoolExecutor(max_workers=1, thread_name_prefix="SyncMasiva")
 
         btn_frame = customtkinter.CTkFrame(tab_masiva, fg_color="transparent")
         btn_frame.grid(row=3, column=0, padx=20, pady=10)
@@ -407,13 +436,13 @@ class Dashboard(customtkinter.CTkTabview):
         )
         btn_deseleccionar.pack(side="left", padx=5)
 
-        btn_sincronizar = customtkinter.CTkButton(
+        self.btn_sincronizar_masiva = customtkinter.CTkButton(
             btn_frame,
             text="Sincronizar Seleccionados",
             command=self._sincronizar_usuarios_masiva,
             fg_color="green"
         )
-        btn_sincronizar.pack(side="left", padx=5)
+        self.btn_sincronizar_masiva.pack(side="left", padx=5)
 
         self.lbl_status_masiva = customtkinter.CTkLabel(
             tab_masiva,
@@ -422,43 +451,66 @@ class Dashboard(customtkinter.CTkTabview):
         )
         self.lbl_status_masiva.grid(row=4, column=0, padx=20, pady=5)
 
-        self._actualizar_lista_sync_masiva()
-
     def _actualizar_lista_sync_masiva(self):
-        """Actualiza la lista de usuarios para sincronización masiva."""
-        for widget in self.scrollable_frame_masiva.winfo_children():
-            widget.destroy()
-
-        self.checkboxes_usuarios = {}
-        usuarios = madre_db.get_all_users()
+        """Vuelve a cargar en segundo plano la lista de usuarios para sincronización masiva."""
+        self.tabla_masiva.reload()
 
-        for i, user in enumerate(usuarios):
-            username = user['username']
+    def _crear_check_usuario(self, row):
+        """Añade a una fila de la tabla masiva su casilla de selección."""
+        row.checkbox = customtkinter.CTkCheckBox(
+            row,
+            text="",
+            width=24,
+            command=lambda: self._conmutar_seleccion(row)
+        )
+        row.checkbox.grid(row=0, column=0, padx=(10, 0), pady=5)
+        for lbl in row.labels:
+            lbl.grid_configure(column=lbl.grid_info()["column"] + 1)
+
+    def _pintar_check_usuario(self, row, user):
+        """Marca la casilla de una fila si su usuario está seleccionado."""
+        row.username = user['username'] if user else None
+        row.checkbox.configure(state="normal" if user else "disabled")
+        if row.username in self.usuarios_seleccionados:
+            row.checkbox.select()
+        else:
+            row.checkbox.deselect()
 
-            checkbox = customtkinter.CTkCheckBox(
-                self.scrollable_frame_masiva,
-                text=f"{username} ({user.get('nombre_completo', 'N/A')})"
-            )
-            checkbox.grid(row=i, column=0, padx=10, pady=5, sticky="w")
+    def _conmutar_seleccion(self, row):
+        """Añade o quita de la selección el usuario de una fila."""
+        if row.username is None:
+            return
+        if row.checkbox.get():
+            self.usuarios_seleccionados.add(row.username)
+        else:
+            self.usuarios_seleccionados.discard(row.username)
+        self._mostrar_seleccion()
 
-            self.checkboxes_usuarios[username] = checkbox
+    def _mostrar_seleccion(self):
+        """Muestra cuántos usuarios hay seleccionados."""
+        self.lbl_status_masiva.configure(
+            text=f"{len(self.usuarios_seleccionados)} usuarios seleccionados",
+            text_color="gray"
+        )
 
     def _seleccionar_todos_usuarios(self):
-        """Selecciona todos los checkboxes de usuarios."""
-        for checkbox in self.checkboxes_usuarios.values():
-            checkbox.select()
+        """Selecciona todos los usuarios que cumplen la búsqueda actual (consulta en segundo plano)."""
+        def _on_done(usernames):
+            self.usuarios_seleccionados.update(usernames)
+            self.tabla_masiva.redraw()
+            self._mostrar_seleccion()
+
+        self.tabla_masiva.submit(madre_db.get_usernames, _on_done, self.tabla_masiva.search)
 
     def _deseleccionar_todos_usuarios(self):
-        """Deselecciona todos los checkboxes de usuarios."""
-        for checkbox in self.checkboxes_usuarios.values():
-            checkbox.deselect()
+        """Vacía la selección de usuarios."""
+        self.usuarios_seleccionados.clear()
+        self.tabla_masiva.redraw()
+        self._mostrar_seleccion()
 
     def _sincronizar_usuarios_masiva(self):
         """Realiza sincronización masiva de usuarios seleccionados."""
-        usuarios_seleccionados = [
-            username for username, checkbox in self.checkboxes_usuarios.items()
-            if checkbox.get()
-        ]
+        usuarios_seleccionados = sorted(self.usuarios_seleccionados)
 
         if not usuarios_seleccionados:
             self.lbl_status_masiva.configure(
@@ -467,34 +519,36 @@ class Dashboard(customtkinter.CTkTabview):
             )
             return
 
-        exitosos = 0
-        for username in usuarios_seleccionados:
-            if madre_db.update_user_sync(username):
-                exitosos += 1
+        self.btn_sincronizar_masiva.configure(state="disabled")
+        self.lbl_status_masiva.configure(text="Sincronizando...", text_color="gray")
+        future = self._executor_masivo.submit(madre_db.update_users_sync_bulk, usuarios_seleccionados)
+        self._esperar_sync_masiva(future, len(usuarios_seleccionados))
+
+    def _esperar_sync_masiva(self, future, total: int):
+        """
+        Espera en el hilo de Tk a que termine la escritura masiva. Siempre
+        informa del resultado (o del error) y vuelve a cargar la tabla.
+        """
+        if not future.done():
+            self.after(RESULT_POLL_MS, self._esperar_sync_masiva, future, total)
+            return
 
+        self.btn_sincronizar_masiva.configure(state="normal")
         try:
-            response = requests.post(
-                "http://localhost:8000/sincronizar_masiva",
-                json=usuarios_seleccionados,
-                timeout=2
+            exitosos = sum(future.result().values())
+        except Exception as e:
+            self.lbl_status_masiva.configure(
+                text=f"✗ Error en la sincronización masiva: {e}",
+                text_color="red"
             )
-            if response.status_code == 200:
-                self.lbl_status_masiva.configure(
-                    text=f"✓ Sincronización masiva exitosa: {exitosos}/{len(usuarios_seleccionados)} usuarios",
-                    text_color="green"
-                )
-            else:
-                self.lbl_status_masiva.configure(
-                    text=f"Advertencia: Actualizado localmente ({exitosos} usuarios), servidor no respondió",
-                    text_color="orange"
-                )
-        except Exception:
+            print(f"Error en sincronización masiva: {e}")
+        else:
             self.lbl_status_masiva.configure(
-                text=f"✓ Actualizado localmente: {exitosos} usuarios (servidor no disponible)",
+                text=f"✓ Sincronización masiva exitosa: {exitosos}/{total} usuarios",
                 text_color="green"
             )
-
-        print(f"Sincronización masiva: {exitosos} usuarios actualizados")
+            print(f"Sincronización masiva: {exitosos} usuarios actualizados")
+        self.tabla_masiva.reload()
 
     def _publicar_sync_data(self):
         """
@@ -553,7 +607,7 @@ class Dashboard(customtkinter.CTkTabview):
         for widget in self.scrollable_mensajes.winfo_children():
             widget.destroy()
 
-        messages = madre_db.get_user_messages("admin", include_read=True)
+        messages = madre_db.get_user_threads("admin")
         unread_count = madre_db.count_unread_messages("admin")
 
         self.lbl_unread_count.configure(text=f"📬 {unread_count} no leídos")
@@ -571,8 +625,9 @@ class Dashboard(customtkinter.CTkTabview):
             msg_frame.grid_columnconfigure(1, weight=1)
             msg_frame.pack(fill="x", padx=5, pady=5)
 
-            indicator = "●" if not msg.get('is_read') else "○"
-            color = "#2563eb" if not msg.get('is_read') else "gray"
+            unread = msg.get('unread_count', 0)
+            indicator = "●" if unread else "○"
+            color = "#2563eb" if unread else "gray"
 
             lbl_indicator = customtkinter.CTkLabel(
                 msg_frame,
@@ -587,8 +642,9 @@ class Dashboard(customtkinter.CTkTabview):
 
             lbl_from = customtkinter.CTkLabel(
                 info_frame,
-                text=f"De: {msg.get('from_user', 'Desconocido')} - {msg.get('subject', 'Sin asunto')}",
-                font=customtkinter.CTkFont(weight="bold" if not msg.get('is_read') else "normal"),
+                text=f"De: {msg.get('from_user', 'Desconocido')} - {msg.get('thread_subject') or 'Sin asunto'}"
+                     f" ({msg.get('message_count', 1)})",
+                font=customtkinter.CTkFont(weight="bold" if unread else "normal"),
                 anchor="w"
             )
             lbl_from.pack(side="left", fill="x", expand=True)
@@ -640,7 +696,10 @@ class Dashboard(customtkinter.CTkTabview):
 
     def _ver_mensaje(self, msg: dict):
         """Muestra los detalles de un mensaje en una ventana emergente."""
-        madre_db.mark_message_read(msg['id'])
+        if msg.get('thread_id'):
+            madre_db.mark_thread_read(msg['thread_id'], "admin")
+        else:
+            madre_db.mark_message_read(msg['id'])
 
         dialog = MessageDetailWindow(self, msg)
 
@@ -653,8 +712,10 @@ class Dashboard(customtkinter.CTkTabview):
 
     def _responder_mensaje(self, msg: dict):
         """Abre un diálogo para responder un mensaje."""
+        destinatario = msg.get('to_user') if msg.get('from_user') == "admin" else msg.get('from_user')
+
         dialog = customtkinter.CTkToplevel(self)
-        dialog.title(f"Responder a {msg.get('from_user', 'Desconocido')}")
+        dialog.title(f"Responder a {destinatario or 'Desconocido'}")
         dialog.geometry("600x400")
 
         content_frame = customtkinter.CTkFrame(dialog)
@@ -664,7 +725,7 @@ class Dashboard(customtkinter.CTkTabview):
 
         lbl_to = customtkinter.CTkLabel(
             content_frame,
-            text=f"Para: {msg.get('from_user', 'Desconocido')}",
+            text=f"Para: {destinatario or 'Desconocido'}",
             font=customtkinter.CTkFont(weight="bold")
         )
         lbl_to.grid(row=0, column=0, padx=10, pady=5, sticky="w")
@@ -684,7 +745,7 @@ class Dashboard(customtkinter.CTkTabview):
             text="Enviar Respuesta",
             command=lambda: self._enviar_respuesta(
                 dialog,
-                msg.get('from_user', ''),
+                destinatario or '',
                 entry_subject.get(),
                 textbox_body.get("1.0", "end-1c"),
                 msg.get('id')
@@ -720,7 +781,8 @@ class Dashboard(customtkinter.CTkTabview):
 
     def _eliminar_mensaje(self, msg: dict):
         """Elimina un mensaje."""
-        madre_db.delete_message(msg['id'])
+        if madre_db.delete_message(msg['id']):
+            madre_storage.schedule_gc()
         self._actualizar_mensajes()
 
 
@@ -0,0 +1,53 @@
+import argparse
+
+import uvicorn
+
+import madre_db
+from config.settings import get_madre_settings
+from shared.logger import setup_logger
+
+logger = setup_logger(__name__, log_file="madre_headless.log")
+
+settings = get_madre_settings()
+
+
+def iniciar_servidor(workers: int, host: str, port: int) -> None:
+    """
+    Inicia la API sin GUI con varios procesos worker de uvicorn.
+
+    El esquema ya se ha inicializado en este proceso al importar madre_db,
+    así que los workers arrancan sobre una base de datos migrada. Cada
+    worker tiene su propio db_lock y cachés; la coordinación entre
+    procesos la hacen los bloqueos de SQLite (WAL + busy_timeout) y la
+    tabla db_version. Con SIGTERM/SIGINT uvicorn deja de aceptar
+    conexiones, espera a las peticiones en curso hasta SHUTDOWN_TIMEOUT
+    y ejecuta el apagado de cada worker.
+    """
+    log_level = settings.LOG_LEVEL.lower()
+    if log_level not in ['critical', 'error', 'warning', 'info', 'debug', 'trace']:
+        log_level = 'info'
+
+    logger.info(f"Iniciando servidor headless en http://{host}:{port} con {workers} workers "
+                f"(BD: {madre_db.DB_PATH})")
+
+    uvicorn.run(
+        "madre_server:app",
+        host=host,
+        port=port,
+        workers=workers,
+        log_level=log_level,
+        timeout_graceful_shutdown=settings.SHUTDOWN_TIMEOUT
+    )
+
+    logger.info("Servidor headless detenido")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Servidor Madre sin interfaz gráfica (multi-worker)")
+    parser.add_argument("--workers", type=int, default=settings.WORKERS,
+                        help="Número de procesos worker (default: MADRE_WORKERS)")
+    parser.add_argument("--host", default=settings.HOST, help="Interfaz de escucha")
+    parser.add_argument("--port", type=int, default=settings.PORT, help="Puerto de escucha")
+    args = parser.parse_args()
+
+    iniciar_servidor(max(1, args.workers), args.host, args.port)
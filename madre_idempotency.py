@@ -0,0 +1,101 @@
+"""
+Escrituras idempotentes del servidor Madre.
+
+IdempotencyMiddleware (ASGI) atiende los POST que traen la cabecera
+Idempotency-Key (la cola de salida de la Hija la envía con cada escritura y
+sus reenvíos). La primera petición con una clave se ejecuta y, si responde
+2xx, su respuesta se guarda en idempotency_keys; las siguientes con la misma
+clave reciben esa respuesta sin volver a aplicar la escritura. Si la primera
+sigue en curso se responde 409 con Retry-After, y si falló la clave se libera
+para que el reintento se ejecute. Las claves se purgan a los
+IDEMPOTENCY_RETENTION_DAYS días (madre_db.maintain_changes).
+"""
+import asyncio
+
+from fastapi.responses import Response
+from starlette.datastructures import Headers
+
+import madre_db
+from madre_metrics import registry
+from madre_responses import FastJSONResponse
+from shared.constants import IDEMPOTENCY_HEADER
+from shared.logger import setup_logger
+
+logger = setup_logger(__name__, log_file="madre_idempotency.log")
+
+_MAX_KEY_LENGTH = 200
+
+IDEMPOTENT_REQUESTS = registry.counter(
+    "madre_idempotency_requests_total", "Escrituras con Idempotency-Key por resultado", ("result",))
+
+
+class IdempotencyMiddleware:
+    """Middleware ASGI que no repite los POST con una Idempotency-Key ya aplicada."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "POST":
+            await self.app(scope, receive, send)
+            return
+
+        key = Headers(scope=scope).get(IDEMPOTENCY_HEADER)
+        if not key:
+            await self.app(scope, receive, send)
+            return
+        if len(key) > _MAX_KEY_LENGTH:
+            response = FastJSONResponse({"detail": f"{IDEMPOTENCY_HEADER} demasiado larga"}, status_code=400)
+            await response(scope, receive, send)
+            return
+
+        path = scope["path"]
+        existing = await asyncio.to_thread(madre_db.claim_idempotency_key, key, path)
+        if existing is not None:
+            await self._respond_existing(existing, path, scope, receive, send)
+            return
+
+        status = None
+        content_type = "application/json"
+        chunks = []
+        complete = False
+
+        async def send_recording(message):
+            nonlocal status, content_type, complete
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                content_type = Headers(raw=message.get("headers", [])).get("content-type", content_type)
+            elif message["type"] == "http.response.body":
+                chunks.append(message.get("body", b""))
+                complete = not message.get("more_body", False)
+            await send(message)
+
+        saved = False
+        try:
+            await self.app(scope, receive, send_recording)
+            if status is not None and 200 <= status < 300 and complete:
+                await asyncio.to_thread(madre_db.save_idempotent_response, key, status,
+                                        content_type, b"".join(chunks))
+                saved = True
+                IDEMPOTENT_REQUESTS.inc("nueva")
+        finally:
+            if not saved:
+                await asyncio.to_thread(madre_db.release_idempotency_key, key)
+
+    @staticmethod
+    async def _respond_existing(existing: dict, path: str, scope, receive, send):
+        if existing["path"] != path:
+            IDEMPOTENT_REQUESTS.inc("reutilizada")
+            response = FastJSONResponse(
+                {"detail": f"{IDEMPOTENCY_HEADER} ya usada en otra ruta"}, status_code=422)
+        elif existing["status"] is None:
+            IDEMPOTENT_REQUESTS.inc("en_curso")
+            response = FastJSONResponse(
+                {"detail": "La misma petición sigue en curso"}, status_code=409, headers={"Retry-After": "1"})
+        else:
+            IDEMPOTENT_REQUESTS.inc("repetida")
+            logger.info(f"Replaying stored response for {IDEMPOTENCY_HEADER} on {path}")
+            response = Response(content=existing["body"], status_code=existing["status"],
+                                media_type=existing["content_type"],
+                                headers={"Idempotent-Replayed": "true"})
+        await response(scope, receive, send)
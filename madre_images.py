@@ -0,0 +1,160 @@
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, Optional, Tuple
+
+import madre_db
+from config.settings import get_madre_settings
+from shared.constants import THUMBNAIL_SIZES, THUMBNAIL_QUALITY
+from shared.logger import setup_logger
+
+logger = setup_logger(__name__, log_file="madre_images.log")
+
+settings = get_madre_settings()
+
+try:
+    from PIL import Image, ImageOps
+    PIL_AVAILABLE = True
+except ImportError:
+    PIL_AVAILABLE = False
+    logger.warning("Pillow no está instalado: no se generarán miniaturas")
+
+BASE_DIR = os.path.dirname(__file__)
+
+THUMBNAILS_DIR = settings.THUMBNAILS_DIR if os.path.isabs(
+    settings.THUMBNAILS_DIR) else os.path.join(
+        BASE_DIR,
+    settings.THUMBNAILS_DIR)
+
+PHOTO_KINDS = ("galeria", "perfil")
+
+_executor: Optional[ThreadPoolExecutor] = None
+_pending: Dict[Tuple[str, int], Future] = {}
+_pending_lock = threading.RLock()
+
+
+def thumbnail_path(kind: str, photo_id: int, size: str) -> str:
+    """Ruta en disco de una miniatura ya generada."""
+    return os.path.join(THUMBNAILS_DIR, kind, f"{photo_id}_{size}.jpg")
+
+
+def _resolve_source(photo_path: str) -> str:
+    """Resuelve la ruta de la foto original (relativa a la raíz del proyecto)."""
+    return photo_path if os.path.isabs(photo_path) else os.path.join(BASE_DIR, photo_path)
+
+
+def generate_thumbnails(kind: str, photo_id: int, photo_path: str) -> bool:
+    """
+    Genera todas las miniaturas de THUMBNAIL_SIZES para una foto.
+
+    La imagen original se decodifica una sola vez y cada tamaño se obtiene
+    reduciendo el anterior, de mayor a menor.
+
+    Returns:
+        bool: True si las miniaturas quedaron disponibles
+    """
+    if not PIL_AVAILABLE:
+        return False
+
+    source = _resolve_source(photo_path)
+    if not os.path.isfile(source):
+        logger.debug(f"Foto original no encontrada: {source}")
+        return False
+
+    os.makedirs(os.path.join(THUMBNAILS_DIR, kind), exist_ok=True)
+
+    try:
+        with Image.open(source) as original:
+            image = ImageOps.exif_transpose(original).convert("RGB")
+
+        for size, pixels in sorted(THUMBNAIL_SIZES.items(), key=lambda item: -item[1]):
+            image.thumbnail((pixels, pixels), Image.LANCZOS)
+            final_path = thumbnail_path(kind, photo_id, size)
+            tmp_path = f"{final_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            image.save(tmp_path, "JPEG", quality=THUMBNAIL_QUALITY, optimize=True)
+            os.replace(tmp_path, final_path)
+
+        return True
+
+    except Exception as e:
+        logger.error(f"Error generando miniaturas de {kind}/{photo_id}: {e}", exc_info=True)
+        return False
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    """Crea bajo demanda el pool de trabajadores de miniaturas."""
+    global _executor
+    with _pending_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=max(1, settings.THUMBNAIL_WORKERS),
+                thread_name_prefix="Thumbnail"
+            )
+        return _executor
+
+
+def submit_thumbnails(kind: str, photo_id: int, photo_path: str) -> Optional[Future]:
+    """
+    Encola la generación de miniaturas en el pool de trabajadores.
+    Si ya hay una generación en curso para la misma foto, devuelve esa.
+    """
+    if not PIL_AVAILABLE:
+        return None
+
+    executor = _get_executor()
+    key = (kind, photo_id)
+
+    with _pending_lock:
+        future = _pending.get(key)
+        if future is None:
+            future = executor.submit(generate_thumbnails, kind, photo_id, photo_path)
+            _pending[key] = future
+            future.add_done_callback(lambda _f: _discard_pending(key))
+        return future
+
+
+def _discard_pending(key: Tuple[str, int]):
+    """Olvida una generación terminada."""
+    with _pending_lock:
+        _pending.pop(key, None)
+
+
+def get_thumbnail(kind: str, photo_id: int, photo_path: str, size: str) -> Optional[str]:
+    """
+    Devuelve la ruta de la miniatura pedida, generándola si aún no existe
+    (fotos anteriores al pipeline o caché borrada).
+    """
+    path = thumbnail_path(kind, photo_id, size)
+    if os.path.isfile(path):
+        return path
+
+    future = submit_thumbnails(kind, photo_id, photo_path)
+    if future is None or not future.result():
+        return None
+
+    return path if os.path.isfile(path) else None
+
+
+def add_gallery_photo(user_id: int, photo_path: str, descripcion: str = "") -> Optional[int]:
+    """Añade una foto a la galería y programa la generación de sus miniaturas."""
+    photo_id = madre_db.add_photo_to_gallery(user_id, photo_path, descripcion)
+    if photo_id:
+        submit_thumbnails("galeria", photo_id, photo_path)
+    return photo_id
+
+
+def set_profile_photo(user_id: int, photo_path: str) -> Optional[int]:
+    """Establece la foto de perfil y programa la generación de sus miniaturas."""
+    photo_id = madre_db.set_user_profile_photo(user_id, photo_path)
+    if photo_id:
+        submit_thumbnails("perfil", photo_id, photo_path)
+    return photo_id
+
+
+def shutdown():
+    """Detiene el pool de trabajadores esperando a las tareas en curso."""
+    global _executor
+    with _pending_lock:
+        executor, _executor = _executor, None
+    if executor:
+        executor.shutdown(wait=True)
@@ -0,0 +1,298 @@
+"""
+Perfilador de consultas SQL de madre_db (opcional, QUERY_PROFILING=true).
+
+Con el perfilador activo, get_db_connection() crea conexiones cuyos cursores
+miden una muestra (QUERY_PROFILE_SAMPLE_RATE) de las sentencias ejecutadas:
+duración, filas devueltas o afectadas y, la primera vez que se ve cada
+sentencia, su EXPLAIN QUERY PLAN. Las sentencias no muestreadas solo pagan
+una comparación con random(), de modo que puede dejarse activo en
+producción. Desactivado, las conexiones son sqlite3.Connection normales.
+
+Cada proceso guarda su informe en QUERY_PROFILE_DIR/<pid>.json cada
+QUERY_PROFILE_FLUSH_INTERVAL segundos. Para ver el top-N combinado de todos
+los workers:
+
+    python madre_profiler.py --top 20 --orden max
+"""
+import argparse
+import glob
+import json
+import os
+import random
+import re
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from config.settings import get_madre_settings
+from shared.logger import setup_logger
+
+logger = setup_logger(__name__, log_file="madre_profiler.log")
+
+settings = get_madre_settings()
+
+PROFILE_DIR = settings.QUERY_PROFILE_DIR if os.path.isabs(
+    settings.QUERY_PROFILE_DIR) else os.path.join(os.path.dirname(__file__), settings.QUERY_PROFILE_DIR)
+
+ORDENES = {
+    "max": lambda stat: stat["max_ms"],
+    "total": lambda stat: stat["total_ms"],
+    "media": lambda stat: stat["mean_ms"],
+    "llamadas": lambda stat: stat["count"],
+}
+
+_SIN_PLAN = ("PRAGMA", "BEGIN", "COMMIT", "ROLLBACK", "CREATE", "DROP", "ALTER", "EXPLAIN", "ANALYZE", "VACUUM")
+
+_WHITESPACE = re.compile(r"\s+")
+
+_stats: Dict[str, Dict[str, Any]] = {}
+_stats_lock = threading.Lock()
+_flush_stop = threading.Event()
+_flush_thread: Optional[threading.Thread] = None
+
+
+def is_enabled() -> bool:
+    return settings.QUERY_PROFILING and settings.QUERY_PROFILE_SAMPLE_RATE > 0
+
+
+def _normalize(sql: str) -> str:
+    """Clave de la sentencia: SQL con los espacios colapsados."""
+    return _WHITESPACE.sub(" ", sql).strip()
+
+
+def _record(sql: str, duration: float, rows: int) -> Dict[str, Any]:
+    """Acumula una muestra y devuelve la entrada de la sentencia."""
+    key = _normalize(sql)
+    ms = duration * 1000
+    with _stats_lock:
+        stat = _stats.get(key)
+        if stat is None:
+            stat = _stats[key] = {
+                "sql": key, "count": 0, "total_ms": 0.0, "max_ms": 0.0,
+                "rows": 0, "plan": None, "last_seen": None
+            }
+        stat["count"] += 1
+        stat["total_ms"] += ms
+        stat["max_ms"] = max(stat["max_ms"], ms)
+        stat["rows"] += max(rows, 0)
+        stat["last_seen"] = datetime.now().isoformat()
+        return stat
+
+
+def _add_rows(stat: Optional[Dict[str, Any]], rows: int):
+    if stat is not None and rows:
+        with _stats_lock:
+            stat["rows"] += rows
+
+
+def _capture_plan(conn: sqlite3.Connection, stat: Dict[str, Any], sql: str, params):
+    """Guarda el EXPLAIN QUERY PLAN de la sentencia la primera vez que se muestrea."""
+    if stat["plan"] is not None or stat["sql"].upper().startswith(_SIN_PLAN):
+        return
+    try:
+        cursor = sqlite3.Connection.cursor(conn)
+        sqlite3.Cursor.execute(cursor, f"EXPLAIN QUERY PLAN {sql}", params)
+        plan = [row[-1] for row in cursor.fetchall()]
+    except sqlite3.Error as e:
+        plan = [f"(sin plan: {e})"]
+    with _stats_lock:
+        stat["plan"] = plan
+
+
+class ProfilingCursor(sqlite3.Cursor):
+    """Cursor que mide una muestra de las sentencias ejecutadas."""
+
+    _profile_stat = None
+
+    def execute(self, sql, parameters=()):
+        if random.random() >= settings.QUERY_PROFILE_SAMPLE_RATE:
+            self._profile_stat = None
+            return super().execute(sql, parameters)
+
+        start = time.perf_counter()
+        result = super().execute(sql, parameters)
+        duration = time.perf_counter() - start
+
+        stat = _record(sql, duration, self.rowcount)
+        self._profile_stat = stat
+        _capture_plan(self.connection, stat, sql, parameters)
+        return result
+
+    def executemany(self, sql, seq_of_parameters):
+        self._profile_stat = None
+        if random.random() >= settings.QUERY_PROFILE_SAMPLE_RATE:
+            return super().executemany(sql, seq_of_parameters)
+
+        start = time.perf_counter()
+        result = super().executemany(sql, seq_of_parameters)
+        _record(sql, time.perf_counter() - start, self.rowcount)
+        return result
+
+    def fetchone(self):
+        row = super().fetchone()
+        if row is not None:
+            _add_rows(self._profile_stat, 1)
+        return row
+
+    def fetchmany(self, size=None):
+        rows = super().fetchmany(size) if size is not None else super().fetchmany()
+        _add_rows(self._profile_stat, len(rows))
+        return rows
+
+    def fetchall(self):
+        rows = super().fetchall()
+        _add_rows(self._profile_stat, len(rows))
+        return rows
+
+
+class ProfilingConnection(sqlite3.Connection):
+    """Conexión cuyos cursores (y conn.execute) pasan por ProfilingCursor."""
+
+    def cursor(self, factory=ProfilingCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+
+def connection_factory() -> type:
+    """Clase de conexión a usar en sqlite3.connect según QUERY_PROFILING."""
+    return ProfilingConnection if is_enabled() else sqlite3.Connection
+
+
+def _finish(stat: Dict[str, Any]) -> Dict[str, Any]:
+    stat = dict(stat)
+    stat["mean_ms"] = stat["total_ms"] / stat["count"] if stat["count"] else 0.0
+    for field in ("total_ms", "max_ms", "mean_ms"):
+        stat[field] = round(stat[field], 3)
+    return stat
+
+
+def report(top: Optional[int] = None, orden: str = "max",
+           stats: Optional[List[Dict[str, Any]]] = None) -> List[Dict[str, Any]]:
+    """
+    Top-N de sentencias más lentas.
+
+    Args:
+        top: Número de sentencias (por defecto QUERY_PROFILE_TOP_N)
+        orden: "max", "total", "media" o "llamadas"
+        stats: Entradas a ordenar (por defecto las de este proceso)
+    """
+    if stats is None:
+        with _stats_lock:
+            stats = [dict(stat) for stat in _stats.values()]
+    key = ORDENES.get(orden, ORDENES["max"])
+    finished = [_finish(stat) for stat in stats]
+    finished.sort(key=key, reverse=True)
+    return finished[:top or settings.QUERY_PROFILE_TOP_N]
+
+
+def reset():
+    """Descarta las muestras acumuladas en este proceso."""
+    with _stats_lock:
+        _stats.clear()
+
+
+def flush() -> Optional[str]:
+    """Escribe las muestras de este proceso en QUERY_PROFILE_DIR/<pid>.json."""
+    with _stats_lock:
+        stats = [dict(stat) for stat in _stats.values()]
+    if not stats:
+        return None
+
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    path = os.path.join(PROFILE_DIR, f"{os.getpid()}.json")
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"pid": os.getpid(), "updated": datetime.now().isoformat(), "stats": stats}, f)
+    os.replace(tmp_path, path)
+    return path
+
+
+def _flush_loop():
+    while not _flush_stop.wait(settings.QUERY_PROFILE_FLUSH_INTERVAL):
+        try:
+            flush()
+        except Exception as e:
+            logger.error(f"Error guardando el perfil de consultas: {e}")
+
+
+def start():
+    """Arranca el volcado periódico a disco (solo si el perfilador está activo)."""
+    global _flush_thread
+    if not is_enabled() or (_flush_thread is not None and _flush_thread.is_alive()):
+        return
+
+    _flush_stop.clear()
+    _flush_thread = threading.Thread(target=_flush_loop, daemon=True, name="QueryProfileFlush")
+    _flush_thread.start()
+    logger.info(f"Perfilador de consultas activo (muestreo {settings.QUERY_PROFILE_SAMPLE_RATE:.0%})")
+
+
+def shutdown():
+    """Detiene el volcado periódico y guarda las últimas muestras."""
+    _flush_stop.set()
+    if is_enabled():
+        try:
+            flush()
+        except Exception as e:
+            logger.error(f"Error guardando el perfil de consultas: {e}")
+
+
+def load_reports(directory: str = PROFILE_DIR) -> List[Dict[str, Any]]:
+    """Combina por sentencia los informes guardados por todos los procesos."""
+    merged: Dict[str, Dict[str, Any]] = {}
+    for path in glob.glob(os.path.join(directory, "*.json")):
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                stats = json.load(f).get("stats", [])
+        except (OSError, ValueError) as e:
+            logger.warning(f"Informe de perfil ilegible {path}: {e}")
+            continue
+
+        for stat in stats:
+            current = merged.get(stat["sql"])
+            if current is None:
+                merged[stat["sql"]] = dict(stat)
+                continue
+            current["count"] += stat["count"]
+            current["total_ms"] += stat["total_ms"]
+            current["max_ms"] = max(current["max_ms"], stat["max_ms"])
+            current["rows"] += stat["rows"]
+            current["plan"] = current["plan"] or stat["plan"]
+            current["last_seen"] = max(current["last_seen"] or "", stat["last_seen"] or "")
+    return list(merged.values())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Muestra las consultas más lentas registradas por el perfilador")
+    parser.add_argument("--top", type=int, default=settings.QUERY_PROFILE_TOP_N, help="Número de sentencias")
+    parser.add_argument("--orden", choices=sorted(ORDENES), default="max", help="Criterio de orden")
+    parser.add_argument("--dir", default=PROFILE_DIR, help="Directorio de informes")
+    parser.add_argument("--json", action="store_true", help="Salida en JSON")
+    args = parser.parse_args()
+
+    stats = report(args.top, args.orden, load_reports(args.dir))
+    if args.json:
+        print(json.dumps(stats, indent=2, ensure_ascii=False))
+        return
+
+    if not stats:
+        print(f"Sin muestras en {args.dir} (¿QUERY_PROFILING=true?)")
+        return
+
+    for i, stat in enumerate(stats, 1):
+        print(f"{i:>3}. max {stat['max_ms']:.2f} ms | media {stat['mean_ms']:.2f} ms | "
+              f"total {stat['total_ms']:.1f} ms | {stat['count']} muestras | {stat['rows']} filas")
+        print(f"     {stat['sql'][:200]}")
+        for step in stat["plan"] or []:
+            print(f"       -> {step}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,211 @@
+"""
+Replicación incremental entre servidores Madre.
+
+Cada servidor tira (pull) de los servidores registrados en madre_servers:
+para cada tabla de madre_db.REPLICATED_TABLES pide a GET /replicacion/cambios
+del otro servidor las filas que cambiaron desde su high-water mark (la
+última secuencia del log de cambios remoto ya aplicada) y las aplica con
+madre_db.apply_replicated_changes, que resuelve los conflictos por última
+escritura y avanza el mark en la misma transacción. Si la pasada se
+interrumpe, la siguiente continúa desde el último lote confirmado.
+
+Cada servidor asigna sus propios ids, así que las filas viajan con su
+identidad global (servidor de origen e id en ese servidor) y las
+referencias entre tablas se traducen a los ids locales de quien las recibe.
+
+La primera vez (sin mark para la tabla), o si la retención del log remoto
+ya eliminó cambios pendientes (reset), se copia la tabla completa por
+páginas. Los lotes viajan en JSON comprimido con gzip.
+
+Para replicar en los dos sentidos, cada servidor registra al otro con el
+mismo sync_token (obligatorio). Cada petición lleva el nombre del servidor que la hace
+(X-Madre-Server, su MADRE_SERVER_NAME) y ese token (X-Sync-Token).
+
+    python madre_replication.py                       # una pasada contra todos
+    python madre_replication.py --servidor sede_norte
+"""
+import argparse
+import gzip
+import hmac
+import json
+import urllib.error
+import urllib.parse
+import urllib.request
+from typing import Any, Dict, Optional
+
+import madre_db
+from config.settings import get_madre_settings
+from madre_metrics import registry
+from shared.constants import ENDPOINT_REPLICACION_CAMBIOS
+from shared.logger import setup_logger
+
+logger = setup_logger(__name__, log_file="madre_replication.log")
+
+settings = get_madre_settings()
+
+REPLICATED_ROWS = registry.counter(
+    "madre_replication_rows_total", "Filas recibidas por replicación por servidor y resultado",
+    ("server", "result"))
+
+
+def encode_batch(payload: Dict[str, Any]) -> bytes:
+    """Serializa un lote de replicación en JSON comprimido con gzip."""
+    return gzip.compress(json.dumps(payload, separators=(",", ":")).encode("utf-8"), compresslevel=6)
+
+
+def decode_batch(body: bytes, content_encoding: Optional[str] = None) -> Dict[str, Any]:
+    """Deserializa un lote (comprimido o no, según Content-Encoding)."""
+    if content_encoding == "gzip":
+        body = gzip.decompress(body)
+    return json.loads(body.decode("utf-8"))
+
+
+def is_authorized(server_name: Optional[str], token: str) -> bool:
+    """Comprueba que quien pide un lote es un servidor registrado y activo con ese token."""
+    if not server_name:
+        return False
+    server = madre_db.get_madre_server(server_name)
+    if server is None or not server['is_active']:
+        return False
+    expected = server['sync_token'] or ""
+    if not expected:
+        # Sin token no hay autenticación: nunca se sirven lotes (incluyen password_hash)
+        logger.warning(f"Replication refused for {server_name}: no sync_token registered")
+        return False
+    return hmac.compare_digest(expected, token or "")
+
+
+def _fetch(server: Dict[str, Any], params: Dict[str, Any]) -> Dict[str, Any]:
+    """Pide un lote a otro servidor."""
+    url = f"{server['server_url'].rstrip('/')}{ENDPOINT_REPLICACION_CAMBIOS}?{urllib.parse.urlencode(params)}"
+    request = urllib.request.Request(url, headers={
+        "Accept-Encoding": "gzip",
+        "X-Madre-Server": settings.SERVER_NAME,
+        "X-Sync-Token": server['sync_token'] or ""
+    })
+    with urllib.request.urlopen(request, timeout=settings.REPLICATION_TIMEOUT) as response:
+        return decode_batch(response.read(), response.headers.get("Content-Encoding"))
+
+
+def _add(totals: Dict[str, int], result: Optional[Dict[str, int]], server_name: str):
+    for key, value in (result or {}).items():
+        totals[key] = totals.get(key, 0) + value
+        if value:
+            REPLICATED_ROWS.inc(server_name, key, amount=value)
+
+
+def _snapshot_table(server: Dict[str, Any], table: str) -> Dict[str, int]:
+    """Copia completa de una tabla remota; deja el mark en la secuencia remota del inicio."""
+    name = server['server_name']
+    totals = {"aplicados": 0, "descartados": 0, "conflictos": 0}
+    after_id, start_seq = 0, None
+    while True:
+        page = _fetch(server, {"tabla": table, "snapshot": "true", "desde": after_id,
+                               "limite": settings.REPLICATION_BATCH_SIZE})
+        if start_seq is None:
+            start_seq = page["last_seq"]
+        if page["changes"]:
+            _add(totals, madre_db.apply_replicated_changes(name, table, page["changes"]), name)
+        after_id = page["last_id"]
+        if not page["has_more"]:
+            break
+
+    madre_db.apply_replicated_changes(name, table, [], new_seq=start_seq)
+    logger.info(f"Copia completa de {table} desde {name}: {totals}")
+    return totals
+
+
+def pull_table(server: Dict[str, Any], table: str, mark: Optional[int]) -> Dict[str, int]:
+    """
+    Trae los cambios de una tabla desde su high-water mark, lote a lote.
+
+    Args:
+        server: Fila de madre_servers
+        table: Tabla replicada
+        mark: Última secuencia remota aplicada (None si nunca se replicó)
+
+    Returns:
+        Dict con aplicados, descartados y conflictos
+    """
+    if mark is None:
+        return _snapshot_table(server, table)
+
+    name = server['server_name']
+    totals = {"aplicados": 0, "descartados": 0, "conflictos": 0}
+    while True:
+        page = _fetch(server, {"tabla": table, "desde": mark, "limite": settings.REPLICATION_BATCH_SIZE})
+        if page["reset"]:
+            logger.warning(f"{name} purgó cambios de {table} posteriores a {mark}: copia completa")
+            return _snapshot_table(server, table)
+
+        if page["changes"] or page["last_seq"] != mark:
+            result = madre_db.apply_replicated_changes(
+                name, table, page["changes"], expected_seq=mark, new_seq=page["last_seq"])
+            if result is None:
+                logger.info(f"Lote de {table} desde {name} ya aplicado por otro proceso")
+                return totals
+            _add(totals, result, name)
+
+        mark = page["last_seq"]
+        if not page["has_more"]:
+            return totals
+
+
+def pull_from(server: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Replica todas las tablas desde un servidor. Un error en una tabla
+    detiene la pasada (lo ya aplicado queda confirmado).
+
+    Returns:
+        Dict con status y el resultado por tabla
+    """
+    name = server['server_name']
+    marks = madre_db.get_replication_marks(name)
+    tablas = {}
+    try:
+        for table in madre_db.REPLICATED_TABLES:
+            tablas[table] = pull_table(server, table, marks.get(table))
+    except (urllib.error.URLError, OSError, ValueError) as e:
+        logger.error(f"Error replicando desde {name}: {e}")
+        return {"status": "error", "error": str(e), "tablas": tablas}
+
+    madre_db.update_madre_server_sync(name)
+    aplicados = sum(result["aplicados"] for result in tablas.values())
+    if aplicados:
+        logger.info(f"Replicación desde {name}: {aplicados} filas aplicadas")
+    return {"status": "ok", "tablas": tablas}
+
+
+def replicate_all(server_name: Optional[str] = None) -> Dict[str, Any]:
+    """Una pasada de replicación contra todos los servidores activos (o solo server_name)."""
+    servers = madre_db.get_all_madre_servers()
+    if server_name is not None:
+        servers = [server for server in servers if server['server_name'] == server_name]
+    return {server['server_name']: pull_from(server) for server in servers
+            if server['server_name'] != settings.SERVER_NAME}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replica los cambios de otros servidores Madre")
+    parser.add_argument("--servidor", help="Replicar solo desde este servidor registrado")
+    args = parser.parse_args()
+
+    resultados = replicate_all(args.servidor)
+    if not resultados:
+        print("No hay servidores Madre registrados para replicar")
+        return
+
+    for name, resultado in resultados.items():
+        if resultado["status"] != "ok":
+            print(f"{name}: error - {resultado['error']}")
+            continue
+        totales = {"aplicados": 0, "descartados": 0, "conflictos": 0}
+        for result in resultado["tablas"].values():
+            for key in totales:
+                totales[key] += result[key]
+        print(f"{name}: {totales['aplicados']} aplicados, {totales['descartados']} descartados, "
+              f"{totales['conflictos']} conflictos")
+
+
+if __name__ == "__main__":
+    main()
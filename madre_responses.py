@@ -0,0 +1,96 @@
+"""
+Serialización de las respuestas de la API Madre.
+
+  - FastJSONResponse: clase de respuesta por defecto de la app. Serializa
+    con orjson si está instalado (varias veces más rápido que json) y, si
+    no, con json igual que JSONResponse.
+  - json_array_response: respuesta JSON cuya lista ya viene serializada por
+    SQLite (madre_db.fetch_json_rows); se inserta tal cual en el sobre, sin
+    dicts intermedios ni jsonable_encoder.
+  - MessagePack: si el cliente lo pide en Accept (application/msgpack) y
+    está instalado el paquete msgpack, respond() lo usa en lugar de JSON.
+"""
+import json
+from typing import Any, Dict
+
+from fastapi import Request
+from fastapi.responses import JSONResponse, Response
+
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+try:
+    import msgpack
+    MSGPACK_AVAILABLE = True
+except ImportError:
+    MSGPACK_AVAILABLE = False
+
+MSGPACK_MEDIA_TYPE = "application/msgpack"
+_MSGPACK_MEDIA_TYPES = (MSGPACK_MEDIA_TYPE, "application/x-msgpack", "application/vnd.msgpack")
+
+
+def dumps(content: Any) -> bytes:
+    """Serializa a JSON compacto en UTF-8 (orjson si está disponible)."""
+    if ORJSON_AVAILABLE:
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode("utf-8")
+
+
+class FastJSONResponse(JSONResponse):
+    """JSONResponse serializada con orjson (o json si no está instalado)."""
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+class MessagePackResponse(Response):
+    """Respuesta en MessagePack (requiere el paquete msgpack)."""
+
+    media_type = MSGPACK_MEDIA_TYPE
+
+    def render(self, content: Any) -> bytes:
+        return msgpack.packb(content, use_bin_type=True)
+
+
+def wants_msgpack(request: Request) -> bool:
+    """True si el Accept de la petición prefiere MessagePack a JSON y msgpack está instalado."""
+    if not MSGPACK_AVAILABLE:
+        return False
+    msgpack_q = json_q = 0.0
+    for part in request.headers.get("accept", "").lower().split(","):
+        media_type, _, params = part.partition(";")
+        media_type = media_type.strip()
+        q = 1.0
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if media_type in _MSGPACK_MEDIA_TYPES:
+            msgpack_q = max(msgpack_q, q)
+        elif media_type in ("application/json", "application/*", "*/*"):
+            json_q = max(json_q, q)
+    return msgpack_q > 0 and msgpack_q >= json_q
+
+
+def respond(request: Request, content: Any) -> Response:
+    """Respuesta en MessagePack si el cliente la prefiere; si no, JSON rápido."""
+    if wants_msgpack(request):
+        return MessagePackResponse(content)
+    return FastJSONResponse(content)
+
+
+def json_array_response(envelope: Dict[str, Any], key: str, array: bytes) -> Response:
+    """
+    Respuesta JSON {**envelope, key: array} donde array es un array JSON ya
+    serializado (p. ej. por madre_db.fetch_json_rows); la lista va al final.
+    """
+    head = dumps(envelope)[:-1]
+    separator = b"," if envelope else b""
+    body = b"".join((head, separator, dumps(key), b":", array, b"}"))
+    return Response(content=body, media_type="application/json")
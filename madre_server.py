@@ -1,19 +1,152 @@
 
-from fastapi import FastAPI, Query, HTTPException
+import asyncio
+import os
+import sqlite3
+import time
+from contextlib import asynccontextmanager
+
+from fastapi import FastAPI, Query, HTTPException, Request
+from fastapi.responses import FileResponse, Response
 from pydantic import BaseModel, Field
 from typing import Optional
 from datetime import datetime
 
+import madre_admission
+import madre_archive
+import madre_backup
+import madre_compression
 import madre_db
+import madre_idempotency
+import madre_images
+import madre_metrics
+import madre_profiler
+import madre_replication
+import madre_responses
+import madre_storage
+import madre_tasks
+from config.settings import get_madre_settings
 from shared.logger import setup_logger
-from shared.constants import APP_VERSION, APP_FEATURES, SYNC_REQUIRED_HOURS
+from shared.constants import (
+    APP_VERSION, APP_FEATURES, SYNC_REQUIRED_HOURS, THUMBNAIL_SIZES, BATCH_MAX_REQUESTS,
+    REPLICATION_MIN_TOKEN_LENGTH
+)
 
 logger = setup_logger(__name__, log_file="madre_server.log")
 
-app = FastAPI(title="API del Sistema de Gestión del Gimnasio", version=APP_VERSION)
+settings = get_madre_settings()
+
+
+async def _mantener_log_cambios():
+    """Compacta y purga periódicamente el log de cambios (CDC), en un solo worker."""
+    while True:
+        await asyncio.sleep(settings.CDC_MAINTENANCE_INTERVAL)
+        try:
+            await asyncio.to_thread(madre_tasks.run_if_due, "cdc", settings.CDC_MAINTENANCE_INTERVAL,
+                                    madre_db.maintain_changes)
+        except Exception as e:
+            logger.error(f"Error en el mantenimiento del log de cambios: {e}", exc_info=True)
+
+
+async def _replicar_periodicamente():
+    """Replica desde los servidores Madre registrados cada REPLICATION_INTERVAL segundos, en un solo worker."""
+    while True:
+        await asyncio.sleep(settings.REPLICATION_INTERVAL)
+        try:
+            await asyncio.to_thread(madre_tasks.run_if_due, "replicacion", settings.REPLICATION_INTERVAL,
+                                    madre_replication.replicate_all)
+        except Exception as e:
+            logger.error(f"Error en la replicación periódica: {e}", exc_info=True)
+
+
+async def _backup_periodico():
+    """Crea una copia de seguridad cuando la última tiene más de BACKUP_INTERVAL segundos."""
+    while True:
+        await asyncio.sleep(min(settings.BACKUP_INTERVAL, 600))
+        try:
+            await asyncio.to_thread(madre_backup.backup_if_due)
+        except Exception as e:
+            logger.error(f"Error en la copia de seguridad programada: {e}", exc_info=True)
+
+
+async def _archivar_periodicamente():
+    """Archiva las filas anteriores a ARCHIVE_HORIZON_DAYS cada ARCHIVE_INTERVAL segundos, en un solo worker."""
+    while True:
+        await asyncio.sleep(settings.ARCHIVE_INTERVAL)
+        try:
+            await asyncio.to_thread(madre_tasks.run_if_due, "archivado", settings.ARCHIVE_INTERVAL,
+                                    madre_archive.archive_old_rows)
+        except Exception as e:
+            logger.error(f"Error en el archivado periódico: {e}", exc_info=True)
+
+
+@asynccontextmanager
+async def lifespan(_app: FastAPI):
+    """
+    Ciclo de vida de cada worker. Al apagarse (SIGTERM/SIGINT, tras
+    terminar las peticiones en curso) detiene los trabajos en segundo plano.
+    """
+    logger.info(f"Worker iniciado (PID {os.getpid()})")
+    madre_profiler.start()
+    tareas = []
+    if settings.CDC_MAINTENANCE_INTERVAL > 0:
+        tareas.append(asyncio.create_task(_mantener_log_cambios()))
+    if settings.REPLICATION_INTERVAL > 0:
+        tareas.append(asyncio.create_task(_replicar_periodicamente()))
+    if settings.BACKUP_INTERVAL > 0:
+        tareas.append(asyncio.create_task(_backup_periodico()))
+    if settings.ARCHIVE_INTERVAL > 0 and settings.ARCHIVE_HORIZON_DAYS > 0:
+        tareas.append(asyncio.create_task(_archivar_periodicamente()))
+    yield
+    logger.info(f"Deteniendo worker (PID {os.getpid()})...")
+    for tarea in tareas:
+        tarea.cancel()
+    madre_profiler.shutdown()
+    madre_storage.shutdown()
+    madre_images.shutdown()
+
+
+app = FastAPI(title="API del Sistema de Gestión del Gimnasio", version=APP_VERSION, lifespan=lifespan,
+              default_response_class=madre_responses.FastJSONResponse)
+# Por dentro de la compresión: se guarda el cuerpo sin comprimir
+app.add_middleware(madre_idempotency.IdempotencyMiddleware)
+app.add_middleware(madre_compression.CompressionMiddleware)
+# Control de admisión por prioridades (429 + Retry-After); por fuera de la compresión
+admission = madre_admission.AdmissionController()
+app.add_middleware(madre_admission.AdmissionMiddleware, controller=admission)
 
 logger.info(f"FastAPI application initialized - Version {APP_VERSION}")
 
+REQUEST_SECONDS = madre_metrics.registry.histogram(
+    "madre_http_request_duration_seconds", "Latencia de las peticiones HTTP por ruta",
+    ("method", "route", "status"))
+REQUESTS_IN_FLIGHT = madre_metrics.registry.gauge(
+    "madre_http_requests_in_flight", "Peticiones HTTP en curso", ("method",))
+
+# Respuestas de catálogo ya serializadas y comprimidas; se vacía cuando cambia el catálogo
+catalog_responses = madre_compression.PrecompressedCache(lambda: madre_db.get_db_version("catalogo"))
+
+
+@app.middleware("http")
+async def medir_peticiones(request: Request, call_next):
+    """
+    Mide la latencia de cada petición y las peticiones en curso. La ruta se
+    etiqueta con su plantilla (/obtener_hilo/{thread_id}) para no crear una
+    serie por cada id.
+    """
+    method = request.method
+    REQUESTS_IN_FLIGHT.inc(method)
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        route = request.scope.get("route")
+        route_path = route.path if route is not None else "sin_ruta"
+        REQUEST_SECONDS.observe(time.perf_counter() - start, method, route_path, str(status))
+        REQUESTS_IN_FLIGHT.dec(method)
+
 try:
     from madre_server_extended_api import get_extended_api_router
     from madre_server_extended_api2 import get_extended_api_router2
@@ -80,30 +213,9 @@ async def autorizar_usuario(auth_request: AuthRequest):
     }
 
 
-@app.get("/validar_sync", summary="Valida si el usuario necesita sincronizar")
-async def validar_sync(
-    usuario: str = Query(..., description="Nombre de usuario")
-):
-    """
-    Valida si el usuario ha sincronizado en las últimas horas configuradas.
-    Si no, debe bloquearse el acceso en la app Hija.
-
-    Args:
-        usuario: Nombre de usuario a validar
-
-    Returns:
-        Dict con requiere_sync, bloqueado, mensaje, horas_desde_sync
-
-    Raises:
-        HTTPException: 404 si usuario no encontrado
-    """
-    logger.debug(f"Validando estado de sincronización para usuario: {usuario}")
-
-    user = madre_db.get_user(usuario)
-    if not user:
-        logger.warning(f"Usuario no encontrado en validación de sync: {usuario}")
-        raise HTTPException(status_code=404, detail="Usuario no encontrado.")
-
+def _evaluar_sync(user: dict) -> dict:
+    """Calcula el estado de sincronización de un usuario ya resuelto."""
+    usuario = user['username']
     last_sync_str = user.get('last_sync')
     if not last_sync_str:
         logger.info(f"Primera sincronización requerida para: {usuario}")
@@ -114,9 +226,7 @@ async def validar_sync(
         }
 
     try:
-        last_sync = datetime.fromisoformat(last_sync_str)
-        tiempo_desde_sync = datetime.now() - last_sync
-        horas_desde_sync = tiempo_desde_sync.total_seconds() / 3600
+        horas_desde_sync = (madre_db.to_epoch(datetime.now()) - user['last_sync_ts']) / 3600
 
         if horas_desde_sync > SYNC_REQUIRED_HOURS:
             logger.warning(f"Sincronización requerida para {usuario}: {horas_desde_sync:.1f} horas desde última sync")
@@ -143,30 +253,35 @@ async def validar_sync(
         }
 
 
-@app.get("/sincronizar_datos", summary="Proporciona datos de sincronización completos a una Hija")
-async def obtener_datos_sync(
-    usuario: str = Query(..., description="El nombre de usuario de la Hija que solicita los datos")
+@app.get("/validar_sync", summary="Valida si el usuario necesita sincronizar")
+async def validar_sync(
+    usuario: str = Query(..., description="Nombre de usuario")
 ):
     """
-    Endpoint de sincronización completa.
-    Devuelve todos los datos del usuario: perfil, cronograma, galería, etc.
-    """
-    user = madre_db.get_user(usuario)
-    if not user:
-        raise HTTPException(status_code=404, detail="Usuario solicitante desconocido.")
+    Valida si el usuario ha sincronizado en las últimas horas configuradas.
+    Si no, debe bloquearse el acceso en la app Hija.
 
-    user_id = user['id']
+    Args:
+        usuario: Nombre de usuario a validar
 
-    profile_photo = madre_db.get_user_profile_photo(user_id)
+    Returns:
+        Dict con requiere_sync, bloqueado, mensaje, horas_desde_sync
 
-    training_schedule = madre_db.get_training_schedule(user_id)
+    Raises:
+        HTTPException: 404 si usuario no encontrado
+    """
+    logger.debug(f"Validando estado de sincronización para usuario: {usuario}")
 
-    photo_gallery = madre_db.get_photo_gallery(user_id)
+    user = madre_db.get_user(usuario)
+    if not user:
+        logger.warning(f"Usuario no encontrado en validación de sync: {usuario}")
+        raise HTTPException(status_code=404, detail="Usuario no encontrado.")
 
-    sync_data = madre_db.get_sync_data()
+    return _evaluar_sync(user)
 
-    madre_db.update_user_sync(usuario)
 
+def _respuesta_sync(user: dict, profile_photo, training_schedule, photo_gallery, sync_data) -> dict:
+    """Arma la respuesta de sincronización completa de un usuario."""
     return {
         "status": "sincronizacion_exitosa",
         "timestamp": datetime.now().isoformat(),
@@ -185,6 +300,70 @@ async def obtener_datos_sync(
     }
 
 
+@app.get("/sincronizar_datos", summary="Proporciona datos de sincronización completos a una Hija")
+async def obtener_datos_sync(
+    usuario: str = Query(..., description="El nombre de usuario de la Hija que solicita los datos")
+):
+    """
+    Endpoint de sincronización completa.
+    Devuelve todos los datos del usuario: perfil, cronograma, galería, etc.
+    """
+    user = madre_db.get_user(usuario)
+    if not user:
+        raise HTTPException(status_code=404, detail="Usuario solicitante desconocido.")
+
+    user_id = user['id']
+
+    profile_photo = madre_db.get_user_profile_photo(user_id)
+
+    training_schedule = madre_db.get_training_schedule(user_id)
+
+    photo_gallery = madre_db.get_photo_gallery(user_id)
+
+    sync_data = madre_db.get_sync_data()
+
+    madre_db.update_user_sync(usuario)
+
+    return _respuesta_sync(user, profile_photo, training_schedule, photo_gallery, sync_data)
+
+
+@app.get("/sync/version", summary="Sondeo ligero de cambios para la sincronización")
+async def version_sync(
+    usuario: str = Query(..., description="Nombre de usuario"),
+    version: Optional[str] = Query(None, description="Versión de los datos que tiene la Hija")
+):
+    """
+    Permite a la Hija comprobar si sus datos siguen al día sin descargarlos.
+    Solo si la versión difiere necesita pedir /sincronizar_datos. Si coincide,
+    la comprobación cuenta como sincronización (regla de las 72 horas).
+
+    Returns:
+        Dict con status, version y cambios
+
+    Raises:
+        HTTPException: 404 si usuario no encontrado, 503 (con Retry-After)
+            si la base de datos está ocupada
+    """
+    try:
+        with madre_db.db_session() as (_conn, cursor):
+            actual = madre_db.fetch_sync_version(cursor, usuario)
+            if actual is None:
+                raise HTTPException(status_code=404, detail="Usuario no encontrado.")
+
+            cambios = version != actual
+            if not cambios:
+                madre_db.touch_user_sync(cursor, usuario)
+    except sqlite3.OperationalError as e:
+        logger.warning(f"Base de datos ocupada en sondeo de sync para {usuario}: {e}")
+        raise HTTPException(
+            status_code=503,
+            detail="Servidor ocupado, reintente más tarde.",
+            headers={"Retry-After": str(settings.DB_BUSY_RETRY_AFTER)}
+        )
+
+    return {"status": "ok", "version": actual, "cambios": cambios}
+
+
 @app.post("/actualizar_permiso", summary="Actualiza el permiso de acceso de un usuario")
 async def actualizar_permiso(request: UserUpdateRequest):
     """
@@ -205,39 +384,58 @@ async def actualizar_permiso(request: UserUpdateRequest):
 async def sincronizar_masiva(usernames: list[str]):
     """
     Endpoint para sincronización masiva.
-    Marca la hora de sincronización para múltiples usuarios.
-    """
-    resultados = []
-    for username in usernames:
-        success = madre_db.update_user_sync(username)
-        resultados.append({
-            "usuario": username,
-            "actualizado": success
-        })
+    Marca la hora de sincronización para múltiples usuarios en una sola transacción.
+    """
+    actualizados = madre_db.update_users_sync_bulk(usernames)
+    resultados = [
+        {"usuario": username, "actualizado": success}
+        for username, success in actualizados.items()
+    ]
 
     return {
         "status": "sincronizacion_masiva_completada",
-        "total": len(usernames),
+        "total": len(resultados),
+        "actualizados": sum(actualizados.values()),
         "resultados": resultados
     }
 
 
-@app.get("/usuarios", summary="Obtiene lista de todos los usuarios")
-async def obtener_usuarios():
+@app.post("/actualizar_permisos", summary="Actualiza el permiso de acceso de múltiples usuarios")
+async def actualizar_permisos(request: list[UserUpdateRequest]):
     """
-    Endpoint para obtener la lista completa de usuarios.
-    Usado por la app Madre para gestión.
+    Endpoint para cambiar permisos en bloque desde la app Madre (una sola transacción).
     """
-    usuarios = madre_db.get_all_users()
-    for user in usuarios:
-        user.pop('password_hash', None)
+    permisos = {cambio.username: cambio.permiso_acceso for cambio in request}
+    actualizados = madre_db.update_permissions_bulk(permisos)
 
     return {
-        "total": len(usuarios),
-        "usuarios": usuarios
+        "status": "actualizado",
+        "total": len(actualizados),
+        "actualizados": sum(actualizados.values()),
+        "resultados": [
+            {"usuario": username, "permiso_acceso": permisos[username], "actualizado": success}
+            for username, success in actualizados.items()
+        ]
     }
 
 
+@app.get("/usuarios", summary="Obtiene lista de todos los usuarios")
+async def obtener_usuarios(request: Request):
+    """
+    Endpoint para obtener la lista completa de usuarios.
+    Usado por la app Madre para gestión. En JSON la lista la serializa
+    SQLite directamente; en MessagePack (Accept) se arma con dicts.
+    """
+    if madre_responses.wants_msgpack(request):
+        usuarios = madre_db.get_all_users()
+        for user in usuarios:
+            user.pop('password_hash', None)
+        return madre_responses.MessagePackResponse({"total": len(usuarios), "usuarios": usuarios})
+
+    total, usuarios = madre_db.get_users_json()
+    return madre_responses.json_array_response({"total": total}, "usuarios", usuarios)
+
+
 
 class MessageRequest(BaseModel):
     from_user: str
@@ -276,18 +474,57 @@ async def enviar_mensaje(request: MessageRequest):
 
 @app.get("/obtener_mensajes", summary="Obtener mensajes del usuario")
 async def obtener_mensajes(
+    request: Request,
     usuario: str = Query(..., description="Nombre de usuario"),
     solo_no_leidos: bool = Query(False, description="Solo mensajes no leídos")
 ):
     """Endpoint para obtener mensajes de un usuario."""
-    messages = madre_db.get_user_messages(usuario, include_read=not solo_no_leidos)
+    unread_count = madre_db.count_unread_messages(usuario)
+    if madre_responses.wants_msgpack(request):
+        messages = madre_db.get_user_messages(usuario, include_read=not solo_no_leidos)
+        return madre_responses.MessagePackResponse({
+            "status": "ok",
+            "total_mensajes": len(messages),
+            "mensajes_no_leidos": unread_count,
+            "mensajes": messages
+        })
+
+    total, messages = madre_db.get_user_messages_json(usuario, include_read=not solo_no_leidos)
+    return madre_responses.json_array_response({
+        "status": "ok",
+        "total_mensajes": total,
+        "mensajes_no_leidos": unread_count
+    }, "mensajes", messages)
+
+
+@app.get("/obtener_hilos", summary="Obtener conversaciones del usuario")
+async def obtener_hilos(
+    usuario: str = Query(..., description="Nombre de usuario"),
+    limit: int = Query(50, ge=1, le=200, description="Hilos por página"),
+    offset: int = Query(0, ge=0, description="Desplazamiento de la página")
+):
+    """Endpoint para obtener el buzón como hilos ordenados por última actividad."""
+    threads = madre_db.get_user_threads(usuario, limit, offset)
     unread_count = madre_db.count_unread_messages(usuario)
 
     return {
         "status": "ok",
-        "total_mensajes": len(messages),
+        "total_hilos": madre_db.count_user_threads(usuario),
         "mensajes_no_leidos": unread_count,
-        "mensajes": messages
+        "hilos": threads
+    }
+
+
+@app.get("/obtener_hilo/{thread_id}", summary="Obtener conversación completa")
+async def obtener_hilo(thread_id: int):
+    """Endpoint para obtener todos los mensajes de un hilo con sus adjuntos."""
+    thread = madre_db.get_thread(thread_id)
+    if not thread:
+        raise HTTPException(status_code=404, detail="Hilo no encontrado")
+
+    return {
+        "status": "ok",
+        "hilo": thread
     }
 
 
@@ -322,11 +559,147 @@ async def eliminar_mensaje(message_id: int):
     """Endpoint para eliminar un mensaje."""
     success = madre_db.delete_message(message_id)
     if success:
+        madre_storage.schedule_gc()
         return {"status": "mensaje_eliminado", "message_id": message_id}
     else:
         raise HTTPException(status_code=404, detail="Mensaje no encontrado")
 
 
+@app.post("/adjuntos/subir/{message_id}", summary="Subir adjunto a un mensaje")
+async def subir_adjunto(
+    message_id: int,
+    request: Request,
+    filename: str = Query(..., min_length=1, description="Nombre original del archivo")
+):
+    """
+    Endpoint para subir un adjunto. El cuerpo es el contenido binario del
+    archivo y se procesa por bloques, sin cargarlo entero en memoria.
+    Archivos idénticos se guardan una sola vez (direccionamiento por SHA-256).
+    """
+    if not madre_db.get_message_by_id(message_id):
+        raise HTTPException(status_code=404, detail="Mensaje no encontrado")
+
+    max_size = settings.MAX_ATTACHMENT_MB * 1024 * 1024
+    declared_size = request.headers.get("content-length")
+    if declared_size and declared_size.isdigit() and int(declared_size) > max_size:
+        raise HTTPException(status_code=413, detail="Adjunto demasiado grande")
+
+    try:
+        sha256, size, is_new = await madre_storage.store_stream(request.stream(), max_size)
+    except madre_storage.AttachmentTooLarge:
+        raise HTTPException(status_code=413, detail="Adjunto demasiado grande")
+
+    content_type = request.headers.get("content-type", "application/octet-stream")
+    attachment_id = madre_db.add_message_attachment(
+        message_id, os.path.basename(filename), madre_storage.blob_path(sha256),
+        size, sha256=sha256, content_type=content_type
+    )
+    if attachment_id is None:
+        raise HTTPException(status_code=500, detail="Error al registrar adjunto")
+
+    return {
+        "status": "ok",
+        "attachment_id": attachment_id,
+        "sha256": sha256,
+        "size": size,
+        "deduplicado": not is_new
+    }
+
+
+@app.get("/adjuntos/{attachment_id}", summary="Descargar adjunto")
+async def descargar_adjunto(attachment_id: int):
+    """
+    Endpoint para descargar un adjunto. Soporta peticiones Range para
+    reanudar descargas; los blobs son inmutables y se cachean por su hash.
+    """
+    attachment = madre_db.get_attachment(attachment_id)
+    if not attachment:
+        raise HTTPException(status_code=404, detail="Adjunto no encontrado")
+
+    sha256 = attachment.get('sha256')
+    path = madre_storage.blob_path(sha256) if sha256 else attachment['file_path']
+    if not path or not os.path.isfile(path):
+        raise HTTPException(status_code=404, detail="Archivo del adjunto no disponible")
+
+    headers = {}
+    if sha256:
+        headers["ETag"] = f'"{sha256}"'
+        headers["Cache-Control"] = "private, max-age=31536000, immutable"
+
+    return FileResponse(
+        path,
+        media_type=attachment.get('content_type') or "application/octet-stream",
+        filename=attachment['filename'],
+        headers=headers
+    )
+
+
+@app.get("/imagenes/{tipo}/{photo_id}", summary="Obtener miniatura de una foto")
+async def obtener_imagen(
+    tipo: str,
+    photo_id: int,
+    request: Request,
+    tamano: str = Query("medium", description="Tamaño de la miniatura: small, medium o large")
+):
+    """
+    Endpoint para obtener la miniatura de una foto de galería o de perfil.
+    Las miniaturas no cambian una vez generadas, así que se sirven con
+    caché de larga duración.
+    """
+    if tamano not in THUMBNAIL_SIZES:
+        raise HTTPException(status_code=400, detail="Tamaño de miniatura no válido")
+
+    if tipo == "galeria":
+        photo = madre_db.get_gallery_photo(photo_id)
+    elif tipo == "perfil":
+        photo = madre_db.get_profile_photo(photo_id)
+    else:
+        raise HTTPException(status_code=404, detail="Tipo de imagen desconocido")
+
+    if not photo:
+        raise HTTPException(status_code=404, detail="Foto no encontrada")
+
+    etag = f'"{tipo}-{photo_id}-{tamano}"'
+    headers = {
+        "ETag": etag,
+        "Cache-Control": "public, max-age=31536000, immutable"
+    }
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+
+    path = await asyncio.to_thread(
+        madre_images.get_thumbnail, tipo, photo_id, photo['photo_path'], tamano
+    )
+    if not path:
+        raise HTTPException(status_code=404, detail="Miniatura no disponible")
+
+    return FileResponse(path, media_type="image/jpeg", headers=headers)
+
+
+@app.get("/buscar_mensajes", summary="Buscar en mensajes y chat")
+async def buscar_mensajes(
+    usuario: str = Query(..., description="Nombre de usuario"),
+    q: str = Query(..., min_length=1, description="Texto a buscar"),
+    limit: int = Query(20, ge=1, le=100, description="Resultados por página"),
+    offset: int = Query(0, ge=0, description="Desplazamiento de la página")
+):
+    """
+    Endpoint de búsqueda de texto completo en mensajes y chat del usuario.
+    Devuelve resultados ordenados por relevancia y paginados.
+    """
+    resultados = madre_db.search_messages(usuario, q, limit + 1, offset)
+    hay_mas = len(resultados) > limit
+
+    return {
+        "status": "ok",
+        "consulta": q,
+        "limit": limit,
+        "offset": offset,
+        "hay_mas": hay_mas,
+        "resultados": resultados[:limit]
+    }
+
+
 @app.get("/contar_no_leidos", summary="Contar mensajes no leídos")
 async def contar_no_leidos(usuario: str = Query(..., description="Nombre de usuario")):
     """Endpoint para contar mensajes no leídos."""
@@ -360,17 +733,18 @@ async def enviar_chat(request: ChatMessageRequest):
 
 @app.get("/obtener_chat", summary="Obtener historial de chat")
 async def obtener_chat(
+    request: Request,
     user1: str = Query(..., description="Usuario 1"),
     user2: str = Query(..., description="Usuario 2"),
     limit: int = Query(50, description="Límite de mensajes")
 ):
     """Endpoint para obtener historial de chat entre dos usuarios."""
     messages = madre_db.get_chat_history(user1, user2, limit)
-    return {
+    return madre_responses.respond(request, {
         "status": "ok",
         "total_mensajes": len(messages),
         "mensajes": messages
-    }
+    })
 
 
 @app.post("/marcar_chat_leido", summary="Marcar mensajes de chat como leídos")
@@ -395,13 +769,151 @@ async def contar_chat_no_leidos(usuario: str = Query(..., description="Nombre de
 
 
 
+class BatchSubRequest(BaseModel):
+    op: str = Field(..., description="Operación a ejecutar (p. ej. 'obtener_hilos')")
+    id: Optional[str] = Field(None, description="Identificador de la respuesta (por defecto, op)")
+    params: dict = Field(default_factory=dict, description="Parámetros de la operación")
+
+
+class BatchRequest(BaseModel):
+    usuario: str = Field(..., min_length=1, description="Usuario para el que se ejecutan las operaciones")
+    peticiones: list[BatchSubRequest] = Field(..., min_length=1, max_length=BATCH_MAX_REQUESTS)
+
+
+def _batch_validar_sync(cursor, user: dict, params: dict) -> dict:
+    return _evaluar_sync(user)
+
+
+def _batch_sincronizar_datos(cursor, user: dict, params: dict) -> dict:
+    user_id = user['id']
+    respuesta = _respuesta_sync(
+        user,
+        madre_db.fetch_user_profile_photo(cursor, user_id),
+        madre_db.fetch_training_schedule(cursor, user_id),
+        madre_db.fetch_photo_gallery(cursor, user_id),
+        madre_db.fetch_sync_data(cursor)
+    )
+    madre_db.touch_user_sync(cursor, user['username'])
+    return respuesta
+
+
+def _batch_obtener_mensajes(cursor, user: dict, params: dict) -> dict:
+    include_read = not params.get('solo_no_leidos', False)
+    messages = madre_db.fetch_user_messages(cursor, user['username'], include_read)
+    return {
+        "status": "ok",
+        "total_mensajes": len(messages),
+        "mensajes_no_leidos": madre_db.fetch_unread_count(cursor, user['username']),
+        "mensajes": messages
+    }
+
+
+def _batch_obtener_hilos(cursor, user: dict, params: dict) -> dict:
+    limit = min(max(int(params.get('limit', 50)), 1), 200)
+    offset = max(int(params.get('offset', 0)), 0)
+    threads = madre_db.fetch_user_threads(cursor, user['username'], limit, offset)
+    return {
+        "status": "ok",
+        "total_hilos": madre_db.fetch_thread_count(cursor, user['username']),
+        "mensajes_no_leidos": madre_db.fetch_unread_count(cursor, user['username']),
+        "hilos": threads
+    }
+
+
+def _batch_contar_no_leidos(cursor, user: dict, params: dict) -> dict:
+    return {
+        "status": "ok",
+        "usuario": user['username'],
+        "mensajes_no_leidos": madre_db.fetch_unread_count(cursor, user['username'])
+    }
+
+
+def _batch_obtener_chat(cursor, user: dict, params: dict) -> dict:
+    if not params.get('user2'):
+        raise ValueError("Falta el parámetro 'user2'")
+    messages = madre_db.fetch_chat_history(cursor, user['username'], params['user2'],
+                                           int(params.get('limit', 50)))
+    return {
+        "status": "ok",
+        "total_mensajes": len(messages),
+        "mensajes": messages
+    }
+
+
+def _batch_contar_chat_no_leidos(cursor, user: dict, params: dict) -> dict:
+    return {
+        "status": "ok",
+        "usuario": user['username'],
+        "chat_no_leidos": madre_db.fetch_unread_chat_count(cursor, user['username'])
+    }
+
+
+BATCH_OPERATIONS = {
+    "validar_sync": _batch_validar_sync,
+    "sincronizar_datos": _batch_sincronizar_datos,
+    "obtener_mensajes": _batch_obtener_mensajes,
+    "obtener_hilos": _batch_obtener_hilos,
+    "contar_no_leidos": _batch_contar_no_leidos,
+    "obtener_chat": _batch_obtener_chat,
+    "contar_chat_no_leidos": _batch_contar_chat_no_leidos,
+}
+
+
+@app.post("/batch", summary="Ejecuta varias consultas de un usuario en una sola petición")
+async def ejecutar_batch(request: BatchRequest):
+    """
+    Agrupa varias consultas de lectura de un mismo usuario (las que la Hija
+    hace al arrancar) en una única petición. El usuario se resuelve una sola
+    vez y todas las operaciones comparten la misma conexión a la base de datos.
+
+    Cada operación responde por separado con su código: un error en una no
+    invalida las demás.
+
+    Returns:
+        Dict con status y resultados {id: {"codigo": int, "datos"|"detail": ...}}
+
+    Raises:
+        HTTPException: 404 si usuario no encontrado
+    """
+    resultados = {}
+
+    with madre_db.db_session() as (_conn, cursor):
+        user = madre_db.fetch_user(cursor, request.usuario)
+        if not user:
+            raise HTTPException(status_code=404, detail="Usuario no encontrado.")
+
+        for peticion in request.peticiones:
+            key = peticion.id or peticion.op
+            handler = BATCH_OPERATIONS.get(peticion.op)
+            if handler is None:
+                resultados[key] = {"codigo": 400, "detail": f"Operación desconocida: {peticion.op}"}
+                continue
+
+            try:
+                resultados[key] = {"codigo": 200, "datos": handler(cursor, user, peticion.params)}
+            except (ValueError, TypeError) as e:
+                resultados[key] = {"codigo": 400, "detail": str(e)}
+            except Exception as e:
+                logger.error(f"Error en operación batch '{peticion.op}' para {request.usuario}: {e}",
+                             exc_info=True)
+                resultados[key] = {"codigo": 500, "detail": "Error interno"}
+
+    logger.debug(f"Batch de {len(request.peticiones)} operaciones para {request.usuario}")
+    return {"status": "ok", "usuario": request.usuario, "resultados": resultados}
+
+
+
 @app.post("/registrar_servidor_madre", summary="Registrar otro servidor Madre")
 async def registrar_servidor_madre(
     server_name: str = Query(..., description="Nombre del servidor"),
     server_url: str = Query(..., description="URL del servidor"),
-    sync_token: str = Query("", description="Token de sincronización")
+    sync_token: str = Query(..., min_length=REPLICATION_MIN_TOKEN_LENGTH,
+                            description="Token de sincronización (compartido por ambos servidores)")
 ):
-    """Endpoint para registrar otro servidor Madre para sincronización."""
+    """
+    Endpoint para registrar otro servidor Madre para sincronización. El
+    token es obligatorio: /replicacion/cambios no sirve lotes sin él.
+    """
     success = madre_db.add_madre_server(server_name, server_url, sync_token)
     if success:
         return {
@@ -415,7 +927,7 @@ async def registrar_servidor_madre(
 @app.get("/obtener_servidores_madre", summary="Obtener servidores Madre registrados")
 async def obtener_servidores_madre():
     """Endpoint para obtener todos los servidores Madre registrados."""
-    servers = madre_db.get_all_madre_servers()
+    servers = madre_db.list_madre_servers()
     return {
         "status": "ok",
         "total": len(servers),
@@ -423,18 +935,79 @@ async def obtener_servidores_madre():
     }
 
 
+@app.get("/replicacion/cambios", summary="Lote de replicación para otro servidor Madre")
+async def replicacion_cambios(
+    request: Request,
+    tabla: str = Query(..., description="Tabla replicada"),
+    desde: int = Query(0, ge=0, description="High-water mark (o último id si snapshot)"),
+    limite: int = Query(None, ge=1, le=10000, description="Máximo de entradas del lote"),
+    snapshot: bool = Query(False, description="Copia completa de la tabla por páginas de id")
+):
+    """
+    Devuelve a otro servidor Madre las filas de `tabla` que cambiaron desde
+    `desde`, con su versión, comprimidas con gzip si el cliente lo acepta.
+    Requiere las cabeceras X-Madre-Server y X-Sync-Token de un servidor
+    registrado (ver madre_replication).
+
+    Raises:
+        HTTPException: 403 si el servidor no está registrado o el token no
+            coincide, 400 si la tabla no se replica
+    """
+    servidor = request.headers.get("X-Madre-Server")
+    if not await asyncio.to_thread(madre_replication.is_authorized, servidor,
+                                   request.headers.get("X-Sync-Token", "")):
+        raise HTTPException(status_code=403, detail="Servidor Madre no autorizado.")
+    if tabla not in madre_db.REPLICATED_TABLES:
+        raise HTTPException(status_code=400, detail=f"Tabla no replicable: {tabla}")
+
+    if snapshot:
+        lote = await asyncio.to_thread(madre_db.export_snapshot, tabla, desde, limite)
+    else:
+        lote = await asyncio.to_thread(madre_db.export_changes, tabla, desde, limite, servidor)
+
+    if "gzip" in request.headers.get("Accept-Encoding", ""):
+        return Response(content=madre_replication.encode_batch(lote), media_type="application/json",
+                        headers={"Content-Encoding": "gzip"})
+    return lote
+
+
+@app.post("/replicacion/sincronizar", summary="Replica ahora desde los servidores Madre registrados")
+async def replicacion_sincronizar(
+    servidor: Optional[str] = Query(None, description="Replicar solo desde este servidor")
+):
+    """Ejecuta una pasada de replicación y devuelve el resultado por servidor y tabla."""
+    resultados = await asyncio.to_thread(madre_replication.replicate_all, servidor)
+    return {"status": "ok", "servidor": settings.SERVER_NAME, "resultados": resultados}
+
+
+@app.get("/replicacion/estado", summary="High-water marks de replicación por servidor")
+async def replicacion_estado():
+    """Última secuencia remota aplicada por tabla para cada servidor registrado."""
+    servers = madre_db.get_all_madre_servers()
+    return {
+        "status": "ok",
+        "servidor": settings.SERVER_NAME,
+        "ultima_secuencia": madre_db.get_latest_change_seq(),
+        "servidores": {
+            server['server_name']: {
+                "last_sync": server['last_sync'],
+                "marcas": madre_db.get_replication_marks(server['server_name'])
+            } for server in servers
+        }
+    }
+
+
 @app.get("/health", summary="Health check endpoint")
 async def health_check():
     """
     Health check endpoint para verificar el estado del servidor.
-    Verifica conectividad con la base de datos.
+    Comprueba la base de datos con un SELECT 1 e informa del estado de db_lock.
 
     Returns:
-        Dict con status, version, database_status
+        Dict con status, version, database_status, db_lock y admission
     """
     try:
-        _ = len(madre_db.get_all_users())
-        db_status = "healthy"
+        db_status = "healthy" if madre_db.ping() else "unhealthy"
         logger.debug("Health check: Database connection OK")
     except Exception as e:
         db_status = "unhealthy"
@@ -443,10 +1016,132 @@ async def health_check():
     return {
         "status": "online",
         "version": APP_VERSION,
-        "database_status": db_status
+        "database_status": db_status,
+        "db_lock": {
+            "locked": madre_db.db_lock.locked(),
+            "holder": madre_db.db_lock.holder()
+        },
+        "admission": admission.status()
+    }
+
+
+@app.get("/metrics", summary="Métricas en formato de texto de Prometheus")
+async def metrics():
+    """
+    Latencias por ruta, peticiones en curso, tiempos y espera de db_lock por
+    función de madre_db y aciertos de caché (métricas del worker que responde).
+    """
+    return Response(content=madre_metrics.registry.render(), media_type=madre_metrics.CONTENT_TYPE)
+
+
+@app.get("/admin/consultas_lentas", summary="Top de consultas SQL más lentas (perfilador)")
+async def consultas_lentas(
+    top: int = Query(None, ge=1, le=500, description="Número de sentencias"),
+    orden: str = Query("max", description="Criterio: max, total, media o llamadas")
+):
+    """
+    Informe del perfilador de consultas de este worker (QUERY_PROFILING=true).
+    Para el informe combinado de todos los workers: python madre_profiler.py
+    """
+    if orden not in madre_profiler.ORDENES:
+        raise HTTPException(status_code=400, detail=f"Orden no válido: {orden}")
+
+    return {
+        "status": "ok",
+        "activo": madre_profiler.is_enabled(),
+        "muestreo": settings.QUERY_PROFILE_SAMPLE_RATE,
+        "pid": os.getpid(),
+        "consultas": madre_profiler.report(top, orden)
     }
 
 
+@app.delete("/admin/consultas_lentas", summary="Reinicia el perfilador de consultas")
+async def reiniciar_consultas_lentas():
+    """Descarta las muestras acumuladas en este worker."""
+    madre_profiler.reset()
+    return {"status": "ok"}
+
+
+@app.post("/admin/backup", summary="Crea una copia de seguridad en caliente")
+async def crear_backup(
+    comprimir: Optional[bool] = Query(None, description="Comprimir con gzip (por defecto BACKUP_COMPRESS)")
+):
+    """Copia la base de datos con la API de backup de SQLite sin detener el servidor."""
+    try:
+        resultado = await asyncio.to_thread(madre_backup.create_backup, None, comprimir)
+    except Exception as e:
+        logger.error(f"Error creando copia de seguridad: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail="Error al crear la copia de seguridad.")
+    return {"status": "ok", **resultado}
+
+
+@app.get("/admin/backups", summary="Lista las copias de seguridad")
+async def listar_backups():
+    """Copias de seguridad existentes, de la más reciente a la más antigua."""
+    backups = await asyncio.to_thread(madre_backup.list_backups)
+    return {"status": "ok", "total": len(backups), "backups": backups}
+
+
+@app.post("/admin/archivar", summary="Archiva las filas antiguas de las tablas históricas")
+async def archivar(
+    dias: Optional[int] = Query(None, ge=0, description="Días que se conservan (por defecto ARCHIVE_HORIZON_DAYS)")
+):
+    """Mueve a los archivos por periodo las filas anteriores al horizonte."""
+    try:
+        movidas = await asyncio.to_thread(madre_archive.archive_old_rows, dias)
+    except Exception as e:
+        logger.error(f"Error archivando: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail="Error al archivar.")
+    return {"status": "ok", "cutoff": madre_archive.archive_cutoff(dias), "archivadas": movidas}
+
+
+@app.get("/admin/archivo", summary="Lista los archivos históricos")
+async def listar_archivo():
+    """Filas archivadas por periodo y tabla."""
+    catalogo = await asyncio.to_thread(madre_db.get_archive_catalog)
+    return {"status": "ok", "total": len(catalogo), "archivos": catalogo}
+
+
+@app.get("/cambios", summary="Lee el log de cambios (CDC) a partir de una secuencia")
+async def obtener_cambios(
+    desde: int = Query(0, ge=0, description="Última secuencia ya procesada"),
+    limite: int = Query(None, ge=1, le=10000, description="Máximo de cambios por página"),
+    tablas: Optional[str] = Query(None, description="Tablas separadas por comas"),
+    excluir_origen: Optional[str] = Query(None, description="Omitir los cambios con este origen")
+):
+    """
+    Devuelve los cambios registrados después de `desde`, en orden de
+    secuencia. Para seguir leyendo se vuelve a pedir con desde=last_seq
+    mientras has_more sea true. Si reset es true, la retención ya eliminó
+    cambios que el consumidor no había leído y debe resincronizar por completo.
+
+    Returns:
+        Dict con status, changes, last_seq, has_more y reset
+
+    Raises:
+        HTTPException: 400 si alguna tabla no está en el log de cambios
+    """
+    lista_tablas = [t.strip() for t in tablas.split(",") if t.strip()] if tablas else None
+    if lista_tablas:
+        desconocidas = [t for t in lista_tablas if t not in madre_db.CDC_TABLES]
+        if desconocidas:
+            raise HTTPException(status_code=400, detail=f"Tablas sin log de cambios: {', '.join(desconocidas)}")
+
+    try:
+        pagina = await asyncio.to_thread(madre_db.get_changes, desde, limite, lista_tablas, excluir_origen)
+    except sqlite3.OperationalError as e:
+        logger.warning(f"Base de datos ocupada leyendo cambios desde {desde}: {e}")
+        raise HTTPException(
+            status_code=503,
+            detail="Servidor ocupado, reintente más tarde.",
+            headers={"Retry-After": str(settings.DB_BUSY_RETRY_AFTER)}
+        )
+    except Exception as e:
+        logger.error(f"Error leyendo el log de cambios: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail="Error al leer el log de cambios.")
+
+    return {"status": "ok", **pagina}
+
 
 class ClassBookingRequest(BaseModel):
     username: str
@@ -465,22 +1160,24 @@ class ClassRatingRequest(BaseModel):
 
 
 @app.get("/clases", summary="Obtiene todas las clases disponibles")
-async def get_classes(active_only: bool = True):
+async def get_classes(request: Request, active_only: bool = True):
     """Retorna lista de todas las clases."""
     try:
-        classes = madre_db.get_all_classes(active_only)
-        return {"status": "success", "clases": classes}
+        return madre_compression.cached_json_response(
+            catalog_responses, request, ("clases", active_only),
+            lambda: {"status": "success", "clases": madre_db.get_all_classes(active_only)})
     except Exception as e:
         logger.error(f"Error getting classes: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail="Error al obtener clases")
 
 
 @app.get("/clases/horarios", summary="Obtiene horarios de clases")
-async def get_schedules(class_id: Optional[int] = None):
+async def get_schedules(request: Request, class_id: Optional[int] = None):
     """Retorna horarios de clases disponibles."""
     try:
-        schedules = madre_db.get_class_schedules(class_id)
-        return {"status": "success", "horarios": schedules}
+        return madre_compression.cached_json_response(
+            catalog_responses, request, ("horarios", class_id),
+            lambda: {"status": "success", "horarios": madre_db.get_class_schedules(class_id)})
     except Exception as e:
         logger.error(f"Error getting schedules: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail="Error al obtener horarios")
@@ -586,11 +1283,12 @@ class EquipmentReservationRequest(BaseModel):
 
 
 @app.get("/equipos", summary="Obtiene equipos y zonas disponibles")
-async def get_equipment():
+async def get_equipment(request: Request):
     """Retorna lista de equipos y zonas reservables."""
     try:
-        equipment = madre_db.get_all_equipment_zones()
-        return {"status": "success", "equipos": equipment}
+        return madre_compression.cached_json_response(
+            catalog_responses, request, ("equipos",),
+            lambda: {"status": "success", "equipos": madre_db.get_all_equipment_zones()})
     except Exception as e:
         logger.error(f"Error getting equipment: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail="Error al obtener equipos")
@@ -632,11 +1330,12 @@ class WorkoutLogRequest(BaseModel):
 
 
 @app.get("/ejercicios", summary="Obtiene lista de ejercicios")
-async def get_exercises():
+async def get_exercises(request: Request):
     """Retorna todos los ejercicios disponibles."""
     try:
-        exercises = madre_db.get_all_exercises()
-        return {"status": "success", "ejercicios": exercises}
+        return madre_compression.cached_json_response(
+            catalog_responses, request, ("ejercicios",),
+            lambda: {"status": "success", "ejercicios": madre_db.get_all_exercises()})
     except Exception as e:
         logger.error(f"Error getting exercises: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail="Error al obtener ejercicios")
@@ -0,0 +1,231 @@
+import asyncio
+import hashlib
+import os
+import sys
+import tempfile
+import threading
+import time
+from typing import AsyncIterator, Optional, Tuple
+
+import madre_db
+from config.settings import get_madre_settings
+from shared.constants import STORAGE_CHUNK_SIZE, STORAGE_GC_GRACE_SECONDS
+from shared.logger import setup_logger
+
+logger = setup_logger(__name__, log_file="madre_storage.log")
+
+settings = get_madre_settings()
+
+STORAGE_DIR = settings.ATTACHMENTS_DIR if os.path.isabs(
+    settings.ATTACHMENTS_DIR) else os.path.join(
+        os.path.dirname(__file__),
+    settings.ATTACHMENTS_DIR)
+TMP_DIR = os.path.join(STORAGE_DIR, "tmp")
+
+storage_lock = threading.Lock()
+
+_gc_timer: Optional[threading.Timer] = None
+_gc_timer_lock = threading.Lock()
+
+logger.info(f"Attachment storage initialized - Dir: {STORAGE_DIR}")
+
+
+class AttachmentTooLarge(Exception):
+    """El adjunto supera el tamaño máximo permitido."""
+
+
+def blob_path(sha256: str) -> str:
+    """Ruta en disco de un blob: <dir>/ab/cd/<sha256>."""
+    return os.path.join(STORAGE_DIR, sha256[:2], sha256[2:4], sha256)
+
+
+class BlobWriter:
+    """
+    Escribe un blob por bloques en un fichero temporal calculando su SHA-256
+    al vuelo, de modo que nunca se mantiene el fichero completo en memoria.
+    Al confirmar, el temporal se mueve a su ruta por contenido; si ya
+    existía un blob idéntico se descarta la copia nueva.
+    """
+
+    def __init__(self, max_size: Optional[int] = None):
+        os.makedirs(TMP_DIR, exist_ok=True)
+        fd, self.tmp_path = tempfile.mkstemp(dir=TMP_DIR, suffix=".part")
+        self._file = os.fdopen(fd, "wb")
+        self._hash = hashlib.sha256()
+        self.size = 0
+        self.max_size = max_size
+
+    def write(self, chunk: bytes) -> None:
+        """Añade un bloque al blob."""
+        self.size += len(chunk)
+        if self.max_size is not None and self.size > self.max_size:
+            raise AttachmentTooLarge(f"El adjunto supera {self.max_size} bytes")
+        self._hash.update(chunk)
+        self._file.write(chunk)
+
+    def commit(self) -> Tuple[str, int, bool]:
+        """
+        Cierra el blob y lo publica en el almacén.
+
+        Returns:
+            Tuple[str, int, bool]: (sha256, tamaño, es_nuevo)
+        """
+        self._file.close()
+        sha256 = self._hash.hexdigest()
+        final_path = blob_path(sha256)
+
+        with storage_lock:
+            if os.path.exists(final_path):
+                os.remove(self.tmp_path)
+                os.utime(final_path)
+                return sha256, self.size, False
+
+            os.makedirs(os.path.dirname(final_path), exist_ok=True)
+            os.replace(self.tmp_path, final_path)
+
+        return sha256, self.size, True
+
+    def abort(self) -> None:
+        """Descarta el blob en curso."""
+        try:
+            self._file.close()
+            os.remove(self.tmp_path)
+        except OSError:
+            pass
+
+
+def store_file(path: str) -> Tuple[str, int, bool]:
+    """Guarda un fichero local en el almacén leyéndolo por bloques."""
+    writer = BlobWriter()
+    try:
+        with open(path, "rb") as f:
+            while True:
+                chunk = f.read(STORAGE_CHUNK_SIZE)
+                if not chunk:
+                    break
+                writer.write(chunk)
+        return writer.commit()
+    except BaseException:
+        writer.abort()
+        raise
+
+
+async def store_stream(chunks: AsyncIterator[bytes],
+                       max_size: Optional[int] = None) -> Tuple[str, int, bool]:
+    """
+    Guarda en el almacén un flujo asíncrono de bloques (p. ej. request.stream()).
+    Los bloques se agrupan hasta STORAGE_CHUNK_SIZE y se escriben en un hilo
+    para no bloquear el event loop con E/S de disco.
+
+    Raises:
+        AttachmentTooLarge: Si el flujo supera max_size bytes
+    """
+    writer = BlobWriter(max_size)
+    buffer = bytearray()
+    try:
+        async for chunk in chunks:
+            buffer.extend(chunk)
+            if len(buffer) >= STORAGE_CHUNK_SIZE:
+                await asyncio.to_thread(writer.write, bytes(buffer))
+                buffer.clear()
+        if buffer:
+            await asyncio.to_thread(writer.write, bytes(buffer))
+        return await asyncio.to_thread(writer.commit)
+    except BaseException:
+        writer.abort()
+        raise
+
+
+def _is_recent(path: str, now: float) -> bool:
+    """Indica si un fichero se modificó dentro del periodo de gracia del GC."""
+    return now - os.path.getmtime(path) < STORAGE_GC_GRACE_SECONDS
+
+
+def collect_garbage(full: bool = False) -> int:
+    """
+    Borra del disco los blobs que ningún adjunto referencia.
+
+    Procesa la cola que llena madre_db.delete_message. Con full=True además
+    recorre el almacén completo eliminando ficheros huérfanos y temporales
+    abandonados. Los ficheros tocados dentro del periodo de gracia se
+    conservan para no competir con subidas en curso.
+
+    Returns:
+        int: Número de ficheros eliminados
+    """
+    now = time.time()
+    removed = 0
+    processed = []
+
+    with storage_lock:
+        for sha256 in madre_db.get_attachment_gc_queue():
+            path = blob_path(sha256)
+            try:
+                if _is_recent(path, now):
+                    continue
+                os.remove(path)
+                removed += 1
+            except FileNotFoundError:
+                pass
+            processed.append(sha256)
+
+    if processed:
+        madre_db.clear_attachment_gc_queue(processed)
+
+    if full and os.path.isdir(STORAGE_DIR):
+        known = madre_db.get_attachment_blob_hashes()
+        with storage_lock:
+            for root, _dirs, files in os.walk(STORAGE_DIR):
+                for name in files:
+                    path = os.path.join(root, name)
+                    is_orphan = root.startswith(TMP_DIR) or name not in known
+                    try:
+                        if is_orphan and not _is_recent(path, now):
+                            os.remove(path)
+                            removed += 1
+                    except FileNotFoundError:
+                        pass
+
+    if removed:
+        logger.info(f"Attachment GC: {removed} blobs eliminados")
+    return removed
+
+
+def schedule_gc(delay: float = 5.0) -> None:
+    """
+    Programa una pasada del recolector en segundo plano.
+    Varias llamadas seguidas se agrupan en una sola pasada.
+    """
+    global _gc_timer
+
+    def _run():
+        global _gc_timer
+        with _gc_timer_lock:
+            _gc_timer = None
+        try:
+            collect_garbage()
+        except Exception as e:
+            logger.error(f"Error en el recolector de adjuntos: {e}", exc_info=True)
+
+    with _gc_timer_lock:
+        if _gc_timer is None:
+            _gc_timer = threading.Timer(delay, _run)
+            _gc_timer.daemon = True
+            _gc_timer.start()
+
+
+def shutdown() -> None:
+    """Cancela la pasada del recolector pendiente (la cola persiste en la BD)."""
+    global _gc_timer
+    with _gc_timer_lock:
+        if _gc_timer is not None:
+            _gc_timer.cancel()
+            _gc_timer = None
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "gc":
+        count = collect_garbage(full="--full" in sys.argv)
+        print(f"Blobs eliminados: {count}")
+    else:
+        print("Uso: python madre_storage.py gc [--full]")
@@ -0,0 +1,79 @@
+"""
+Trabajos periódicos del servidor Madre con varios workers.
+
+Cada worker arranca los mismos bucles en segundo plano (lifespan de
+madre_server), pero el mantenimiento del log de cambios, la replicación y el
+archivado no deben ejecutarse a la vez en dos procesos ni una vez por worker
+en cada intervalo. run_if_due sigue el esquema de las copias de seguridad
+(madre_backup.backup_if_due): un archivo de marca junto a la base de datos
+guarda cuándo empezó la última ejecución correcta, y un archivo de bloqueo
+creado en exclusiva impide que otro worker la repita mientras dura.
+"""
+import os
+import time
+from typing import Any, Callable, Optional
+
+import madre_db
+from shared.logger import setup_logger
+
+logger = setup_logger(__name__, log_file="madre_tasks.log")
+
+LOCK_STALE_SECONDS = 3600
+
+
+def acquire_lock(directory: str, name: str, stale_seconds: int = LOCK_STALE_SECONDS) -> Optional[str]:
+    """
+    Bloqueo entre procesos (workers) mediante un archivo creado en exclusiva.
+    Un bloqueo con más de stale_seconds se considera abandonado.
+
+    Returns:
+        Ruta del archivo de bloqueo (hay que borrarlo al terminar), o None si otro proceso lo tiene
+    """
+    os.makedirs(directory, exist_ok=True)
+    lock_path = os.path.join(directory, name)
+    try:
+        if time.time() - os.path.getmtime(lock_path) > stale_seconds:
+            os.remove(lock_path)
+    except OSError:
+        pass
+    try:
+        os.close(os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+        return lock_path
+    except FileExistsError:
+        return None
+
+
+def run_if_due(name: str, interval: int, func: Callable[..., Any], *args) -> Optional[Any]:
+    """
+    Ejecuta func(*args) si ningún worker lo ha hecho en los últimos
+    `interval` segundos, y solo en un worker a la vez.
+
+    Returns:
+        Lo que devuelva func, o None si no tocaba o ya lo está ejecutando otro worker
+    """
+    directory = os.path.dirname(madre_db.DB_PATH)
+    stamp_path = os.path.join(directory, f".{name}.last")
+
+    def due() -> bool:
+        try:
+            return time.time() - os.path.getmtime(stamp_path) >= interval
+        except OSError:
+            return True
+
+    if not due():
+        return None
+    lock_path = acquire_lock(directory, f".{name}.lock")
+    if lock_path is None:
+        return None
+    try:
+        # Otro worker puede haber terminado justo antes de que tomáramos el bloqueo
+        if not due():
+            return None
+        start = time.time()
+        result = func(*args)
+        with open(stamp_path, "a"):
+            pass
+        os.utime(stamp_path, (start, start))
+        return result
+    finally:
+        os.remove(lock_path)
@@ -0,0 +1,367 @@
+import math
+import queue
+import tkinter
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import customtkinter
+
+PAGE_SIZE = 100
+MAX_CACHED_PAGES = 20
+OVERSCAN_ROWS = 5
+SEARCH_DEBOUNCE_MS = 300
+RESULT_POLL_MS = 30
+SCROLL_UNITS_PER_STEP = 3
+
+
+class PagedTable(customtkinter.CTkFrame):
+    """
+    Tabla virtualizada, ordenable y con búsqueda sobre una fuente paginada.
+
+    Solo existen widgets para las filas visibles (reutilizados al hacer
+    scroll) y solo se piden a la fuente las páginas que esas filas
+    necesitan. Las consultas se ejecutan en un hilo de fondo; sus
+    resultados se aplican en el hilo de Tk. Mientras llega una página sus
+    filas muestran "Cargando...".
+
+    Args:
+        columns: Lista de (clave, título, ancho) de las columnas de texto
+        fetch_page: fetch_page(search, sort_by, descending, limit, offset) -> filas
+        count_rows: count_rows(search) -> total de filas
+        create_actions: create_actions(row) añade widgets extra al final de
+            cada fila (botones, switches...)
+        bind_actions: bind_actions(row, item) actualiza esos widgets
+        row_height: Alto de fila en px
+        sort_by: Columna de orden inicial
+        search_placeholder: Texto de ayuda del buscador
+    """
+
+    def __init__(self, master, columns: Sequence[Tuple[str, str, int]],
+                 fetch_page: Callable[..., List[Dict[str, Any]]],
+                 count_rows: Callable[[str], int],
+                 create_actions: Optional[Callable[[Any], None]] = None,
+                 bind_actions: Optional[Callable[[Any, Dict[str, Any]], None]] = None,
+                 row_height: int = 40, sort_by: Optional[str] = None,
+                 search_placeholder: str = "Buscar...", **kwargs):
+        super().__init__(master, **kwargs)
+
+        self.columns = list(columns)
+        self.fetch_page = fetch_page
+        self.count_rows = count_rows
+        self.create_actions = create_actions
+        self.bind_actions = bind_actions
+        self.row_height = row_height
+        self.search_placeholder = search_placeholder
+
+        self.search = ""
+        self.sort_by = sort_by or self.columns[0][0]
+        self.descending = False
+        self.total = 0
+
+        self._generation = 0
+        self._pages: "OrderedDict[int, List[Dict[str, Any]]]" = OrderedDict()
+        self._stale_pages = set()
+        self._requested = set()
+        self._active: Dict[int, Tuple[Any, int, Optional[Dict[str, Any]]]] = {}
+        self._free: List[Tuple[Any, int]] = []
+
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="PagedTable")
+        self._results: "queue.SimpleQueue[Tuple[int, Callable, Any]]" = queue.SimpleQueue()
+        self._pending = 0
+        self._poll_job = None
+        self._layout_job = None
+        self._search_job = None
+
+        self.grid_columnconfigure(0, weight=1)
+        self.grid_rowconfigure(2, weight=1)
+
+        self._crear_barra_busqueda()
+        self._crear_cabecera()
+
+        self._canvas = tkinter.Canvas(self, highlightthickness=0, bd=0, bg=self._canvas_bg())
+        self._canvas.grid(row=2, column=0, sticky="nsew")
+
+        self._scrollbar = customtkinter.CTkScrollbar(self, command=self._canvas.yview)
+        self._scrollbar.grid(row=2, column=1, sticky="ns")
+        self._canvas.configure(yscrollcommand=self._on_yscroll,
+                               yscrollincrement=max(1, self._row_px() // 2))
+
+        self._canvas.bind("<Configure>", lambda _e: self._programar_layout())
+        self._bind_wheel(self._canvas)
+
+        self.reload()
+
+    def _crear_barra_busqueda(self):
+        """Buscador con retardo (no consulta en cada tecla) y contador de filas."""
+        bar = customtkinter.CTkFrame(self, fg_color="transparent")
+        bar.grid(row=0, column=0, columnspan=2, sticky="ew", pady=(0, 5))
+        bar.grid_columnconfigure(0, weight=1)
+
+        self.entry_search = customtkinter.CTkEntry(bar, placeholder_text=self.search_placeholder)
+        self.entry_search.grid(row=0, column=0, sticky="ew", padx=(0, 10))
+        self.entry_search.bind("<KeyRelease>", self._on_search_key)
+
+        self.lbl_total = customtkinter.CTkLabel(bar, text="", text_color="gray")
+        self.lbl_total.grid(row=0, column=1)
+
+    def _crear_cabecera(self):
+        """Cabecera con un botón por columna para ordenar."""
+        header = customtkinter.CTkFrame(self)
+        header.grid(row=1, column=0, columnspan=2, sticky="ew")
+
+        self._header_buttons = {}
+        for col, (key, title, width) in enumerate(self.columns):
+            btn = customtkinter.CTkButton(
+                header,
+                text=title,
+                width=width,
+                anchor="w",
+                fg_color="transparent",
+                hover_color=("gray70", "gray30"),
+                text_color=("gray10", "gray90"),
+                command=lambda k=key: self.sort(k)
+            )
+            btn.grid(row=0, column=col, padx=5, pady=2, sticky="w")
+            self._header_buttons[key] = btn
+        self._actualizar_cabecera()
+
+    def _actualizar_cabecera(self):
+        """Marca la columna de orden actual con ▲/▼."""
+        for key, title, _width in self.columns:
+            arrow = ""
+            if key == self.sort_by:
+                arrow = " ▼" if self.descending else " ▲"
+            self._header_buttons[key].configure(text=f"{title}{arrow}")
+
+    def _canvas_bg(self) -> str:
+        """Color de fondo del canvas según el tema actual."""
+        color = self._bg_color if self._fg_color == "transparent" else self._fg_color
+        return self._apply_appearance_mode(color)
+
+    def _set_appearance_mode(self, mode_string):
+        super()._set_appearance_mode(mode_string)
+        self._canvas.configure(bg=self._canvas_bg())
+
+    def _row_px(self) -> int:
+        """Alto real (escalado) de una fila."""
+        return int(self.row_height * self._get_widget_scaling())
+
+    # --- Consultas en segundo plano -------------------------------------
+
+    def submit(self, fn: Callable, on_done: Callable, *args):
+        """
+        Ejecuta fn(*args) en el hilo de fondo; on_done(resultado) se llama en
+        el hilo de Tk, salvo que la tabla haya cambiado de búsqueda/orden.
+        """
+        generation = self._generation
+        future = self._executor.submit(fn, *args)
+        future.add_done_callback(lambda f: self._results.put((generation, on_done, f)))
+        self._pending += 1
+        if self._poll_job is None:
+            self._poll_job = self.after(RESULT_POLL_MS, self._poll_results)
+
+    def _poll_results(self):
+        """Aplica en el hilo de Tk los resultados que hayan llegado."""
+        self._poll_job = None
+        while True:
+            try:
+                generation, on_done, future = self._results.get_nowait()
+            except queue.Empty:
+                break
+            self._pending -= 1
+            if generation != self._generation:
+                continue
+            try:
+                on_done(future.result())
+            except Exception as e:
+                print(f"Error cargando datos de la tabla: {e}")
+
+        if self._pending > 0:
+            self._poll_job = self.after(RESULT_POLL_MS, self._poll_results)
+
+    def reload(self):
+        """Vuelve a contar y a pedir las filas visibles (misma búsqueda y orden)."""
+        self._generation += 1
+        self._stale_pages = set(self._pages)
+        self._requested = set()
+        self.submit(self.count_rows, self._on_count, self.search)
+        self._programar_layout()
+
+    def _reset(self):
+        """Descarta las páginas cargadas y vuelve al principio (nueva búsqueda u orden)."""
+        self._pages.clear()
+        self._canvas.yview_moveto(0)
+        self.reload()
+
+    def _on_count(self, total: int):
+        self.total = total
+        self.lbl_total.configure(text=f"{total} resultados")
+        self._canvas.configure(scrollregion=(0, 0, 0, total * self._row_px()))
+        self._programar_layout()
+
+    def _request_page(self, page: int):
+        """Pide una página a la fuente si no está ya pedida en esta generación."""
+        if page in self._requested:
+            return
+        self._requested.add(page)
+        self.submit(
+            self.fetch_page,
+            lambda rows, p=page: self._on_page(p, rows),
+            self.search, self.sort_by, self.descending, PAGE_SIZE, page * PAGE_SIZE
+        )
+
+    def _on_page(self, page: int, rows: List[Dict[str, Any]]):
+        self._pages[page] = rows
+        self._pages.move_to_end(page)
+        self._stale_pages.discard(page)
+        while len(self._pages) > MAX_CACHED_PAGES:
+            evicted, _rows = self._pages.popitem(last=False)
+            self._requested.discard(evicted)
+        self._programar_layout()
+
+    # --- Búsqueda y orden -------------------------------------------------
+
+    def _on_search_key(self, _event=None):
+        if self._search_job is not None:
+            self.after_cancel(self._search_job)
+        self._search_job = self.after(SEARCH_DEBOUNCE_MS, self._aplicar_busqueda)
+
+    def _aplicar_busqueda(self):
+        self._search_job = None
+        search = self.entry_search.get().strip()
+        if search != self.search:
+            self.search = search
+            self._reset()
+
+    def sort(self, key: str):
+        """Ordena por una columna; si ya era la de orden, invierte el sentido."""
+        if key == self.sort_by:
+            self.descending = not self.descending
+        else:
+            self.sort_by = key
+            self.descending = False
+        self._actualizar_cabecera()
+        self._reset()
+
+    def patch_rows(self, match: Callable[[Dict[str, Any]], bool], changes: Dict[str, Any]):
+        """Aplica cambios a las filas ya cargadas que cumplan match y repinta las visibles."""
+        for page, rows in self._pages.items():
+            self._pages[page] = [dict(row, **changes) if match(row) else row for row in rows]
+        self._programar_layout()
+
+    def redraw(self):
+        """Vuelve a pintar las filas visibles (p. ej. tras cambiar una selección externa)."""
+        for row, _window_id, item in self._active.values():
+            self._bind_row(row, item)
+
+    # --- Virtualización -----------------------------------------------------
+
+    def _item_at(self, index: int) -> Optional[Dict[str, Any]]:
+        """Fila `index` si su página está cargada; None si hay que pedirla."""
+        page, pos = divmod(index, PAGE_SIZE)
+        rows = self._pages.get(page)
+        if rows is None or page in self._stale_pages:
+            self._request_page(page)
+        if rows is not None and pos < len(rows):
+            return rows[pos]
+        return None
+
+    def _new_row(self) -> Tuple[Any, int]:
+        """Crea una fila nueva para el pool."""
+        row = customtkinter.CTkFrame(self._canvas, height=self.row_height)
+        row.grid_propagate(False)
+        row.labels = []
+        for col, (_key, _title, width) in enumerate(self.columns):
+            lbl = customtkinter.CTkLabel(row, text="", width=width, anchor="w")
+            lbl.grid(row=0, column=col, padx=5, pady=2, sticky="w")
+            row.labels.append(lbl)
+        row.actions_column = len(self.columns)
+        if self.create_actions:
+            self.create_actions(row)
+
+        window_id = self._canvas.create_window(0, 0, window=row, anchor="nw")
+        self._bind_wheel(row)
+        return row, window_id
+
+    def _bind_row(self, row, item: Optional[Dict[str, Any]]):
+        """Rellena una fila; sin datos muestra 'Cargando...' y desactiva las acciones."""
+        for lbl, (key, _title, _width) in zip(row.labels, self.columns):
+            if item is None:
+                lbl.configure(text="Cargando..." if key == self.columns[0][0] else "")
+            else:
+                value = item.get(key)
+                lbl.configure(text="" if value is None else str(value))
+
+        if self.bind_actions:
+            self.bind_actions(row, item)
+
+    def _on_yscroll(self, first, last):
+        self._scrollbar.set(first, last)
+        self._programar_layout()
+
+    def _programar_layout(self):
+        if self._layout_job is None:
+            self._layout_job = self.after_idle(self._layout)
+
+    def _layout(self):
+        """
+        Reconcilia las filas con la ventana visible: libera las que salen,
+        asigna filas del pool a las que entran y solo vuelve a rellenar
+        las que cambiaron de contenido.
+        """
+        self._layout_job = None
+        if not self.winfo_exists():
+            return
+
+        row_px = self._row_px()
+        width = self._canvas.winfo_width()
+        top = self._canvas.canvasy(0)
+        bottom = top + self._canvas.winfo_height()
+
+        first = max(int(top // row_px) - OVERSCAN_ROWS, 0)
+        last = min(math.ceil(bottom / row_px) + OVERSCAN_ROWS, self.total)
+        visible = range(first, last)
+
+        for index in [i for i in self._active if i not in visible]:
+            row, window_id, _item = self._active.pop(index)
+            self._canvas.itemconfigure(window_id, state="hidden")
+            self._free.append((row, window_id))
+
+        for index in visible:
+            item = self._item_at(index)
+            entry = self._active.get(index)
+
+            if entry is None:
+                row, window_id = self._free.pop() if self._free else self._new_row()
+                self._bind_row(row, item)
+            else:
+                row, window_id, bound = entry
+                if bound != item:
+                    self._bind_row(row, item)
+
+            self._canvas.coords(window_id, 0, index * row_px)
+            self._canvas.itemconfigure(window_id, width=width, height=row_px, state="normal")
+            self._active[index] = (row, window_id, item)
+
+    def _bind_wheel(self, widget):
+        """Propaga la rueda del ratón de una fila (y sus hijos) al canvas."""
+        for sequence in ("<MouseWheel>", "<Button-4>", "<Button-5>"):
+            tkinter.Misc.bind(widget, sequence, self._on_mousewheel, "+")
+        for child in widget.winfo_children():
+            self._bind_wheel(child)
+
+    def _on_mousewheel(self, event):
+        if event.num == 4 or getattr(event, "delta", 0) > 0:
+            step = -SCROLL_UNITS_PER_STEP
+        else:
+            step = SCROLL_UNITS_PER_STEP
+        self._canvas.yview_scroll(step, "units")
+        return "break"
+
+    def destroy(self):
+        for job in (self._poll_job, self._layout_job, self._search_job):
+            if job is not None:
+                self.after_cancel(job)
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        super().destroy()
@@ -1,6 +1,11 @@
-
+import argparse
+import itertools
+import random
+import time
+from datetime import date, datetime, timedelta
 
 import madre_db
+import madre_images
 
 
 def create_sample_users():
@@ -33,7 +38,7 @@ def create_sample_users():
         user = madre_db.get_user("juan_perez")
         user_id = user['id']
 
-        madre_db.set_user_profile_photo(
+        madre_images.set_profile_photo(
             user_id,
             "data/users/profile_photos/juan_perez.jpg"
         )
@@ -91,7 +96,7 @@ def create_sample_users():
         ]
 
         for photo_path, descripcion in gallery_photos:
-            madre_db.add_photo_to_gallery(user_id, photo_path, descripcion)
+            madre_images.add_gallery_photo(user_id, photo_path, descripcion)
         print(f"  - {len(gallery_photos)} fotos añadidas a la galería")
 
     if madre_db.create_user(
@@ -108,7 +113,7 @@ def create_sample_users():
         user = madre_db.get_user("maria_lopez")
         user_id = user['id']
 
-        madre_db.set_user_profile_photo(
+        madre_images.set_profile_photo(
             user_id,
             "data/users/profile_photos/maria_lopez.jpg"
         )
@@ -165,7 +170,7 @@ def create_sample_users():
         ]
 
         for photo_path, descripcion in gallery_photos:
-            madre_db.add_photo_to_gallery(user_id, photo_path, descripcion)
+            madre_images.add_gallery_photo(user_id, photo_path, descripcion)
         print(f"  - {len(gallery_photos)} fotos añadidas a la galería")
 
     if madre_db.create_user(
@@ -182,7 +187,7 @@ def create_sample_users():
         user = madre_db.get_user("carlos_rodriguez")
         user_id = user['id']
 
-        madre_db.set_user_profile_photo(
+        madre_images.set_profile_photo(
             user_id,
             "data/users/profile_photos/carlos_rodriguez.jpg"
         )
@@ -238,7 +243,7 @@ def create_sample_users():
         ]
 
         for photo_path, descripcion in gallery_photos:
-            madre_db.add_photo_to_gallery(user_id, photo_path, descripcion)
+            madre_images.add_gallery_photo(user_id, photo_path, descripcion)
         print(f"  - {len(gallery_photos)} fotos añadidas a la galería")
 
 
@@ -261,8 +266,8 @@ Este sistema te permite:
     print("✓ Contenido de sincronización creado")
 
 
-def main():
-    """Función principal."""
+def populate_sample_data():
+    """Datos de ejemplo: tres usuarios completos, clases, ejercicios y equipos."""
     print("=" * 60)
     print("POBLANDO BASE DE DATOS DEL SISTEMA GYM")
     print("=" * 60)
@@ -273,6 +278,7 @@ def main():
     populate_classes_and_schedules()
     populate_exercises()
     populate_equipment_zones()
+    madre_images.shutdown()
 
     print()
     print("=" * 60)
@@ -494,5 +500,279 @@ def populate_equipment_zones():
             print(f"✓ Equipo/Zona '{equipment['nombre']}' creado")
 
 
+NOMBRES = ["Juan", "María", "Carlos", "Lucía", "Javier", "Ana", "Pablo", "Laura", "Diego", "Elena",
+           "Sergio", "Marta", "Andrés", "Paula", "Raúl", "Sara", "Miguel", "Carmen", "Hugo", "Irene"]
+APELLIDOS = ["García", "López", "Martínez", "Sánchez", "Pérez", "Gómez", "Fernández", "Ruiz", "Díaz",
+             "Moreno", "Muñoz", "Álvarez", "Romero", "Navarro", "Torres", "Domínguez", "Vázquez", "Gil"]
+EQUIPOS = ["Equipo A - Fitness Avanzado", "Equipo B - Cardio y Resistencia", "Equipo C - Principiantes",
+           "Equipo D - Fuerza", "Equipo E - Funcional", None]
+FRASES_CHAT = ["¿Vienes hoy al gimnasio?", "Te espero en la sala de pesas", "¡Buen entreno!",
+               "¿A qué hora es spinning?", "Hoy toca pierna", "No puedo ir, mañana sí",
+               "¿Me pasas la rutina?", "Gracias por el consejo", "Nos vemos en clase de yoga",
+               "He batido mi récord en sentadilla"]
+
+SYNTHETIC_PREFIX = "socio_"
+SYNTHETIC_PASSWORD = "socio123"
+SYNTHETIC_TABLES = ("users", "workout_logs", "checkin_history", "chat_messages", "class_bookings")
+DIAS_SEMANA = ["Lunes", "Martes", "Miércoles", "Jueves", "Viernes", "Sábado", "Domingo"]
+
+
+def _chunks(rows, size: int):
+    """Agrupa un iterable de filas en listas de `size` para executemany."""
+    iterator = iter(rows)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _bulk_insert(conn, sql: str, rows, lote: int, etiqueta: str) -> int:
+    """Inserta filas con executemany, confirmando cada `lote` filas."""
+    total = 0
+    start = time.perf_counter()
+    for chunk in _chunks(rows, lote):
+        conn.executemany(sql, chunk)
+        conn.commit()
+        total += len(chunk)
+        print(f"\r  {etiqueta}: {total:,} filas", end="", flush=True)
+    print(f"\r  ✓ {etiqueta}: {total:,} filas en {time.perf_counter() - start:.1f}s")
+    return total
+
+
+def _aplazar_indices(cursor) -> list:
+    """
+    Elimina los índices de las tablas a cargar y los triggers del índice de
+    búsqueda (se reconstruye al final) y devuelve su SQL para recrearlos. Los
+    triggers de db_version, sync_version y del log de cambios (CDC) se
+    mantienen: las filas cargadas invalidan las cachés y llegan a las réplicas.
+    """
+    placeholders = ",".join("?" * len(SYNTHETIC_TABLES))
+    cursor.execute(f'''
+        SELECT type, name, sql FROM sqlite_master
+        WHERE sql IS NOT NULL AND tbl_name IN ({placeholders})
+          AND (type = 'index' OR (type = 'trigger' AND name LIKE '%\\_fts\\_%' ESCAPE '\\'))
+    ''', SYNTHETIC_TABLES)
+    objetos = [(row['type'], row['name'], row['sql']) for row in cursor.fetchall()]
+    for tipo, nombre, _sql in objetos:
+        cursor.execute(f"DROP {tipo.upper()} IF EXISTS {nombre}")
+    return objetos
+
+
+def _restaurar_indices(cursor, objetos: list):
+    for _tipo, _nombre, sql in objetos:
+        cursor.execute(sql)
+
+
+def _fecha_aleatoria(rng: random.Random, hasta: date, dias: int) -> date:
+    return hasta - timedelta(days=rng.randrange(dias))
+
+
+def _generar_socios(rng: random.Random, inicio: int, socios: int, hasta: date, dias: int):
+    password_hash = madre_db.hash_password(SYNTHETIC_PASSWORD)
+    for n in range(inicio, inicio + socios):
+        nombre = rng.choice(NOMBRES)
+        apellido1, apellido2 = rng.choice(APELLIDOS), rng.choice(APELLIDOS)
+        username = f"{SYNTHETIC_PREFIX}{n:06d}"
+        registro = datetime.combine(_fecha_aleatoria(rng, hasta, dias * 2), datetime.min.time())
+        yield (
+            username, password_hash, int(rng.random() > 0.03),
+            f"{nombre} {apellido1} {apellido2}", f"{username}@example.com",
+            f"+34 6{rng.randrange(10**7, 10**8)}", registro.isoformat(), rng.choice(EQUIPOS),
+            (datetime.combine(hasta, datetime.min.time()) - timedelta(hours=rng.randrange(24 * 7))).isoformat()
+        )
+
+
+def _generar_entrenos(rng: random.Random, user_ids: list, exercise_ids: list, por_socio: int,
+                      hasta: date, dias: int):
+    """Sesiones de 3-4 series de un ejercicio hasta sumar ~por_socio series por socio."""
+    for user_id in user_ids:
+        restantes = int(rng.expovariate(1 / por_socio)) if por_socio else 0
+        while restantes > 0:
+            fecha = _fecha_aleatoria(rng, hasta, dias)
+            exercise_id = rng.choice(exercise_ids)
+            peso = round(rng.uniform(10, 120) / 2.5) * 2.5
+            log_date = datetime.combine(fecha, datetime.min.time()) + timedelta(hours=rng.randrange(6, 22))
+            for serie in range(1, min(rng.randint(3, 4), restantes) + 1):
+                yield (user_id, exercise_id, fecha.isoformat(), serie, rng.randint(6, 15), peso,
+                       rng.choice((60, 90, 120)), (log_date + timedelta(minutes=2 * serie)).isoformat())
+            restantes -= serie
+
+
+def _generar_checkins(rng: random.Random, user_ids: list, por_socio: int, hasta: date, dias: int):
+    """Check-ins concentrados en la franja de 6 a 9 (hora punta de la mañana) y por la tarde."""
+    for user_id in user_ids:
+        for _ in range(rng.randint(0, 2 * por_socio)):
+            hora = rng.choice((6, 7, 7, 8, 8, 9, 13, 17, 18, 19, 20))
+            entrada = datetime.combine(_fecha_aleatoria(rng, hasta, dias), datetime.min.time()) + timedelta(
+                hours=hora, minutes=rng.randrange(60))
+            salida = entrada + timedelta(minutes=rng.randint(40, 120))
+            yield (user_id, entrada.isoformat(), salida.isoformat(),
+                   rng.choice(("qr", "qr", "nfc", "manual")), "entrada")
+
+
+def _generar_chat(rng: random.Random, usernames: list, por_socio: int, hasta: date, dias: int):
+    """Conversaciones cortas entre pares de socios, en orden cronológico dentro de cada una."""
+    mensajes = len(usernames) * por_socio
+    while mensajes > 0:
+        a, b = rng.sample(usernames, 2) if len(usernames) > 1 else (usernames[0], usernames[0])
+        momento = datetime.combine(_fecha_aleatoria(rng, hasta, dias), datetime.min.time()) + timedelta(
+            hours=rng.randrange(7, 23))
+        for _ in range(min(rng.randint(2, 8), mensajes)):
+            momento += timedelta(seconds=rng.randint(5, 600))
+            origen, destino = (a, b) if rng.random() < 0.5 else (b, a)
+            yield (origen, destino, rng.choice(FRASES_CHAT), momento.isoformat(), int(rng.random() < 0.9))
+            mensajes -= 1
+
+
+def _generar_reservas(rng: random.Random, user_ids: list, schedules: list, por_socio: int,
+                      hasta: date, dias: int):
+    """Reservas en el día de la semana de cada horario; las pasadas, asistidas o canceladas."""
+    lunes_final = hasta - timedelta(days=hasta.weekday())
+    semanas = max(dias // 7, 1)
+    for user_id in user_ids:
+        for _ in range(rng.randint(0, 2 * por_socio)):
+            schedule_id, dia_semana = rng.choice(schedules)
+            semana = rng.randrange(-semanas, 2)
+            fecha = lunes_final + timedelta(weeks=semana, days=DIAS_SEMANA.index(dia_semana)
+                                            if dia_semana in DIAS_SEMANA else 0)
+            reserva = datetime.combine(fecha - timedelta(days=rng.randint(0, 6)), datetime.min.time())
+            if fecha > hasta:
+                status, checked_in, checkin_date = "confirmed", 0, None
+            elif rng.random() < 0.1:
+                status, checked_in, checkin_date = "cancelled", 0, None
+            else:
+                asistio = rng.random() < 0.85
+                status = "attended" if asistio else "confirmed"
+                checked_in = int(asistio)
+                checkin_date = datetime.combine(fecha, datetime.min.time()).isoformat() if asistio else None
+            yield (user_id, schedule_id, fecha.isoformat(), reserva.isoformat(), status, checked_in,
+                   checkin_date, reserva.isoformat() if status == "cancelled" else None)
+
+
+def populate_synthetic(socios: int, entrenos: int, checkins: int, chats: int, reservas: int,
+                       semilla: int, dias: int, hasta: date, lote: int, forzar: bool = False):
+    """
+    Genera un volumen realista y reproducible de datos sintéticos.
+
+    La misma semilla, los mismos parámetros y la misma fecha final producen
+    exactamente los mismos datos. Los índices de las tablas cargadas se
+    eliminan antes de la carga y se recrean al final, y el índice de búsqueda
+    se reconstruye de una vez con rebuild_search_index. Las filas cargadas
+    quedan en el log de cambios como cualquier otra escritura.
+    """
+    rng = random.Random(semilla)
+
+    if not madre_db.get_all_exercises():
+        populate_exercises()
+    if not madre_db.get_class_schedules():
+        populate_classes_and_schedules()
+
+    print("=" * 60)
+    print(f"DATOS SINTÉTICOS: {socios:,} socios (semilla {semilla}, {dias} días hasta {hasta})")
+    print("=" * 60)
+
+    start = time.perf_counter()
+    with madre_db.db_session() as (conn, cursor):
+        cursor.execute("SELECT COUNT(*) AS total FROM users WHERE username LIKE ?", (f"{SYNTHETIC_PREFIX}%",))
+        existentes = cursor.fetchone()['total']
+        if existentes and not forzar:
+            print(f"La base de datos ya tiene {existentes:,} socios sintéticos; use --forzar para añadir más.")
+            return
+
+        cursor.execute("SELECT id FROM exercises ORDER BY id")
+        exercise_ids = [row['id'] for row in cursor.fetchall()]
+        cursor.execute("SELECT id, dia_semana FROM class_schedules ORDER BY id")
+        schedules = [(row['id'], row['dia_semana']) for row in cursor.fetchall()]
+
+        conn.commit()
+        cursor.execute("PRAGMA synchronous=OFF")
+        cursor.execute("PRAGMA cache_size=-200000")
+        cursor.execute("PRAGMA temp_store=MEMORY")
+
+        aplazados = _aplazar_indices(cursor)
+        conn.commit()
+        print(f"  {len(aplazados)} índices/triggers de búsqueda aplazados hasta el final de la carga")
+
+        try:
+            _bulk_insert(conn, '''
+                INSERT INTO users (username, password_hash, permiso_acceso, nombre_completo, email,
+                                   telefono, fecha_registro, equipo, last_sync)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', _generar_socios(rng, existentes, socios, hasta, dias), lote, "socios")
+
+            cursor.execute('''
+                SELECT id, username FROM users WHERE username LIKE ? ORDER BY id DESC LIMIT ?
+            ''', (f"{SYNTHETIC_PREFIX}%", socios))
+            nuevos = cursor.fetchall()[::-1]
+            user_ids = [row['id'] for row in nuevos]
+            usernames = [row['username'] for row in nuevos]
+
+            _bulk_insert(conn, '''
+                INSERT INTO workout_logs (user_id, exercise_id, fecha, serie, repeticiones, peso,
+                                          descanso_segundos, log_date)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ''', _generar_entrenos(rng, user_ids, exercise_ids, entrenos, hasta, dias), lote, "series de entreno")
+
+            _bulk_insert(conn, '''
+                INSERT INTO checkin_history (user_id, checkin_date, checkout_date, checkin_method, location)
+                VALUES (?, ?, ?, ?, ?)
+            ''', _generar_checkins(rng, user_ids, checkins, hasta, dias), lote, "check-ins")
+
+            _bulk_insert(conn, '''
+                INSERT INTO chat_messages (from_user, to_user, message, timestamp, is_read)
+                VALUES (?, ?, ?, ?, ?)
+            ''', _generar_chat(rng, usernames, chats, hasta, dias), lote, "mensajes de chat")
+
+            if schedules:
+                _bulk_insert(conn, '''
+                    INSERT OR IGNORE INTO class_bookings (user_id, schedule_id, fecha_clase, booking_date,
+                                                          status, checked_in, checkin_date, cancellation_date)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                ''', _generar_reservas(rng, user_ids, schedules, reservas, hasta, dias), lote, "reservas")
+        finally:
+            print("  Recreando índices y triggers de búsqueda...")
+            _restaurar_indices(cursor, aplazados)
+            conn.commit()
+            cursor.execute("ANALYZE")
+
+    print("  Reconstruyendo índice de búsqueda...")
+    madre_db.rebuild_search_index()
+    print(f"\n✓ Carga completada en {time.perf_counter() - start:.1f}s "
+          f"(contraseña de los socios: {SYNTHETIC_PASSWORD})")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Puebla la base de datos (DB_PATH) con datos de ejemplo o sintéticos a escala",
+        epilog="Ejemplo: DB_PATH=/tmp/bench.db python populate_db.py --escala 0.1 --semilla 7"
+    )
+    parser.add_argument("--escala", type=float,
+                        help="Factor de escala de datos sintéticos (1.0 = 100.000 socios, ~3M series, "
+                             "~1M check-ins, ~1M mensajes de chat y ~500k reservas)")
+    parser.add_argument("--socios", type=int, help="Número de socios sintéticos (sustituye a --escala)")
+    parser.add_argument("--entrenos-por-socio", type=int, default=30, help="Media de series registradas por socio")
+    parser.add_argument("--checkins-por-socio", type=int, default=10, help="Media de check-ins por socio")
+    parser.add_argument("--chats-por-socio", type=int, default=10, help="Mensajes de chat por socio")
+    parser.add_argument("--reservas-por-socio", type=int, default=5, help="Media de reservas por socio")
+    parser.add_argument("--dias", type=int, default=365, help="Días de historial a generar")
+    parser.add_argument("--hasta", type=date.fromisoformat, default=date.today(),
+                        help="Último día del historial (AAAA-MM-DD, por defecto hoy)")
+    parser.add_argument("--semilla", type=int, default=42, help="Semilla del generador")
+    parser.add_argument("--lote", type=int, default=50000, help="Filas por executemany/commit")
+    parser.add_argument("--forzar", action="store_true", help="Añadir socios aunque ya existan sintéticos")
+    args = parser.parse_args()
+
+    if args.escala is None and args.socios is None:
+        populate_sample_data()
+        return
+
+    socios = args.socios if args.socios is not None else max(int(100_000 * args.escala), 1)
+    populate_synthetic(
+        socios, args.entrenos_por_socio, args.checkins_por_socio, args.chats_por_socio,
+        args.reservas_por_socio, args.semilla, args.dias, args.hasta, args.lote, args.forzar
+    )
+
+
 if __name__ == "__main__":
     main()
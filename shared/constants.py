@@ -13,10 +13,19 @@ HTTP_TIMEOUT_SHORT = 5
 HTTP_TIMEOUT_MEDIUM = 10
 HTTP_TIMEOUT_LONG = 30
 HTTP_TIMEOUT_UPLOAD = 60
+HTTP_MAX_RETRY_AFTER = 30
 
 SYNC_REQUIRED_HOURS = 72
 SYNC_INTERVAL_INITIAL = 300
 SYNC_INTERVAL_NORMAL = 1800
+SYNC_STARTUP_DELAY = 2
+SYNC_JITTER = 0.2
+SYNC_BACKOFF_BASE = 30
+SYNC_BACKOFF_MAX = 3600
+SYNC_IDLE_AFTER = 600
+SYNC_IDLE_MULTIPLIER = 4
+SYNC_WAKE_MIN_GAP = 30
+DB_BUSY_RETRY_AFTER = 5
 
 STATUS_APPROVED = "aprobado"
 STATUS_SYNC_SUCCESS = "sincronizacion_exitosa"
@@ -24,6 +33,7 @@ STATUS_OK = "ok"
 
 ERROR_CONNECTION = "Error de conexión: No se pudo alcanzar la Aplicación Madre."
 ERROR_TIMEOUT = "Error: La petición de conexión ha tardado demasiado."
+ERROR_SERVER_BUSY = "Error: La Aplicación Madre está saturada, reintente más tarde."
 ERROR_INVALID_CREDENTIALS = "Credenciales inválidas."
 ERROR_ACCESS_DENIED = "Permiso de acceso denegado por el administrador."
 ERROR_USER_NOT_FOUND = "Usuario no encontrado."
@@ -31,27 +41,119 @@ ERROR_SYNC_REQUIRED = "Primera sincronización requerida"
 ERROR_UNKNOWN = "Error desconocido"
 
 LOCAL_DATA_DIR_NAME = "data"
+ATTACHMENTS_DIR_NAME = "attachments"
+THUMBNAILS_DIR_NAME = "thumbnails"
+IMAGE_CACHE_DIR_NAME = "image_cache"
 HIJA_LOCAL_DIR_NAME = "hija_local"
 CREDENTIALS_FILENAME = "credentials.json"
+LOCAL_STORE_FILENAME = "hija_store.db"
 
 ENDPOINT_AUTORIZAR = "/autorizar"
 ENDPOINT_VALIDAR_SYNC = "/validar_sync"
 ENDPOINT_SINCRONIZAR_DATOS = "/sincronizar_datos"
+ENDPOINT_VERSION_SYNC = "/sync/version"
 ENDPOINT_ACTUALIZAR_PERMISO = "/actualizar_permiso"
+ENDPOINT_ACTUALIZAR_PERMISOS = "/actualizar_permisos"
+ENDPOINT_SINCRONIZAR_MASIVA = "/sincronizar_masiva"
 ENDPOINT_USUARIOS = "/usuarios"
 ENDPOINT_ENVIAR_MENSAJE = "/enviar_mensaje"
 ENDPOINT_OBTENER_MENSAJES = "/obtener_mensajes"
+ENDPOINT_OBTENER_HILOS = "/obtener_hilos"
+ENDPOINT_OBTENER_HILO = "/obtener_hilo"
 ENDPOINT_MARCAR_LEIDO = "/marcar_leido"
 ENDPOINT_CONTAR_NO_LEIDOS = "/contar_no_leidos"
+ENDPOINT_BUSCAR_MENSAJES = "/buscar_mensajes"
 ENDPOINT_ENVIAR_CHAT = "/enviar_chat"
 ENDPOINT_OBTENER_CHAT = "/obtener_chat"
+ENDPOINT_ADJUNTOS = "/adjuntos"
+ENDPOINT_IMAGENES = "/imagenes"
+ENDPOINT_RESERVAR_CLASE = "/clases/reservar"
+ENDPOINT_MIS_RESERVAS = "/clases/mis-reservas"
+ENDPOINT_WORKOUT_LOG = "/workout/log"
+ENDPOINT_WORKOUT_HISTORIAL = "/workout/historial"
 ENDPOINT_HEALTH = "/health"
+ENDPOINT_BATCH = "/batch"
+ENDPOINT_REPLICACION_CAMBIOS = "/replicacion/cambios"
+
+STORAGE_CHUNK_SIZE = 1024 * 1024
+MAX_ATTACHMENT_MB = 100
+STORAGE_GC_GRACE_SECONDS = 3600
+
+DB_BUSY_TIMEOUT_MS = 10000
+DEFAULT_WORKERS = 4
+SHUTDOWN_TIMEOUT = 15
+
+THUMBNAIL_SIZES = {"small": 128, "medium": 320, "large": 800}
+THUMBNAIL_QUALITY = 85
+THUMBNAIL_WORKERS = 2
+IMAGE_CACHE_MB = 50
+
+OUTBOX_MAX_ATTEMPTS = 5
+OUTBOX_RETRY_INTERVAL = 30
+IDEMPOTENCY_HEADER = "Idempotency-Key"
+IDEMPOTENCY_RETENTION_DAYS = 7
+
+BATCH_WINDOW_MS = 20
+BATCH_MAX_REQUESTS = 20
+
+QUERY_PROFILE_SAMPLE_RATE = 0.05
+QUERY_PROFILE_TOP_N = 20
+QUERY_PROFILE_FLUSH_INTERVAL = 60
+QUERY_PROFILE_DIR_NAME = "query_profile"
+
+CDC_RETENTION_DAYS = 30
+CDC_PAGE_SIZE = 500
+CDC_MAINTENANCE_INTERVAL = 3600
+
+REPLICATION_INTERVAL = 60
+REPLICATION_BATCH_SIZE = 500
+REPLICATION_TIMEOUT = 30
+REPLICATION_MIN_TOKEN_LENGTH = 16
+
+BACKUP_DIR_NAME = "backups"
+BACKUP_INTERVAL = 86400
+BACKUP_KEEP = 7
+BACKUP_PAGES = 256
+BACKUP_STEP_SLEEP_MS = 5
+BACKUP_MAX_RESTARTS = 5
+
+ARCHIVE_DIR_NAME = "archive"
+ARCHIVE_HORIZON_DAYS = 365
+ARCHIVE_PERIOD = "year"
+ARCHIVE_BATCH_SIZE = 5000
+ARCHIVE_INTERVAL = 86400
+
+COMPRESSION_ENCODINGS = "zstd,br,gzip"
+COMPRESSION_MIN_SIZE = 1024
+COMPRESSION_GZIP_LEVEL = 6
+COMPRESSION_ZSTD_LEVEL = 3
+COMPRESSION_BROTLI_LEVEL = 5
+COMPRESSION_CACHE_ENTRIES = 64
+
+ADMISSION_MAX_CONCURRENT = 64
+ADMISSION_BULK_SHARE = 0.5
+ADMISSION_CRITICAL_RESERVE = 0.1
+ADMISSION_MAX_QUEUE = 100
+ADMISSION_QUEUE_TIMEOUT = 5.0
+ADMISSION_RETRY_AFTER = 2
+ADMISSION_CRITICAL_PATHS = "/autorizar,/checkin"
+ADMISSION_BULK_PATHS = ("/usuarios,/workout/historial,/sincronizar_masiva,/actualizar_permisos,"
+                        "/buscar_mensajes,/cambios,/replicacion,/admin,/exportar,/export,/analytics,/reportes")
+ADMISSION_EXEMPT_PATHS = "/health,/metrics"
+ADMISSION_RATE_CRITICAL = 20.0
+ADMISSION_BURST_CRITICAL = 60
+ADMISSION_RATE_INTERACTIVE = 5.0
+ADMISSION_BURST_INTERACTIVE = 30
+ADMISSION_RATE_BULK = 0.5
+ADMISSION_BURST_BULK = 5
+ADMISSION_MAX_BUCKETS = 10000
 
 LOG_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
 LOG_DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
 LOG_FILE_MAX_BYTES = 10 * 1024 * 1024
 LOG_FILE_BACKUP_COUNT = 5
 LOG_DIR_NAME = "logs"
+LOG_RATE_BURST = 50
 
 APP_VERSION = "3.1.0"
 APP_FEATURES = [
@@ -1,25 +1,256 @@
 """
 Configuración centralizada de logging para el sistema GYM.
 Proporciona logging estructurado con rotación de archivos y salida a consola.
+
+Por defecto (LOG_ASYNC=true) los loggers no escriben en el hilo que los
+llama: cada uno tiene un QueueHandler que encola el registro y un único
+QueueListener por proceso lo formatea y lo escribe (archivo y consola) en
+segundo plano. Opcionalmente:
+  - LOG_JSON=true: una línea JSON por registro en lugar del texto plano.
+  - LOG_RATE_LIMIT / LOG_RATE_BURST: máximo de registros por segundo por
+    logger (por debajo de WARNING); los descartados se resumen en el
+    siguiente registro que pase.
+  - LOG_SAMPLE_RATE: fracción de registros DEBUG/INFO que se conservan.
 """
 
+import atexit
+import json
 import logging
 import os
-from logging.handlers import RotatingFileHandler
-from typing import Optional
+import queue
+import random
+import threading
+import time
+from datetime import datetime
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from typing import Dict, Optional
+from config.settings import get_env
 from shared.constants import (
     LOG_FORMAT,
     LOG_DATE_FORMAT,
     LOG_FILE_MAX_BYTES,
     LOG_FILE_BACKUP_COUNT,
-    LOG_DIR_NAME
+    LOG_DIR_NAME,
+    LOG_RATE_BURST
 )
 
+LOG_ASYNC = get_env('LOG_ASYNC', True, bool)
+LOG_JSON = get_env('LOG_JSON', False, bool)
+LOG_RATE_LIMIT = get_env('LOG_RATE_LIMIT', 0.0, float)
+LOG_RATE_BURST_SIZE = get_env('LOG_RATE_BURST', LOG_RATE_BURST, int)
+LOG_SAMPLE_RATE = get_env('LOG_SAMPLE_RATE', 1.0, float)
+
+LOG_DIR = os.path.join(os.path.dirname(__file__), '..', LOG_DIR_NAME)
+
+
+class JsonFormatter(logging.Formatter):
+    """Formatea cada registro como una línea JSON."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "module": record.module,
+            "line": record.lineno,
+            "thread": record.threadName,
+            "pid": record.process,
+        }
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False)
+
+
+def _make_formatter() -> logging.Formatter:
+    return JsonFormatter() if LOG_JSON else logging.Formatter(LOG_FORMAT, LOG_DATE_FORMAT)
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Limita y muestrea los registros de un logger por debajo de WARNING.
+
+    Cubeta de tokens de `rate` registros/s con ráfagas de hasta `burst`;
+    además conserva solo una fracción `sample_rate` de DEBUG/INFO. Los
+    avisos y errores pasan siempre. Cuando vuelve a pasar un registro tras
+    haber descartado otros, se le añade cuántos se suprimieron.
+    """
+
+    def __init__(self, rate: float = 0.0, burst: int = LOG_RATE_BURST, sample_rate: float = 1.0):
+        super().__init__()
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self.sample_rate = sample_rate
+        self._tokens = float(self.burst)
+        self._last = time.monotonic()
+        self._dropped = 0
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+
+        if self.sample_rate < 1.0 and random.random() >= self.sample_rate:
+            return False
+
+        if self.rate <= 0:
+            return True
+
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            if self._tokens < 1:
+                self._dropped += 1
+                return False
+            self._tokens -= 1
+            dropped, self._dropped = self._dropped, 0
+
+        if dropped:
+            record.msg = f"{record.getMessage()} [{dropped} registros suprimidos por límite de tasa]"
+            record.args = None
+        return True
+
+
+class _FileQueueHandler(QueueHandler):
+    """
+    QueueHandler que marca el archivo de destino del registro.
+
+    prepare() no aplica el formateador (fecha, JSON...) en el hilo que
+    registra: solo resuelve el mensaje con sus argumentos, para que el
+    registro no dependa de objetos que puedan cambiar antes de escribirse.
+    """
+
+    def __init__(self, log_queue, log_file: str, console: bool):
+        super().__init__(log_queue)
+        self.log_file = log_file
+        self.console = console
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record.msg = record.getMessage()
+        record.args = None
+        record.log_file = self.log_file
+        record.console = self.console
+        return record
+
+
+class _RoutingHandler(logging.Handler):
+    """Handler del hilo de escritura: envía cada registro a su archivo y a consola."""
+
+    def __init__(self):
+        super().__init__()
+        self._files: Dict[str, logging.Handler] = {}
+        self._console: Optional[logging.Handler] = None
+        self._formatter = _make_formatter()
+
+    def file_handler(self, log_file: str) -> logging.Handler:
+        handler = self._files.get(log_file)
+        if handler is None:
+            handler = _file_handler(log_file)
+            handler.setFormatter(self._formatter)
+            self._files[log_file] = handler
+        return handler
+
+    def console_handler(self) -> logging.Handler:
+        if self._console is None:
+            self._console = logging.StreamHandler()
+            self._console.setFormatter(self._formatter)
+        return self._console
+
+    def handle(self, record: logging.LogRecord):
+        log_file = getattr(record, "log_file", None)
+        if log_file:
+            self.file_handler(log_file).handle(record)
+        if getattr(record, "console", False):
+            self.console_handler().handle(record)
+        return True
+
+    def emit(self, record: logging.LogRecord):
+        self.handle(record)
+
+    def flush(self):
+        for handler in list(self._files.values()) + ([self._console] if self._console else []):
+            try:
+                handler.flush()
+            except (OSError, ValueError):
+                pass
+
+    def close(self):
+        for handler in list(self._files.values()) + ([self._console] if self._console else []):
+            handler.close()
+        super().close()
+
+
+_queue: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+_router: Optional[_RoutingHandler] = None
+_listener: Optional[QueueListener] = None
+_listener_lock = threading.Lock()
+
+
+def _file_handler(log_file: str) -> RotatingFileHandler:
+    os.makedirs(LOG_DIR, exist_ok=True)
+    return RotatingFileHandler(
+        os.path.join(LOG_DIR, log_file),
+        maxBytes=LOG_FILE_MAX_BYTES,
+        backupCount=LOG_FILE_BACKUP_COUNT,
+        encoding='utf-8'
+    )
+
+
+def _ensure_listener():
+    """Arranca (una vez por proceso) el hilo que escribe los registros encolados."""
+    global _router, _listener
+    with _listener_lock:
+        if _listener is not None:
+            return
+        _router = _RoutingHandler()
+        _listener = QueueListener(_queue, _router, respect_handler_level=False)
+        _listener.start()
+
+
+def shutdown_logging():
+    """Escribe los registros pendientes y detiene el hilo de escritura."""
+    global _listener
+    with _listener_lock:
+        if _listener is None:
+            return
+        _listener.stop()
+        _listener = None
+        _router.flush()
+
+
+def _reset_after_fork():
+    """En un proceso hijo (fork) el hilo de escritura no existe: se vuelve a crear al usarse."""
+    global _queue, _listener, _router, _listener_lock
+    _queue = queue.SimpleQueue()
+    _listener = None
+    _router = None
+    _listener_lock = threading.Lock()
+    for logger in logging.Logger.manager.loggerDict.values():
+        for handler in getattr(logger, "handlers", []):
+            if isinstance(handler, _FileQueueHandler):
+                handler.queue = _queue
+    if LOG_ASYNC:
+        _ensure_listener()
+
+
+atexit.register(shutdown_logging)
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def _default_level() -> int:
+    """Nivel de LOG_LEVEL (INFO si no está definido o no es válido)."""
+    level = logging.getLevelName(get_env('LOG_LEVEL', 'INFO').upper())
+    return level if isinstance(level, int) else logging.INFO
+
 
 def setup_logger(
     name: str,
     log_file: Optional[str] = None,
-    level: int = logging.INFO,
+    level: Optional[int] = None,
     console_output: bool = True
 ) -> logging.Logger:
     """
@@ -28,7 +259,7 @@ def setup_logger(
     Args:
         name: Nombre del logger (usualmente nombre del módulo)
         log_file: Nombre opcional del archivo de log (sin ruta). Si es None, usa {name}.log
-        level: Nivel de logging (por defecto: INFO)
+        level: Nivel de logging (por defecto: LOG_LEVEL del entorno, o INFO)
         console_output: Si también debe mostrar salida en consola (por defecto: True)
 
     Returns:
@@ -39,33 +270,30 @@ def setup_logger(
         >>> logger.info("Aplicación iniciada")
     """
     logger = logging.getLogger(name)
-    logger.setLevel(level)
+    logger.setLevel(level if level is not None else _default_level())
 
     if logger.handlers:
         return logger
 
-    log_dir = os.path.join(os.path.dirname(__file__), '..', LOG_DIR_NAME)
-    os.makedirs(log_dir, exist_ok=True)
-
     if log_file is None:
         log_file = f"{name}.log"
-    log_path = os.path.join(log_dir, log_file)
 
-    formatter = logging.Formatter(LOG_FORMAT, LOG_DATE_FORMAT)
+    if LOG_RATE_LIMIT > 0 or LOG_SAMPLE_RATE < 1.0:
+        logger.addFilter(RateLimitFilter(LOG_RATE_LIMIT, LOG_RATE_BURST_SIZE, LOG_SAMPLE_RATE))
 
-    file_handler = RotatingFileHandler(
-        log_path,
-        maxBytes=LOG_FILE_MAX_BYTES,
-        backupCount=LOG_FILE_BACKUP_COUNT,
-        encoding='utf-8'
-    )
-    file_handler.setLevel(level)
+    if LOG_ASYNC:
+        _ensure_listener()
+        logger.addHandler(_FileQueueHandler(_queue, log_file, console_output))
+        return logger
+
+    formatter = _make_formatter()
+
+    file_handler = _file_handler(log_file)
     file_handler.setFormatter(formatter)
     logger.addHandler(file_handler)
 
     if console_output:
         console_handler = logging.StreamHandler()
-        console_handler.setLevel(level)
         console_handler.setFormatter(formatter)
         logger.addHandler(console_handler)
 
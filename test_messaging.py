@@ -4,7 +4,10 @@ Test script for the new messaging and chat features.
 Tests database operations and API endpoints for messaging.
 """
 
+import os
+import sqlite3
 import sys
+import tempfile
 import madre_db
 
 GREEN = '\033[92m'
@@ -86,6 +89,19 @@ def test_messaging():
         else:
             print_error("Failed to send reply")
 
+        print_info("\nChecking conversation thread...")
+        threads = madre_db.get_user_threads("juan_perez")
+        thread = next((t for t in threads if t['id'] == reply_id), None)
+        if thread and thread['message_count'] == 2:
+            full_thread = madre_db.get_thread(thread['thread_id'])
+            ids = [m['id'] for m in full_thread['mensajes']]
+            if ids == [msg_id, reply_id]:
+                print_success(f"Thread {thread['thread_id']} contains original and reply")
+            else:
+                print_error(f"Unexpected thread contents: {ids}")
+        else:
+            print_error("Reply is not the latest message of its thread")
+
         print_info("\nGetting specific message...")
         message = madre_db.get_message_by_id(msg_id)
         if message:
@@ -171,9 +187,68 @@ def test_chat():
         return False
 
 
+def test_search():
+    """Test full-text search over messages and chat."""
+    print_header("TEST 3: Message Search")
+
+    try:
+        print_info("Sending searchable message and chat...")
+        msg_id = madre_db.send_message(
+            from_user="juan_perez",
+            to_user="admin",
+            subject="Horario de natación",
+            body="Quisiera saber el horario de la piscina climatizada."
+        )
+        chat_id = madre_db.send_chat_message(
+            from_user="admin",
+            to_user="juan_perez",
+            message="La piscina abre a las 7:00."
+        )
+
+        print_info("\nSearching 'piscina' for juan_perez...")
+        results = madre_db.search_messages("juan_perez", "piscina")
+        found = {(r['tipo'], r['id']) for r in results}
+        if ('mensaje', msg_id) in found and ('chat', chat_id) in found:
+            print_success(f"Search returned message and chat ({len(results)} results)")
+        else:
+            print_error("Search did not return expected results")
+            return False
+
+        print_info("Searching with prefix and accents ('natacion', 'clima')...")
+        if any(r['id'] == msg_id for r in madre_db.search_messages("juan_perez", "natacion")):
+            print_success("Accent-insensitive search OK")
+        else:
+            print_error("Accent-insensitive search failed")
+        if any(r['id'] == msg_id for r in madre_db.search_messages("juan_perez", "clima")):
+            print_success("Prefix search OK")
+        else:
+            print_error("Prefix search failed")
+
+        if not madre_db.search_messages("maria_lopez", "piscina climatizada"):
+            print_success("Other users' messages are not visible")
+        else:
+            print_error("Search leaked messages of other users")
+            return False
+
+        print_info("Deleting message and searching again...")
+        madre_db.delete_message(msg_id)
+        results = madre_db.search_messages("juan_perez", "climatizada")
+        if not any(r['tipo'] == 'mensaje' and r['id'] == msg_id for r in results):
+            print_success("Deleted message removed from index")
+        else:
+            print_error("Deleted message still in index")
+            return False
+
+        return True
+
+    except Exception as e:
+        print_error(f"Search test failed: {e}")
+        return False
+
+
 def test_multi_madre():
     """Test multi-madre server functionality."""
-    print_header("TEST 3: Multi-Madre Server Support")
+    print_header("TEST 4: Multi-Madre Server Support")
 
     try:
         print_info("Registering secondary madre server...")
@@ -210,6 +285,158 @@ def test_multi_madre():
         return False
 
 
+def test_replication():
+    """Test two madre servers that insert concurrently and then replicate both ways."""
+    print_header("TEST 5: Replication Between Two Madre Servers")
+
+    original = (madre_db.DB_PATH, madre_db.settings.SERVER_NAME)
+    tmp_dir = tempfile.mkdtemp()
+    paths = {name: os.path.join(tmp_dir, f"{name}.db") for name in ("sede_norte", "sede_sur")}
+    tables = ("message_threads", "messages", "chat_messages")
+
+    def use(name):
+        madre_db.DB_PATH = paths[name]
+        madre_db.settings.SERVER_NAME = name
+
+    def pull(into, source):
+        applied = 0
+        for table in tables:
+            use(into)
+            mark = madre_db.get_replication_marks(source).get(table, start_seq)
+            use(source)
+            page = madre_db.export_changes(table, mark, exclude_origin=into)
+            use(into)
+            result = madre_db.apply_replicated_changes(source, table, page["changes"], new_seq=page["last_seq"])
+            applied += result["aplicados"]
+        return applied
+
+    try:
+        print_info("Cloning the database for two servers...")
+        source = sqlite3.connect(original[0])
+        for path in paths.values():
+            target = sqlite3.connect(path)
+            source.backup(target)
+            target.close()
+        start_seq = source.execute("SELECT COALESCE(MAX(seq), 0) FROM changes").fetchone()[0]
+        source.close()
+
+        print_info("Both servers write before replicating...")
+        ids = {}
+        for name in paths:
+            use(name)
+            root = madre_db.send_message("juan_perez", "admin", f"Hilo de {name}", f"Mensaje de {name}")
+            reply = madre_db.send_message("admin", "juan_perez", f"Re: Hilo de {name}",
+                                          f"Respuesta en {name}", parent_message_id=root)
+            chat = madre_db.send_chat_message("juan_perez", "admin", f"Chat desde {name}")
+            ids[name] = (root, reply, chat)
+
+        if ids["sede_norte"] != ids["sede_sur"]:
+            print_error(f"Expected colliding local ids, got {ids}")
+            return False
+        print_success(f"Both servers assigned the same local ids {ids['sede_norte']}")
+
+        applied = pull("sede_sur", "sede_norte") + pull("sede_norte", "sede_sur")
+        print_success(f"Replicated both ways: {applied} rows applied")
+
+        for name in paths:
+            use(name)
+            history = madre_db.get_chat_history("juan_perez", "admin", limit=500)
+            chats = {msg['message'] for msg in history}
+            threads = {thread['thread_subject']: thread for thread in madre_db.get_user_threads("juan_perez", limit=500)}
+            for origin in paths:
+                if f"Chat desde {origin}" not in chats:
+                    print_error(f"{name} is missing the chat message from {origin}")
+                    return False
+                thread = threads.get(f"Hilo de {origin}")
+                if thread is None or thread['message_count'] != 2:
+                    print_error(f"{name} has a wrong thread from {origin}: {thread}")
+                    return False
+                messages = madre_db.get_thread(thread['thread_id'])['mensajes']
+                if [msg['body'] for msg in messages] != [f"Mensaje de {origin}", f"Respuesta en {origin}"] \
+                        or messages[1]['parent_message_id'] != messages[0]['id']:
+                    print_error(f"{name} has wrong messages in the thread from {origin}: {messages}")
+                    return False
+            print_success(f"{name} has both servers' threads, replies and chat messages")
+
+        if pull("sede_sur", "sede_norte") + pull("sede_norte", "sede_sur"):
+            print_error("A second replication pass applied rows again")
+            return False
+        print_success("A second replication pass applies nothing")
+
+        return True
+
+    except Exception as e:
+        print_error(f"Replication test failed: {e}")
+        return False
+
+    finally:
+        madre_db.DB_PATH, madre_db.settings.SERVER_NAME = original
+
+
+def test_change_log():
+    """Test change log paging, compaction and the reset signal after retention."""
+    print_header("TEST 6: Change Data Capture Log")
+
+    original = madre_db.DB_PATH
+    path = os.path.join(tempfile.mkdtemp(), "cdc.db")
+
+    def ops(after_seq):
+        page = madre_db.get_changes(after_seq, tables=["messages"])
+        return [(change['row_id'], change['op']) for change in page['changes']]
+
+    try:
+        print_info("Cloning the database...")
+        source = sqlite3.connect(original)
+        target = sqlite3.connect(path)
+        source.backup(target)
+        target.close()
+        start_seq = source.execute("SELECT COALESCE(MAX(seq), 0) FROM changes").fetchone()[0]
+        source.close()
+        madre_db.DB_PATH = path
+
+        read_id = madre_db.send_message("juan_perez", "admin", "CDC leído", "Se marca como leído")
+        madre_db.mark_message_read(read_id)
+        deleted_id = madre_db.send_message("juan_perez", "admin", "CDC borrado", "Se borra")
+        madre_db.delete_message(deleted_id)
+
+        logged = ops(start_seq)
+        if [op for row_id, op in logged if row_id == read_id][:2] != ['I', 'U'] \
+                or [op for row_id, op in logged if row_id == deleted_id][0] != 'I' \
+                or logged[-1] != (deleted_id, 'D'):
+            print_error(f"Unexpected change log: {logged}")
+            return False
+        print_success(f"Change log recorded {len(logged)} message changes in order")
+
+        removed = madre_db.compact_changes()
+        compacted = ops(start_seq)
+        if sorted(compacted) != [(read_id, 'U'), (deleted_id, 'D')]:
+            print_error(f"Compaction did not keep the latest op per row: {compacted}")
+            return False
+        print_success(f"Compaction removed {removed} entries and kept the latest op per row")
+
+        latest = madre_db.get_changes(start_seq)['last_seq']
+        madre_db.purge_changes(retention_days=0)
+        behind = madre_db.get_changes(start_seq)
+        if not behind['reset'] or behind['changes']:
+            print_error(f"A consumer behind the purge was not told to resnapshot: {behind}")
+            return False
+        print_success("A consumer behind purged_up_to gets reset")
+
+        if madre_db.get_changes(latest)['reset']:
+            print_error("An up-to-date consumer was told to resnapshot")
+            return False
+        print_success("An up-to-date consumer keeps reading without reset")
+
+        return True
+
+    except Exception as e:
+        print_error(f"Change log test failed: {e}")
+        return False
+
+    finally:
+        madre_db.DB_PATH = original
+
+
 def main():
     """Run all messaging tests."""
     print(f"\n{BLUE}╔════════════════════════════════════════════════════════════╗{RESET}")
@@ -222,8 +449,14 @@ def main():
 
     results.append(('Live Chat System', test_chat()))
 
+    results.append(('Message Search', test_search()))
+
     results.append(('Multi-Madre Support', test_multi_madre()))
 
+    results.append(('Replication', test_replication()))
+
+    results.append(('Change Log', test_change_log()))
+
     print_header("TEST SUMMARY")
 
     passed = sum(1 for _, result in results if result)
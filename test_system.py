@@ -243,6 +243,271 @@ def test_credentials():
         return False
 
 
+def test_outbox_busy():
+    """Test that busy answers (503 + Retry-After, 409 in progress) keep writes queued."""
+    print_header("TEST 4: Outbox Replay Against Busy Responses")
+
+    try:
+        import asyncio
+        import json
+        import os
+        import tempfile
+        import uuid
+        import httpx
+        from hija_async import AsyncAPIClient, OUTBOX_OPERATIONS
+        from hija_store import LocalStore
+        from madre_idempotency import IdempotencyMiddleware
+        from shared.constants import IDEMPOTENCY_HEADER
+
+        username = f"outbox_{uuid.uuid4().hex[:8]}"
+        payload = {"username": username, "exercise_id": 1, "peso": 50, "repeticiones": 10}
+        state = {"mode": "busy", "keys": [], "applied": 0}
+
+        async def madre_stub(scope, receive, send):
+            """Slow write endpoint: 503 while the database is busy, else waits for 'release'."""
+            while (await receive()).get("more_body"):
+                pass
+            state["keys"].append(dict(scope["headers"]).get(IDEMPOTENCY_HEADER.lower().encode(), b"").decode())
+            if state["mode"] == "busy":
+                status, headers, body = 503, [(b"retry-after", b"1")], {"detail": "Base de datos ocupada"}
+            else:
+                state["started"].set()
+                await state["release"].wait()
+                state["applied"] += 1
+                status, headers, body = 200, [], {"status": "ok"}
+            await send({"type": "http.response.start", "status": status,
+                        "headers": headers + [(b"content-type", b"application/json")]})
+            await send({"type": "http.response.body", "body": json.dumps(body).encode()})
+
+        store = LocalStore(os.path.join(tempfile.mkdtemp(), "hija_local.db"))
+        cli = AsyncAPIClient(base_url="http://madre")
+
+        async def scenario():
+            await cli._client.aclose()
+            cli._client = httpx.AsyncClient(base_url="http://madre",
+                                            transport=httpx.ASGITransport(app=IdempotencyMiddleware(madre_stub)))
+
+            print_info("Sending a write while the madre database is busy (503 + Retry-After)...")
+            success, data = await cli.log_workout(payload, store=store)
+            entries = store.pending(username)
+            if not success or data.get("status") != "encolado" or len(entries) != 1 \
+                    or entries[0]['idempotency_key'] != state["keys"][0]:
+                print_error(f"Busy write was not queued with its key: {data}, {entries}")
+                return False
+            print_success("Busy write queued with the idempotency key it was sent with")
+
+            print_info("Replaying while the same write is still in progress (409)...")
+            state["mode"], state["started"], state["release"] = "slow", asyncio.Event(), asyncio.Event()
+            in_flight = asyncio.create_task(cli._client.post(
+                OUTBOX_OPERATIONS["registrar_serie"], json=payload,
+                headers={IDEMPOTENCY_HEADER: entries[0]['idempotency_key']}))
+            await state["started"].wait()
+            success, data = await cli.replay_outbox(store, username)
+            entries = store.pending(username)
+            if data.get("enviados") != 0 or len(entries) != 1 or entries[0]['attempts'] != 0:
+                print_error(f"409 in progress was counted as a failure: {data}, {entries}")
+                return False
+            print_success("Replay stopped on 409 without marking the write as failed")
+
+            state["release"].set()
+            await in_flight
+            success, data = await cli.replay_outbox(store, username)
+            if data != {"enviados": 1, "pendientes": 0} or state["applied"] != 1:
+                print_error(f"Replay after completion: {data}, applied {state['applied']} times")
+                return False
+            print_success("Later replay got the stored response; the write was applied once")
+            return True
+
+        try:
+            return asyncio.run_coroutine_threadsafe(scenario(), cli._loop).result(timeout=30)
+        finally:
+            cli.close()
+            store.close()
+
+    except Exception as e:
+        print_error(f"Outbox busy test failed: {e}")
+        return False
+
+
+def test_backup_restore():
+    """Test a compressed backup with archive files and its restore round trip."""
+    print_header("TEST 5: Backup And Restore Round Trip")
+
+    try:
+        import gzip
+        import os
+        import shutil
+        import sqlite3
+        import tempfile
+        import madre_backup
+        import madre_db
+
+        tmp_dir = tempfile.mkdtemp()
+        db_path = os.path.join(tmp_dir, "gym.db")
+        archive_dir = os.path.join(tmp_dir, "archive")
+        backup_dir = os.path.join(tmp_dir, "backups")
+        original_backup_dir = madre_backup.BACKUP_DIR
+        os.makedirs(archive_dir)
+
+        def archive_path(period):
+            return os.path.join(archive_dir, f"{madre_db.ARCHIVE_PREFIX}_{period}.db")
+
+        def query(path, sql):
+            conn = sqlite3.connect(path)
+            try:
+                return conn.execute(sql).fetchall()
+            finally:
+                conn.close()
+
+        def write(path, *statements):
+            conn = sqlite3.connect(path)
+            for statement in statements:
+                conn.execute(statement)
+            conn.commit()
+            conn.close()
+
+        source = sqlite3.connect(madre_db.DB_PATH)
+        target = sqlite3.connect(db_path)
+        source.backup(target)
+        target.close()
+        source.close()
+        write(archive_path("2025-01"), "CREATE TABLE chat_messages (id INTEGER PRIMARY KEY, message TEXT)",
+              "INSERT INTO chat_messages (message) VALUES ('antes')")
+        users = query(db_path, "SELECT username, nombre_completo FROM users ORDER BY username")
+
+        madre_backup.BACKUP_DIR = backup_dir
+        try:
+            print_info("Creating a compressed backup...")
+            backup = madre_backup.create_backup(directory=backup_dir, compress=True,
+                                                source=db_path, archive_dir=archive_dir)
+            copy_dir = madre_backup.archive_copy_dir(backup["archivo"])
+            if not backup["archivo"].endswith(".db.gz") or backup["archivos_historicos"] != 1 \
+                    or os.listdir(copy_dir) != [f"{madre_db.ARCHIVE_PREFIX}_2025-01.db.gz"]:
+                print_error(f"Unexpected backup: {backup}, archive folder {os.listdir(copy_dir)}")
+                return False
+            print_success(f"Backup {os.path.basename(backup['archivo'])} with its archive folder")
+
+            print_info("Changing the database and the archives, then restoring...")
+            write(db_path, "UPDATE users SET nombre_completo = 'modificado'")
+            write(archive_path("2025-01"), "INSERT INTO chat_messages (message) VALUES ('después')")
+            write(archive_path("2025-02"), "CREATE TABLE chat_messages (id INTEGER PRIMARY KEY, message TEXT)")
+            restored = madre_backup.restore_backup(backup["archivo"], target=db_path, archive_dir=archive_dir)
+        finally:
+            madre_backup.BACKUP_DIR = original_backup_dir
+
+        if query(db_path, "SELECT username, nombre_completo FROM users ORDER BY username") != users \
+                or query(archive_path("2025-01"), "SELECT message FROM chat_messages") != [("antes",)] \
+                or os.path.exists(archive_path("2025-02")) or restored["archivos_historicos"] != 1:
+            print_error(f"The database or its archives were not restored: {restored}")
+            return False
+        print_success("Database and archive files restored; the newer archive file was removed")
+
+        previous = restored["copia_previa"]
+        if not previous or not os.path.basename(previous).startswith(madre_backup.PRE_RESTORE_PREFIX) \
+                or len(os.listdir(madre_backup.archive_copy_dir(previous))) != 2:
+            print_error(f"Missing pre-restore safety copy: {previous}")
+            return False
+        if previous.endswith(".gz"):
+            with gzip.open(previous, "rb") as src, open(os.path.join(tmp_dir, "previa.db"), "wb") as dst:
+                shutil.copyfileobj(src, dst)
+            previous = os.path.join(tmp_dir, "previa.db")
+        if query(previous, "SELECT DISTINCT nombre_completo FROM users") != [("modificado",)]:
+            print_error("The pre-restore copy does not hold the overwritten data")
+            return False
+        print_success("The pre-restore safety copy holds the overwritten data and archives")
+
+        return True
+
+    except Exception as e:
+        print_error(f"Backup/restore test failed: {e}")
+        return False
+
+
+def test_admission():
+    """Test that overload sheds bulk before interactive and always admits critical."""
+    print_header("TEST 6: Priority Admission Control")
+
+    try:
+        import asyncio
+        import httpx
+        from madre_admission import (AdmissionController, AdmissionMiddleware, TokenBuckets,
+                                     PRIORITIES, CRITICAL, INTERACTIVE, BULK, classify)
+
+        paths = {CRITICAL: "/checkin", INTERACTIVE: "/enviar_mensaje", BULK: "/usuarios"}
+        if any(classify(path) != priority for priority, path in paths.items()):
+            print_error(f"Unexpected route classes: {[classify(path) for path in paths.values()]}")
+            return False
+
+        async def scenario():
+            # 4 slots: bulk may use 2, interactive 3, and the last one is reserved for critical
+            controller = AdmissionController(capacity=4, bulk_share=0.5, critical_reserve=0.25,
+                                             max_queue=0, queue_timeout=0)
+            buckets = TokenBuckets(rates={priority: (0, 0) for priority in PRIORITIES})
+            release = asyncio.Event()
+            started = []
+
+            async def slow_app(scope, receive, send):
+                """Holds every admitted request until 'release' is set."""
+                started.append(scope["path"])
+                await release.wait()
+                await send({"type": "http.response.start", "status": 200,
+                            "headers": [(b"content-type", b"application/json")]})
+                await send({"type": "http.response.body", "body": b'{"status": "ok"}'})
+
+            client = httpx.AsyncClient(base_url="http://madre", transport=httpx.ASGITransport(
+                app=AdmissionMiddleware(slow_app, controller, buckets)))
+            tasks = []
+
+            async def fire(priority, count):
+                """Starts count requests of a class and returns the status of those already answered."""
+                new = [asyncio.create_task(client.get(paths[priority])) for _ in range(count)]
+                tasks.extend(new)
+                for _ in range(100):
+                    await asyncio.sleep(0.01)
+                    # Every request is either held by the slow app or already answered (429)
+                    if len(started) + sum(task.done() for task in tasks) == len(tasks):
+                        break
+                return sorted(task.result().status_code for task in new if task.done())
+
+            try:
+                print_info("Filling the server with slow bulk requests...")
+                if await fire(BULK, 3) != [429] or controller.status()["running"][BULK] != 2:
+                    print_error(f"Bulk was not capped at its share: {controller.status()}")
+                    return False
+                print_success("Bulk capped at 2 of 4 slots; the third bulk request got 429")
+
+                print_info("Interactive requests under bulk overload...")
+                if await fire(INTERACTIVE, 2) != [429] or await fire(BULK, 1) != [429] \
+                        or controller.status()["running"][INTERACTIVE] != 1:
+                    print_error(f"Interactive was shed before bulk: {controller.status()}")
+                    return False
+                print_success("Interactive still admitted while bulk is shed; beyond 3 slots it is shed too")
+
+                print_info("Critical request with every other class at its limit...")
+                if await fire(CRITICAL, 1) != [] or controller.status()["running"][CRITICAL] != 1:
+                    print_error(f"Critical request was not admitted: {controller.status()}")
+                    return False
+                print_success("Critical request got the reserved slot")
+
+                release.set()
+                statuses = [response.status_code for response in await asyncio.gather(*tasks)]
+                if statuses.count(200) != 4 or controller.status()["in_flight"] != 0:
+                    print_error(f"Slots were not released: {statuses}, {controller.status()}")
+                    return False
+                print_success("All admitted requests finished and released their slots")
+                return True
+            finally:
+                release.set()
+                await asyncio.gather(*tasks, return_exceptions=True)
+                await client.aclose()
+
+        return asyncio.run(scenario())
+
+    except Exception as e:
+        print_error(f"Admission test failed: {e}")
+        return False
+
+
 def main():
     """Run all tests."""
     print(f"\n{BLUE}╔════════════════════════════════════════════════════════════╗{RESET}")
@@ -260,6 +525,12 @@ def main():
 
     results.append(('Credential Management', test_credentials()))
 
+    results.append(('Outbox Busy Replay', test_outbox_busy()))
+
+    results.append(('Backup And Restore', test_backup_restore()))
+
+    results.append(('Admission Control', test_admission()))
+
     print_header("TEST SUMMARY")
 
     passed = sum(1 for _, result in results if result)